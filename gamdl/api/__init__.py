@@ -1,3 +1,4 @@
+from .account_pool import AppleMusicAccountPool, PoolAccount
 from .apple_music import AppleMusicApi
 from .exceptions import *
 from .itunes import ItunesApi
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import TypeVar
+
+import structlog
+
+from .apple_music import AppleMusicApi
+from .constants import ACCOUNT_COOLDOWN_SECONDS, ACCOUNT_FAILOVER_STATUS_CODES
+from .exceptions import GamdlApiResponseError
+from .wrapper import WrapperApi
+
+logger = structlog.get_logger(__name__)
+
+T = TypeVar("T")
+
+
+@dataclass
+class PoolAccount:
+    name: str
+    apple_music_api: AppleMusicApi
+    wrapper_api: WrapperApi | None = None
+    in_flight: int = 0
+    requests: int = 0
+    failovers: int = 0
+    unavailable_until: float = 0.0
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.unavailable_until
+
+
+class AppleMusicAccountPool:
+    def __init__(
+        self,
+        accounts: list[PoolAccount],
+        cooldown: float = ACCOUNT_COOLDOWN_SECONDS,
+    ):
+        if not accounts:
+            raise ValueError("Account pool needs at least one account")
+
+        self.accounts = accounts
+        self.cooldown = cooldown
+
+    @property
+    def has_wrapper_accounts(self) -> bool:
+        return any(account.wrapper_api for account in self.accounts)
+
+    def _candidates(self, wrapper: bool, primary: bool = False) -> list[PoolAccount]:
+        # Library IDs only resolve on the account that owns the library
+        return [
+            account
+            for account in (self.accounts[:1] if primary else self.accounts)
+            if not wrapper or account.wrapper_api is not None
+        ]
+
+    def acquire(
+        self,
+        wrapper: bool = False,
+        exclude: set[str] = frozenset(),
+        primary: bool = False,
+    ) -> PoolAccount:
+        candidates = [
+            account
+            for account in self._candidates(wrapper, primary)
+            if account.name not in exclude
+        ]
+        if not candidates:
+            raise ValueError("No account in the pool can serve this request")
+
+        healthy = [account for account in candidates if account.healthy]
+        if not healthy:
+            return min(candidates, key=lambda account: account.unavailable_until)
+
+        return min(
+            healthy,
+            key=lambda account: (account.in_flight, account.requests),
+        )
+
+    @asynccontextmanager
+    async def use(
+        self,
+        wrapper: bool = False,
+        primary: bool = False,
+    ) -> AsyncIterator[PoolAccount]:
+        account = self.acquire(wrapper, primary=primary)
+        account.in_flight += 1
+        account.requests += 1
+        try:
+            yield account
+        finally:
+            account.in_flight -= 1
+
+    async def call(
+        self,
+        func: Callable[[PoolAccount], Awaitable[T]],
+        wrapper: bool = False,
+        primary: bool = False,
+    ) -> T:
+        tried = set()
+        while True:
+            account = self.acquire(wrapper, tried, primary)
+            tried.add(account.name)
+
+            account.in_flight += 1
+            account.requests += 1
+            try:
+                return await func(account)
+            except GamdlApiResponseError as e:
+                if e.status_code not in ACCOUNT_FAILOVER_STATUS_CODES:
+                    raise
+
+                account.failovers += 1
+                account.unavailable_until = time.monotonic() + self.cooldown
+                logger.bind(action=f'Account "{account.name}"').warning(
+                    f"Returned {e.status_code}, pausing it for {self.cooldown:.0f}s"
+                )
+
+                if len(tried) == len(self._candidates(wrapper, primary)):
+                    raise
+            finally:
+                account.in_flight -= 1
+
+    def usage(self) -> list[dict]:
+        return [
+            {
+                "name": account.name,
+                "requests": account.requests,
+                "failovers": account.failovers,
+                "in_flight": account.in_flight,
+                "healthy": account.healthy,
+            }
+            for account in self.accounts
+        ]
@@ -6,6 +6,7 @@ import httpx
 import structlog
 from httpx_retries import Retry, RetryTransport
 
+from ..metrics import metrics
 from .constants import (
     APPLE_MUSIC_ACCOUNT_INFO_API_URI,
     APPLE_MUSIC_ALBUM_API_URI,
@@ -75,6 +76,7 @@ class AppleMusicApi:
         return data[0].get("attributes", {}).get("restrictions")
 
     @staticmethod
+    @metrics.timed("get_token")
     async def get_token() -> str:
         log = logger.bind(action="get_token")
 
@@ -127,6 +129,7 @@ class AppleMusicApi:
         return token
 
     @staticmethod
+    @metrics.timed("get_account_info")
     async def get_account_info(
         token: str,
         media_user_token: str,
@@ -298,6 +301,7 @@ class AppleMusicApi:
 
         return response_json
 
+    @metrics.timed("get_song")
     async def get_song(
         self,
         song_id: str,
@@ -321,6 +325,7 @@ class AppleMusicApi:
 
         return song
 
+    @metrics.timed("get_music_video")
     async def get_music_video(
         self,
         music_video_id: str,
@@ -342,6 +347,7 @@ class AppleMusicApi:
 
         return music_video
 
+    @metrics.timed("get_uploaded_video")
     async def get_uploaded_video(
         self,
         uploaded_video_id: str,
@@ -361,6 +367,7 @@ class AppleMusicApi:
 
         return uploaded_video
 
+    @metrics.timed("get_album")
     async def get_album(
         self,
         album_id: str,
@@ -382,6 +389,7 @@ class AppleMusicApi:
 
         return album
 
+    @metrics.timed("get_playlist")
     async def get_playlist(
         self,
         playlist_id: str,
@@ -405,6 +413,7 @@ class AppleMusicApi:
 
         return playlist
 
+    @metrics.timed("get_artist")
     async def get_artist(
         self,
         artist_id: str,
@@ -433,6 +442,7 @@ class AppleMusicApi:
 
         return artist
 
+    @metrics.timed("get_library_song")
     async def get_library_song(
         self,
         song_id: str,
@@ -455,6 +465,7 @@ class AppleMusicApi:
 
         return song
 
+    @metrics.timed("get_library_music_video")
     async def get_library_music_video(
         self,
         music_video_id: str,
@@ -477,6 +488,7 @@ class AppleMusicApi:
 
         return music_video
 
+    @metrics.timed("get_library_album")
     async def get_library_album(
         self,
         album_id: str,
@@ -499,6 +511,7 @@ class AppleMusicApi:
 
         return album
 
+    @metrics.timed("get_library_playlist")
     async def get_library_playlist(
         self,
         playlist_id: str,
@@ -523,6 +536,7 @@ class AppleMusicApi:
 
         return playlist
 
+    @metrics.timed("get_library_songs")
     async def get_library_songs(
         self,
         limit: int = 100,
@@ -546,6 +560,7 @@ class AppleMusicApi:
 
         return library_songs
 
+    @metrics.timed("get_library_music_videos")
     async def get_library_music_videos(
         self,
         limit: int = 100,
@@ -567,6 +582,7 @@ class AppleMusicApi:
 
         return library_music_videos
 
+    @metrics.timed("get_library_albums")
     async def get_library_albums(
         self,
         limit: int = 100,
@@ -588,6 +604,7 @@ class AppleMusicApi:
 
         return library_albums
 
+    @metrics.timed("get_library_playlists")
     async def get_library_playlists(
         self,
         limit: int = 100,
@@ -609,6 +626,7 @@ class AppleMusicApi:
 
         return library_playlists
 
+    @metrics.timed("get_search_results")
     async def get_search_results(
         self,
         term: str,
@@ -634,6 +652,7 @@ class AppleMusicApi:
 
         return search_results
 
+    @metrics.timed("get_assets")
     async def get_assets(
         self,
         media_id: str,
@@ -669,6 +688,7 @@ class AppleMusicApi:
 
         return assets
 
+    @metrics.timed("extend_api_data")
     async def get_extended_api_data(
         self,
         next_uri: str | None,
@@ -702,6 +722,7 @@ class AppleMusicApi:
 
         return extended_data
 
+    @metrics.timed("get_webplayback")
     async def get_webplayback(
         self,
         track_id: str,
@@ -745,6 +766,7 @@ class AppleMusicApi:
 
         return webplayback
 
+    @metrics.timed("get_license_exchange")
     async def get_license_exchange(
         self,
         track_id: str,
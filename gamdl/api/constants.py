@@ -41,3 +41,6 @@ APPLE_MUSIC_MUSIC_KIT_URL = (
 
 ITUNES_LOOKUP_API_URL = "https://itunes.apple.com/lookup"
 ITUNES_PAGE_API_URL = "https://music.apple.com/{media_type}/{media_id}"
+
+ACCOUNT_FAILOVER_STATUS_CODES = {401, 429}
+ACCOUNT_COOLDOWN_SECONDS = 60.0
@@ -3,6 +3,7 @@ import re
 import httpx
 import structlog
 
+from ..metrics import metrics
 from .constants import (
     APPLE_MUSIC_MUSIC_KIT_URL,
     ITUNES_LOOKUP_API_URL,
@@ -27,6 +28,7 @@ class ItunesApi:
         self.storefront_id = storefront_id
 
     @staticmethod
+    @metrics.timed("get_storefront_id")
     async def get_storefront_id(storefront: str) -> int:
         log = logger.bind(action="get_storefront_id", storefront=storefront)
 
@@ -87,6 +89,7 @@ class ItunesApi:
             storefront_id=storefront_id,
         )
 
+    @metrics.timed("get_lookup_result")
     async def get_lookup_result(
         self,
         media_id: str,
@@ -118,6 +121,7 @@ class ItunesApi:
 
         return lookup_result
 
+    @metrics.timed("get_itunes_page")
     async def get_itunes_page(
         self,
         media_type: str,
@@ -7,6 +7,7 @@ from typing import TypeVar
 import httpx
 import structlog
 
+from ..metrics import metrics
 from .exceptions import GamdlApiResponseError
 
 logger = structlog.get_logger(__name__)
@@ -134,6 +135,7 @@ class WrapperApi:
         )
 
     @staticmethod
+    @metrics.timed("wrapper_get_me")
     async def get_me(client: httpx.AsyncClient, base_url: str) -> dict:
         log = logger.bind(action="wrapper_get_me")
 
@@ -154,6 +156,7 @@ class WrapperApi:
 
         return account_info
 
+    @metrics.timed("wrapper_get_playback")
     async def get_playback(self, media_id: str) -> dict:
         log = logger.bind(action="wrapper_get_playback", media_id=media_id)
 
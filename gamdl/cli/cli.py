@@ -1,4 +1,7 @@
 import asyncio
+import json
+import multiprocessing
+import os
 from functools import wraps
 from pathlib import Path
 
@@ -9,7 +12,7 @@ from dataclass_click import dataclass_click
 from httpx import ConnectError
 
 from .. import __version__
-from ..api import AppleMusicApi
+from ..api import AppleMusicAccountPool, AppleMusicApi, PoolAccount
 from ..api.wrapper import WrapperApi
 from ..downloader import (
     AppleMusicBaseDownloader,
@@ -17,9 +20,6 @@ from ..downloader import (
     AppleMusicMusicVideoDownloader,
     AppleMusicSongDownloader,
     AppleMusicUploadedVideoDownloader,
-    GamdlDownloaderDependencyNotFoundError,
-    GamdlDownloaderMediaFileExistsError,
-    GamdlDownloaderSyncedLyricsOnlyError,
 )
 from ..interface import (
     AppleMusicBaseInterface,
@@ -27,18 +27,19 @@ from ..interface import (
     AppleMusicMusicVideoInterface,
     AppleMusicSongInterface,
     AppleMusicUploadedVideoInterface,
-    GamdlInterfaceArtistMediaTypeError,
-    GamdlInterfaceDecryptionNotAvailableError,
-    GamdlInterfaceFlatFilterExcludedError,
-    GamdlInterfaceFormatNotAvailableError,
-    GamdlInterfaceMediaNotStreamableError,
-    GamdlInterfaceUrlParseError,
 )
 from ..interface.enums import SongCodec
+from ..metrics import metrics
+from ..profiling import profiler
+from ..tracing import tracer
 from .cli_config import CliConfig
 from .config_file import ConfigFile
 from .database import Database
+from .indexer import LibraryIndexer
 from .interactive_prompts import InteractivePrompts
+from .rate_limiter import HostRateLimiter
+from .runner import DownloadStats, download_url
+from .server import DownloadServer
 from .utils import CustomOutputWriter, custom_structlog_formatter, prompt_path
 
 logger = structlog.get_logger(__name__)
@@ -52,13 +53,7 @@ def make_sync(func):
     return wrapper
 
 
-@click.command()
-@click.help_option("-h", "--help")
-@click.version_option(__version__, "-v", "--version")
-@dataclass_click(CliConfig)
-@ConfigFile.loader
-@make_sync
-async def main(config: CliConfig):
+def configure_logging(config: CliConfig) -> None:
     colorama.just_fix_windows_console()
 
     log_output = CustomOutputWriter()
@@ -77,7 +72,117 @@ async def main(config: CliConfig):
         wrapper_class=structlog.make_filtering_bound_logger(config.log_level),
     )
 
-    logger.info(f"Starting Gamdl {__version__}")
+
+def read_urls(config: CliConfig) -> list[str]:
+    if not config.read_urls_as_txt:
+        return list(config.urls)
+
+    urls_from_file = []
+    for url in config.urls:
+        if Path(url).is_file() and Path(url).exists():
+            urls_from_file.extend(
+                [
+                    line.strip()
+                    for line in Path(url).read_text(encoding="utf-8").splitlines()
+                    if line.strip()
+                ]
+            )
+    return urls_from_file
+
+
+def parse_wrapper_account(value: str) -> tuple[str, str, int]:
+    base_url, _, decrypt_address = value.rpartition("@")
+    decrypt_host, _, decrypt_port = decrypt_address.rpartition(":")
+    if not base_url or not decrypt_host or not decrypt_port.isdigit():
+        raise click.BadParameter(
+            f"'{value}' is not in the form URL@DECRYPT_HOST:PORT",
+            param_hint="--extra-wrappers",
+        )
+    return base_url, decrypt_host, int(decrypt_port)
+
+
+async def create_extra_accounts(config: CliConfig) -> list[PoolAccount]:
+    accounts = []
+
+    for cookies_path in config.extra_cookies_paths or []:
+        apple_music_api = await AppleMusicApi.create_from_netscape_cookies(
+            cookies_path=cookies_path,
+            language=config.language,
+        )
+        accounts.append(PoolAccount(Path(cookies_path).name, apple_music_api))
+
+    for value in config.extra_wrappers or []:
+        base_url, decrypt_host, decrypt_port = parse_wrapper_account(value)
+        wrapper_api = await WrapperApi.create(
+            base_url=base_url,
+            decrypt_host=decrypt_host,
+            decrypt_port=decrypt_port,
+        )
+        apple_music_api = await AppleMusicApi.create_from_wrapper(
+            wrapper_api=wrapper_api,
+            language=config.language,
+        )
+        accounts.append(PoolAccount(value, apple_music_api, wrapper_api))
+
+    for account in accounts[:]:
+        if not account.apple_music_api.active_subscription:
+            logger.warning(
+                f'Account "{account.name}" has no active subscription, not using it'
+            )
+            accounts.remove(account)
+
+    return accounts
+
+
+def log_account_usage(account_pool: AppleMusicAccountPool | None) -> None:
+    if account_pool is None:
+        return
+
+    for usage in account_pool.usage():
+        logger.bind(action=f'Account "{usage["name"]}"').info(
+            f'{usage["requests"]} request(s), {usage["failovers"]} failover(s)'
+        )
+
+
+def get_process_path(config: CliConfig, path: str) -> str:
+    if config.workers <= 1:
+        return path
+    return str(Path(path).with_stem(f"{Path(path).stem}-{os.getpid()}"))
+
+
+def stop_profiler() -> None:
+    if profiler.mode is None:
+        return
+
+    log = logger.bind(action="Profile")
+    path = profiler.path
+    for line in profiler.stop():
+        log.info(line)
+    log.info(f'Profile written to "{path}"')
+
+
+def log_metrics_summary() -> None:
+    if metrics.enabled:
+        logger.bind(action="Metrics").info(json.dumps(metrics.summary(), indent=2))
+
+
+async def create_downloader(
+    config: CliConfig,
+) -> tuple[AppleMusicDownloader, Database | None] | None:
+    if config.metrics:
+        metrics.enable()
+
+    if config.trace_file:
+        tracer.start(get_process_path(config, config.trace_file))
+
+    if config.profile:
+        profiler.start(
+            config.profile,
+            get_process_path(
+                config,
+                config.profile_file or f"gamdl-profile-{config.profile.value}.txt",
+            ),
+        )
 
     interactive_prompts = InteractivePrompts(
         artist_auto_select=config.artist_auto_select,
@@ -98,7 +203,7 @@ async def main(config: CliConfig):
             )
         except Exception as e:
             logger.exception(f"Error: {e}")
-            return
+            return None
     else:
         cookies_path = prompt_path(config.cookies_path)
         apple_music_api = await AppleMusicApi.create_from_netscape_cookies(
@@ -112,7 +217,7 @@ async def main(config: CliConfig):
             "No active Apple Music subscription found, you won't be able to download"
             " anything"
         )
-        return
+        return None
 
     if apple_music_api.account_restrictions:
         logger.warning(
@@ -127,12 +232,27 @@ async def main(config: CliConfig):
             "to API limitations."
         )
 
+    try:
+        extra_accounts = await create_extra_accounts(config)
+    except Exception as e:
+        logger.exception(f"Error: {e}")
+        return None
+
+    if extra_accounts:
+        account_pool = AppleMusicAccountPool(
+            [PoolAccount("primary", apple_music_api, wrapper_api), *extra_accounts]
+        )
+    else:
+        account_pool = None
+
     if config.database_path:
         database = Database(config.database_path, config.overwrite)
         flat_filter = database.flat_filter
+        flat_filter_prefetch = database.filter_ids
     else:
         database = None
         flat_filter = None
+        flat_filter_prefetch = None
 
     base_interface = await AppleMusicBaseInterface.create(
         apple_music_api=apple_music_api,
@@ -140,6 +260,7 @@ async def main(config: CliConfig):
         cover_size=config.cover_size,
         wvd_path=config.wvd_path,
         wrapper_api=wrapper_api,
+        account_pool=account_pool,
     )
 
     song_interface = AppleMusicSongInterface(
@@ -170,15 +291,24 @@ async def main(config: CliConfig):
         artist_select_media_type_function=interactive_prompts.ask_artist_media_type,
         artist_select_items_function=interactive_prompts.ask_artist_select_items,
         flat_filter_function=flat_filter,
+        flat_filter_prefetch_function=flat_filter_prefetch,
     )
 
     base_downloader = AppleMusicBaseDownloader(
         interface=interface,
         output_path=config.output_path,
         temp_path=config.temp_path,
+        staging_mode=config.staging_mode,
         nm3u8dlre_path=config.nm3u8dlre_path,
         ffmpeg_path=config.ffmpeg_path,
         download_mode=config.download_mode,
+        ranged_download_connections=config.ranged_download_connections,
+        memory_download_max_size=config.memory_download_max_size,
+        filesystem_workers=config.filesystem_workers,
+        decrypt_threads=config.decrypt_threads,
+        wrapper_decrypt_connections=config.wrapper_decrypt_connections,
+        wrapper_decrypt_pipeline_depth=config.wrapper_decrypt_pipeline_depth,
+        mux_mode=config.mux_mode,
         album_folder_template=config.album_folder_template,
         compilation_folder_template=config.compilation_folder_template,
         no_album_folder_template=config.no_album_folder_template,
@@ -212,95 +342,191 @@ async def main(config: CliConfig):
         save_playlist=config.save_playlist,
         no_synced_lyrics=config.no_synced_lyrics,
         synced_lyrics_only=config.synced_lyrics_only,
+        content_store_mode=config.content_store_mode,
+        content_store_get_function=database.get_content if database else None,
+        content_store_add_function=database.add_content if database else None,
     )
 
-    if config.read_urls_as_txt:
-        urls_from_file = []
-        for url in config.urls:
-            if Path(url).is_file() and Path(url).exists():
-                urls_from_file.extend(
-                    [
-                        line.strip()
-                        for line in Path(url).read_text(encoding="utf-8").splitlines()
-                        if line.strip()
-                    ]
-                )
-        urls = urls_from_file
-    else:
-        urls = config.urls
+    if config.host_rate_limit:
+        rate_limiter = HostRateLimiter(
+            config.host_rate_limit,
+            (
+                Database(config.database_path, config.overwrite)
+                if config.database_path
+                else None
+            ),
+        )
+        rate_limiter.attach(apple_music_api.client)
+        rate_limiter.attach(base_interface.itunes_api.client)
+        for account in extra_accounts:
+            rate_limiter.attach(account.apple_music_api.client)
 
-    error_count = 0
-    for url_index, url in enumerate(urls, 1):
-        url_log = logger.bind(action=f"URL {url_index:>3}/{len(urls):<3}")
+    return downloader, database
 
-        url_log.info(f'Processing "{url}"')
 
-        try:
-            async for download_item in downloader.get_download_item_from_url(url):
-                media_index = download_item.media.index + 1
-                media_total = download_item.media.total or "-"
-
-                track_log = logger.bind(
-                    action=f"Track {media_index:>3}/{media_total:<3}"
-                )
-
-                media_title = (
-                    download_item.media.media_metadata["attributes"]["name"]
-                    if download_item.media.media_metadata
-                    and download_item.media.media_metadata.get("attributes", {}).get(
-                        "name"
-                    )
-                    else "Unknown Title"
-                )
-                media_type = (
-                    download_item.media.media_metadata["type"]
-                    if download_item.media.media_metadata
-                    else None
-                )
-
-                if download_item.media.partial and media_type in {
-                    None,
-                    "songs",
-                    "library-songs",
-                    "music-videos",
-                    "library-music-videos",
-                    "uploaded-videos",
-                }:
-                    track_log.info(f'Downloading "{media_title}"')
-
-                try:
-                    await downloader.download(download_item)
-                except (
-                    GamdlInterfaceMediaNotStreamableError,
-                    GamdlInterfaceFormatNotAvailableError,
-                    GamdlInterfaceDecryptionNotAvailableError,
-                    GamdlInterfaceArtistMediaTypeError,
-                    GamdlDownloaderSyncedLyricsOnlyError,
-                    GamdlDownloaderMediaFileExistsError,
-                    GamdlDownloaderDependencyNotFoundError,
-                    GamdlInterfaceFlatFilterExcludedError,
-                ) as e:
-                    track_log.warning(f'Skipping "{media_title}": {e}')
-                    continue
-                except Exception as e:
-                    error_count += 1
-                    track_log.exception(f'Error downloading "{media_title}"')
-
-                if (
-                    database
-                    and download_item.media.media_metadata
-                    and download_item.final_path
-                ):
-                    database.add(
-                        download_item.media.media_metadata["id"],
-                        download_item.final_path,
-                    )
-        except GamdlInterfaceUrlParseError as e:
-            url_log.error(f"{e}")
-            continue
-        except Exception as e:
-            url_log.exception(f'Error processing "{url}": {e}')
-            error_count += 1
+def run_worker(config: CliConfig, min_job_id: int) -> None:
+    configure_logging(config)
+    asyncio.run(_run_worker(config, min_job_id))
+
+
+async def _run_worker(config: CliConfig, min_job_id: int) -> None:
+    try:
+        setup = await create_downloader(config)
+        if setup is None:
+            return
+        downloader, database = setup
+
+        stats = DownloadStats()
+        while job := database.claim_job(min_job_id):
+            job_id, url = job
+            url_log = logger.bind(action=f"Job {job_id:>4}")
+            await download_url(downloader, database, url, url_log, stats, job_id)
+    finally:
+        tracer.stop()
+        stop_profiler()
+
+    log_account_usage(downloader.base.interface.base.account_pool)
+    log_metrics_summary()
+    logger.info(f"Worker finished with {stats.errors} error(s)")
+
+
+async def run_workers(config: CliConfig, min_job_id: int) -> None:
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=run_worker,
+            args=(config, min_job_id),
+            name=f"gamdl-worker-{index}",
+        )
+        for index in range(config.workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        await asyncio.to_thread(process.join)
+
+    failed_count = sum(1 for process in processes if process.exitcode)
+    logger.info(
+        f"Finished {config.workers} worker(s), {failed_count} exited with an error"
+    )
+
+
+def index_library(config: CliConfig, output_path: str) -> None:
+    database = Database(config.database_path, config.overwrite)
+    try:
+        stats = LibraryIndexer(database, config.filesystem_workers).index(output_path)
+    finally:
+        database.close()
+
+    logger.info(
+        f"Indexed {stats.indexed} file(s), {stats.unchanged} unchanged, "
+        f"{stats.without_id} without an Apple Music ID, "
+        f"{stats.pruned} missing file(s) pruned, {stats.errors} error(s)"
+    )
+
+
+def add_jobs(
+    database: Database,
+    urls: list[str],
+    reuse_pending: bool,
+) -> list[tuple[int, str]]:
+    jobs = []
+    for url in urls:
+        if reuse_pending and database.get_pending_job(url) is not None:
             continue
+        jobs.append((database.add_job(url), url))
+    return jobs
+
+
+async def run_downloads(
+    config: CliConfig,
+    downloader: AppleMusicDownloader,
+    database: Database | None,
+    urls: list[str],
+) -> None:
+    if config.serve:
+        server = DownloadServer(
+            downloader=downloader,
+            database=database,
+            host=config.serve_host,
+            port=config.serve_port,
+        )
+        await server.serve_forever()
+        return
+
+    if database:
+        jobs = database.get_unfinished_jobs() if config.resume else []
+        jobs += add_jobs(database, urls, config.resume)
+    else:
+        jobs = [(None, url) for url in urls]
+
+    stats = DownloadStats()
+    for url_index, (job_id, url) in enumerate(jobs, 1):
+        url_log = logger.bind(action=f"URL {url_index:>3}/{len(jobs):<3}")
+        await download_url(downloader, database, url, url_log, stats, job_id)
+
+    log_account_usage(downloader.base.interface.base.account_pool)
+    log_metrics_summary()
+    logger.info(f"Finished with {stats.errors} error(s)")
+
+
+@click.command()
+@click.help_option("-h", "--help")
+@click.version_option(__version__, "-v", "--version")
+@dataclass_click(CliConfig)
+@ConfigFile.loader
+@make_sync
+async def main(config: CliConfig):
+    if config.urls and config.urls[0] == "index":
+        if len(config.urls) > 2:
+            raise click.UsageError("index takes a single output path.")
+
+        if not config.database_path:
+            raise click.UsageError("index requires --database-path.")
+
+        configure_logging(config)
+        index_library(
+            config,
+            config.urls[1] if len(config.urls) == 2 else config.output_path,
+        )
+        return
+
+    if not config.urls and not config.serve and not config.resume:
+        raise click.UsageError("Missing argument 'URLS...'.")
+
+    if config.resume and not config.database_path:
+        raise click.UsageError("--resume requires --database-path.")
 
-    logger.info(f"Finished with {error_count} error(s)")
+    if config.workers > 1 and not config.database_path:
+        raise click.UsageError("--workers requires --database-path.")
+
+    if config.workers > 1 and config.serve:
+        raise click.UsageError("--workers can't be used with --serve.")
+
+    for value in config.extra_wrappers or []:
+        parse_wrapper_account(value)
+
+    configure_logging(config)
+
+    logger.info(f"Starting Gamdl {__version__}")
+
+    urls = read_urls(config)
+
+    if config.workers > 1:
+        database = Database(config.database_path, config.overwrite)
+        job_ids = [job_id for job_id, _ in add_jobs(database, urls, config.resume)]
+        database.close()
+        if not job_ids and not config.resume:
+            logger.info("No URLs to download")
+            return
+        await run_workers(config, 0 if config.resume else min(job_ids))
+        return
+
+    try:
+        setup = await create_downloader(config)
+        if setup is None:
+            return
+        await run_downloads(config, *setup, urls)
+    finally:
+        tracer.stop()
+        stop_profiler()
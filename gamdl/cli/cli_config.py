@@ -11,9 +11,12 @@ from ..downloader import (
     AppleMusicBaseDownloader,
     AppleMusicDownloader,
     AppleMusicMusicVideoDownloader,
+    ContentStoreMode,
     DownloadMode,
     RemuxFormatMusicVideo,
+    MuxMode,
     RemuxMode,
+    StagingMode,
 )
 from ..interface import (
     AppleMusicBaseInterface,
@@ -29,6 +32,8 @@ from ..interface import (
     SyncedLyricsFormat,
     UploadedVideoQuality,
 )
+from ..profiling import ProfileMode
+from .server import DownloadServer
 from .utils import Csv
 
 api_from_cookies_sig = inspect.signature(AppleMusicApi.create_from_netscape_cookies)
@@ -47,6 +52,8 @@ base_downloader_sig = inspect.signature(AppleMusicBaseDownloader.__init__)
 music_video_downloader_sig = inspect.signature(AppleMusicMusicVideoDownloader.__init__)
 downloader_sig = inspect.signature(AppleMusicDownloader.__init__)
 
+server_sig = inspect.signature(DownloadServer.__init__)
+
 
 @dataclass
 class CliConfig:
@@ -56,7 +63,6 @@ class CliConfig:
         argument(
             nargs=-1,
             type=str,
-            required=True,
         ),
     ]
     read_urls_as_txt: Annotated[
@@ -68,6 +74,55 @@ class CliConfig:
             is_flag=True,
         ),
     ]
+    resume: Annotated[
+        bool,
+        option(
+            "--resume",
+            help="Resume unfinished jobs recorded in the database",
+            is_flag=True,
+        ),
+    ]
+    serve: Annotated[
+        bool,
+        option(
+            "--serve",
+            help="Run as a service that downloads URL jobs submitted over HTTP",
+            is_flag=True,
+        ),
+    ]
+    serve_host: Annotated[
+        str,
+        option(
+            "--serve-host",
+            help="Host to listen on in service mode",
+            default=server_sig.parameters["host"].default,
+        ),
+    ]
+    serve_port: Annotated[
+        int,
+        option(
+            "--serve-port",
+            help="Port to listen on in service mode",
+            default=server_sig.parameters["port"].default,
+        ),
+    ]
+    workers: Annotated[
+        int,
+        option(
+            "--workers",
+            help="Number of worker processes sharing the database job queue",
+            default=1,
+        ),
+    ]
+    host_rate_limit: Annotated[
+        float,
+        option(
+            "--host-rate-limit",
+            help="Maximum API requests per second to each host, shared by all workers",
+            default=None,
+            type=float,
+        ),
+    ]
     config_path: Annotated[
         str,
         option(
@@ -113,6 +168,51 @@ class CliConfig:
             is_flag=True,
         ),
     ]
+    trace_file: Annotated[
+        str,
+        option(
+            "--trace-file",
+            help="Write a Chrome trace of every stage and HTTP request to this file",
+            default=None,
+            type=click.Path(
+                file_okay=True,
+                dir_okay=False,
+                writable=True,
+                resolve_path=True,
+            ),
+        ),
+    ]
+    profile: Annotated[
+        ProfileMode | None,
+        option(
+            "--profile",
+            help="Profile the run for CPU time, allocations or event loop stalls",
+            default=None,
+            type=ProfileMode,
+        ),
+    ]
+    profile_file: Annotated[
+        str,
+        option(
+            "--profile-file",
+            help="Write the profile report to this file",
+            default=None,
+            type=click.Path(
+                file_okay=True,
+                dir_okay=False,
+                writable=True,
+                resolve_path=True,
+            ),
+        ),
+    ]
+    metrics: Annotated[
+        bool,
+        option(
+            "--metrics",
+            help="Record per-stage timings and print a JSON summary or serve /metrics",
+            is_flag=True,
+        ),
+    ]
     artist_auto_select: Annotated[
         ArtistMediaType | None,
         option(
@@ -170,6 +270,15 @@ class CliConfig:
             default=wrapper_api_create_sig.parameters["decrypt_port"].default,
         ),
     ]
+    extra_wrappers: Annotated[
+        list[str],
+        option(
+            "--extra-wrappers",
+            help="Comma-separated extra wrapper accounts as URL@DECRYPT_HOST:PORT",
+            default=None,
+            type=Csv(str),
+        ),
+    ]
     # API specific options
     cookies_path: Annotated[
         str,
@@ -186,6 +295,15 @@ class CliConfig:
             ),
         ),
     ]
+    extra_cookies_paths: Annotated[
+        list[str],
+        option(
+            "--extra-cookies-paths",
+            help="Comma-separated cookies file paths of extra accounts",
+            default=None,
+            type=Csv(str),
+        ),
+    ]
     language: Annotated[
         str,
         option(
@@ -321,6 +439,15 @@ class CliConfig:
             ),
         ),
     ]
+    staging_mode: Annotated[
+        StagingMode,
+        option(
+            "--staging-mode",
+            help="Where staged files are written before the final move",
+            default=base_downloader_sig.parameters["staging_mode"].default,
+            type=StagingMode,
+        ),
+    ]
     nm3u8dlre_path: Annotated[
         str,
         option(
@@ -346,6 +473,69 @@ class CliConfig:
             type=DownloadMode,
         ),
     ]
+    ranged_download_connections: Annotated[
+        int,
+        option(
+            "--ranged-download-connections",
+            help="Parallel connections for non-HLS downloads (1 to disable)",
+            default=base_downloader_sig.parameters[
+                "ranged_download_connections"
+            ].default,
+        ),
+    ]
+    memory_download_max_size: Annotated[
+        int,
+        option(
+            "--memory-download-max-size",
+            help="Keep encrypted song downloads up to this many bytes in memory (0 to disable)",
+            default=base_downloader_sig.parameters["memory_download_max_size"].default,
+        ),
+    ]
+    filesystem_workers: Annotated[
+        int,
+        option(
+            "--filesystem-workers",
+            help="Number of threads for blocking filesystem operations",
+            default=base_downloader_sig.parameters["filesystem_workers"].default,
+        ),
+    ]
+    decrypt_threads: Annotated[
+        int,
+        option(
+            "--decrypt-threads",
+            help="Number of threads for native sample decryption (0 to use all cores)",
+            default=base_downloader_sig.parameters["decrypt_threads"].default,
+        ),
+    ]
+    wrapper_decrypt_connections: Annotated[
+        int,
+        option(
+            "--wrapper-decrypt-connections",
+            help="Number of pooled wrapper decrypt connections",
+            default=base_downloader_sig.parameters[
+                "wrapper_decrypt_connections"
+            ].default,
+        ),
+    ]
+    wrapper_decrypt_pipeline_depth: Annotated[
+        int,
+        option(
+            "--wrapper-decrypt-pipeline-depth",
+            help="Number of decrypt batches kept in flight per wrapper connection",
+            default=base_downloader_sig.parameters[
+                "wrapper_decrypt_pipeline_depth"
+            ].default,
+        ),
+    ]
+    mux_mode: Annotated[
+        MuxMode,
+        option(
+            "--mux-mode",
+            help="How encrypted songs are decrypted and muxed",
+            default=base_downloader_sig.parameters["mux_mode"].default,
+            type=MuxMode,
+        ),
+    ]
     album_folder_template: Annotated[
         str,
         option(
@@ -489,3 +679,12 @@ class CliConfig:
             is_flag=True,
         ),
     ]
+    content_store_mode: Annotated[
+        ContentStoreMode,
+        option(
+            "--content-store-mode",
+            help="Place duplicate tracks by linking an existing download",
+            default=downloader_sig.parameters["content_store_mode"].default,
+            type=ContentStoreMode,
+        ),
+    ]
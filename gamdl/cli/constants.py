@@ -2,8 +2,25 @@ EXCLUDED_CONFIG_FILE_PARAMS = {
     "urls",
     "config_path",
     "read_urls_as_txt",
+    "resume",
+    "serve",
     "no_config_file",
     "version",
     "help",
 }
 X_NOT_IN_PATH = '{} was not found in PATH at "{}"'
+TASK_LEASE_SECONDS = 60 * 60
+TRACK_MEDIA_TYPES = {
+    "songs",
+    "library-songs",
+    "music-videos",
+    "library-music-videos",
+    "uploaded-videos",
+}
+DATABASE_BUSY_TIMEOUT = 30.0
+DATABASE_WRITE_BATCH_SIZE = 256
+DATABASE_WRITE_BATCH_SECONDS = 5.0
+DATABASE_QUERY_CHUNK_SIZE = 500
+INDEX_FILE_EXTENSIONS = {".m4a", ".m4v", ".mp4"}
+INDEX_BATCH_SIZE = 1000
+INDEX_PROGRESS_INTERVAL = 10000
@@ -1,6 +1,69 @@
+import functools
+import itertools
+import os
+import socket
 import sqlite3
+import threading
+import time
+from operator import itemgetter
 from pathlib import Path
 
+from ..downloader import LedgerEntry
+from .constants import (
+    DATABASE_BUSY_TIMEOUT,
+    DATABASE_QUERY_CHUNK_SIZE,
+    DATABASE_WRITE_BATCH_SECONDS,
+    DATABASE_WRITE_BATCH_SIZE,
+    TASK_LEASE_SECONDS,
+    TRACK_MEDIA_TYPES,
+)
+
+LEDGER_COLUMNS = {
+    "codec": "TEXT",
+    "size": "INTEGER",
+    "mtime": "REAL",
+    "content_hash": "TEXT",
+    "tag_version": "TEXT",
+    "album_id": "INTEGER",
+    "artist_id": "INTEGER",
+}
+LEDGER_INSERT_QUERY = (
+    f"INSERT OR REPLACE INTO media (id, path, {', '.join(LEDGER_COLUMNS)})"
+    f" VALUES ({', '.join('?' * (len(LEDGER_COLUMNS) + 2))})"
+)
+
+
+def _is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _is_lease_live(lease_owner: str | None, lease_expires_at: float | None) -> bool:
+    if lease_owner is None or lease_expires_at is None:
+        return False
+    if lease_expires_at < time.time():
+        return False
+
+    # Signal 0 terminates the process on Windows instead of probing it
+    host, _, pid = lease_owner.rpartition(":")
+    if host != socket.gethostname() or os.name == "nt" or not pid.isdigit():
+        return True
+    return _is_process_alive(int(pid))
+
+
+def _synchronized(func):
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return func(self, *args, **kwargs)
+
+    return wrapper
+
 
 class Database:
     def __init__(
@@ -9,9 +72,24 @@ class Database:
         overwrite: bool,
     ):
         self.overwrite = overwrite
+        self.lease_owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.job_id = None
+        self._registered: dict[str, bool] = {}
+        self._pending_writes: list[tuple[str, tuple]] = []
+        self._batch_started_at = 0.0
+        self._flush_timer: threading.Timer | None = None
+        self._closed = False
+        self._lock = threading.RLock()
 
-        self.connection = sqlite3.connect(path)
+        self.connection = sqlite3.connect(
+            path,
+            timeout=DATABASE_BUSY_TIMEOUT,
+            check_same_thread=False,
+        )
+        self.connection.create_function("lease_is_live", 2, _is_lease_live)
         self.cursor = self.connection.cursor()
+        self.cursor.execute("PRAGMA journal_mode = WAL")
+        self.cursor.execute("PRAGMA synchronous = NORMAL")
         self._create_tables()
 
     def _create_tables(self) -> None:
@@ -23,36 +101,410 @@ class Database:
             )
             """
         )
-        self.connection.commit()
+        self.cursor.execute("PRAGMA table_info(media)")
+        media_columns = {row[1] for row in self.cursor.fetchall()}
+        for column, column_type in LEDGER_COLUMNS.items():
+            if column not in media_columns:
+                self.cursor.execute(
+                    f"ALTER TABLE media ADD COLUMN {column} {column_type}"
+                )
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS media_path ON media (path)")
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS content (
+                media_id TEXT NOT NULL,
+                codec TEXT NOT NULL,
+                tag_hash TEXT NOT NULL,
+                path TEXT NOT NULL,
+                PRIMARY KEY (media_id, codec, tag_hash)
+            )
+            """
+        )
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                lease_owner TEXT,
+                lease_expires_at REAL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tasks (
+                job_id INTEGER NOT NULL REFERENCES jobs (id),
+                media_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                stage TEXT NOT NULL DEFAULT 'expand',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                lease_owner TEXT,
+                lease_expires_at REAL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (job_id, media_id)
+            )
+            """
+        )
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS jobs_url ON jobs (url, state)")
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS tasks_state ON tasks (job_id, state)"
+        )
+        self.cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                host TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self.flush()
+
+    @_synchronized
+    def _write(self, query: str, parameters: tuple = ()) -> None:
+        # Buffered in Python so no write lock is held between flushes
+        self._pending_writes.append((query, parameters))
+        if len(self._pending_writes) == 1:
+            self._batch_started_at = time.monotonic()
+            self._flush_timer = threading.Timer(
+                DATABASE_WRITE_BATCH_SECONDS,
+                self.flush,
+            )
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+        if (
+            len(self._pending_writes) >= DATABASE_WRITE_BATCH_SIZE
+            or time.monotonic() - self._batch_started_at >= DATABASE_WRITE_BATCH_SECONDS
+        ):
+            self.flush()
+
+    @_synchronized
+    def flush(self) -> None:
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if self._closed:
+            return
 
+        pending_writes, self._pending_writes = self._pending_writes, []
+        for query, writes in itertools.groupby(pending_writes, key=itemgetter(0)):
+            self.cursor.executemany(query, [parameters for _, parameters in writes])
+        if self.connection.in_transaction:
+            self.connection.commit()
+
+    @_synchronized
     def get(self, media_id: str) -> str | None:
+        self.flush()
         self.cursor.execute("SELECT path FROM media WHERE id = ?", (media_id,))
         row = self.cursor.fetchone()
         return row[0] if row else None
 
+    @staticmethod
+    def _ledger_row(entry: LedgerEntry) -> tuple:
+        return (
+            entry.media_id,
+            str(Path(entry.path).absolute()),
+            *(getattr(entry, column) for column in LEDGER_COLUMNS),
+        )
+
     def add(self, media_id: str, path: str) -> None:
+        self.add_entry(LedgerEntry(media_id, path))
+
+    @_synchronized
+    def add_entry(self, entry: LedgerEntry) -> None:
+        self._write(LEDGER_INSERT_QUERY, self._ledger_row(entry))
+        self._registered[entry.media_id] = True
+
+    @_synchronized
+    def add_entries(self, entries: list[LedgerEntry]) -> None:
+        self.flush()
+        self.cursor.executemany(
+            LEDGER_INSERT_QUERY,
+            [self._ledger_row(entry) for entry in entries],
+        )
+        self.flush()
+        for entry in entries:
+            self._registered[entry.media_id] = True
+
+    @_synchronized
+    def get_indexed_mtimes(self) -> dict[str, float]:
+        self.flush()
+        self.cursor.execute("SELECT path, mtime FROM media WHERE mtime IS NOT NULL")
+        return dict(self.cursor.fetchall())
+
+    @_synchronized
+    def get_paths_under(self, root: str) -> list[str]:
+        prefix = os.path.join(root, "")
+        self.flush()
         self.cursor.execute(
-            "INSERT OR REPLACE INTO media (id, path) VALUES (?, ?)",
-            (media_id, str(Path(path).absolute())),
+            "SELECT path FROM media WHERE path >= ? AND path < ?",
+            (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)),
         )
-        self.connection.commit()
+        return [row[0] for row in self.cursor.fetchall()]
+
+    @_synchronized
+    def remove_paths(self, paths: list[str]) -> None:
+        self.flush()
+        for index in range(0, len(paths), DATABASE_QUERY_CHUNK_SIZE):
+            chunk = paths[index : index + DATABASE_QUERY_CHUNK_SIZE]
+            placeholders = ", ".join("?" * len(chunk))
+            self.cursor.execute(
+                f"SELECT id FROM media WHERE path IN ({placeholders})",
+                chunk,
+            )
+            for (media_id,) in self.cursor.fetchall():
+                self._registered[media_id] = False
+            self.cursor.execute(
+                f"DELETE FROM media WHERE path IN ({placeholders})",
+                chunk,
+            )
+        self.flush()
 
+    @_synchronized
     def remove(self, media_id: str) -> None:
-        self.cursor.execute("DELETE FROM media WHERE id = ?", (media_id,))
-        self.connection.commit()
+        self._write("DELETE FROM media WHERE id = ?", (media_id,))
+        self._registered[media_id] = False
 
+    @_synchronized
+    def filter_ids(self, media_ids: list[str]) -> set[str]:
+        unknown_ids = list(
+            dict.fromkeys(
+                media_id for media_id in media_ids if media_id not in self._registered
+            )
+        )
+        for index in range(0, len(unknown_ids), DATABASE_QUERY_CHUNK_SIZE):
+            chunk = unknown_ids[index : index + DATABASE_QUERY_CHUNK_SIZE]
+            self.cursor.execute(
+                f"SELECT id FROM media WHERE id IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            )
+            registered_ids = {row[0] for row in self.cursor.fetchall()}
+            for media_id in chunk:
+                self._registered[media_id] = media_id in registered_ids
+
+        return {media_id for media_id in media_ids if self._registered[media_id]}
+
+    @_synchronized
+    def is_registered(self, media_id: str) -> bool:
+        if media_id not in self._registered:
+            self._registered[media_id] = self.get(media_id) is not None
+        return self._registered[media_id]
+
+    @_synchronized
+    def get_content(self, media_id: str, codec: str, tag_hash: str) -> str | None:
+        self.flush()
+        self.cursor.execute(
+            "SELECT path FROM content"
+            " WHERE media_id = ? AND codec = ? AND tag_hash = ?",
+            (media_id, codec, tag_hash),
+        )
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+
+    @_synchronized
+    def add_content(
+        self,
+        media_id: str,
+        codec: str,
+        tag_hash: str,
+        path: str,
+    ) -> None:
+        self._write(
+            "INSERT OR REPLACE INTO content (media_id, codec, tag_hash, path)"
+            " VALUES (?, ?, ?, ?)",
+            (media_id, codec, tag_hash, str(Path(path).absolute())),
+        )
+
+    @_synchronized
+    def add_job(self, url: str) -> int:
+        now = time.time()
+        self.flush()
+        self.cursor.execute(
+            "INSERT INTO jobs (url, created_at, updated_at) VALUES (?, ?, ?)",
+            (url, now, now),
+        )
+        self.flush()
+        return self.cursor.lastrowid
+
+    @_synchronized
+    def get_pending_job(self, url: str) -> int | None:
+        self.flush()
+        self.cursor.execute(
+            "SELECT id FROM jobs WHERE url = ? AND state = 'pending'"
+            " ORDER BY id LIMIT 1",
+            (url,),
+        )
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+
+    @_synchronized
+    def get_unfinished_jobs(self) -> list[tuple[int, str]]:
+        self.flush()
+        self.cursor.execute(
+            "SELECT id, url FROM jobs WHERE state = 'pending'"
+            " AND (lease_owner = ? OR NOT lease_is_live(lease_owner, lease_expires_at))"
+            " ORDER BY id",
+            (self.lease_owner,),
+        )
+        return self.cursor.fetchall()
+
+    @_synchronized
+    def claim_job(self, min_job_id: int = 0) -> tuple[int, str] | None:
+        now = time.time()
+        self.flush()
+        self.cursor.execute("BEGIN IMMEDIATE")
+        try:
+            self.cursor.execute(
+                "SELECT id, url FROM jobs"
+                " WHERE id >= ? AND state = 'pending'"
+                " AND NOT lease_is_live(lease_owner, lease_expires_at)"
+                " ORDER BY id LIMIT 1",
+                (min_job_id,),
+            )
+            job = self.cursor.fetchone()
+            if job:
+                self.cursor.execute(
+                    "UPDATE jobs SET lease_owner = ?, lease_expires_at = ?,"
+                    " updated_at = ? WHERE id = ?",
+                    (self.lease_owner, now + TASK_LEASE_SECONDS, now, job[0]),
+                )
+            self.flush()
+        except BaseException:
+            self.connection.rollback()
+            raise
+        return job
+
+    def start_job(self, job_id: int | None) -> None:
+        self.job_id = job_id
+
+    @_synchronized
+    def finish_job(self, job_id: int, failed: bool = False) -> None:
+        if failed:
+            state = "failed"
+        else:
+            self.flush()
+            self.cursor.execute(
+                "SELECT COUNT(*) FROM tasks"
+                " WHERE job_id = ? AND state NOT IN ('done', 'skipped')",
+                (job_id,),
+            )
+            state = "pending" if self.cursor.fetchone()[0] else "done"
+        self._write(
+            "UPDATE jobs SET state = ?, lease_owner = NULL, lease_expires_at = NULL,"
+            " updated_at = ? WHERE id = ?",
+            (state, time.time(), job_id),
+        )
+        self.job_id = None
+
+    @_synchronized
+    def add_task(self, job_id: int, media_id: str, position: int) -> None:
+        self._write(
+            "INSERT OR IGNORE INTO tasks (job_id, media_id, position, updated_at)"
+            " VALUES (?, ?, ?, ?)",
+            (job_id, media_id, position, time.time()),
+        )
+
+    @_synchronized
+    def lease_task(self, job_id: int, media_id: str) -> bool:
+        now = time.time()
+        self.flush()
+        self.cursor.execute(
+            "UPDATE tasks SET state = 'running', stage = 'resolve',"
+            " attempts = attempts + (state != 'running' OR lease_owner IS NOT ?),"
+            " lease_owner = ?, lease_expires_at = ?, updated_at = ?"
+            " WHERE job_id = ? AND media_id = ?"
+            " AND state NOT IN ('done', 'skipped')"
+            " AND (state != 'running' OR lease_owner = ?"
+            " OR NOT lease_is_live(lease_owner, lease_expires_at))",
+            (
+                self.lease_owner,
+                self.lease_owner,
+                now + TASK_LEASE_SECONDS,
+                now,
+                job_id,
+                media_id,
+                self.lease_owner,
+            ),
+        )
+        leased = self.cursor.rowcount == 1
+        if leased:
+            self.cursor.execute(
+                "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND lease_owner = ?",
+                (now + TASK_LEASE_SECONDS, job_id, self.lease_owner),
+            )
+        self.flush()
+        return leased
+
+    @_synchronized
+    def set_task_stage(self, job_id: int, media_id: str, stage: str) -> None:
+        self._write(
+            "UPDATE tasks SET stage = ?, updated_at = ?"
+            " WHERE job_id = ? AND media_id = ? AND lease_owner = ?",
+            (stage, time.time(), job_id, media_id, self.lease_owner),
+        )
+
+    @_synchronized
+    def finish_task(
+        self,
+        job_id: int,
+        media_id: str,
+        state: str,
+        error: str | None = None,
+    ) -> None:
+        self._write(
+            "UPDATE tasks SET state = ?, error = ?, lease_owner = NULL,"
+            " lease_expires_at = NULL, updated_at = ?"
+            " WHERE job_id = ? AND media_id = ?"
+            " AND state = 'running' AND lease_owner = ?",
+            (state, error, time.time(), job_id, media_id, self.lease_owner),
+        )
+
+    @_synchronized
+    def reserve_rate_limit_token(self, host: str, rate: float, burst: float) -> float:
+        now = time.time()
+        self.flush()
+        self.cursor.execute("BEGIN IMMEDIATE")
+        try:
+            self.cursor.execute(
+                "SELECT tokens, updated_at FROM rate_limits WHERE host = ?",
+                (host,),
+            )
+            tokens, updated_at = self.cursor.fetchone() or (burst, now)
+            tokens = min(burst, tokens + max(0.0, now - updated_at) * rate) - 1
+            self.cursor.execute(
+                "INSERT OR REPLACE INTO rate_limits (host, tokens, updated_at)"
+                " VALUES (?, ?, ?)",
+                (host, tokens, now),
+            )
+            self.flush()
+        except BaseException:
+            self.connection.rollback()
+            raise
+        return max(0.0, -tokens / rate)
+
+    @_synchronized
     def close(self) -> None:
+        self.flush()
+        self._closed = True
         self.connection.close()
 
+    @_synchronized
     def flat_filter(self, media_metadata: dict) -> str | None:
         media_id = media_metadata["id"]
-        result = self.get(media_id)
+        if (
+            self.job_id is not None
+            and media_metadata["type"] in TRACK_MEDIA_TYPES
+            and not self.lease_task(self.job_id, media_id)
+        ):
+            return "Finished or leased in the job queue"
 
-        if not result:
+        if self.overwrite or not self.is_registered(media_id):
             return None
 
-        return (
-            "Registered in database"
-            if Path(result).exists() and not self.overwrite
-            else None
-        )
+        return "Registered in database"
@@ -0,0 +1,219 @@
+import os
+import struct
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import BinaryIO, Iterator
+
+import structlog
+
+from ..downloader import LedgerEntry
+from ..downloader.constants import STAGING_PATH_TEMPLATE
+from .constants import INDEX_BATCH_SIZE, INDEX_FILE_EXTENSIONS, INDEX_PROGRESS_INTERVAL
+from .database import Database
+
+logger = structlog.get_logger(__name__)
+
+ILST_PATH = (b"moov", b"udta", b"meta", b"ilst")
+ILST_ID_ATOMS = {b"cnID", b"plID", b"atID"}
+STAGING_DIR_PREFIX = STAGING_PATH_TEMPLATE.format("")
+
+
+@dataclass
+class IndexStats:
+    indexed: int = 0
+    unchanged: int = 0
+    without_id: int = 0
+    pruned: int = 0
+    errors: int = 0
+
+
+def _iter_boxes(
+    file: BinaryIO,
+    start: int,
+    end: int,
+) -> Iterator[tuple[bytes, int, int]]:
+    offset = start
+    while offset + 8 <= end:
+        file.seek(offset)
+        size, box_type = struct.unpack(">I4s", file.read(8))
+        header_size = 8
+        if size == 1:
+            size = struct.unpack(">Q", file.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            return
+
+        yield box_type, offset + header_size, min(offset + size, end)
+        offset += size
+
+
+def read_ilst_ids(path: str) -> dict[str, int]:
+    with open(path, "rb") as file:
+        start, end = 0, file.seek(0, os.SEEK_END)
+        for container in ILST_PATH:
+            for box_type, payload_start, payload_end in _iter_boxes(file, start, end):
+                if box_type == container:
+                    start, end = payload_start, payload_end
+                    break
+            else:
+                return {}
+
+            if container == b"meta":
+                file.seek(start + 4)
+                if file.read(4) != b"hdlr":
+                    start += 4
+
+        ids = {}
+        for box_type, payload_start, payload_end in _iter_boxes(file, start, end):
+            if box_type not in ILST_ID_ATOMS:
+                continue
+            for data_type, data_start, data_end in _iter_boxes(
+                file,
+                payload_start,
+                payload_end,
+            ):
+                if data_type == b"data" and data_end - data_start > 8:
+                    file.seek(data_start + 8)
+                    ids[box_type.decode()] = int.from_bytes(
+                        file.read(data_end - data_start - 8),
+                        "big",
+                    )
+                    break
+
+    return ids
+
+
+class LibraryIndexer:
+    def __init__(
+        self,
+        database: Database,
+        workers: int = 4,
+    ):
+        self.database = database
+        self.workers = workers
+
+    @staticmethod
+    def _scan_dir(path: str) -> tuple[list[str], list[tuple[str, int, float]]]:
+        dirs = []
+        files = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if not entry.name.startswith(STAGING_DIR_PREFIX):
+                        dirs.append(entry.path)
+                elif (
+                    entry.is_file()
+                    and os.path.splitext(entry.name)[1].lower() in INDEX_FILE_EXTENSIONS
+                ):
+                    stat = entry.stat()
+                    files.append((entry.path, stat.st_size, stat.st_mtime))
+        return dirs, files
+
+    @staticmethod
+    def _read_entry(path: str, size: int, mtime: float) -> LedgerEntry | None:
+        ids = read_ilst_ids(path)
+        if "cnID" not in ids:
+            return None
+
+        return LedgerEntry(
+            media_id=str(ids["cnID"]),
+            path=path,
+            size=size,
+            mtime=mtime,
+            album_id=ids.get("plID"),
+            artist_id=ids.get("atID"),
+        )
+
+    def _prune(
+        self,
+        root: str,
+        seen_paths: set[str],
+        failed_dirs: list[str],
+    ) -> int:
+        failed_prefixes = tuple(os.path.join(path, "") for path in failed_dirs)
+        missing_paths = [
+            path
+            for path in self.database.get_paths_under(root)
+            if path not in seen_paths
+            and not path.startswith(failed_prefixes)
+            and not os.path.exists(path)
+        ]
+        if missing_paths:
+            self.database.remove_paths(missing_paths)
+        return len(missing_paths)
+
+    def index(self, output_path: str) -> IndexStats:
+        log = logger.bind(action="Index")
+
+        stats = IndexStats()
+        root = os.path.abspath(output_path)
+        indexed_mtimes = self.database.get_indexed_mtimes()
+        entries = []
+        seen_paths = set()
+        failed_dirs = []
+
+        with ThreadPoolExecutor(
+            self.workers,
+            thread_name_prefix="gamdl-index",
+        ) as executor:
+            dir_futures: dict[Future, str] = {
+                executor.submit(self._scan_dir, root): root
+            }
+            file_futures: dict[Future, str] = {}
+
+            while dir_futures or file_futures:
+                done, _ = wait(
+                    dir_futures.keys() | file_futures.keys(),
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done:
+                    if future in dir_futures:
+                        dir_path = dir_futures.pop(future)
+                        try:
+                            dirs, files = future.result()
+                        except OSError as e:
+                            stats.errors += 1
+                            failed_dirs.append(dir_path)
+                            log.warning(f"Can't scan directory: {e}")
+                            continue
+
+                        for path in dirs:
+                            dir_futures[executor.submit(self._scan_dir, path)] = path
+                        for path, size, mtime in files:
+                            seen_paths.add(path)
+                            if indexed_mtimes.get(path) == mtime:
+                                stats.unchanged += 1
+                                continue
+                            file_futures[
+                                executor.submit(self._read_entry, path, size, mtime)
+                            ] = path
+                        continue
+
+                    path = file_futures.pop(future)
+                    try:
+                        entry = future.result()
+                    except (OSError, struct.error) as e:
+                        stats.errors += 1
+                        log.warning(f'Can\'t read "{path}": {e}')
+                        continue
+
+                    if entry is None:
+                        stats.without_id += 1
+                        continue
+
+                    entries.append(entry)
+                    stats.indexed += 1
+                    if len(entries) >= INDEX_BATCH_SIZE:
+                        self.database.add_entries(entries)
+                        entries.clear()
+                    if stats.indexed % INDEX_PROGRESS_INTERVAL == 0:
+                        log.info(f"Indexed {stats.indexed} file(s)")
+
+        if entries:
+            self.database.add_entries(entries)
+
+        stats.pruned = self._prune(root, seen_paths, failed_dirs)
+
+        return stats
@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+import httpx
+
+from .database import Database
+
+
+class MemoryTokenStore:
+    def __init__(self):
+        self._buckets: dict[str, tuple[float, float]] = {}
+
+    def reserve_rate_limit_token(self, host: str, rate: float, burst: float) -> float:
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(host, (burst, now))
+        tokens = min(burst, tokens + (now - updated_at) * rate) - 1
+        self._buckets[host] = (tokens, now)
+        return max(0.0, -tokens / rate)
+
+
+class HostRateLimiter:
+    def __init__(
+        self,
+        rate: float,
+        token_store: Database | MemoryTokenStore | None = None,
+    ):
+        self.rate = rate
+        self.burst = max(1.0, rate)
+        self.token_store = token_store or MemoryTokenStore()
+
+    async def acquire(self, host: str) -> None:
+        if isinstance(self.token_store, Database):
+            # Shared token buckets take a SQLite write lock that other worker
+            # processes may be holding
+            wait = await asyncio.to_thread(
+                self.token_store.reserve_rate_limit_token,
+                host,
+                self.rate,
+                self.burst,
+            )
+        else:
+            wait = self.token_store.reserve_rate_limit_token(
+                host,
+                self.rate,
+                self.burst,
+            )
+        if wait:
+            await asyncio.sleep(wait)
+
+    async def _on_request(self, request: httpx.Request) -> None:
+        await self.acquire(request.url.host)
+
+    def attach(self, client: httpx.AsyncClient) -> None:
+        event_hooks = client.event_hooks
+        event_hooks["request"] = [*event_hooks["request"], self._on_request]
+        client.event_hooks = event_hooks
@@ -0,0 +1,142 @@
+from dataclasses import dataclass
+
+import structlog
+
+from ..downloader import (
+    AppleMusicDownloader,
+    GamdlDownloaderDependencyNotFoundError,
+    GamdlDownloaderMediaFileExistsError,
+    GamdlDownloaderSyncedLyricsOnlyError,
+)
+from ..interface import (
+    GamdlInterfaceArtistMediaTypeError,
+    GamdlInterfaceDecryptionNotAvailableError,
+    GamdlInterfaceFlatFilterExcludedError,
+    GamdlInterfaceFormatNotAvailableError,
+    GamdlInterfaceMediaNotStreamableError,
+    GamdlInterfaceUrlParseError,
+)
+from ..profiling import profiler
+from ..tracing import current_media_id
+from .constants import TRACK_MEDIA_TYPES
+from .database import Database
+
+logger = structlog.get_logger(__name__)
+
+
+@dataclass
+class DownloadStats:
+    downloaded: int = 0
+    skipped: int = 0
+    errors: int = 0
+
+
+async def download_url(
+    downloader: AppleMusicDownloader,
+    database: Database | None,
+    url: str,
+    url_log: structlog.typing.FilteringBoundLogger,
+    stats: DownloadStats,
+    job_id: int | None = None,
+) -> None:
+    url_log.info(f'Processing "{url}"')
+
+    if database and job_id is not None:
+        database.start_job(job_id)
+    else:
+        job_id = None
+
+    url_failed = False
+    try:
+        async for download_item in downloader.get_download_item_from_url(url):
+            task_id = (
+                download_item.media.media_metadata["id"]
+                if download_item.media.media_metadata
+                else download_item.media.media_id
+            )
+            media_type = (
+                download_item.media.media_metadata["type"]
+                if download_item.media.media_metadata
+                else None
+            )
+            # Albums, playlists and artists only expand into tracks, so they
+            # are not tracked as tasks unless they failed to expand
+            is_task = job_id is not None and (
+                not download_item.media.partial
+                or media_type is None
+                or media_type in TRACK_MEDIA_TYPES
+            )
+            if is_task:
+                database.add_task(job_id, task_id, download_item.media.index)
+                if not download_item.media.partial and not database.lease_task(
+                    job_id, task_id
+                ):
+                    stats.skipped += 1
+                    continue
+
+            media_index = download_item.media.index + 1
+            media_total = download_item.media.total or "-"
+
+            track_log = logger.bind(action=f"Track {media_index:>3}/{media_total:<3}")
+
+            media_title = (
+                download_item.media.media_metadata["attributes"]["name"]
+                if download_item.media.media_metadata
+                and download_item.media.media_metadata.get("attributes", {}).get("name")
+                else "Unknown Title"
+            )
+
+            if download_item.media.partial and (
+                media_type is None or media_type in TRACK_MEDIA_TYPES
+            ):
+                track_log.info(f'Downloading "{media_title}"')
+
+            if is_task and not download_item.media.partial:
+                database.set_task_stage(job_id, task_id, "download")
+
+            current_media_id.set(task_id)
+            try:
+                await downloader.download(download_item)
+            except (
+                GamdlInterfaceMediaNotStreamableError,
+                GamdlInterfaceFormatNotAvailableError,
+                GamdlInterfaceDecryptionNotAvailableError,
+                GamdlInterfaceArtistMediaTypeError,
+                GamdlDownloaderSyncedLyricsOnlyError,
+                GamdlDownloaderMediaFileExistsError,
+                GamdlDownloaderDependencyNotFoundError,
+                GamdlInterfaceFlatFilterExcludedError,
+            ) as e:
+                stats.skipped += 1
+                track_log.warning(f'Skipping "{media_title}": {e}')
+                if is_task:
+                    database.finish_task(job_id, task_id, "skipped", str(e))
+                continue
+            except Exception as e:
+                stats.errors += 1
+                track_log.exception(f'Error downloading "{media_title}"')
+                if is_task:
+                    database.finish_task(job_id, task_id, "failed", str(e))
+            else:
+                if not download_item.media.partial:
+                    stats.downloaded += 1
+                    if is_task:
+                        database.finish_task(job_id, task_id, "done")
+
+            if database and (
+                ledger_entry := await downloader.get_ledger_entry(download_item)
+            ):
+                database.add_entry(ledger_entry)
+    except GamdlInterfaceUrlParseError as e:
+        url_failed = True
+        url_log.error(f"{e}")
+    except Exception as e:
+        url_log.exception(f'Error processing "{url}": {e}')
+        stats.errors += 1
+    finally:
+        await downloader.flush_playlist_files()
+        if job_id is not None:
+            database.finish_job(job_id, failed=url_failed)
+        if database:
+            database.flush()
+        profiler.checkpoint(url)
@@ -0,0 +1,267 @@
+import asyncio
+import json
+import time
+import uuid
+from dataclasses import dataclass, field
+from enum import Enum
+from http import HTTPStatus
+
+import structlog
+
+from ..downloader import AppleMusicDownloader
+from ..metrics import metrics
+from .database import Database
+from .runner import DownloadStats, download_url
+
+logger = structlog.get_logger(__name__)
+
+
+class JobStatus(Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+@dataclass
+class DownloadJob:
+    urls: list[str]
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: JobStatus = JobStatus.QUEUED
+    stats: DownloadStats = field(default_factory=DownloadStats)
+    created_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    error: str | None = None
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "urls": self.urls,
+            "status": self.status.value,
+            "downloaded": self.stats.downloaded,
+            "skipped": self.stats.skipped,
+            "errors": self.stats.errors,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+
+class HttpError(Exception):
+    def __init__(self, status: HTTPStatus, message: str | None = None):
+        super().__init__(message or status.phrase)
+        self.status = status
+
+
+class DownloadServer:
+    def __init__(
+        self,
+        downloader: AppleMusicDownloader,
+        database: Database | None = None,
+        host: str = "127.0.0.1",
+        port: int = 8181,
+        max_request_size: int = 1024 * 1024,
+    ):
+        self.downloader = downloader
+        self.database = database
+        self.host = host
+        self.port = port
+        self.max_request_size = max_request_size
+
+        self.jobs: dict[str, DownloadJob] = {}
+        self._queue: asyncio.Queue[DownloadJob] = asyncio.Queue()
+
+    def submit(self, urls: list[str]) -> DownloadJob:
+        job = DownloadJob(urls=urls)
+        self.jobs[job.id] = job
+        self._queue.put_nowait(job)
+        return job
+
+    async def serve_forever(self) -> None:
+        log = logger.bind(action="Serve")
+
+        worker = asyncio.create_task(self._run_jobs())
+        server = await asyncio.start_server(
+            self._handle_connection,
+            self.host,
+            self.port,
+        )
+        log.info(f"Listening on http://{self.host}:{self.port}")
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            worker.cancel()
+
+    async def _run_jobs(self) -> None:
+        while True:
+            job = await self._queue.get()
+            await self._run_job(job)
+            self._queue.task_done()
+
+    async def _run_job(self, job: DownloadJob) -> None:
+        job_log = logger.bind(action=f"Job {job.id[:8]}")
+
+        job.status = JobStatus.RUNNING
+        job.started_at = time.time()
+        try:
+            for url_index, url in enumerate(job.urls, 1):
+                url_log = logger.bind(
+                    action=(f"Job {job.id[:8]} URL {url_index:>3}/{len(job.urls):<3}"),
+                )
+                await download_url(
+                    self.downloader,
+                    self.database,
+                    url,
+                    url_log,
+                    job.stats,
+                    self.database.add_job(url) if self.database else None,
+                )
+        except Exception as e:
+            job.status = JobStatus.FAILED
+            job.error = str(e)
+            job_log.exception(f"Job failed: {e}")
+        else:
+            job.status = JobStatus.DONE
+            job_log.info(f"Finished with {job.stats.errors} error(s)")
+        finally:
+            job.finished_at = time.time()
+
+    async def _handle_connection(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        try:
+            try:
+                method, path, body = await self._read_request(reader)
+                status, payload = self._route(method, path, body)
+            except HttpError as e:
+                status, payload = e.status, {"error": str(e)}
+            await self._write_response(writer, status, payload)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(
+        self,
+        reader: asyncio.StreamReader,
+    ) -> tuple[str, str, bytes]:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            raise HttpError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+
+        request_line, *header_lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, path, _ = request_line.split(" ", 2)
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Malformed request line")
+
+        headers = {}
+        for line in header_lines:
+            name, sep, value = line.partition(":")
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+
+        try:
+            content_length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length")
+        if content_length > self.max_request_size:
+            raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+
+        body = await reader.readexactly(content_length) if content_length else b""
+        return method.upper(), path.split("?", 1)[0].rstrip("/") or "/", body
+
+    def _route(
+        self,
+        method: str,
+        path: str,
+        body: bytes,
+    ) -> tuple[HTTPStatus, dict | str]:
+        if path == "/metrics":
+            if method != "GET":
+                raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED)
+            if not metrics.enabled:
+                raise HttpError(HTTPStatus.NOT_FOUND, "Metrics are disabled")
+            return HTTPStatus.OK, metrics.prometheus_text()
+
+        if path == "/health":
+            if method != "GET":
+                raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED)
+            account_pool = self.downloader.base.interface.base.account_pool
+            return HTTPStatus.OK, {
+                "status": "ok",
+                "queued": self._queue.qsize(),
+                "accounts": account_pool.usage() if account_pool else [],
+            }
+
+        if path == "/jobs":
+            if method == "GET":
+                return HTTPStatus.OK, {
+                    "jobs": [job.as_dict() for job in self.jobs.values()]
+                }
+            if method == "POST":
+                return (
+                    HTTPStatus.ACCEPTED,
+                    self.submit(self._parse_urls(body)).as_dict(),
+                )
+            raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED)
+
+        if path.startswith("/jobs/"):
+            if method != "GET":
+                raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED)
+            job = self.jobs.get(path.removeprefix("/jobs/"))
+            if job is None:
+                raise HttpError(HTTPStatus.NOT_FOUND, "Unknown job")
+            return HTTPStatus.OK, job.as_dict()
+
+        raise HttpError(HTTPStatus.NOT_FOUND)
+
+    @staticmethod
+    def _parse_urls(body: bytes) -> list[str]:
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Body must be JSON")
+
+        urls = payload.get("urls") if isinstance(payload, dict) else None
+        if (
+            not isinstance(urls, list)
+            or not urls
+            or not all(isinstance(url, str) and url.strip() for url in urls)
+        ):
+            raise HttpError(
+                HTTPStatus.BAD_REQUEST,
+                'Body must be {"urls": [...]} with at least one URL',
+            )
+        return [url.strip() for url in urls]
+
+    @staticmethod
+    async def _write_response(
+        writer: asyncio.StreamWriter,
+        status: HTTPStatus,
+        payload: dict | str,
+    ) -> None:
+        if isinstance(payload, str):
+            body = payload.encode()
+            content_type = "text/plain; version=0.0.4"
+        else:
+            body = json.dumps(payload).encode()
+            content_type = "application/json"
+        writer.write(
+            (
+                f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n"
+                "\r\n"
+            ).encode("latin-1")
+            + body
+        )
+        await writer.drain()
@@ -1,4 +1,4 @@
-from .ammuxer import decrypt_and_mux_hex, decrypt_and_mux_wrapper
+from .ammuxer import decrypt_and_mux_hex, decrypt_and_mux_many, decrypt_and_mux_wrapper
 from .base import AppleMusicBaseDownloader
 from .downloader import AppleMusicDownloader
 from .enums import *
@@ -3,11 +3,124 @@
 from __future__ import annotations
 
 import asyncio
+import struct
+from typing import Callable
 
 from .. import _ammuxer
 from ..api.wrapper import WrapperApi
+from ..interface.enums import CoverFormat
+from ..metrics import metrics
+from ..tracing import tracer
+from .types import DecryptMuxJob
 
+ILST_DATA_TYPE_IMPLICIT = 0
+ILST_DATA_TYPE_UTF8 = 1
+ILST_DATA_TYPE_JPEG = 13
+ILST_DATA_TYPE_PNG = 14
+ILST_DATA_TYPE_INTEGER = 21
+ILST_INTEGER_MIN_BYTES = {
+    "plID": 8,
+    "cnID": 4,
+    "geID": 4,
+    "atID": 4,
+    "sfID": 4,
+    "cmID": 4,
+    "stik": 1,
+    "rtng": 1,
+}
 
+
+def _render_atom(name: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", len(payload) + 8, name) + payload
+
+
+def _render_data_atom(name: bytes, data_type: int, values: list[bytes]) -> bytes:
+    return _render_atom(
+        name,
+        b"".join(
+            _render_atom(b"data", struct.pack(">2I", data_type, 0) + value)
+            for value in values
+        ),
+    )
+
+
+def _render_integer(value: int, min_bytes: int) -> bytes:
+    for size in (1, 2, 4, 8):
+        if size < min_bytes:
+            continue
+        try:
+            return int(value).to_bytes(size, "big", signed=True)
+        except OverflowError:
+            continue
+    raise ValueError(f"Integer tag value out of range: {value}")
+
+
+def build_ilst(
+    mp4_tags: dict,
+    cover_bytes: bytes | None = None,
+    cover_format: CoverFormat = CoverFormat.JPG,
+) -> bytes:
+    """Render MediaTags.as_mp4_tags output as ilst children for the native muxer."""
+    atoms = []
+    for key, value in mp4_tags.items():
+        name = key.encode("latin-1")
+        if key == "trkn":
+            atoms.append(
+                _render_data_atom(
+                    name,
+                    ILST_DATA_TYPE_IMPLICIT,
+                    [struct.pack(">4H", 0, track, total, 0) for track, total in value],
+                )
+            )
+        elif key == "disk":
+            atoms.append(
+                _render_data_atom(
+                    name,
+                    ILST_DATA_TYPE_IMPLICIT,
+                    [struct.pack(">3H", 0, disc, total) for disc, total in value],
+                )
+            )
+        elif isinstance(value, bool):
+            atoms.append(
+                _render_data_atom(name, ILST_DATA_TYPE_INTEGER, [bytes([value])])
+            )
+        elif key in ILST_INTEGER_MIN_BYTES:
+            atoms.append(
+                _render_data_atom(
+                    name,
+                    ILST_DATA_TYPE_INTEGER,
+                    [
+                        _render_integer(item, ILST_INTEGER_MIN_BYTES[key])
+                        for item in value
+                    ],
+                )
+            )
+        else:
+            atoms.append(
+                _render_data_atom(
+                    name,
+                    ILST_DATA_TYPE_UTF8,
+                    [str(item).encode("utf-8") for item in value],
+                )
+            )
+
+    if cover_bytes is not None:
+        atoms.append(
+            _render_data_atom(
+                b"covr",
+                (
+                    ILST_DATA_TYPE_JPEG
+                    if cover_format == CoverFormat.JPG
+                    else ILST_DATA_TYPE_PNG
+                ),
+                [cover_bytes],
+            )
+        )
+
+    return b"".join(atoms)
+
+
+@metrics.timed("decrypt_and_mux_hex")
 async def decrypt_and_mux_hex(
     decryption_key_audio: str,
     input_audio_path: str,
@@ -18,10 +131,14 @@ async def decrypt_and_mux_hex(
     use_cenc: bool = False,
     use_single_content_key: bool = False,
     m4v_brand: bool = False,
+    ilst: bytes | None = None,
+    input_audio_buffer: bytearray | memoryview | None = None,
+    input_video_buffer: bytearray | memoryview | None = None,
+    decrypt_threads: int = 0,
 ) -> None:
     """Decrypt local-key media and mux the final file in one Rust call."""
     await asyncio.to_thread(
-        _ammuxer.decrypt_and_mux_hex_native,
+        tracer.wrap(_ammuxer.decrypt_and_mux_hex_native, "decrypt_and_mux_hex_native"),
         decryption_key_audio,
         input_audio_path,
         output_path,
@@ -30,9 +147,28 @@ async def decrypt_and_mux_hex(
         use_cenc,
         use_single_content_key,
         m4v_brand,
+        ilst,
+        input_audio_buffer,
+        input_video_buffer,
+        decrypt_threads,
     )
 
 
+def create_wrapper_decrypt_session(
+    wrapper_api: WrapperApi,
+    max_connections: int = 2,
+    pipeline_depth: int = 4,
+) -> _ammuxer.WrapperDecryptSession:
+    """Create a pooled wrapper-v2 decrypt session that can be shared across tracks."""
+    return _ammuxer.WrapperDecryptSession(
+        wrapper_api.decrypt_host,
+        wrapper_api.decrypt_port,
+        max_connections,
+        pipeline_depth,
+    )
+
+
+@metrics.timed("decrypt_and_mux_wrapper")
 async def decrypt_and_mux_wrapper(
     wrapper_api: WrapperApi,
     track_id: str,
@@ -44,10 +180,16 @@ async def decrypt_and_mux_wrapper(
     fairplay_key_video: str | None = None,
     use_single_content_key: bool = False,
     m4v_brand: bool = False,
+    ilst: bytes | None = None,
+    input_audio_buffer: bytearray | memoryview | None = None,
+    input_video_buffer: bytearray | memoryview | None = None,
+    decrypt_session: _ammuxer.WrapperDecryptSession | None = None,
 ) -> None:
     """Decrypt wrapper-v2 FairPlay media and mux the final file in one Rust call."""
     await asyncio.to_thread(
-        _ammuxer.decrypt_and_mux_wrapper_native,
+        tracer.wrap(
+            _ammuxer.decrypt_and_mux_wrapper_native, "decrypt_and_mux_wrapper_native"
+        ),
         wrapper_api.decrypt_host,
         wrapper_api.decrypt_port,
         track_id,
@@ -58,4 +200,92 @@ async def decrypt_and_mux_wrapper(
         fairplay_key_video,
         use_single_content_key,
         m4v_brand,
+        ilst,
+        input_audio_buffer,
+        input_video_buffer,
+        decrypt_session,
+    )
+
+
+@metrics.timed("decrypt_and_mux_many")
+async def decrypt_and_mux_many(
+    jobs: list[DecryptMuxJob],
+    *,
+    wrapper_api: WrapperApi | None = None,
+    decrypt_session: _ammuxer.WrapperDecryptSession | None = None,
+    max_workers: int = 0,
+    decrypt_threads: int = 0,
+    progress: Callable[[int, Exception | None], None] | None = None,
+) -> list[Exception | None]:
+    """Decrypt and mux a batch of files in one Rust call, one result per job."""
+    native_progress = None
+    if progress is not None:
+        loop = asyncio.get_running_loop()
+
+        def native_progress(index: int, error: Exception | None) -> None:
+            loop.call_soon_threadsafe(progress, index, error)
+
+    return await asyncio.to_thread(
+        tracer.wrap(
+            _ammuxer.decrypt_and_mux_many_native, "decrypt_and_mux_many_native"
+        ),
+        jobs,
+        wrapper_api.decrypt_host if wrapper_api else None,
+        wrapper_api.decrypt_port if wrapper_api else None,
+        decrypt_session,
+        max_workers,
+        decrypt_threads,
+        native_progress,
+    )
+
+
+def create_fragmented_muxer(
+    output_path: str,
+    *,
+    decryption_key: str | None = None,
+    decrypt_session: _ammuxer.WrapperDecryptSession | None = None,
+    track_id: str | None = None,
+    fairplay_key: str | None = None,
+    use_cenc: bool = False,
+    use_single_content_key: bool = False,
+    ilst: bytes | None = None,
+    decrypt_threads: int = 0,
+) -> _ammuxer.FragmentedMuxer:
+    """Create a native muxer that decrypts fragmented MP4 data as it is fed."""
+    return _ammuxer.FragmentedMuxer(
+        output_path,
+        decryption_key,
+        decrypt_session,
+        track_id,
+        fairplay_key,
+        use_cenc,
+        use_single_content_key,
+        ilst,
+        decrypt_threads,
+    )
+
+
+async def feed_muxer(muxer: _ammuxer.FragmentedMuxer, data: bytes) -> None:
+    """Hand downloaded bytes to a fragmented muxer off the event loop."""
+    await asyncio.to_thread(tracer.wrap(muxer.feed, "muxer_feed"), data)
+
+
+@metrics.timed("finish_muxer")
+async def finish_muxer(muxer: _ammuxer.FragmentedMuxer) -> None:
+    """Flush a fragmented muxer and verify the stream ended on a box boundary."""
+    await asyncio.to_thread(tracer.wrap(muxer.finish, "muxer_finish"))
+
+
+@metrics.timed("defragment")
+async def defragment(
+    input_path: str,
+    output_path: str,
+    ilst: bytes | None = None,
+) -> None:
+    """Rewrite clear fragmented MP4 output into the regular moov/mdat layout."""
+    await asyncio.to_thread(
+        tracer.wrap(_ammuxer.defragment_native, "defragment_native"),
+        input_path,
+        output_path,
+        ilst,
     )
@@ -0,0 +1,248 @@
+use crate::decrypt::{WrapperDecryptSession, WrapperPool};
+use crate::media::{mux_files, MuxKeys, WRAPPER_DECRYPT_PIPELINE_DEPTH};
+use crate::mp4::validate_ilst;
+use pyo3::exceptions::{PyIOError, PyValueError};
+use pyo3::prelude::*;
+use pyo3::types::PyAny;
+use rayon::prelude::*;
+use rayon::ThreadPoolBuilder;
+use std::sync::Arc;
+
+fn py_value_error(message: impl Into<String>) -> PyErr {
+    PyValueError::new_err(message.into())
+}
+
+fn bytes_attr(obj: &Bound<'_, PyAny>, name: &str) -> PyResult<Vec<u8>> {
+    let value = obj.getattr(name)?;
+    if value.is_none() {
+        Ok(Vec::new())
+    } else {
+        Ok(value.extract::<Vec<u8>>()?)
+    }
+}
+
+fn option_string_attr(obj: &Bound<'_, PyAny>, name: &str) -> PyResult<Option<String>> {
+    let value = obj.getattr(name)?;
+    if value.is_none() {
+        Ok(None)
+    } else {
+        value.extract::<String>().map(Some)
+    }
+}
+
+/// One file-to-file decrypt and mux of a batch.
+struct MuxJob {
+    input_audio_path: String,
+    input_video_path: Option<String>,
+    output_path: String,
+    keys: MuxKeys,
+    use_single_content_key: bool,
+    m4v_brand: bool,
+    ilst: Vec<u8>,
+}
+
+impl MuxJob {
+    fn extract(
+        job: &Bound<'_, PyAny>,
+        wrapper_pool: &mut dyn FnMut() -> PyResult<Arc<WrapperPool>>,
+        decrypt_threads: usize,
+    ) -> PyResult<Self> {
+        let decryption_key_audio = option_string_attr(job, "decryption_key_audio")?;
+        let track_id = option_string_attr(job, "track_id")?;
+        let fairplay_key_audio = option_string_attr(job, "fairplay_key_audio")?;
+        let keys =
+            match (decryption_key_audio, track_id, fairplay_key_audio) {
+                (Some(audio), _, _) => MuxKeys::Hex {
+                    audio,
+                    video: option_string_attr(job, "decryption_key_video")?,
+                    use_cenc: job.getattr("use_cenc")?.extract()?,
+                    decrypt_threads,
+                },
+                (None, Some(track_id), Some(audio)) => MuxKeys::Wrapper {
+                    pool: wrapper_pool()?,
+                    track_id,
+                    audio,
+                    video: option_string_attr(job, "fairplay_key_video")?,
+                },
+                _ => return Err(py_value_error(
+                    "batch: job needs decryption_key_audio, or track_id with fairplay_key_audio",
+                )),
+            };
+        let ilst = bytes_attr(job, "ilst")?;
+        validate_ilst(&ilst).map_err(|err| py_value_error(err.to_string()))?;
+        Ok(Self {
+            input_audio_path: job.getattr("input_audio_path")?.extract()?,
+            input_video_path: option_string_attr(job, "input_video_path")?,
+            output_path: job.getattr("output_path")?.extract()?,
+            keys,
+            use_single_content_key: job.getattr("use_single_content_key")?.extract()?,
+            m4v_brand: job.getattr("m4v_brand")?.extract()?,
+            ilst,
+        })
+    }
+
+    fn run(&self) -> PyResult<()> {
+        mux_files(
+            &self.input_audio_path,
+            self.input_video_path.as_deref(),
+            &self.keys,
+            &self.output_path,
+            self.use_single_content_key,
+            self.m4v_brand,
+            &self.ilst,
+        )
+    }
+}
+
+fn batch_workers(max_workers: usize, jobs: usize) -> usize {
+    let workers = match max_workers {
+        0 => std::thread::available_parallelism().map_or(1, usize::from),
+        workers => workers,
+    };
+    workers.min(jobs).max(1)
+}
+
+/// Runs every job on a dedicated pool and calls `on_done` as each one ends.
+fn run_jobs<F>(jobs: &[MuxJob], workers: usize, on_done: F) -> PyResult<Vec<PyResult<()>>>
+where
+    F: Fn(usize, &PyResult<()>) + Sync,
+{
+    let pool = ThreadPoolBuilder::new()
+        .num_threads(workers)
+        .thread_name(|index| format!("ammuxer-batch-{index}"))
+        .build()
+        .map_err(|err| PyIOError::new_err(err.to_string()))?;
+    Ok(pool.install(|| {
+        jobs.par_iter()
+            .enumerate()
+            .map(|(index, job)| {
+                let result = job.run();
+                on_done(index, &result);
+                result
+            })
+            .collect()
+    }))
+}
+
+#[pyfunction]
+#[pyo3(signature = (jobs, wrapper_decrypt_host=None, wrapper_decrypt_port=None, decrypt_session=None, max_workers=0, decrypt_threads=0, progress=None))]
+pub fn decrypt_and_mux_many_native(
+    py: Python<'_>,
+    jobs: Vec<Bound<'_, PyAny>>,
+    wrapper_decrypt_host: Option<String>,
+    wrapper_decrypt_port: Option<u16>,
+    decrypt_session: Option<Bound<'_, WrapperDecryptSession>>,
+    max_workers: usize,
+    decrypt_threads: usize,
+    progress: Option<Py<PyAny>>,
+) -> PyResult<Vec<Option<PyErr>>> {
+    let workers = batch_workers(max_workers, jobs.len());
+    let mut shared_pool: Option<Arc<WrapperPool>> = None;
+    let mut wrapper_pool = || -> PyResult<Arc<WrapperPool>> {
+        if let Some(pool) = &shared_pool {
+            return Ok(pool.clone());
+        }
+        let pool = match (
+            &decrypt_session,
+            &wrapper_decrypt_host,
+            wrapper_decrypt_port,
+        ) {
+            (Some(session), _, _) => session.get().pool(),
+            (None, Some(host), Some(port)) => {
+                WrapperPool::new(host.clone(), port, workers, WRAPPER_DECRYPT_PIPELINE_DEPTH)
+            }
+            _ => {
+                return Err(py_value_error(
+                    "batch: wrapper jobs need decrypt_session or a wrapper host and port",
+                ))
+            }
+        };
+        shared_pool = Some(pool.clone());
+        Ok(pool)
+    };
+    let jobs = jobs
+        .iter()
+        .map(|job| MuxJob::extract(job, &mut wrapper_pool, decrypt_threads))
+        .collect::<PyResult<Vec<_>>>()?;
+    let results = py.detach(|| {
+        run_jobs(&jobs, workers, |index, result| {
+            let Some(progress) = &progress else {
+                return;
+            };
+            Python::attach(|py| {
+                let error = result.as_ref().err().map(|err| err.clone_ref(py));
+                if let Err(err) = progress.call1(py, (index, error)) {
+                    err.write_unraisable(py, None);
+                }
+            });
+        })
+    })?;
+    Ok(results.into_iter().map(Result::err).collect())
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::fixtures::{init_segment, media_segment, KEY};
+    use std::sync::Mutex;
+
+    fn hex_job(input_audio_path: &str, output_path: &str) -> MuxJob {
+        MuxJob {
+            input_audio_path: input_audio_path.to_string(),
+            input_video_path: None,
+            output_path: output_path.to_string(),
+            keys: MuxKeys::Hex {
+                audio: KEY.iter().map(|byte| format!("{byte:02x}")).collect(),
+                video: None,
+                use_cenc: false,
+                decrypt_threads: 1,
+            },
+            use_single_content_key: true,
+            m4v_brand: false,
+            ilst: Vec::new(),
+        }
+    }
+
+    #[test]
+    fn runs_jobs_and_reports_each_result() {
+        let samples: Vec<Vec<u8>> = (0..4u8).map(|index| vec![index; 64]).collect();
+        let input = [init_segment(), media_segment(1, &samples)].concat();
+        let input_file = tempfile::NamedTempFile::new().unwrap();
+        std::fs::write(input_file.path(), &input).unwrap();
+        let input_path = input_file.path().to_string_lossy().to_string();
+        let outputs: Vec<_> = (0..3)
+            .map(|_| tempfile::NamedTempFile::new().unwrap())
+            .collect();
+        let output_path = |index: usize| outputs[index].path().to_string_lossy().to_string();
+        let jobs = vec![
+            hex_job(&input_path, &output_path(0)),
+            hex_job("/nonexistent/input.mp4", &output_path(1)),
+            hex_job(&input_path, &output_path(2)),
+        ];
+
+        let reported = Mutex::new(Vec::new());
+        let results = run_jobs(&jobs, 2, |index, result| {
+            reported.lock().unwrap().push((index, result.is_ok()));
+        })
+        .unwrap();
+
+        assert!(results[0].is_ok());
+        assert!(results[1].is_err());
+        assert!(results[2].is_ok());
+        let mut reported = reported.into_inner().unwrap();
+        reported.sort();
+        assert_eq!(reported, vec![(0, true), (1, false), (2, true)]);
+        for index in [0, 2] {
+            let written = std::fs::read(output_path(index)).unwrap();
+            assert!(written.ends_with(&samples.concat()));
+        }
+    }
+
+    #[test]
+    fn caps_workers_at_job_count() {
+        assert_eq!(batch_workers(8, 3), 3);
+        assert_eq!(batch_workers(2, 10), 2);
+        assert_eq!(batch_workers(4, 0), 1);
+        assert!(batch_workers(0, 64) >= 1);
+    }
+}
@@ -1,7 +1,12 @@
-use pyo3::exceptions::{PyIOError, PyRuntimeError, PyValueError};
+use pyo3::exceptions::{PyIOError, PyValueError};
 use pyo3::prelude::*;
-use std::io::{Read, Write};
-use std::net::TcpStream;
+use std::collections::HashMap;
+use std::io::{self, Read, Write};
+use std::net::{Shutdown, TcpStream};
+use std::ops::{Deref, DerefMut};
+use std::sync::mpsc::{self, Receiver};
+use std::sync::{Arc, Condvar, Mutex, MutexGuard};
+use std::thread::{self, JoinHandle};
 use std::time::Duration;
 
 const DECRYPT_MAGIC: u32 = 0x57563244; // WV2D
@@ -12,6 +17,7 @@ const DECRYPT_KIND_ERROR: u16 = 3;
 const DECRYPT_KIND_CLOSE: u16 = 9;
 
 type BatchItem = (Vec<u8>, Vec<u8>, Vec<u8>, Vec<(usize, usize)>);
+type Frame = (u16, u32, Vec<u8>);
 
 fn value_error(message: impl Into<String>) -> PyErr {
     PyValueError::new_err(message.into())
@@ -21,6 +27,26 @@ fn io_error(message: impl Into<String>) -> PyErr {
     PyIOError::new_err(message.into())
 }
 
+fn py_error(err: io::Error) -> PyErr {
+    if err.kind() == io::ErrorKind::InvalidInput {
+        value_error(err.to_string())
+    } else {
+        io_error(err.to_string())
+    }
+}
+
+fn invalid_input(message: impl Into<String>) -> io::Error {
+    io::Error::new(io::ErrorKind::InvalidInput, message.into())
+}
+
+fn invalid_data(message: impl Into<String>) -> io::Error {
+    io::Error::new(io::ErrorKind::InvalidData, message.into())
+}
+
+fn with_context(err: io::Error, context: &str) -> io::Error {
+    io::Error::new(err.kind(), format!("{context}: {err}"))
+}
+
 fn validate_label(name: &str, value: &str) -> PyResult<Vec<u8>> {
     let bytes = value.as_bytes();
     if bytes.is_empty() {
@@ -118,71 +144,79 @@ fn reassemble_sample(
 fn build_decrypt_batch_payload(
     adam_id: &[u8],
     skd_uri: &[u8],
-    items: &[BatchItem],
-) -> PyResult<Vec<u8>> {
-    if items.is_empty() {
-        return Err(value_error(
+    ciphertexts: &[&[u8]],
+) -> io::Result<Vec<u8>> {
+    if adam_id.is_empty() || skd_uri.is_empty() {
+        return Err(invalid_input(
+            "wrapper-v2: decrypt labels must not be empty",
+        ));
+    }
+    if adam_id.len() > u16::MAX as usize || skd_uri.len() > u16::MAX as usize {
+        return Err(invalid_input("wrapper-v2: decrypt label too long"));
+    }
+    if ciphertexts.is_empty() {
+        return Err(invalid_input(
             "wrapper-v2: ciphertext batch must not be empty",
         ));
     }
-    if items.len() > u32::MAX as usize {
-        return Err(value_error("wrapper-v2: ciphertext batch is too large"));
+    if ciphertexts.len() > u32::MAX as usize {
+        return Err(invalid_input("wrapper-v2: ciphertext batch is too large"));
     }
     let mut size = 8usize
         .checked_add(
-            items
+            ciphertexts
                 .len()
                 .checked_mul(4)
-                .ok_or_else(|| value_error("wrapper-v2: decrypt batch size overflow"))?,
+                .ok_or_else(|| invalid_input("wrapper-v2: decrypt batch size overflow"))?,
         )
         .and_then(|n| n.checked_add(adam_id.len()))
         .and_then(|n| n.checked_add(skd_uri.len()))
-        .ok_or_else(|| value_error("wrapper-v2: decrypt batch size overflow"))?;
-    for (idx, (_, aligned, _, _)) in items.iter().enumerate() {
+        .ok_or_else(|| invalid_input("wrapper-v2: decrypt batch size overflow"))?;
+    for (idx, aligned) in ciphertexts.iter().enumerate() {
         if aligned.is_empty() {
-            return Err(value_error(format!(
+            return Err(invalid_input(format!(
                 "wrapper-v2: ciphertext sample {idx} must not be empty"
             )));
         }
         if aligned.len() > u32::MAX as usize {
-            return Err(value_error(format!(
+            return Err(invalid_input(format!(
                 "wrapper-v2: ciphertext sample {idx} is too large"
             )));
         }
         size = size
             .checked_add(aligned.len())
-            .ok_or_else(|| value_error("wrapper-v2: decrypt batch size overflow"))?;
+            .ok_or_else(|| invalid_input("wrapper-v2: decrypt batch size overflow"))?;
     }
 
     let mut out = Vec::with_capacity(size);
     out.extend_from_slice(&(adam_id.len() as u16).to_be_bytes());
     out.extend_from_slice(&(skd_uri.len() as u16).to_be_bytes());
-    out.extend_from_slice(&(items.len() as u32).to_be_bytes());
-    for (_, aligned, _, _) in items {
+    out.extend_from_slice(&(ciphertexts.len() as u32).to_be_bytes());
+    for aligned in ciphertexts {
         out.extend_from_slice(&(aligned.len() as u32).to_be_bytes());
     }
     out.extend_from_slice(adam_id);
     out.extend_from_slice(skd_uri);
-    for (_, aligned, _, _) in items {
+    for aligned in ciphertexts {
         out.extend_from_slice(aligned);
     }
     Ok(out)
 }
 
-fn read_decrypt_samples_payload(data: &[u8]) -> PyResult<Vec<Vec<u8>>> {
+fn read_decrypt_samples_payload(data: &[u8]) -> io::Result<Vec<Vec<u8>>> {
     if data.len() < 4 {
-        return Err(io_error("wrapper-v2: decrypt response too short"));
+        return Err(invalid_data("wrapper-v2: decrypt response too short"));
     }
     let sample_count = u32::from_be_bytes([data[0], data[1], data[2], data[3]]) as usize;
     let table_end = 4usize
         .checked_add(
             sample_count
                 .checked_mul(4)
-                .ok_or_else(|| io_error("wrapper-v2: decrypt response overflow"))?,
+                .ok_or_else(|| invalid_data("wrapper-v2: decrypt response overflow"))?,
         )
-        .ok_or_else(|| io_error("wrapper-v2: decrypt response overflow"))?;
+        .ok_or_else(|| invalid_data("wrapper-v2: decrypt response overflow"))?;
     if data.len() < table_end {
-        return Err(io_error("wrapper-v2: truncated decrypt length table"));
+        return Err(invalid_data("wrapper-v2: truncated decrypt length table"));
     }
     let mut lengths = Vec::with_capacity(sample_count);
     for i in 0..sample_count {
@@ -196,97 +230,372 @@ fn read_decrypt_samples_payload(data: &[u8]) -> PyResult<Vec<Vec<u8>>> {
     for len in lengths {
         let end = offset
             .checked_add(len)
-            .ok_or_else(|| io_error("wrapper-v2: decrypt response overflow"))?;
+            .ok_or_else(|| invalid_data("wrapper-v2: decrypt response overflow"))?;
         if end > data.len() {
-            return Err(io_error("wrapper-v2: truncated plaintext sample"));
+            return Err(invalid_data("wrapper-v2: truncated plaintext sample"));
         }
         out.push(data[offset..end].to_vec());
         offset = end;
     }
     if offset != data.len() {
-        return Err(io_error("wrapper-v2: trailing decrypt response bytes"));
+        return Err(invalid_data("wrapper-v2: trailing decrypt response bytes"));
     }
     Ok(out)
 }
 
-fn read_frame(stream: &mut TcpStream) -> PyResult<(u16, u32, Vec<u8>)> {
+fn read_frame(stream: &mut TcpStream) -> io::Result<Frame> {
     let mut h = [0u8; 16];
-    stream.read_exact(&mut h).map_err(|e| {
-        io_error(format!(
-            "wrapper-v2: TCP decrypt truncated frame header: {e}"
-        ))
-    })?;
+    stream
+        .read_exact(&mut h)
+        .map_err(|e| with_context(e, "wrapper-v2: TCP decrypt truncated frame header"))?;
     let magic = u32::from_be_bytes([h[0], h[1], h[2], h[3]]);
     let version = u16::from_be_bytes([h[4], h[5]]);
     if magic != DECRYPT_MAGIC {
-        return Err(io_error("wrapper-v2: bad decrypt response magic"));
+        return Err(invalid_data("wrapper-v2: bad decrypt response magic"));
     }
     if version != DECRYPT_VERSION {
-        return Err(io_error("wrapper-v2: bad decrypt response version"));
+        return Err(invalid_data("wrapper-v2: bad decrypt response version"));
     }
     let kind = u16::from_be_bytes([h[6], h[7]]);
     let request_id = u32::from_be_bytes([h[8], h[9], h[10], h[11]]);
     let payload_len = u32::from_be_bytes([h[12], h[13], h[14], h[15]]) as usize;
     let mut payload = vec![0u8; payload_len];
-    stream.read_exact(&mut payload).map_err(|e| {
-        io_error(format!(
-            "wrapper-v2: TCP decrypt truncated frame payload: {e}"
-        ))
-    })?;
+    stream
+        .read_exact(&mut payload)
+        .map_err(|e| with_context(e, "wrapper-v2: TCP decrypt truncated frame payload"))?;
     Ok((kind, request_id, payload))
 }
 
-fn write_frame(stream: &mut TcpStream, kind: u16, request_id: u32, payload: &[u8]) -> PyResult<()> {
+fn write_frame(
+    stream: &mut TcpStream,
+    kind: u16,
+    request_id: u32,
+    payload: &[u8],
+) -> io::Result<()> {
     if payload.len() > u32::MAX as usize {
-        return Err(value_error("wrapper-v2: decrypt frame is too large"));
+        return Err(invalid_input("wrapper-v2: decrypt frame is too large"));
     }
+    let mut header = [0u8; 16];
+    header[0..4].copy_from_slice(&DECRYPT_MAGIC.to_be_bytes());
+    header[4..6].copy_from_slice(&DECRYPT_VERSION.to_be_bytes());
+    header[6..8].copy_from_slice(&kind.to_be_bytes());
+    header[8..12].copy_from_slice(&request_id.to_be_bytes());
+    header[12..16].copy_from_slice(&(payload.len() as u32).to_be_bytes());
     stream
-        .write_all(&DECRYPT_MAGIC.to_be_bytes())
-        .and_then(|_| stream.write_all(&DECRYPT_VERSION.to_be_bytes()))
-        .and_then(|_| stream.write_all(&kind.to_be_bytes()))
-        .and_then(|_| stream.write_all(&request_id.to_be_bytes()))
-        .and_then(|_| stream.write_all(&(payload.len() as u32).to_be_bytes()))
+        .write_all(&header)
         .and_then(|_| stream.write_all(payload))
-        .map_err(|e| io_error(format!("wrapper-v2: TCP decrypt frame write failed: {e}")))
+        .map_err(|e| with_context(e, "wrapper-v2: TCP decrypt frame write failed"))
 }
 
-#[pyclass]
-pub struct WrapperDecryptSession {
-    stream: Option<TcpStream>,
+/// One wrapper connection that can keep several batches in flight.
+///
+/// A reader thread drains responses as they arrive so a large pipelined
+/// batch never deadlocks against a wrapper that is still writing.
+pub(crate) struct WrapperConnection {
+    stream: TcpStream,
+    responses: Receiver<io::Result<Frame>>,
+    reader: Option<JoinHandle<()>>,
     next_request_id: u32,
+    received: HashMap<u32, Frame>,
+    in_flight: usize,
+    broken: bool,
 }
 
-#[pymethods]
-impl WrapperDecryptSession {
-    #[new]
-    fn new(host: String, port: u16) -> PyResult<Self> {
-        let stream = TcpStream::connect((host.as_str(), port))
-            .map_err(|e| io_error(format!("wrapper-v2: TCP decrypt connect failed: {e}")))?;
+impl WrapperConnection {
+    fn connect(host: &str, port: u16) -> io::Result<Self> {
+        let stream = TcpStream::connect((host, port))
+            .map_err(|e| with_context(e, "wrapper-v2: TCP decrypt connect failed"))?;
         stream
             .set_nodelay(true)
-            .map_err(|e| io_error(format!("wrapper-v2: TCP_NODELAY setup failed: {e}")))?;
+            .map_err(|e| with_context(e, "wrapper-v2: TCP_NODELAY setup failed"))?;
         stream
             .set_read_timeout(Some(Duration::from_secs(600)))
-            .map_err(|e| {
-                io_error(format!(
-                    "wrapper-v2: TCP decrypt read timeout setup failed: {e}"
-                ))
-            })?;
+            .map_err(|e| with_context(e, "wrapper-v2: TCP decrypt read timeout setup failed"))?;
         stream
             .set_write_timeout(Some(Duration::from_secs(600)))
-            .map_err(|e| {
-                io_error(format!(
-                    "wrapper-v2: TCP decrypt write timeout setup failed: {e}"
-                ))
+            .map_err(|e| with_context(e, "wrapper-v2: TCP decrypt write timeout setup failed"))?;
+
+        let mut reader_stream = stream.try_clone()?;
+        let (sender, responses) = mpsc::channel();
+        let reader = thread::Builder::new()
+            .name("ammuxer-wrapper-reader".to_string())
+            .spawn(move || loop {
+                let frame = read_frame(&mut reader_stream);
+                let failed = frame.is_err();
+                if sender.send(frame).is_err() || failed {
+                    break;
+                }
             })?;
+
         Ok(Self {
-            stream: Some(stream),
+            stream,
+            responses,
+            reader: Some(reader),
             next_request_id: 1,
+            received: HashMap::new(),
+            in_flight: 0,
+            broken: false,
         })
     }
 
-    fn decrypt_reassemble(
+    pub(crate) fn send_batch(
+        &mut self,
+        adam_id: &[u8],
+        skd_uri: &[u8],
+        ciphertexts: &[&[u8]],
+    ) -> io::Result<u32> {
+        let payload = build_decrypt_batch_payload(adam_id, skd_uri, ciphertexts)?;
+        let request_id = self.next_request_id;
+        self.next_request_id = self.next_request_id.wrapping_add(1).max(1);
+        if let Err(err) = write_frame(&mut self.stream, DECRYPT_KIND_BATCH, request_id, &payload) {
+            self.broken = true;
+            return Err(err);
+        }
+        self.in_flight += 1;
+        Ok(request_id)
+    }
+
+    fn wait_for(&mut self, request_id: u32) -> io::Result<Frame> {
+        if let Some(frame) = self.received.remove(&request_id) {
+            return Ok(frame);
+        }
+        loop {
+            let frame = match self.responses.recv() {
+                Ok(Ok(frame)) => frame,
+                Ok(Err(err)) => {
+                    self.broken = true;
+                    return Err(err);
+                }
+                Err(_) => {
+                    self.broken = true;
+                    return Err(io::Error::new(
+                        io::ErrorKind::UnexpectedEof,
+                        "wrapper-v2: decrypt connection closed",
+                    ));
+                }
+            };
+            if frame.1 == request_id {
+                return Ok(frame);
+            }
+            self.received.insert(frame.1, frame);
+        }
+    }
+
+    pub(crate) fn receive_batch(
         &mut self,
+        request_id: u32,
+        expected: usize,
+    ) -> io::Result<Vec<Vec<u8>>> {
+        let (kind, _, payload) = self.wait_for(request_id)?;
+        self.in_flight -= 1;
+        if kind == DECRYPT_KIND_ERROR {
+            return Err(io::Error::new(
+                io::ErrorKind::Other,
+                format!(
+                    "wrapper-v2: decrypt failed: {}",
+                    String::from_utf8_lossy(&payload)
+                ),
+            ));
+        }
+        if kind != DECRYPT_KIND_OK {
+            self.broken = true;
+            return Err(invalid_data("wrapper-v2: unexpected decrypt response kind"));
+        }
+        let plains = read_decrypt_samples_payload(&payload)?;
+        if plains.len() != expected {
+            return Err(invalid_data(format!(
+                "wrapper-v2: expected {} plaintexts, got {}",
+                expected,
+                plains.len()
+            )));
+        }
+        Ok(plains)
+    }
+
+    fn reusable(&self) -> bool {
+        !self.broken && self.in_flight == 0
+    }
+}
+
+impl Drop for WrapperConnection {
+    fn drop(&mut self) {
+        let _ = write_frame(&mut self.stream, DECRYPT_KIND_CLOSE, 0, &[]);
+        let _ = self.stream.shutdown(Shutdown::Both);
+        if let Some(reader) = self.reader.take() {
+            let _ = reader.join();
+        }
+    }
+}
+
+struct WrapperPoolState {
+    idle: Vec<WrapperConnection>,
+    open: usize,
+    closed: bool,
+}
+
+/// Long-lived wrapper connections shared by every track decrypted through
+/// one `WrapperDecryptSession`.
+pub(crate) struct WrapperPool {
+    host: String,
+    port: u16,
+    max_connections: usize,
+    pipeline_depth: usize,
+    state: Mutex<WrapperPoolState>,
+    available: Condvar,
+}
+
+impl WrapperPool {
+    pub(crate) fn new(
+        host: String,
+        port: u16,
+        max_connections: usize,
+        pipeline_depth: usize,
+    ) -> Arc<Self> {
+        Arc::new(Self {
+            host,
+            port,
+            max_connections: max_connections.max(1),
+            pipeline_depth: pipeline_depth.max(1),
+            state: Mutex::new(WrapperPoolState {
+                idle: Vec::new(),
+                open: 0,
+                closed: false,
+            }),
+            available: Condvar::new(),
+        })
+    }
+
+    pub(crate) fn pipeline_depth(&self) -> usize {
+        self.pipeline_depth
+    }
+
+    fn lock_state(&self) -> MutexGuard<'_, WrapperPoolState> {
+        self.state.lock().unwrap_or_else(|err| err.into_inner())
+    }
+
+    pub(crate) fn acquire(self: &Arc<Self>) -> io::Result<PooledWrapperConnection> {
+        let mut state = self.lock_state();
+        loop {
+            if state.closed {
+                return Err(io::Error::new(
+                    io::ErrorKind::NotConnected,
+                    "wrapper-v2: decrypt session is closed",
+                ));
+            }
+            if let Some(connection) = state.idle.pop() {
+                return Ok(PooledWrapperConnection {
+                    pool: Arc::clone(self),
+                    connection: Some(connection),
+                });
+            }
+            if state.open < self.max_connections {
+                state.open += 1;
+                drop(state);
+                return match WrapperConnection::connect(&self.host, self.port) {
+                    Ok(connection) => Ok(PooledWrapperConnection {
+                        pool: Arc::clone(self),
+                        connection: Some(connection),
+                    }),
+                    Err(err) => {
+                        self.lock_state().open -= 1;
+                        self.available.notify_one();
+                        Err(err)
+                    }
+                };
+            }
+            state = self
+                .available
+                .wait(state)
+                .unwrap_or_else(|err| err.into_inner());
+        }
+    }
+
+    fn release(&self, connection: WrapperConnection) {
+        let mut state = self.lock_state();
+        let discarded = if state.closed || !connection.reusable() {
+            state.open -= 1;
+            Some(connection)
+        } else {
+            state.idle.push(connection);
+            None
+        };
+        drop(state);
+        self.available.notify_one();
+        drop(discarded);
+    }
+
+    pub(crate) fn close(&self) {
+        let mut state = self.lock_state();
+        state.closed = true;
+        let idle = std::mem::take(&mut state.idle);
+        state.open -= idle.len();
+        drop(state);
+        self.available.notify_all();
+        drop(idle);
+    }
+}
+
+pub(crate) struct PooledWrapperConnection {
+    pool: Arc<WrapperPool>,
+    connection: Option<WrapperConnection>,
+}
+
+impl Deref for PooledWrapperConnection {
+    type Target = WrapperConnection;
+
+    fn deref(&self) -> &WrapperConnection {
+        self.connection.as_ref().expect("pooled wrapper connection")
+    }
+}
+
+impl DerefMut for PooledWrapperConnection {
+    fn deref_mut(&mut self) -> &mut WrapperConnection {
+        self.connection.as_mut().expect("pooled wrapper connection")
+    }
+}
+
+impl Drop for PooledWrapperConnection {
+    fn drop(&mut self) {
+        if let Some(connection) = self.connection.take() {
+            self.pool.release(connection);
+        }
+    }
+}
+
+#[pyclass(frozen)]
+pub struct WrapperDecryptSession {
+    pool: Arc<WrapperPool>,
+}
+
+impl WrapperDecryptSession {
+    pub(crate) fn pool(&self) -> Arc<WrapperPool> {
+        Arc::clone(&self.pool)
+    }
+}
+
+#[pymethods]
+impl WrapperDecryptSession {
+    #[new]
+    #[pyo3(signature = (host, port, max_connections=2, pipeline_depth=4))]
+    fn new(
+        host: String,
+        port: u16,
+        max_connections: usize,
+        pipeline_depth: usize,
+    ) -> PyResult<Self> {
+        if max_connections == 0 {
+            return Err(value_error("wrapper-v2: max_connections must be positive"));
+        }
+        if pipeline_depth == 0 {
+            return Err(value_error("wrapper-v2: pipeline_depth must be positive"));
+        }
+        Ok(Self {
+            pool: WrapperPool::new(host, port, max_connections, pipeline_depth),
+        })
+    }
+
+    fn decrypt_reassemble(
+        &self,
         py: Python<'_>,
         adam_id: String,
         skd_uri: String,
@@ -294,36 +603,19 @@ impl WrapperDecryptSession {
     ) -> PyResult<Vec<Vec<u8>>> {
         let adam_id = validate_label("adam_id", &adam_id)?;
         let skd_uri = validate_label("skd_uri", &skd_uri)?;
-        let request_id = self.next_request_id;
-        self.next_request_id = self.next_request_id.wrapping_add(1).max(1);
-        let stream = self
-            .stream
-            .as_mut()
-            .ok_or_else(|| PyRuntimeError::new_err("wrapper-v2: decrypt session is closed"))?;
+        let pool = self.pool();
         py.detach(move || {
-            let payload = build_decrypt_batch_payload(&adam_id, &skd_uri, &items)?;
-            write_frame(stream, DECRYPT_KIND_BATCH, request_id, &payload)?;
-            let (kind, response_id, response_payload) = read_frame(stream)?;
-            if response_id != request_id {
-                return Err(io_error("wrapper-v2: mismatched decrypt response id"));
-            }
-            if kind == DECRYPT_KIND_ERROR {
-                return Err(io_error(format!(
-                    "wrapper-v2: decrypt failed: {}",
-                    String::from_utf8_lossy(&response_payload)
-                )));
-            }
-            if kind != DECRYPT_KIND_OK {
-                return Err(io_error("wrapper-v2: unexpected decrypt response kind"));
-            }
-            let plains = read_decrypt_samples_payload(&response_payload)?;
-            if plains.len() != items.len() {
-                return Err(io_error(format!(
-                    "wrapper-v2: expected {} plaintexts, got {}",
-                    items.len(),
-                    plains.len()
-                )));
-            }
+            let mut connection = pool.acquire().map_err(py_error)?;
+            let ciphertexts: Vec<&[u8]> = items
+                .iter()
+                .map(|(_, aligned, _, _)| aligned.as_slice())
+                .collect();
+            let request_id = connection
+                .send_batch(&adam_id, &skd_uri, &ciphertexts)
+                .map_err(py_error)?;
+            let plains = connection
+                .receive_batch(request_id, items.len())
+                .map_err(py_error)?;
             let mut out = Vec::with_capacity(items.len());
             for ((data, _, tail, subsamples), plain) in items.into_iter().zip(plains) {
                 out.push(reassemble_sample(&data, &plain, &tail, &subsamples)?);
@@ -332,16 +624,80 @@ impl WrapperDecryptSession {
         })
     }
 
-    fn close(&mut self) -> PyResult<()> {
-        if let Some(mut stream) = self.stream.take() {
-            let _ = write_frame(&mut stream, DECRYPT_KIND_CLOSE, 0, &[]);
-        }
+    fn close(&self) -> PyResult<()> {
+        self.pool.close();
         Ok(())
     }
 }
 
-impl Drop for WrapperDecryptSession {
-    fn drop(&mut self) {
-        let _ = self.close();
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use std::net::TcpListener;
+    use std::sync::atomic::{AtomicUsize, Ordering};
+
+    fn serve_reversed_pairs(listener: TcpListener, accepted: Arc<AtomicUsize>) {
+        for stream in listener.incoming() {
+            let mut stream = stream.unwrap();
+            accepted.fetch_add(1, Ordering::SeqCst);
+            thread::spawn(move || {
+                let mut held: Option<Frame> = None;
+                while let Ok((kind, request_id, payload)) = read_frame(&mut stream) {
+                    if kind == DECRYPT_KIND_CLOSE {
+                        break;
+                    }
+                    let count = u32::from_be_bytes([payload[4], payload[5], payload[6], payload[7]])
+                        as usize;
+                    let labels = 8
+                        + count * 4
+                        + u16::from_be_bytes([payload[0], payload[1]]) as usize
+                        + u16::from_be_bytes([payload[2], payload[3]]) as usize;
+                    let mut response = payload[4..8 + count * 4].to_vec();
+                    response.extend(payload[labels..].iter().map(|byte| byte ^ 0xff));
+                    // Answer every second request before the one it follows.
+                    match held.take() {
+                        None if request_id % 2 == 1 => {
+                            held = Some((DECRYPT_KIND_OK, request_id, response));
+                        }
+                        held_frame => {
+                            write_frame(&mut stream, DECRYPT_KIND_OK, request_id, &response)
+                                .unwrap();
+                            if let Some((kind, id, payload)) = held_frame {
+                                write_frame(&mut stream, kind, id, &payload).unwrap();
+                            }
+                        }
+                    }
+                }
+            });
+        }
+    }
+
+    #[test]
+    fn pipelines_out_of_order_batches_on_pooled_connection() {
+        let listener = TcpListener::bind(("127.0.0.1", 0)).unwrap();
+        let port = listener.local_addr().unwrap().port();
+        let accepted = Arc::new(AtomicUsize::new(0));
+        let server_accepted = Arc::clone(&accepted);
+        thread::spawn(move || serve_reversed_pairs(listener, server_accepted));
+
+        let pool = WrapperPool::new("127.0.0.1".to_string(), port, 2, 4);
+        for _ in 0..2 {
+            let mut connection = pool.acquire().unwrap();
+            let batches: Vec<Vec<u8>> = (0..4u8).map(|i| vec![i; 16]).collect();
+            let request_ids: Vec<u32> = batches
+                .iter()
+                .map(|batch| {
+                    connection
+                        .send_batch(b"1", b"skd://key", &[batch.as_slice()])
+                        .unwrap()
+                })
+                .collect();
+            for (request_id, batch) in request_ids.into_iter().zip(&batches) {
+                let plains = connection.receive_batch(request_id, 1).unwrap();
+                let expected: Vec<u8> = batch.iter().map(|byte| byte ^ 0xff).collect();
+                assert_eq!(plains, vec![expected]);
+            }
+        }
+        assert_eq!(accepted.load(Ordering::SeqCst), 1);
     }
 }
@@ -0,0 +1,134 @@
+use aes::Aes128;
+use cipher::{KeyIvInit, StreamCipher};
+
+pub(crate) const KEY: [u8; 16] = [7u8; 16];
+
+fn boxed(typ: &[u8; 4], payload: &[u8]) -> Vec<u8> {
+    let mut out = ((payload.len() + 8) as u32).to_be_bytes().to_vec();
+    out.extend_from_slice(typ);
+    out.extend_from_slice(payload);
+    out
+}
+
+fn full(typ: &[u8; 4], flags: u32, payload: &[u8]) -> Vec<u8> {
+    let mut content = flags.to_be_bytes().to_vec();
+    content.extend_from_slice(payload);
+    boxed(typ, &content)
+}
+
+pub(crate) fn init_segment() -> Vec<u8> {
+    let mut tkhd = vec![0u8; 8];
+    tkhd.extend_from_slice(&1u32.to_be_bytes());
+    tkhd.resize(80, 0);
+    let mut hdlr = vec![0u8; 4];
+    hdlr.extend_from_slice(b"soun");
+    hdlr.resize(21, 0);
+    let mut tenc = vec![0, 0, 1, 8];
+    tenc.extend_from_slice(&[9u8; 16]);
+    let sinf = boxed(
+        b"sinf",
+        &[
+            boxed(b"frma", b"mp4a"),
+            full(b"schm", 0, b"cenc\x00\x01\x00\x00"),
+            boxed(b"schi", &full(b"tenc", 0, &tenc)),
+        ]
+        .concat(),
+    );
+    let mut enca = vec![0u8; 28];
+    enca.extend_from_slice(&sinf);
+    let mut stsd = 1u32.to_be_bytes().to_vec();
+    stsd.extend_from_slice(&boxed(b"enca", &enca));
+    let stbl = boxed(b"stbl", &full(b"stsd", 0, &stsd));
+    let mdia = boxed(
+        b"mdia",
+        &[full(b"hdlr", 0, &hdlr), boxed(b"minf", &stbl)].concat(),
+    );
+    let trak = boxed(b"trak", &[full(b"tkhd", 0, &tkhd), mdia].concat());
+    let mut trex = 1u32.to_be_bytes().to_vec();
+    trex.extend_from_slice(&[0, 0, 0, 1, 0, 0, 4, 0, 0, 0, 0, 0, 0, 0, 0, 0]);
+    let mvex = boxed(b"mvex", &full(b"trex", 0, &trex));
+    let pssh = full(b"pssh", 0, &[0u8; 20]);
+    [
+        boxed(b"ftyp", b"iso6\x00\x00\x00\x00iso6"),
+        boxed(b"moov", &[trak, mvex, pssh].concat()),
+    ]
+    .concat()
+}
+
+pub(crate) fn media_segment(sequence: u32, samples: &[Vec<u8>]) -> Vec<u8> {
+    let ivs: Vec<[u8; 8]> = (0..samples.len())
+        .map(|index| (((sequence as u64) << 32) | index as u64).to_be_bytes())
+        .collect();
+    let mut senc = (samples.len() as u32).to_be_bytes().to_vec();
+    for iv in &ivs {
+        senc.extend_from_slice(iv);
+    }
+    let build_moof = |data_offset: u32| {
+        let mut trun = (samples.len() as u32).to_be_bytes().to_vec();
+        trun.extend_from_slice(&data_offset.to_be_bytes());
+        for sample in samples {
+            trun.extend_from_slice(&(sample.len() as u32).to_be_bytes());
+        }
+        let traf = boxed(
+            b"traf",
+            &[
+                full(b"tfhd", 0x020000, &1u32.to_be_bytes()),
+                full(b"trun", 0x201, &trun),
+                full(b"senc", 0, &senc),
+            ]
+            .concat(),
+        );
+        boxed(
+            b"moof",
+            &[full(b"mfhd", 0, &sequence.to_be_bytes()), traf].concat(),
+        )
+    };
+    let moof = build_moof(build_moof(0).len() as u32 + 8);
+    let mut mdat = Vec::new();
+    for (sample, iv) in samples.iter().zip(&ivs) {
+        let mut counter = [0u8; 16];
+        counter[..8].copy_from_slice(iv);
+        let mut encrypted = sample.clone();
+        ctr::Ctr128BE::<Aes128>::new((&KEY).into(), (&counter).into())
+            .apply_keystream(&mut encrypted);
+        mdat.extend_from_slice(&encrypted);
+    }
+    [moof, boxed(b"mdat", &mdat)].concat()
+}
+
+/// A `moof` and `mdat` header for clear samples of the given sizes. The
+/// payload is left to the caller, e.g. as a sparse region of a file.
+pub(crate) fn clear_segment_header(sequence: u32, sample_sizes: &[u32]) -> Vec<u8> {
+    let payload_size: u64 = sample_sizes.iter().map(|&size| size as u64).sum();
+    let mdat_header = if payload_size + 8 > u32::MAX as u64 {
+        [
+            &1u32.to_be_bytes()[..],
+            b"mdat",
+            &(payload_size + 16).to_be_bytes(),
+        ]
+        .concat()
+    } else {
+        [&((payload_size + 8) as u32).to_be_bytes()[..], b"mdat"].concat()
+    };
+    let build_moof = |data_offset: u32| {
+        let mut trun = (sample_sizes.len() as u32).to_be_bytes().to_vec();
+        trun.extend_from_slice(&data_offset.to_be_bytes());
+        for size in sample_sizes {
+            trun.extend_from_slice(&size.to_be_bytes());
+        }
+        let traf = boxed(
+            b"traf",
+            &[
+                full(b"tfhd", 0x020000, &1u32.to_be_bytes()),
+                full(b"trun", 0x201, &trun),
+            ]
+            .concat(),
+        );
+        boxed(
+            b"moof",
+            &[full(b"mfhd", 0, &sequence.to_be_bytes()), traf].concat(),
+        )
+    };
+    let moof = build_moof((build_moof(0).len() + mdat_header.len()) as u32);
+    [moof, mdat_header].concat()
+}
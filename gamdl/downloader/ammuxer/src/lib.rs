@@ -1,8 +1,12 @@
+mod batch;
 mod decrypt;
+#[cfg(test)]
+mod fixtures;
 mod media;
 mod mp4;
 mod mux;
 mod python;
+mod stream;
 
 use pyo3::prelude::*;
 
@@ -1,17 +1,21 @@
+use crate::decrypt::{PooledWrapperConnection, WrapperDecryptSession, WrapperPool};
 use crate::mp4::{
-    write_m4a_file, write_mdat_from_sources, PayloadSource, SampleInfo as Mp4Sample, TrackInfo,
+    build_track_file_header, validate_ilst, write_mdat_header, SampleInfo as Mp4Sample, TrackInfo,
 };
 use aes::Aes128;
 use cbc::cipher::block_padding::NoPadding;
 use cbc::cipher::{BlockDecryptMut, KeyIvInit, StreamCipher};
+use memmap2::Mmap;
+use pyo3::buffer::PyBuffer;
 use pyo3::exceptions::{PyIOError, PyValueError};
 use pyo3::prelude::*;
-use std::collections::HashMap;
+use pyo3::types::PyBytes;
+use rayon::prelude::*;
+use rayon::{ThreadPool, ThreadPoolBuilder};
+use std::collections::{HashMap, VecDeque};
 use std::fs::File;
-use std::io::{self, Read, Seek, SeekFrom, Write};
-use std::net::TcpStream;
-use std::time::Duration;
-use tempfile::NamedTempFile;
+use std::io::{self, BufWriter, Write};
+use std::sync::{Arc, Mutex, OnceLock};
 
 type Aes128CbcDec = cbc::Decryptor<Aes128>;
 type Aes128Ctr = ctr::Ctr128BE<Aes128>;
@@ -21,12 +25,12 @@ const DEFAULT_SONG_DECRYPTION_KEY: [u8; 16] = [
 ];
 const PREFETCH_KEY: &str = "skd://itunes.apple.com/P000000000/s1/e1";
 const WRAPPER_DECRYPT_BATCH_SIZE: usize = 128;
-const DECRYPT_MAGIC: u32 = 0x57563244; // WV2D
-const DECRYPT_VERSION: u16 = 1;
-const DECRYPT_KIND_BATCH: u16 = 1;
-const DECRYPT_KIND_OK: u16 = 2;
-const DECRYPT_KIND_ERROR: u16 = 3;
-const DECRYPT_KIND_CLOSE: u16 = 9;
+pub(crate) const WRAPPER_DECRYPT_PIPELINE_DEPTH: usize = 4;
+const DECRYPT_CHUNK_SAMPLES: usize = 32;
+const DECRYPT_WINDOW_CHUNKS: usize = 8;
+const MUX_WRITE_BUFFER_SIZE: usize = 1024 * 1024;
+
+static DECRYPT_POOLS: OnceLock<Mutex<HashMap<usize, Arc<ThreadPool>>>> = OnceLock::new();
 
 #[derive(Clone, Debug)]
 struct Sample {
@@ -38,7 +42,6 @@ struct Sample {
     composition_time_offset: i32,
     is_sync: bool,
     size: usize,
-    data_path: Option<String>,
     data_offset: u64,
 }
 
@@ -65,9 +68,21 @@ impl Default for EncryptionInfo {
     }
 }
 
+/// Location of one `moof`/`mdat` pair in the input.
+#[derive(Clone, Copy, Debug)]
+struct Fragment {
+    moof_offset: u64,
+    moof_size: usize,
+    mdat_data_offset: u64,
+    mdat_size: usize,
+}
+
+/// Sample tables and fragment layout of one track. Samples carry sizes and
+/// offsets only; IVs and subsamples are parsed per fragment when decrypting.
 #[derive(Clone, Debug)]
 struct SongInfo {
     samples: Vec<Sample>,
+    fragments: Vec<Fragment>,
     moov_data: Vec<u8>,
     ftyp_data: Vec<u8>,
     encryption_info: Option<EncryptionInfo>,
@@ -75,17 +90,55 @@ struct SongInfo {
     track_id: u32,
 }
 
-struct DecryptedTrack {
-    input_path: String,
-    track_info: SongInfo,
-    payload_path: String,
-    payload_size: u64,
+#[derive(Clone, Copy)]
+enum MediaInput<'a> {
+    Mapped(&'a str, &'a [u8]),
+    Memory(&'a [u8]),
+}
+
+impl<'a> MediaInput<'a> {
+    fn path(&self) -> Option<&'a str> {
+        match self {
+            MediaInput::Mapped(path, _) => Some(path),
+            MediaInput::Memory(_) => None,
+        }
+    }
+
+    fn bytes(&self) -> &'a [u8] {
+        match self {
+            MediaInput::Mapped(_, data) | MediaInput::Memory(data) => data,
+        }
+    }
 }
 
-struct DecryptedMedia {
-    audio: DecryptedTrack,
-    video: Option<DecryptedTrack>,
-    captions: Vec<DecryptedTrack>,
+enum InputSource<'a> {
+    Mapped(&'a str, Option<Mmap>),
+    Memory(&'a [u8]),
+}
+
+impl<'a> InputSource<'a> {
+    fn open(path: &'a str, buffer: Option<&'a [u8]>) -> io::Result<Self> {
+        if let Some(buffer) = buffer {
+            return Ok(InputSource::Memory(buffer));
+        }
+        let file = File::open(path)?;
+        if file.metadata()?.len() == 0 {
+            return Ok(InputSource::Mapped(path, None));
+        }
+        // SAFETY: inputs are staged downloads owned by this process and are not
+        // truncated or rewritten while a mux holds the mapping.
+        let map = unsafe { Mmap::map(&file)? };
+        Ok(InputSource::Mapped(path, Some(map)))
+    }
+
+    fn input(&self) -> MediaInput<'_> {
+        match self {
+            InputSource::Mapped(path, map) => {
+                MediaInput::Mapped(path, map.as_deref().unwrap_or_default())
+            }
+            InputSource::Memory(data) => MediaInput::Memory(data),
+        }
+    }
 }
 
 fn py_io_error(err: io::Error) -> PyErr {
@@ -187,18 +240,20 @@ fn sample_entry_header_size(entry_type: &[u8]) -> usize {
     }
 }
 
-fn read_sample_data(sample: &Sample) -> io::Result<Vec<u8>> {
+fn read_sample_data<'a>(sample: &'a Sample, input: MediaInput<'a>) -> io::Result<&'a [u8]> {
     if !sample.data.is_empty() {
-        return Ok(sample.data.clone());
+        return Ok(&sample.data);
     }
-    let Some(path) = &sample.data_path else {
-        return Ok(Vec::new());
-    };
-    let mut file = File::open(path)?;
-    file.seek(SeekFrom::Start(sample.data_offset))?;
-    let mut data = vec![0u8; sample.size];
-    file.read_exact(&mut data)?;
-    Ok(data)
+    let start = usize::try_from(sample.data_offset).unwrap_or(usize::MAX);
+    input
+        .bytes()
+        .get(start..start.saturating_add(sample.size))
+        .ok_or_else(|| {
+            io::Error::new(
+                io::ErrorKind::UnexpectedEof,
+                "sample range exceeds input data",
+            )
+        })
 }
 
 #[derive(Clone)]
@@ -207,54 +262,28 @@ struct BoxRec {
     size: u64,
     typ: [u8; 4],
     header_size: u64,
-    data: Vec<u8>,
 }
 
-fn scan_top_level_boxes(input_path: &str, file_backed_samples: bool) -> io::Result<Vec<BoxRec>> {
-    let file_size = std::fs::metadata(input_path)?.len();
-    let mut file = File::open(input_path)?;
+impl BoxRec {
+    fn bytes<'a>(&self, data: &'a [u8]) -> &'a [u8] {
+        &data[self.offset as usize..(self.offset + self.size) as usize]
+    }
+}
+
+fn scan_top_level_boxes(input: MediaInput<'_>) -> Vec<BoxRec> {
+    let data = input.bytes();
     let mut boxes = Vec::new();
-    let mut offset = 0u64;
-    while offset + 8 <= file_size {
-        file.seek(SeekFrom::Start(offset))?;
-        let mut header = [0u8; 8];
-        if file.read_exact(&mut header).is_err() {
-            break;
-        }
-        let raw_size = u32::from_be_bytes([header[0], header[1], header[2], header[3]]) as u64;
-        let typ = [header[4], header[5], header[6], header[7]];
-        let mut header_size = 8u64;
-        let size = if raw_size == 0 {
-            file_size - offset
-        } else if raw_size == 1 {
-            let mut ext = [0u8; 8];
-            if file.read_exact(&mut ext).is_err() {
-                break;
-            }
-            header_size = 16;
-            u64::from_be_bytes(ext)
-        } else {
-            raw_size
-        };
-        if size < header_size || offset + size > file_size {
-            break;
-        }
-        let mut data = Vec::new();
-        if !file_backed_samples || matches!(&typ, b"ftyp" | b"moov" | b"moof") {
-            file.seek(SeekFrom::Start(offset))?;
-            data.resize(size as usize, 0);
-            file.read_exact(&mut data)?;
-        }
+    let mut offset = 0usize;
+    while let Some((typ, box_offset, size, header_size)) = next_box(data, offset, data.len()) {
         boxes.push(BoxRec {
-            offset,
-            size,
+            offset: box_offset as u64,
+            size: size as u64,
             typ,
-            header_size,
-            data,
+            header_size: header_size as u64,
         });
-        offset += size;
+        offset = box_offset + size;
     }
-    Ok(boxes)
+    boxes
 }
 
 fn extract_track_id(moov: &[u8], handler_type: &[u8; 4], default: u32) -> u32 {
@@ -465,16 +494,14 @@ struct TfhdInfo {
 
 fn parse_moof_mdat(
     moof_data: &[u8],
-    mdat_data: &[u8],
     default_duration: u32,
     default_size: usize,
     default_flags: u32,
     track_id: u32,
     moof_offset: u64,
     mdat_data_offset: u64,
-    per_sample_iv_size: usize,
+    per_sample_iv_size: Option<usize>,
     mdat_data_size: usize,
-    mdat_source_path: Option<&str>,
 ) -> Vec<Sample> {
     let mut samples = Vec::new();
     let mut offset = 8usize;
@@ -493,7 +520,7 @@ fn parse_moof_mdat(
             base_data_offset: None,
         };
         let mut truns: Vec<(Vec<TrunEntry>, Option<i32>)> = Vec::new();
-        let mut raw_senc: Option<Vec<u8>> = None;
+        let mut raw_senc: Option<&[u8]> = None;
         let mut inner = traf_offset + 8;
         let traf_end = traf_offset + traf_size;
         while let Some((inner_type, inner_offset, inner_size, _)) =
@@ -504,8 +531,8 @@ fn parse_moof_mdat(
                 parse_tfhd(payload, &mut info);
             } else if &inner_type == b"trun" {
                 truns.push(parse_trun(payload));
-            } else if &inner_type == b"senc" {
-                raw_senc = Some(payload.to_vec());
+            } else if &inner_type == b"senc" && per_sample_iv_size.is_some() {
+                raw_senc = Some(payload);
             }
             inner = inner_offset + inner_size;
         }
@@ -519,10 +546,12 @@ fn parse_moof_mdat(
             .iter()
             .flat_map(|(entries, _)| entries.iter().map(|e| e.size.unwrap_or(info.default_size)))
             .collect();
-        let senc_entries = raw_senc
-            .as_ref()
-            .map(|d| parse_senc_for_sample_sizes(d, &sample_sizes, per_sample_iv_size))
-            .unwrap_or_default();
+        let senc_entries = match (raw_senc, per_sample_iv_size) {
+            (Some(senc), Some(iv_size)) => {
+                parse_senc_for_sample_sizes(senc, &sample_sizes, iv_size)
+            }
+            _ => Vec::new(),
+        };
         let mut mdat_pos: Option<i64> = None;
         let mut sample_index = 0usize;
         for (entries, trun_data_offset) in truns {
@@ -538,21 +567,8 @@ fn parse_moof_mdat(
                 let flags = entry.sample_flags.unwrap_or(info.default_sample_flags);
                 if sample_size > 0 && read_offset + sample_size <= mdat_data_size {
                     let senc = senc_entries.get(sample_index);
-                    let (data, data_path, data_offset) = if let Some(path) = mdat_source_path {
-                        (
-                            Vec::new(),
-                            Some(path.to_string()),
-                            mdat_data_offset + read_offset as u64,
-                        )
-                    } else {
-                        (
-                            mdat_data[read_offset..read_offset + sample_size].to_vec(),
-                            None,
-                            0,
-                        )
-                    };
                     samples.push(Sample {
-                        data,
+                        data: Vec::new(),
                         duration,
                         desc_index,
                         iv: senc.map(|e| e.iv.clone()).unwrap_or_default(),
@@ -560,8 +576,7 @@ fn parse_moof_mdat(
                         composition_time_offset: entry.composition_time_offset,
                         is_sync: flags & 0x10000 == 0,
                         size: sample_size,
-                        data_path,
-                        data_offset,
+                        data_offset: mdat_data_offset + read_offset as u64,
                     });
                     read_offset += sample_size;
                 }
@@ -642,14 +657,12 @@ fn extract_encryption_info_per_stsd(
     }
 }
 
-fn extract_song(
-    input_path: &str,
-    handler_type: [u8; 4],
-    file_backed: bool,
-) -> io::Result<SongInfo> {
-    let boxes = scan_top_level_boxes(input_path, file_backed)?;
+fn extract_song(input: MediaInput<'_>, handler_type: [u8; 4]) -> SongInfo {
+    let data = input.bytes();
+    let boxes = scan_top_level_boxes(input);
     let mut info = SongInfo {
         samples: Vec::new(),
+        fragments: Vec::new(),
         moov_data: Vec::new(),
         ftyp_data: Vec::new(),
         encryption_info: None,
@@ -658,53 +671,47 @@ fn extract_song(
     };
     for b in &boxes {
         if &b.typ == b"ftyp" {
-            info.ftyp_data = b.data.clone();
+            info.ftyp_data = b.bytes(data).to_vec();
         } else if &b.typ == b"moov" {
-            info.moov_data = b.data.clone();
+            info.moov_data = b.bytes(data).to_vec();
         }
     }
     if info.moov_data.is_empty() {
-        return Ok(info);
+        return info;
     }
     info.track_id = extract_track_id(&info.moov_data, &handler_type, 0);
     if info.track_id == 0 {
-        return Ok(info);
+        return info;
     }
     let (default_duration, default_size, default_flags) =
         extract_trex_defaults(&info.moov_data, info.track_id);
     let per_desc = extract_encryption_info_per_stsd(&info.moov_data, &handler_type);
     info.encryption_info = per_desc.as_ref().and_then(|m| m.values().next().cloned());
 
-    let iv_size = info
-        .encryption_info
-        .as_ref()
-        .map(|e| e.per_sample_iv_size)
-        .unwrap_or(0);
     let mut pending_moof: Option<&BoxRec> = None;
     for b in &boxes {
         if &b.typ == b"moof" {
             pending_moof = Some(b);
         } else if &b.typ == b"mdat" {
             if let Some(moof) = pending_moof.take() {
-                let mdat_size = (b.size - b.header_size) as usize;
-                let mdat_payload = if file_backed {
-                    &[][..]
-                } else {
-                    &b.data[b.header_size as usize..]
+                let fragment = Fragment {
+                    moof_offset: moof.offset,
+                    moof_size: moof.size as usize,
+                    mdat_data_offset: b.offset + b.header_size,
+                    mdat_size: (b.size - b.header_size) as usize,
                 };
                 info.samples.extend(parse_moof_mdat(
-                    &moof.data,
-                    mdat_payload,
+                    moof.bytes(data),
                     default_duration,
                     default_size,
                     default_flags,
                     info.track_id,
-                    moof.offset,
-                    b.offset + b.header_size,
-                    iv_size,
-                    mdat_size,
-                    file_backed.then_some(input_path),
+                    fragment.moof_offset,
+                    fragment.mdat_data_offset,
+                    None,
+                    fragment.mdat_size,
                 ));
+                info.fragments.push(fragment);
             }
         }
     }
@@ -718,7 +725,7 @@ fn extract_song(
             }
         }
     }
-    Ok(info)
+    info
 }
 
 fn key_bytes(hex: &str) -> PyResult<[u8; 16]> {
@@ -862,15 +869,16 @@ fn decrypt_cbcs_pattern(
 
 fn decrypt_sample_hex(
     sample: &Sample,
+    input: MediaInput<'_>,
     key: Option<&[u8; 16]>,
     enc: &EncryptionInfo,
 ) -> io::Result<Vec<u8>> {
-    let data = read_sample_data(sample)?;
+    let data = read_sample_data(sample, input)?;
     let Some(key) = key else {
-        return Ok(data);
+        return Ok(data.to_vec());
     };
     if enc.scheme_type == "cenc" {
-        let mut out = data.clone();
+        let mut out = data.to_vec();
         let iv = padded_iv(&sample.iv);
         let mut cipher = Aes128Ctr::new(key.into(), (&iv).into());
         if sample.subsamples.is_empty() {
@@ -939,8 +947,8 @@ fn decrypt_sample_hex(
         return Ok(out);
     }
 
-    let Some((aligned, tail)) = cbcs_ciphertext_for_sample(&data, &sample.subsamples) else {
-        return Ok(data);
+    let Some((aligned, tail)) = cbcs_ciphertext_for_sample(data, &sample.subsamples) else {
+        return Ok(data.to_vec());
     };
     let mut plain = Vec::new();
     if !aligned.is_empty() {
@@ -958,361 +966,491 @@ fn decrypt_sample_hex(
     reassemble_sample(&data, &plain, &tail, &sample.subsamples)
 }
 
-fn decrypt_track_hex(
-    input_path: &str,
-    key_hex: &str,
-    handler_type: [u8; 4],
-    use_cenc: bool,
-    use_single_content_key: bool,
-    file_backed: bool,
-) -> PyResult<DecryptedTrack> {
-    let mut track = extract_song(input_path, handler_type, true).map_err(py_io_error)?;
-    let mut enc_info = track.encryption_info.clone().unwrap_or_default();
-    if use_cenc {
-        enc_info.scheme_type = "cenc".to_string();
-        enc_info.crypt_byte_block = 0;
-        enc_info.skip_byte_block = 0;
-    }
-    let per_desc = extract_encryption_info_per_stsd(&track.moov_data, &handler_type);
-    let track_key = key_bytes(key_hex)?;
-    let mut keys = HashMap::new();
-    if use_single_content_key {
-        for sample in &track.samples {
-            keys.insert(sample.desc_index, track_key);
+fn decrypt_pool(threads: usize) -> io::Result<Option<Arc<ThreadPool>>> {
+    let threads = match threads {
+        0 => std::thread::available_parallelism().map_or(1, usize::from),
+        threads => threads,
+    };
+    if threads == 1 {
+        return Ok(None);
+    }
+    let mut pools = DECRYPT_POOLS
+        .get_or_init(Default::default)
+        .lock()
+        .unwrap_or_else(|err| err.into_inner());
+    if let Some(pool) = pools.get(&threads) {
+        return Ok(Some(pool.clone()));
+    }
+    let pool = ThreadPoolBuilder::new()
+        .num_threads(threads)
+        .thread_name(|index| format!("ammuxer-decrypt-{index}"))
+        .build()
+        .map_err(|err| io::Error::new(io::ErrorKind::Other, err.to_string()))?;
+    let pool = Arc::new(pool);
+    pools.insert(threads, pool.clone());
+    Ok(Some(pool))
+}
+
+fn decrypt_samples<F>(
+    samples: &[Sample],
+    pool: Option<&ThreadPool>,
+    sink: &mut dyn Write,
+    decrypt: F,
+) -> io::Result<u64>
+where
+    F: Fn(&Sample) -> io::Result<Vec<u8>> + Sync + Send,
+{
+    // Decrypt a bounded window of samples at a time so the payload is still
+    // written in order without holding the whole track in memory.
+    let window_size = pool.map_or(1, |pool| {
+        pool.current_num_threads() * DECRYPT_CHUNK_SAMPLES * DECRYPT_WINDOW_CHUNKS
+    });
+    let mut written = 0u64;
+    for window in samples.chunks(window_size) {
+        let decrypted = match pool {
+            Some(pool) => pool.install(|| {
+                window
+                    .par_iter()
+                    .with_min_len(DECRYPT_CHUNK_SAMPLES)
+                    .map(&decrypt)
+                    .collect::<io::Result<Vec<_>>>()
+            }),
+            None => window.iter().map(&decrypt).collect(),
+        }?;
+        for decrypted in decrypted {
+            sink.write_all(&decrypted)?;
+            written += decrypted.len() as u64;
         }
-    } else {
-        keys.insert(0usize, DEFAULT_SONG_DECRYPTION_KEY);
-        keys.insert(1usize, track_key);
     }
-    let mut temp = NamedTempFile::new().map_err(py_io_error)?;
-    let mut written = 0u64;
-    for sample in &mut track.samples {
-        let effective = per_desc
-            .as_ref()
-            .and_then(|m| m.get(&sample.desc_index))
-            .unwrap_or(&enc_info);
-        let decrypted = decrypt_sample_hex(sample, keys.get(&sample.desc_index), effective)
-            .map_err(py_io_error)?;
-        temp.write_all(&decrypted).map_err(py_io_error)?;
-        sample.size = decrypted.len();
-        written += decrypted.len() as u64;
-        if file_backed {
-            sample.data.clear();
-            sample.subsamples.clear();
-            sample.iv.clear();
-        }
-    }
-    let (_file, path) = temp.keep().map_err(|e| py_io_error(e.error))?;
-    Ok(DecryptedTrack {
-        input_path: input_path.to_string(),
-        track_info: track,
-        payload_path: path.to_string_lossy().to_string(),
-        payload_size: written,
-    })
+    Ok(written)
 }
 
-struct WrapperTcpSession {
-    stream: TcpStream,
-    next_request_id: u32,
+struct PendingWrapperSample {
+    data: Vec<u8>,
+    aligned: Vec<u8>,
+    tail: Vec<u8>,
+    subsamples: Vec<(usize, usize)>,
 }
 
-impl WrapperTcpSession {
-    fn connect(host: &str, port: u16) -> io::Result<Self> {
-        let stream = TcpStream::connect((host, port))?;
-        stream.set_nodelay(true)?;
-        stream.set_read_timeout(Some(Duration::from_secs(600)))?;
-        stream.set_write_timeout(Some(Duration::from_secs(600)))?;
-        Ok(Self {
-            stream,
-            next_request_id: 1,
-        })
-    }
+enum WrapperOutput {
+    Ready(Vec<u8>),
+    Pending(u32, Vec<PendingWrapperSample>),
+}
 
-    fn write_frame(&mut self, kind: u16, request_id: u32, payload: &[u8]) -> io::Result<()> {
-        if payload.len() > u32::MAX as usize {
-            return Err(io::Error::new(
-                io::ErrorKind::InvalidInput,
-                "wrapper-v2: decrypt frame is too large",
-            ));
+/// Keeps up to `depth` wrapper batches in flight while writing decrypted
+/// samples to the payload in their original order.
+struct WrapperPipeline<'a> {
+    connection: PooledWrapperConnection,
+    depth: usize,
+    outputs: VecDeque<WrapperOutput>,
+    pending_batches: usize,
+    sink: &'a mut dyn Write,
+    written: u64,
+}
+
+impl<'a> WrapperPipeline<'a> {
+    fn new(connection: PooledWrapperConnection, depth: usize, sink: &'a mut dyn Write) -> Self {
+        Self {
+            connection,
+            depth,
+            outputs: VecDeque::new(),
+            pending_batches: 0,
+            sink,
+            written: 0,
         }
-        self.stream.write_all(&DECRYPT_MAGIC.to_be_bytes())?;
-        self.stream.write_all(&DECRYPT_VERSION.to_be_bytes())?;
-        self.stream.write_all(&kind.to_be_bytes())?;
-        self.stream.write_all(&request_id.to_be_bytes())?;
-        self.stream
-            .write_all(&(payload.len() as u32).to_be_bytes())?;
-        self.stream.write_all(payload)?;
+    }
+
+    fn write(&mut self, data: &[u8]) -> io::Result<()> {
+        self.sink.write_all(data)?;
+        self.written += data.len() as u64;
         Ok(())
     }
 
-    fn read_frame(&mut self) -> io::Result<(u16, u32, Vec<u8>)> {
-        let mut h = [0u8; 16];
-        self.stream.read_exact(&mut h)?;
-        let magic = u32::from_be_bytes([h[0], h[1], h[2], h[3]]);
-        let version = u16::from_be_bytes([h[4], h[5]]);
-        if magic != DECRYPT_MAGIC || version != DECRYPT_VERSION {
-            return Err(io::Error::new(
-                io::ErrorKind::InvalidData,
-                "wrapper-v2: bad decrypt response frame",
-            ));
+    fn push_ready(&mut self, data: Vec<u8>) -> io::Result<()> {
+        if self.outputs.is_empty() {
+            return self.write(&data);
         }
-        let kind = u16::from_be_bytes([h[6], h[7]]);
-        let request_id = u32::from_be_bytes([h[8], h[9], h[10], h[11]]);
-        let payload_len = u32::from_be_bytes([h[12], h[13], h[14], h[15]]) as usize;
-        let mut payload = vec![0u8; payload_len];
-        self.stream.read_exact(&mut payload)?;
-        Ok((kind, request_id, payload))
+        self.outputs.push_back(WrapperOutput::Ready(data));
+        Ok(())
     }
 
-    fn decrypt_batch(
+    fn push_batch(
         &mut self,
         adam_id: &str,
         skd_uri: &str,
-        samples: &[Vec<u8>],
-    ) -> io::Result<Vec<Vec<u8>>> {
-        if adam_id.is_empty() || skd_uri.is_empty() || samples.is_empty() {
-            return Err(io::Error::new(
-                io::ErrorKind::InvalidInput,
-                "wrapper-v2: invalid decrypt batch",
-            ));
-        }
-        if adam_id.len() > u16::MAX as usize || skd_uri.len() > u16::MAX as usize {
-            return Err(io::Error::new(
-                io::ErrorKind::InvalidInput,
-                "wrapper-v2: decrypt label too long",
-            ));
-        }
-        let mut payload = Vec::new();
-        payload.extend_from_slice(&(adam_id.len() as u16).to_be_bytes());
-        payload.extend_from_slice(&(skd_uri.len() as u16).to_be_bytes());
-        payload.extend_from_slice(&(samples.len() as u32).to_be_bytes());
-        for sample in samples {
-            payload.extend_from_slice(&(sample.len() as u32).to_be_bytes());
+        batch: Vec<PendingWrapperSample>,
+    ) -> io::Result<()> {
+        if batch.is_empty() {
+            return Ok(());
         }
-        payload.extend_from_slice(adam_id.as_bytes());
-        payload.extend_from_slice(skd_uri.as_bytes());
-        for sample in samples {
-            payload.extend_from_slice(sample);
+        let ciphertexts: Vec<&[u8]> = batch.iter().map(|item| item.aligned.as_slice()).collect();
+        let request_id =
+            self.connection
+                .send_batch(adam_id.as_bytes(), skd_uri.as_bytes(), &ciphertexts)?;
+        self.outputs
+            .push_back(WrapperOutput::Pending(request_id, batch));
+        self.pending_batches += 1;
+        while self.pending_batches > self.depth {
+            self.drain_batch()?;
         }
+        Ok(())
+    }
 
-        let request_id = self.next_request_id;
-        self.next_request_id = self.next_request_id.wrapping_add(1).max(1);
-        self.write_frame(DECRYPT_KIND_BATCH, request_id, &payload)?;
-        let (kind, response_id, response) = self.read_frame()?;
-        if response_id != request_id {
-            return Err(io::Error::new(
-                io::ErrorKind::InvalidData,
-                "wrapper-v2: mismatched decrypt response id",
-            ));
-        }
-        if kind == DECRYPT_KIND_ERROR {
-            return Err(io::Error::new(
-                io::ErrorKind::Other,
-                format!(
-                    "wrapper-v2: decrypt failed: {}",
-                    String::from_utf8_lossy(&response)
-                ),
-            ));
-        }
-        if kind != DECRYPT_KIND_OK || response.len() < 4 {
-            return Err(io::Error::new(
-                io::ErrorKind::InvalidData,
-                "wrapper-v2: bad decrypt response",
-            ));
-        }
-        let count = be_u32(&response, 0).unwrap_or(0) as usize;
-        let table_end = 4 + count * 4;
-        if response.len() < table_end {
-            return Err(io::Error::new(
-                io::ErrorKind::UnexpectedEof,
-                "wrapper-v2: truncated decrypt response",
-            ));
-        }
-        let mut out = Vec::with_capacity(count);
-        let mut offset = table_end;
-        for i in 0..count {
-            let len = be_u32(&response, 4 + i * 4).unwrap_or(0) as usize;
-            if offset + len > response.len() {
-                return Err(io::Error::new(
-                    io::ErrorKind::UnexpectedEof,
-                    "wrapper-v2: truncated plaintext sample",
-                ));
+    fn drain_batch(&mut self) -> io::Result<()> {
+        while let Some(output) = self.outputs.pop_front() {
+            match output {
+                WrapperOutput::Ready(data) => self.write(&data)?,
+                WrapperOutput::Pending(request_id, items) => {
+                    let plains = self.connection.receive_batch(request_id, items.len())?;
+                    self.pending_batches -= 1;
+                    for (item, plain) in items.into_iter().zip(plains) {
+                        let sample =
+                            reassemble_sample(&item.data, &plain, &item.tail, &item.subsamples)?;
+                        self.write(&sample)?;
+                    }
+                    return Ok(());
+                }
             }
-            out.push(response[offset..offset + len].to_vec());
-            offset += len;
-        }
-        if out.len() != samples.len() {
-            return Err(io::Error::new(
-                io::ErrorKind::InvalidData,
-                "wrapper-v2: plaintext batch count mismatch",
-            ));
         }
-        Ok(out)
+        Ok(())
     }
-}
 
-impl Drop for WrapperTcpSession {
-    fn drop(&mut self) {
-        let _ = self.write_frame(DECRYPT_KIND_CLOSE, 0, &[]);
+    fn finish(mut self) -> io::Result<u64> {
+        while !self.outputs.is_empty() {
+            self.drain_batch()?;
+        }
+        Ok(self.written)
     }
 }
 
-struct PendingWrapperSample {
-    data: Vec<u8>,
-    aligned: Vec<u8>,
-    tail: Vec<u8>,
-    subsamples: Vec<(usize, usize)>,
-}
-
-fn decrypt_track_wrapper(
-    host: &str,
-    port: u16,
+fn decrypt_samples_wrapper(
+    pool: &Arc<WrapperPool>,
+    samples: &[Sample],
+    input: MediaInput<'_>,
     track_id: &str,
-    input_path: &str,
     fairplay_key: &str,
-    handler_type: [u8; 4],
+    per_desc: Option<&HashMap<usize, EncryptionInfo>>,
+    enc_info: &EncryptionInfo,
     use_single_content_key: bool,
-    file_backed: bool,
-) -> PyResult<DecryptedTrack> {
-    let mut track = extract_song(input_path, handler_type, true).map_err(py_io_error)?;
-    let enc_info = track.encryption_info.clone().unwrap_or_default();
-    let per_desc = extract_encryption_info_per_stsd(&track.moov_data, &handler_type);
-    let mut wrapper = WrapperTcpSession::connect(host, port).map_err(py_io_error)?;
-    let mut temp = NamedTempFile::new().map_err(py_io_error)?;
-    let mut written = 0u64;
-    let mut current_adam: Option<String> = None;
-    let mut current_uri: Option<String> = None;
+    sink: &mut dyn Write,
+) -> io::Result<u64> {
+    let mut pipeline = WrapperPipeline::new(pool.acquire()?, pool.pipeline_depth(), sink);
+    let mut current_adam = track_id;
+    let mut current_uri = fairplay_key;
     let mut batch: Vec<PendingWrapperSample> = Vec::new();
 
-    let flush = |batch: &mut Vec<PendingWrapperSample>,
-                 wrapper: &mut WrapperTcpSession,
-                 temp: &mut NamedTempFile,
-                 written: &mut u64,
-                 adam: &Option<String>,
-                 uri: &Option<String>|
-     -> PyResult<()> {
-        if batch.is_empty() {
-            return Ok(());
-        }
-        let adam = adam.as_deref().ok_or_else(|| {
-            py_io_error(io::Error::new(
-                io::ErrorKind::Other,
-                "wrapper-v2: missing adam id",
-            ))
-        })?;
-        let uri = uri.as_deref().ok_or_else(|| {
-            py_io_error(io::Error::new(
-                io::ErrorKind::Other,
-                "wrapper-v2: missing skd uri",
-            ))
-        })?;
-        let ciphertexts: Vec<Vec<u8>> = batch.iter().map(|item| item.aligned.clone()).collect();
-        let plains = wrapper
-            .decrypt_batch(adam, uri, &ciphertexts)
-            .map_err(py_io_error)?;
-        for (item, plain) in batch.drain(..).zip(plains) {
-            let sample = reassemble_sample(&item.data, &plain, &item.tail, &item.subsamples)
-                .map_err(py_io_error)?;
-            temp.write_all(&sample).map_err(py_io_error)?;
-            *written += sample.len() as u64;
-        }
-        Ok(())
-    };
-
     let mut last_desc_index = usize::MAX;
-    for sample in &mut track.samples {
+    for sample in samples {
         if last_desc_index != sample.desc_index {
-            flush(
-                &mut batch,
-                &mut wrapper,
-                &mut temp,
-                &mut written,
-                &current_adam,
-                &current_uri,
-            )?;
-            if use_single_content_key {
-                current_adam = Some(track_id.to_string());
-                current_uri = Some(fairplay_key.to_string());
+            pipeline.push_batch(current_adam, current_uri, std::mem::take(&mut batch))?;
+            (current_adam, current_uri) = if use_single_content_key {
+                (track_id, fairplay_key)
             } else if sample.desc_index == 0 {
-                current_adam = Some("0".to_string());
-                current_uri = Some(PREFETCH_KEY.to_string());
+                ("0", PREFETCH_KEY)
             } else {
-                current_adam = Some(track_id.to_string());
-                current_uri = Some(fairplay_key.to_string());
-            }
+                (track_id, fairplay_key)
+            };
             last_desc_index = sample.desc_index;
         }
 
         let effective = per_desc
-            .as_ref()
             .and_then(|m| m.get(&sample.desc_index))
-            .unwrap_or(&enc_info);
-        let data = read_sample_data(sample).map_err(py_io_error)?;
-        let decrypted = if !use_single_content_key && current_adam.as_deref() == Some("0") {
-            decrypt_sample_hex(sample, Some(&DEFAULT_SONG_DECRYPTION_KEY), effective)
-                .map_err(py_io_error)?
+            .unwrap_or(enc_info);
+        let data = read_sample_data(sample, input)?;
+        let decrypted = if !use_single_content_key && current_adam == "0" {
+            decrypt_sample_hex(sample, input, Some(&DEFAULT_SONG_DECRYPTION_KEY), effective)?
         } else {
             if effective.crypt_byte_block > 0 && effective.skip_byte_block > 0 {
-                return Err(py_io_error(io::Error::new(
+                return Err(io::Error::new(
                     io::ErrorKind::InvalidInput,
                     "wrapper-v2 pattern CBCS decrypt is not supported by wrapper batch path",
-                )));
+                ));
             }
-            match cbcs_ciphertext_for_sample(&data, &sample.subsamples) {
-                None => data,
+            match cbcs_ciphertext_for_sample(data, &sample.subsamples) {
+                None => data.to_vec(),
                 Some((aligned, tail)) if aligned.is_empty() => {
-                    reassemble_sample(&data, &[], &tail, &sample.subsamples).map_err(py_io_error)?
+                    reassemble_sample(data, &[], &tail, &sample.subsamples)?
                 }
                 Some((aligned, tail)) => {
                     batch.push(PendingWrapperSample {
-                        data,
+                        data: data.to_vec(),
                         aligned,
                         tail,
                         subsamples: sample.subsamples.clone(),
                     });
                     if batch.len() >= WRAPPER_DECRYPT_BATCH_SIZE {
-                        flush(
-                            &mut batch,
-                            &mut wrapper,
-                            &mut temp,
-                            &mut written,
-                            &current_adam,
-                            &current_uri,
+                        pipeline.push_batch(
+                            current_adam,
+                            current_uri,
+                            std::mem::take(&mut batch),
                         )?;
                     }
-                    if file_backed {
-                        sample.data.clear();
-                        sample.subsamples.clear();
-                        sample.iv.clear();
-                    }
                     continue;
                 }
             }
         };
-        temp.write_all(&decrypted).map_err(py_io_error)?;
-        sample.size = decrypted.len();
-        written += decrypted.len() as u64;
-        if file_backed {
-            sample.data.clear();
-            sample.subsamples.clear();
-            sample.iv.clear();
-        }
-    }
-    flush(
-        &mut batch,
-        &mut wrapper,
-        &mut temp,
-        &mut written,
-        &current_adam,
-        &current_uri,
-    )?;
-    let (_file, path) = temp.keep().map_err(|e| py_io_error(e.error))?;
-    Ok(DecryptedTrack {
-        input_path: input_path.to_string(),
-        track_info: track,
-        payload_path: path.to_string_lossy().to_string(),
-        payload_size: written,
-    })
+        pipeline.push_ready(decrypted)?;
+    }
+    pipeline.push_batch(current_adam, current_uri, batch)?;
+    pipeline.finish()
+}
+
+pub(crate) enum FragmentKeys {
+    Hex {
+        key: [u8; 16],
+        pool: Option<Arc<ThreadPool>>,
+    },
+    Wrapper {
+        pool: Arc<WrapperPool>,
+        track_id: String,
+        fairplay_key: String,
+    },
+}
+
+impl FragmentKeys {
+    pub(crate) fn hex(key_hex: &str, decrypt_threads: usize) -> PyResult<Self> {
+        Ok(FragmentKeys::Hex {
+            key: key_bytes(key_hex)?,
+            pool: decrypt_pool(decrypt_threads).map_err(py_io_error)?,
+        })
+    }
+}
+
+/// Decrypts one `moof`/`mdat` pair at a time, using the track layout from
+/// the init segment or `moov`.
+pub(crate) struct FragmentDecryptor {
+    keys: FragmentKeys,
+    use_single_content_key: bool,
+    track_id: u32,
+    trex_defaults: (u32, usize, u32),
+    enc_info: EncryptionInfo,
+    per_desc: Option<HashMap<usize, EncryptionInfo>>,
+    iv_size: usize,
+}
+
+impl FragmentDecryptor {
+    pub(crate) fn new(
+        moov: &[u8],
+        handler_type: [u8; 4],
+        keys: FragmentKeys,
+        use_cenc: bool,
+        use_single_content_key: bool,
+    ) -> io::Result<Self> {
+        let track_id = extract_track_id(moov, &handler_type, 0);
+        if track_id == 0 {
+            return Err(io::Error::new(
+                io::ErrorKind::InvalidData,
+                "decrypt: moov has no matching track",
+            ));
+        }
+        let per_desc = extract_encryption_info_per_stsd(moov, &handler_type);
+        let encryption_info = per_desc.as_ref().and_then(|m| m.values().next().cloned());
+        let iv_size = encryption_info
+            .as_ref()
+            .map(|e| e.per_sample_iv_size)
+            .unwrap_or(0);
+        let mut enc_info = encryption_info.unwrap_or_default();
+        if use_cenc && matches!(keys, FragmentKeys::Hex { .. }) {
+            enc_info.scheme_type = "cenc".to_string();
+            enc_info.crypt_byte_block = 0;
+            enc_info.skip_byte_block = 0;
+        }
+        Ok(Self {
+            keys,
+            use_single_content_key,
+            track_id,
+            trex_defaults: extract_trex_defaults(moov, track_id),
+            enc_info,
+            per_desc,
+            iv_size,
+        })
+    }
+
+    fn fragment_samples(&self, moof: &[u8], fragment: &Fragment) -> Vec<Sample> {
+        let (default_duration, default_size, default_flags) = self.trex_defaults;
+        parse_moof_mdat(
+            moof,
+            default_duration,
+            default_size,
+            default_flags,
+            self.track_id,
+            fragment.moof_offset,
+            fragment.mdat_data_offset,
+            Some(self.iv_size),
+            fragment.mdat_size,
+        )
+    }
+
+    fn decrypt_samples(
+        &self,
+        samples: &[Sample],
+        input: MediaInput<'_>,
+        sink: &mut dyn Write,
+    ) -> io::Result<u64> {
+        match &self.keys {
+            FragmentKeys::Hex { key, pool } => {
+                decrypt_samples(samples, pool.as_deref(), sink, |sample| {
+                    let effective = self
+                        .per_desc
+                        .as_ref()
+                        .and_then(|m| m.get(&sample.desc_index))
+                        .unwrap_or(&self.enc_info);
+                    let key = match sample.desc_index {
+                        _ if self.use_single_content_key => Some(key),
+                        0 => Some(&DEFAULT_SONG_DECRYPTION_KEY),
+                        1 => Some(key),
+                        _ => None,
+                    };
+                    decrypt_sample_hex(sample, input, key, effective)
+                })
+            }
+            FragmentKeys::Wrapper {
+                pool,
+                track_id,
+                fairplay_key,
+            } => decrypt_samples_wrapper(
+                pool,
+                samples,
+                input,
+                track_id,
+                fairplay_key,
+                self.per_desc.as_ref(),
+                &self.enc_info,
+                self.use_single_content_key,
+                sink,
+            ),
+        }
+    }
+
+    /// Writes the decrypted track samples of one fragment of `input` to
+    /// `sink` in sample order and returns the number of bytes written.
+    fn decrypt_fragment_to(
+        &self,
+        input: MediaInput<'_>,
+        fragment: &Fragment,
+        sink: &mut dyn Write,
+    ) -> io::Result<u64> {
+        let start = fragment.moof_offset as usize;
+        let moof = &input.bytes()[start..start + fragment.moof_size];
+        let samples = self.fragment_samples(moof, fragment);
+        self.decrypt_samples(&samples, input, sink)
+    }
+
+    /// Decrypts the track samples of `fragment`, a `moof` box followed by
+    /// its `mdat` box that starts at `fragment_offset` in the stream, in
+    /// place. Clear sample sizes match the encrypted ones.
+    pub(crate) fn decrypt_fragment(
+        &self,
+        fragment: &mut [u8],
+        fragment_offset: u64,
+        moof_size: usize,
+    ) -> io::Result<()> {
+        let Some((_, mdat_offset, mdat_size, mdat_header_size)) =
+            next_box(fragment, moof_size, fragment.len())
+        else {
+            return Err(io::Error::new(
+                io::ErrorKind::InvalidData,
+                "stream: malformed mdat after moof",
+            ));
+        };
+        let layout = Fragment {
+            moof_offset: fragment_offset,
+            moof_size,
+            mdat_data_offset: fragment_offset + (mdat_offset + mdat_header_size) as u64,
+            mdat_size: mdat_size - mdat_header_size,
+        };
+        let mut samples = self.fragment_samples(&fragment[..moof_size], &layout);
+        if samples.is_empty() {
+            return Ok(());
+        }
+        for sample in &mut samples {
+            sample.data_offset -= fragment_offset;
+        }
+        let mut decrypted = Vec::new();
+        self.decrypt_samples(&samples, MediaInput::Memory(fragment), &mut decrypted)?;
+        let expected: usize = samples.iter().map(|sample| sample.size).sum();
+        if decrypted.len() != expected {
+            return Err(io::Error::new(
+                io::ErrorKind::InvalidData,
+                "stream: decrypted fragment size differs from the encrypted samples",
+            ));
+        }
+        let mut cursor = 0usize;
+        for sample in &samples {
+            let offset = sample.data_offset as usize;
+            fragment[offset..offset + sample.size]
+                .copy_from_slice(&decrypted[cursor..cursor + sample.size]);
+            cursor += sample.size;
+        }
+        Ok(())
+    }
+}
+
+/// A track whose payload is written straight into the output `mdat`,
+/// decrypting one fragment at a time when a decryptor is set.
+struct MuxTrack<'a> {
+    input: MediaInput<'a>,
+    info: SongInfo,
+    decryptor: Option<FragmentDecryptor>,
+}
+
+impl<'a> MuxTrack<'a> {
+    fn clear(input: MediaInput<'a>, handler_type: [u8; 4]) -> Self {
+        Self {
+            input,
+            info: extract_song(input, handler_type),
+            decryptor: None,
+        }
+    }
+
+    fn encrypted(
+        input: MediaInput<'a>,
+        handler_type: [u8; 4],
+        keys: FragmentKeys,
+        use_cenc: bool,
+        use_single_content_key: bool,
+    ) -> io::Result<Self> {
+        let info = extract_song(input, handler_type);
+        let decryptor = FragmentDecryptor::new(
+            &info.moov_data,
+            handler_type,
+            keys,
+            use_cenc,
+            use_single_content_key,
+        )?;
+        Ok(Self {
+            input,
+            info,
+            decryptor: Some(decryptor),
+        })
+    }
+
+    fn payload_size(&self) -> u64 {
+        self.info
+            .samples
+            .iter()
+            .map(|sample| sample.size as u64)
+            .sum()
+    }
+
+    fn write_payload(&self, sink: &mut dyn Write) -> io::Result<u64> {
+        let mut written = 0u64;
+        match &self.decryptor {
+            Some(decryptor) => {
+                for fragment in &self.info.fragments {
+                    written += decryptor.decrypt_fragment_to(self.input, fragment, sink)?;
+                }
+            }
+            None => {
+                for sample in &self.info.samples {
+                    let data = read_sample_data(sample, self.input)?;
+                    sink.write_all(data)?;
+                    written += data.len() as u64;
+                }
+            }
+        }
+        Ok(written)
+    }
 }
 
 fn track_to_mp4_info(track: &SongInfo) -> TrackInfo {
@@ -1334,84 +1472,46 @@ fn track_to_mp4_info(track: &SongInfo) -> TrackInfo {
     }
 }
 
-fn payload_source(track: &DecryptedTrack) -> PayloadSource {
-    PayloadSource::File {
-        path: track.payload_path.clone(),
-        offset: 0,
-        size: track.payload_size,
-    }
+fn missing_track_metadata() -> io::Error {
+    io::Error::new(
+        io::ErrorKind::InvalidData,
+        "mux: missing required audio/video track metadata",
+    )
 }
 
-fn write_decrypted_media_native(
-    media: DecryptedMedia,
-    output_path: &str,
+/// Builds the `ftyp` and `moov` of a muxed video file and returns them with
+/// the tracks in `mdat` order.
+fn build_muxed_header<'t, 'a>(
+    audio: &'t MuxTrack<'a>,
+    video: &'t MuxTrack<'a>,
+    captions: &'t [MuxTrack<'a>],
     m4v_brand: bool,
-) -> io::Result<()> {
-    struct Cleanup(Vec<String>);
-    impl Drop for Cleanup {
-        fn drop(&mut self) {
-            for path in &self.0 {
-                let _ = std::fs::remove_file(path);
-            }
-        }
-    }
-    let mut cleanup = Cleanup(vec![media.audio.payload_path.clone()]);
-    if let Some(video) = &media.video {
-        cleanup.0.push(video.payload_path.clone());
-    }
-    for caption in &media.captions {
-        cleanup.0.push(caption.payload_path.clone());
-    }
-
-    if media.video.is_none() {
-        let info = track_to_mp4_info(&media.audio.track_info);
-        write_m4a_file(
-            output_path,
-            &info,
-            Some(&media.audio.input_path),
-            &payload_source(&media.audio),
-        )?;
-        return Ok(());
-    }
-    let video = media.video.as_ref().unwrap();
-    let video_info = track_to_mp4_info(&video.track_info);
-    let audio_info = track_to_mp4_info(&media.audio.track_info);
-    let video_moov = crate::mp4::build_decrypted_track_moov(&video_info, Some(&video.input_path))?;
-    let audio_moov =
-        crate::mp4::build_decrypted_track_moov(&audio_info, Some(&media.audio.input_path))?;
-    let mvhd = crate::mp4::find_child_box(&video_moov, b"mvhd", 8).ok_or_else(|| {
-        io::Error::new(
-            io::ErrorKind::InvalidData,
-            "mux: missing required audio/video track metadata",
-        )
-    })?;
-    let video_trak = crate::mp4::find_track_by_handler(&video_moov, b"vide").ok_or_else(|| {
-        io::Error::new(
-            io::ErrorKind::InvalidData,
-            "mux: missing required audio/video track metadata",
-        )
-    })?;
-    let mut audio_trak =
-        crate::mp4::find_track_by_handler(&audio_moov, b"soun").ok_or_else(|| {
-            io::Error::new(
-                io::ErrorKind::InvalidData,
-                "mux: missing required audio/video track metadata",
-            )
-        })?;
+    ilst: &[u8],
+) -> io::Result<(Vec<u8>, Vec<&'t MuxTrack<'a>>)> {
+    let video_info = track_to_mp4_info(&video.info);
+    let audio_info = track_to_mp4_info(&audio.info);
+    let video_moov = crate::mp4::build_decrypted_track_moov(&video_info, video.input.path())?;
+    let audio_moov = crate::mp4::build_decrypted_track_moov(&audio_info, audio.input.path())?;
+    let mvhd =
+        crate::mp4::find_child_box(&video_moov, b"mvhd", 8).ok_or_else(missing_track_metadata)?;
+    let video_trak = crate::mp4::find_track_by_handler(&video_moov, b"vide")
+        .ok_or_else(missing_track_metadata)?;
+    let mut audio_trak = crate::mp4::find_track_by_handler(&audio_moov, b"soun")
+        .ok_or_else(missing_track_metadata)?;
     let movie_timescale = crate::mp4::extract_mvhd_timescale(&mvhd);
     audio_trak = crate::mp4::patch_trak_track_id(&audio_trak, 2);
     audio_trak = crate::mp4::patch_trak_duration_to_movie_timescale(&audio_trak, movie_timescale);
 
     let mut traks = vec![video_trak, audio_trak];
-    let mut sources = vec![payload_source(video), payload_source(&media.audio)];
-    for (idx, caption) in media.captions.iter().enumerate() {
-        let info = track_to_mp4_info(&caption.track_info);
-        let moov = crate::mp4::build_decrypted_track_moov(&info, Some(&caption.input_path))?;
+    let mut tracks = vec![video, audio];
+    for caption in captions {
+        let info = track_to_mp4_info(&caption.info);
+        let moov = crate::mp4::build_decrypted_track_moov(&info, caption.input.path())?;
         if let Some(mut trak) = crate::mp4::find_child_box(&moov, b"trak", 8) {
-            trak = crate::mp4::patch_trak_track_id(&trak, idx as u32 + 3);
+            trak = crate::mp4::patch_trak_track_id(&trak, traks.len() as u32 + 1);
             trak = crate::mp4::patch_trak_duration_to_movie_timescale(&trak, movie_timescale);
             traks.push(trak);
-            sources.push(payload_source(caption));
+            tracks.push(caption);
         }
     }
     let ftyp = if m4v_brand {
@@ -1419,22 +1519,209 @@ fn write_decrypted_media_native(
     } else {
         crate::mp4::ftyp_mp4()?
     };
-    let moov_probe = crate::mp4::build_muxed_moov(&mvhd, &traks)?;
-    let mut mdat_offset = ftyp.len() as u64 + moov_probe.len() as u64 + 8;
-    let mut patched_traks = Vec::new();
-    for (trak, source) in traks.iter().zip(sources.iter()) {
-        patched_traks.push(crate::mp4::patch_first_chunk_offset(trak, mdat_offset)?);
-        mdat_offset += source.len();
-    }
-    let moov = crate::mp4::build_muxed_moov(&mvhd, &patched_traks)?;
+    let payload_sizes: Vec<u64> = tracks.iter().map(|track| track.payload_size()).collect();
+    let moov = crate::mp4::build_muxed_moov_for_payloads(
+        &mvhd,
+        &traks,
+        &payload_sizes,
+        ftyp.len() as u64,
+        ilst,
+    )?;
+    Ok(([ftyp, moov].concat(), tracks))
+}
+
+/// Writes the final file in a single pass: the header is built from the
+/// sample tables, then each track is decrypted fragment by fragment straight
+/// into `mdat`, so memory use does not grow with the media payload.
+fn write_media_native(
+    audio: &MuxTrack<'_>,
+    video: Option<&MuxTrack<'_>>,
+    captions: &[MuxTrack<'_>],
+    output_path: &str,
+    m4v_brand: bool,
+    ilst: &[u8],
+) -> io::Result<()> {
+    let (header, tracks) = match video {
+        Some(video) => build_muxed_header(audio, video, captions, m4v_brand, ilst)?,
+        None => (
+            build_track_file_header(
+                &track_to_mp4_info(&audio.info),
+                audio.input.path(),
+                audio.payload_size(),
+                ilst,
+            )?,
+            vec![audio],
+        ),
+    };
+    let result = write_media_payloads(output_path, &header, &tracks);
+    if result.is_err() {
+        let _ = std::fs::remove_file(output_path);
+    }
+    result
+}
+
+fn write_media_payloads(
+    output_path: &str,
+    header: &[u8],
+    tracks: &[&MuxTrack<'_>],
+) -> io::Result<()> {
+    let payload_size = tracks.iter().map(|track| track.payload_size()).sum();
     let mut file = File::create(output_path)?;
-    file.write_all(&ftyp)?;
-    file.write_all(&moov)?;
-    write_mdat_from_sources(&mut file, &sources)
+    file.write_all(header)?;
+    write_mdat_header(&mut file, payload_size)?;
+    let mut out = BufWriter::with_capacity(MUX_WRITE_BUFFER_SIZE, &file);
+    for track in tracks {
+        if track.write_payload(&mut out)? != track.payload_size() {
+            return Err(io::Error::new(
+                io::ErrorKind::InvalidData,
+                "mux: decrypted payload size differs from the sample tables",
+            ));
+        }
+    }
+    out.flush()
+}
+
+fn caption_tracks(video: MediaInput<'_>) -> Vec<MuxTrack<'_>> {
+    [*b"clcp", *b"text", *b"sbtl", *b"subt"]
+        .into_iter()
+        .map(|handler| MuxTrack::clear(video, handler))
+        .filter(|track| !track.info.samples.is_empty())
+        .collect()
+}
+
+fn buffer_bytes(buffer: &PyBuffer<u8>) -> PyResult<&[u8]> {
+    if !buffer.is_c_contiguous() {
+        return Err(py_value_error("mux: input buffer must be C-contiguous"));
+    }
+    // SAFETY: the exporter keeps the buffer alive and unresized while the
+    // PyBuffer is held, and the returned slice does not outlive the PyBuffer.
+    Ok(unsafe { std::slice::from_raw_parts(buffer.buf_ptr() as *const u8, buffer.len_bytes()) })
+}
+
+/// Where the keys for one decrypt-and-mux call come from.
+pub(crate) enum MuxKeys {
+    Hex {
+        audio: String,
+        video: Option<String>,
+        use_cenc: bool,
+        decrypt_threads: usize,
+    },
+    Wrapper {
+        pool: Arc<WrapperPool>,
+        track_id: String,
+        audio: String,
+        video: Option<String>,
+    },
+}
+
+impl MuxKeys {
+    fn track<'a>(
+        &self,
+        input: MediaInput<'a>,
+        handler_type: [u8; 4],
+        video: bool,
+        use_single_content_key: bool,
+    ) -> PyResult<MuxTrack<'a>> {
+        match self {
+            MuxKeys::Hex {
+                audio,
+                video: video_key,
+                use_cenc,
+                decrypt_threads,
+            } => {
+                let key = match video {
+                    true => video_key.as_deref().unwrap_or(audio),
+                    false => audio,
+                };
+                MuxTrack::encrypted(
+                    input,
+                    handler_type,
+                    FragmentKeys::hex(key, *decrypt_threads)?,
+                    *use_cenc,
+                    use_single_content_key,
+                )
+                .map_err(py_io_error)
+            }
+            MuxKeys::Wrapper {
+                pool,
+                track_id,
+                audio,
+                video: video_key,
+            } => {
+                let fairplay_key = match video {
+                    true => video_key.as_deref().unwrap_or(audio),
+                    false => audio,
+                };
+                let keys = FragmentKeys::Wrapper {
+                    pool: pool.clone(),
+                    track_id: track_id.clone(),
+                    fairplay_key: fairplay_key.to_string(),
+                };
+                MuxTrack::encrypted(input, handler_type, keys, false, use_single_content_key)
+                    .map_err(py_io_error)
+            }
+        }
+    }
+}
+
+fn mux_inputs(
+    audio_input: MediaInput<'_>,
+    video_input: Option<MediaInput<'_>>,
+    keys: &MuxKeys,
+    output_path: &str,
+    use_single_content_key: bool,
+    m4v_brand: bool,
+    ilst: &[u8],
+) -> PyResult<()> {
+    let single_audio_key = match keys {
+        MuxKeys::Hex { .. } => use_single_content_key || video_input.is_some(),
+        MuxKeys::Wrapper { .. } => use_single_content_key,
+    };
+    let audio = keys.track(audio_input, *b"soun", false, single_audio_key)?;
+    let video = video_input
+        .map(|video_input| keys.track(video_input, *b"vide", true, true))
+        .transpose()?;
+    let captions = video_input.map(caption_tracks).unwrap_or_default();
+    write_media_native(
+        &audio,
+        video.as_ref(),
+        &captions,
+        output_path,
+        m4v_brand,
+        ilst,
+    )
+    .map_err(py_io_error)
+}
+
+/// Decrypts and muxes file inputs without touching Python; used by the
+/// batch entry point.
+pub(crate) fn mux_files(
+    input_audio_path: &str,
+    input_video_path: Option<&str>,
+    keys: &MuxKeys,
+    output_path: &str,
+    use_single_content_key: bool,
+    m4v_brand: bool,
+    ilst: &[u8],
+) -> PyResult<()> {
+    let audio_source = InputSource::open(input_audio_path, None).map_err(py_io_error)?;
+    let video_source = input_video_path
+        .map(|path| InputSource::open(path, None))
+        .transpose()
+        .map_err(py_io_error)?;
+    mux_inputs(
+        audio_source.input(),
+        video_source.as_ref().map(InputSource::input),
+        keys,
+        output_path,
+        use_single_content_key,
+        m4v_brand,
+        ilst,
+    )
 }
 
 #[pyfunction]
-#[pyo3(signature = (decryption_key_audio, input_audio_path, output_path, decryption_key_video=None, input_video_path=None, use_cenc=false, use_single_content_key=false, m4v_brand=false))]
+#[pyo3(signature = (decryption_key_audio, input_audio_path, output_path, decryption_key_video=None, input_video_path=None, use_cenc=false, use_single_content_key=false, m4v_brand=false, ilst=None, input_audio_buffer=None, input_video_buffer=None, decrypt_threads=0))]
 pub fn decrypt_and_mux_hex_native(
     py: Python<'_>,
     decryption_key_audio: String,
@@ -1445,70 +1732,45 @@ pub fn decrypt_and_mux_hex_native(
     use_cenc: bool,
     use_single_content_key: bool,
     m4v_brand: bool,
+    ilst: Option<Bound<'_, PyBytes>>,
+    input_audio_buffer: Option<PyBuffer<u8>>,
+    input_video_buffer: Option<PyBuffer<u8>>,
+    decrypt_threads: usize,
 ) -> PyResult<()> {
+    let ilst = ilst
+        .map(|value| value.as_bytes().to_vec())
+        .unwrap_or_default();
+    validate_ilst(&ilst).map_err(|err| py_value_error(err.to_string()))?;
+    let audio_buffer = input_audio_buffer.as_ref().map(buffer_bytes).transpose()?;
+    let video_buffer = input_video_buffer.as_ref().map(buffer_bytes).transpose()?;
+    let keys = MuxKeys::Hex {
+        audio: decryption_key_audio,
+        video: decryption_key_video,
+        use_cenc,
+        decrypt_threads,
+    };
     py.detach(move || {
-        let audio = decrypt_track_hex(
-            &input_audio_path,
-            &decryption_key_audio,
-            *b"soun",
-            use_cenc,
-            use_single_content_key || input_video_path.is_some(),
-            input_video_path.is_some(),
-        )?;
-        let video = if let Some(video_path) = input_video_path.as_ref() {
-            Some(decrypt_track_hex(
-                video_path,
-                decryption_key_video
-                    .as_deref()
-                    .unwrap_or(&decryption_key_audio),
-                *b"vide",
-                use_cenc,
-                true,
-                true,
-            )?)
-        } else {
-            None
-        };
-        let mut captions = Vec::new();
-        if let Some(video_path) = input_video_path.as_ref() {
-            for handler in [*b"clcp", *b"text", *b"sbtl", *b"subt"] {
-                let mut caption_track =
-                    extract_song(video_path, handler, true).map_err(py_io_error)?;
-                if caption_track.samples.is_empty() {
-                    continue;
-                }
-                let mut temp = NamedTempFile::new().map_err(py_io_error)?;
-                let mut written = 0u64;
-                for sample in &mut caption_track.samples {
-                    let data = read_sample_data(sample).map_err(py_io_error)?;
-                    temp.write_all(&data).map_err(py_io_error)?;
-                    sample.size = data.len();
-                    written += data.len() as u64;
-                }
-                let (_file, path) = temp.keep().map_err(|e| py_io_error(e.error))?;
-                captions.push(DecryptedTrack {
-                    input_path: video_path.clone(),
-                    track_info: caption_track,
-                    payload_path: path.to_string_lossy().to_string(),
-                    payload_size: written,
-                });
-            }
-        }
-        write_decrypted_media_native(
-            DecryptedMedia {
-                audio,
-                video,
-                captions,
-            },
+        let audio_source =
+            InputSource::open(&input_audio_path, audio_buffer).map_err(py_io_error)?;
+        let video_source = input_video_path
+            .as_deref()
+            .map(|path| InputSource::open(path, video_buffer))
+            .transpose()
+            .map_err(py_io_error)?;
+        mux_inputs(
+            audio_source.input(),
+            video_source.as_ref().map(InputSource::input),
+            &keys,
             &output_path,
+            use_single_content_key,
             m4v_brand,
+            &ilst,
         )
-        .map_err(py_io_error)
     })
 }
 
 #[pyfunction]
-#[pyo3(signature = (wrapper_decrypt_host, wrapper_decrypt_port, track_id, input_audio_path, output_path, fairplay_key_audio, input_video_path=None, fairplay_key_video=None, use_single_content_key=false, m4v_brand=false))]
+#[pyo3(signature = (wrapper_decrypt_host, wrapper_decrypt_port, track_id, input_audio_path, output_path, fairplay_key_audio, input_video_path=None, fairplay_key_video=None, use_single_content_key=false, m4v_brand=false, ilst=None, input_audio_buffer=None, input_video_buffer=None, decrypt_session=None))]
 pub fn decrypt_and_mux_wrapper_native(
     py: Python<'_>,
     wrapper_decrypt_host: String,
@@ -1521,73 +1783,86 @@ pub fn decrypt_and_mux_wrapper_native(
     fairplay_key_video: Option<String>,
     use_single_content_key: bool,
     m4v_brand: bool,
+    ilst: Option<Bound<'_, PyBytes>>,
+    input_audio_buffer: Option<PyBuffer<u8>>,
+    input_video_buffer: Option<PyBuffer<u8>>,
+    decrypt_session: Option<Bound<'_, WrapperDecryptSession>>,
 ) -> PyResult<()> {
-    py.detach(move || {
-        let audio = decrypt_track_wrapper(
-            &wrapper_decrypt_host,
+    let ilst = ilst
+        .map(|value| value.as_bytes().to_vec())
+        .unwrap_or_default();
+    validate_ilst(&ilst).map_err(|err| py_value_error(err.to_string()))?;
+    let audio_buffer = input_audio_buffer.as_ref().map(buffer_bytes).transpose()?;
+    let video_buffer = input_video_buffer.as_ref().map(buffer_bytes).transpose()?;
+    let pool = match decrypt_session {
+        Some(session) => session.get().pool(),
+        None => WrapperPool::new(
+            wrapper_decrypt_host,
             wrapper_decrypt_port,
-            &track_id,
-            &input_audio_path,
-            &fairplay_key_audio,
-            *b"soun",
-            use_single_content_key,
-            input_video_path.is_some(),
-        )?;
-        let video = if let Some(video_path) = input_video_path.as_ref() {
-            Some(decrypt_track_wrapper(
-                &wrapper_decrypt_host,
-                wrapper_decrypt_port,
-                &track_id,
-                video_path,
-                fairplay_key_video.as_deref().unwrap_or(&fairplay_key_audio),
-                *b"vide",
-                true,
-                true,
-            )?)
-        } else {
-            None
-        };
-        let mut captions = Vec::new();
-        if let Some(video_path) = input_video_path.as_ref() {
-            for handler in [*b"clcp", *b"text", *b"sbtl", *b"subt"] {
-                let mut caption_track =
-                    extract_song(video_path, handler, true).map_err(py_io_error)?;
-                if caption_track.samples.is_empty() {
-                    continue;
-                }
-                let mut temp = NamedTempFile::new().map_err(py_io_error)?;
-                let mut written = 0u64;
-                for sample in &mut caption_track.samples {
-                    let data = read_sample_data(sample).map_err(py_io_error)?;
-                    temp.write_all(&data).map_err(py_io_error)?;
-                    sample.size = data.len();
-                    written += data.len() as u64;
-                }
-                let (_file, path) = temp.keep().map_err(|e| py_io_error(e.error))?;
-                captions.push(DecryptedTrack {
-                    input_path: video_path.clone(),
-                    track_info: caption_track,
-                    payload_path: path.to_string_lossy().to_string(),
-                    payload_size: written,
-                });
-            }
-        }
-        write_decrypted_media_native(
-            DecryptedMedia {
-                audio,
-                video,
-                captions,
-            },
+            1,
+            WRAPPER_DECRYPT_PIPELINE_DEPTH,
+        ),
+    };
+    let keys = MuxKeys::Wrapper {
+        pool,
+        track_id,
+        audio: fairplay_key_audio,
+        video: fairplay_key_video,
+    };
+    py.detach(move || {
+        let audio_source =
+            InputSource::open(&input_audio_path, audio_buffer).map_err(py_io_error)?;
+        let video_source = input_video_path
+            .as_deref()
+            .map(|path| InputSource::open(path, video_buffer))
+            .transpose()
+            .map_err(py_io_error)?;
+        mux_inputs(
+            audio_source.input(),
+            video_source.as_ref().map(InputSource::input),
+            &keys,
             &output_path,
+            use_single_content_key,
             m4v_brand,
+            &ilst,
         )
-        .map_err(py_io_error)
     })
 }
 
+pub(crate) fn defragment_file(input_path: &str, output_path: &str, ilst: &[u8]) -> io::Result<()> {
+    let source = InputSource::open(input_path, None)?;
+    let audio = MuxTrack::clear(source.input(), *b"soun");
+    if audio.info.samples.is_empty() {
+        return Err(io::Error::new(
+            io::ErrorKind::InvalidData,
+            "defragment: input has no audio samples",
+        ));
+    }
+    write_media_native(&audio, None, &[], output_path, false, ilst)
+}
+
+#[pyfunction]
+#[pyo3(signature = (input_path, output_path, ilst=None))]
+pub fn defragment_native(
+    py: Python<'_>,
+    input_path: String,
+    output_path: String,
+    ilst: Option<Bound<'_, PyBytes>>,
+) -> PyResult<()> {
+    let ilst = ilst
+        .map(|value| value.as_bytes().to_vec())
+        .unwrap_or_default();
+    validate_ilst(&ilst).map_err(|err| py_value_error(err.to_string()))?;
+    py.detach(move || defragment_file(&input_path, &output_path, &ilst).map_err(py_io_error))
+}
+
 #[cfg(test)]
 mod tests {
     use super::*;
+    use crate::fixtures::{clear_segment_header, init_segment, media_segment, KEY};
+    use std::alloc::{GlobalAlloc, Layout, System};
+    use std::cell::Cell;
+    use std::io::Read;
 
     #[test]
     fn decrypts_cenc_sample() {
@@ -1604,14 +1879,13 @@ mod tests {
             composition_time_offset: 0,
             is_sync: true,
             size: 16,
-            data_path: None,
             data_offset: 0,
         };
         let enc = EncryptionInfo {
             scheme_type: "cenc".to_string(),
             ..Default::default()
         };
-        let plain = decrypt_sample_hex(&sample, Some(&key), &enc).unwrap();
+        let plain = decrypt_sample_hex(&sample, MediaInput::Memory(&[]), Some(&key), &enc).unwrap();
         assert_eq!(plain, hex_bytes("6bc1bee22e409f96e93d7e117393172a"));
     }
 
@@ -1630,14 +1904,13 @@ mod tests {
             composition_time_offset: 0,
             is_sync: true,
             size: 16,
-            data_path: None,
             data_offset: 0,
         };
         let enc = EncryptionInfo {
             scheme_type: "cbcs".to_string(),
             ..Default::default()
         };
-        let plain = decrypt_sample_hex(&sample, Some(&key), &enc).unwrap();
+        let plain = decrypt_sample_hex(&sample, MediaInput::Memory(&[]), Some(&key), &enc).unwrap();
         assert_eq!(plain, hex_bytes("6bc1bee22e409f96e93d7e117393172a"));
     }
 
@@ -1666,7 +1939,6 @@ mod tests {
             composition_time_offset: 0,
             is_sync: true,
             size: 41,
-            data_path: None,
             data_offset: 0,
         };
         let enc = EncryptionInfo {
@@ -1676,7 +1948,7 @@ mod tests {
             ..Default::default()
         };
 
-        let plain = decrypt_sample_hex(&sample, Some(&key), &enc).unwrap();
+        let plain = decrypt_sample_hex(&sample, MediaInput::Memory(&[]), Some(&key), &enc).unwrap();
 
         assert_eq!(
             plain,
@@ -1690,6 +1962,277 @@ mod tests {
         );
     }
 
+    #[test]
+    fn reads_samples_from_memory_input() {
+        let mut data = Vec::new();
+        for (typ, payload) in [
+            (b"ftyp", &b"M4A "[..]),
+            (b"moov", &b""[..]),
+            (b"mdat", &b"abcdef"[..]),
+        ] {
+            data.extend_from_slice(&(payload.len() as u32 + 8).to_be_bytes());
+            data.extend_from_slice(typ);
+            data.extend_from_slice(payload);
+        }
+        let boxes = scan_top_level_boxes(MediaInput::Memory(&data));
+        let types: Vec<[u8; 4]> = boxes.iter().map(|b| b.typ).collect();
+        assert_eq!(types, vec![*b"ftyp", *b"moov", *b"mdat"]);
+        assert_eq!(boxes[2].bytes(&data), &data[data.len() - 14..]);
+        let sample = Sample {
+            data: Vec::new(),
+            duration: 1,
+            desc_index: 0,
+            iv: Vec::new(),
+            subsamples: Vec::new(),
+            composition_time_offset: 0,
+            is_sync: true,
+            size: 3,
+            data_offset: boxes[2].offset + boxes[2].header_size + 2,
+        };
+        assert_eq!(
+            read_sample_data(&sample, MediaInput::Memory(&data)).unwrap(),
+            b"cde"
+        );
+        let truncated = &data[..data.len() - 2];
+        assert!(read_sample_data(&sample, MediaInput::Memory(truncated)).is_err());
+    }
+
+    #[test]
+    fn reads_samples_from_mapped_input() {
+        let mut data = Vec::new();
+        for (typ, payload) in [(b"ftyp", &b"M4A "[..]), (b"mdat", &b"abcdef"[..])] {
+            data.extend_from_slice(&(payload.len() as u32 + 8).to_be_bytes());
+            data.extend_from_slice(typ);
+            data.extend_from_slice(payload);
+        }
+        let mut file = tempfile::NamedTempFile::new().unwrap();
+        file.write_all(&data).unwrap();
+        let path = file.path().to_string_lossy().to_string();
+        let source = InputSource::open(&path, None).unwrap();
+        let input = source.input();
+        assert_eq!(input.path(), Some(path.as_str()));
+        let boxes = scan_top_level_boxes(input);
+        assert_eq!(boxes[0].bytes(input.bytes()), &data[..12]);
+        let sample = Sample {
+            data: Vec::new(),
+            duration: 1,
+            desc_index: 0,
+            iv: Vec::new(),
+            subsamples: Vec::new(),
+            composition_time_offset: 0,
+            is_sync: true,
+            size: 4,
+            data_offset: boxes[1].offset + boxes[1].header_size + 1,
+        };
+        assert_eq!(read_sample_data(&sample, input).unwrap(), b"bcde");
+    }
+
+    fn cenc_samples(count: usize, size: usize) -> Vec<Sample> {
+        (0..count)
+            .map(|index| Sample {
+                data: (0..size).map(|byte| (index + byte) as u8).collect(),
+                duration: 1024,
+                desc_index: 0,
+                iv: (index as u64).to_be_bytes().to_vec(),
+                subsamples: Vec::new(),
+                composition_time_offset: 0,
+                is_sync: true,
+                size,
+                data_offset: 0,
+            })
+            .collect()
+    }
+
+    fn decrypt_cenc_samples(samples: &[Sample], pool: Option<&ThreadPool>) -> Vec<u8> {
+        let key = [7u8; 16];
+        let enc = EncryptionInfo {
+            scheme_type: "cenc".to_string(),
+            ..EncryptionInfo::default()
+        };
+        let mut sink = Vec::new();
+        decrypt_samples(samples, pool, &mut sink, |sample| {
+            decrypt_sample_hex(sample, MediaInput::Memory(&[]), Some(&key), &enc)
+        })
+        .unwrap();
+        sink
+    }
+
+    #[test]
+    fn parallel_decrypt_preserves_sample_order() {
+        let pool = decrypt_pool(4).unwrap();
+        let samples = cenc_samples(1000, 61);
+        let parallel = decrypt_cenc_samples(&samples, pool.as_deref());
+        assert_eq!(parallel, decrypt_cenc_samples(&samples, None));
+        assert_eq!(parallel.len(), 1000 * 61);
+    }
+
+    #[test]
+    #[ignore = "benchmark; run with --release -- --ignored --nocapture"]
+    fn benchmarks_parallel_decrypt_scaling() {
+        let samples = cenc_samples(20_000, 16 * 1024);
+        let total_mib = (samples.len() * 16 * 1024) as f64 / (1024.0 * 1024.0);
+        for threads in [1, 2, 4, 8, 16] {
+            let pool = decrypt_pool(threads).unwrap();
+            let started = std::time::Instant::now();
+            decrypt_cenc_samples(&samples, pool.as_deref());
+            let elapsed = started.elapsed().as_secs_f64();
+            println!(
+                "{threads:>2} threads: {elapsed:.3}s {:.1} MiB/s",
+                total_mib / elapsed
+            );
+        }
+    }
+
+    // Tracks heap use per thread so a test can measure its own peak while
+    // other tests run concurrently.
+    struct CountingAllocator;
+
+    thread_local! {
+        static ALLOCATED: Cell<isize> = const { Cell::new(0) };
+        static PEAK: Cell<isize> = const { Cell::new(0) };
+    }
+
+    fn record_allocation(delta: isize) {
+        let _ = ALLOCATED.try_with(|allocated| {
+            let value = allocated.get() + delta;
+            allocated.set(value);
+            let _ = PEAK.try_with(|peak| peak.set(peak.get().max(value)));
+        });
+    }
+
+    unsafe impl GlobalAlloc for CountingAllocator {
+        unsafe fn alloc(&self, layout: Layout) -> *mut u8 {
+            let ptr = System.alloc(layout);
+            if !ptr.is_null() {
+                record_allocation(layout.size() as isize);
+            }
+            ptr
+        }
+
+        unsafe fn dealloc(&self, ptr: *mut u8, layout: Layout) {
+            System.dealloc(ptr, layout);
+            record_allocation(-(layout.size() as isize));
+        }
+
+        unsafe fn realloc(&self, ptr: *mut u8, layout: Layout, new_size: usize) -> *mut u8 {
+            let new_ptr = System.realloc(ptr, layout, new_size);
+            if !new_ptr.is_null() {
+                record_allocation(new_size as isize - layout.size() as isize);
+            }
+            new_ptr
+        }
+    }
+
+    #[global_allocator]
+    static ALLOCATOR: CountingAllocator = CountingAllocator;
+
+    fn peak_heap_during(f: impl FnOnce()) -> usize {
+        let base = ALLOCATED.with(Cell::get);
+        PEAK.with(|peak| peak.set(base));
+        f();
+        (PEAK.with(Cell::get) - base) as usize
+    }
+
+    fn fragmented_input(fragments: usize, sample_size: usize) -> (Vec<u8>, Vec<u8>) {
+        let mut input = init_segment();
+        let mut clear = Vec::new();
+        for fragment in 0..fragments {
+            let samples: Vec<Vec<u8>> = (0..4)
+                .map(|sample| vec![(fragment * 4 + sample) as u8; sample_size])
+                .collect();
+            input.extend_from_slice(&media_segment(fragment as u32 + 1, &samples));
+            clear.extend_from_slice(&samples.concat());
+        }
+        (input, clear)
+    }
+
+    fn mux_fragmented(input: &[u8], output_path: &str) {
+        let keys = FragmentKeys::Hex {
+            key: KEY,
+            pool: None,
+        };
+        let audio =
+            MuxTrack::encrypted(MediaInput::Memory(input), *b"soun", keys, false, true).unwrap();
+        write_media_native(&audio, None, &[], output_path, false, &[]).unwrap();
+    }
+
+    #[test]
+    fn muxes_fragments_straight_into_mdat() {
+        let (input, clear) = fragmented_input(3, 1000);
+        let mut file = tempfile::NamedTempFile::new().unwrap();
+        file.write_all(&input).unwrap();
+        let input_path = file.path().to_string_lossy().to_string();
+        let source = InputSource::open(&input_path, None).unwrap();
+        let keys = FragmentKeys::Hex {
+            key: KEY,
+            pool: None,
+        };
+        let audio = MuxTrack::encrypted(source.input(), *b"soun", keys, false, true).unwrap();
+        assert_eq!(audio.info.fragments.len(), 3);
+        assert!(audio.info.samples.iter().all(|sample| sample.iv.is_empty()));
+
+        let output = tempfile::NamedTempFile::new().unwrap();
+        let output_path = output.path().to_string_lossy().to_string();
+        write_media_native(&audio, None, &[], &output_path, false, &[]).unwrap();
+        let written = std::fs::read(&output_path).unwrap();
+        assert!(find_subslice(&written, b"stco").is_some());
+        assert!(find_subslice(&written, b"moof").is_none());
+        let mdat = find_subslice(&written, b"mdat").unwrap();
+        assert_eq!(&written[mdat + 4..], &clear[..]);
+    }
+
+    #[test]
+    fn decrypts_within_fixed_memory_budget() {
+        const BUDGET: usize = 2 * 1024 * 1024;
+        let output = tempfile::NamedTempFile::new().unwrap();
+        let output_path = output.path().to_string_lossy().to_string();
+        let mut peaks = Vec::new();
+        for fragments in [4, 32] {
+            let (input, clear) = fragmented_input(fragments, 24 * 1024);
+            peaks.push(peak_heap_during(|| mux_fragmented(&input, &output_path)));
+            assert!(std::fs::metadata(&output_path).unwrap().len() > clear.len() as u64);
+        }
+        // Eight times the media only adds sample table entries, and neither
+        // run holds more than one fragment and the write buffer in memory.
+        assert!(peaks[1] < BUDGET, "peak heap {} bytes", peaks[1]);
+        assert!(peaks[1] < peaks[0] + 64 * 1024, "peaks {peaks:?}");
+    }
+
+    #[test]
+    #[ignore = "writes a sparse input and a real output over 4 GiB; run with -- --ignored"]
+    fn defragments_input_over_4_gib_with_bounded_memory() {
+        let sample_sizes = vec![64 << 20; 65];
+        let payload_size: u64 = sample_sizes.iter().map(|&size| size as u64).sum();
+        assert!(payload_size > u32::MAX as u64);
+        let header = [init_segment(), clear_segment_header(1, &sample_sizes)].concat();
+        let mut input = tempfile::NamedTempFile::new().unwrap();
+        input.write_all(&header).unwrap();
+        input
+            .as_file()
+            .set_len(header.len() as u64 + payload_size)
+            .unwrap();
+        let input_path = input.path().to_string_lossy().to_string();
+        let output = tempfile::NamedTempFile::new().unwrap();
+        let output_path = output.path().to_string_lossy().to_string();
+
+        let peak = peak_heap_during(|| defragment_file(&input_path, &output_path, &[]).unwrap());
+        assert!(peak < 2 * 1024 * 1024, "peak heap {peak} bytes");
+
+        let mut head = vec![0u8; 64 * 1024];
+        let read = File::open(&output_path).unwrap().read(&mut head).unwrap();
+        head.truncate(read);
+        assert!(find_subslice(&head, b"stco").is_none());
+        let co64 = find_subslice(&head, b"co64").unwrap() - 4;
+        let data_offset = be_u64(&head, co64 + 16).unwrap();
+        let mdat = data_offset as usize - 16;
+        assert_eq!(&head[mdat..mdat + 8], b"\0\0\0\x01mdat");
+        assert_eq!(be_u64(&head, mdat + 8), Some(payload_size + 16));
+        assert_eq!(
+            std::fs::metadata(&output_path).unwrap().len(),
+            data_offset + payload_size
+        );
+    }
+
     fn hex_bytes(value: &str) -> Vec<u8> {
         let compact: String = value.chars().filter(|c| !c.is_whitespace()).collect();
         (0..compact.len())
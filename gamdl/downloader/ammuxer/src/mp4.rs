@@ -2,6 +2,8 @@ use std::fs::File;
 use std::io::{self, Read, Seek, SeekFrom, Write};
 use std::path::Path;
 
+const KERNEL_COPY_CHUNK_SIZE: u64 = 1 << 30;
+
 #[derive(Clone, Debug)]
 pub struct SampleInfo {
     pub size: u64,
@@ -604,7 +606,63 @@ pub fn patch_first_chunk_offset(trak: &[u8], chunk_offset: u64) -> io::Result<Ve
     ))
 }
 
-fn build_udta() -> io::Result<Vec<u8>> {
+/// Rewrites every `stco` under `container` as `co64` so chunk offsets can
+/// point past 4 GiB, fixing up the enclosing box sizes.
+pub fn widen_chunk_offsets(container: &[u8]) -> io::Result<Vec<u8>> {
+    let mut payload = Vec::with_capacity(container.len() + 64);
+    let mut offset = 8usize;
+    while let Some((typ, box_offset, size, _)) = next_box(container, offset, container.len()) {
+        let data = &container[box_offset..box_offset + size];
+        match &typ {
+            b"trak" | b"mdia" | b"minf" | b"stbl" => {
+                payload.extend_from_slice(&widen_chunk_offsets(data)?)
+            }
+            b"stco" if data.len() >= 16 => {
+                let entry_count = be_u32(data, 12).unwrap_or(0);
+                let mut co64 = Vec::with_capacity(4 + entry_count as usize * 8);
+                put_u32(&mut co64, entry_count);
+                for index in 0..entry_count as usize {
+                    let chunk_offset = be_u32(data, 16 + index * 4).unwrap_or(0) as u64;
+                    co64.extend_from_slice(&chunk_offset.to_be_bytes());
+                }
+                push_full_box(&mut payload, b"co64", 0, 0, &co64)?;
+            }
+            _ => payload.extend_from_slice(data),
+        }
+        offset = box_offset + size;
+    }
+    wrap_box(&fourcc(&container[4..8]), payload)
+}
+
+/// Size of the `mdat` header for `payload_size` bytes: a 64-bit largesize
+/// header once the box no longer fits a 32-bit size.
+pub fn mdat_header_size(payload_size: u64) -> u64 {
+    if payload_size + 8 > u32::MAX as u64 {
+        16
+    } else {
+        8
+    }
+}
+
+fn needs_co64(header_size: u64, payload_size: u64) -> bool {
+    header_size + mdat_header_size(payload_size) + payload_size > u32::MAX as u64
+}
+
+pub fn validate_ilst(ilst: &[u8]) -> io::Result<()> {
+    let mut offset = 0usize;
+    while offset < ilst.len() {
+        let Some((_, _, size, _)) = next_box(ilst, offset, ilst.len()) else {
+            return Err(io::Error::new(
+                io::ErrorKind::InvalidData,
+                "mux: malformed ilst payload",
+            ));
+        };
+        offset += size;
+    }
+    Ok(())
+}
+
+fn build_udta(ilst: &[u8]) -> io::Result<Vec<u8>> {
     let mut meta = Vec::new();
     put_u32(&mut meta, 0);
     let mut hdlr = Vec::new();
@@ -615,7 +673,7 @@ fn build_udta() -> io::Result<Vec<u8>> {
     put_u32(&mut hdlr, 0);
     hdlr.push(0);
     push_full_box(&mut meta, b"hdlr", 0, 0, &hdlr)?;
-    push_box(&mut meta, b"ilst", b"")?;
+    push_box(&mut meta, b"ilst", ilst)?;
     wrap_box(b"udta", wrap_box(b"meta", meta)?)
 }
 
@@ -816,6 +874,7 @@ fn build_moov_internal(
     track: &TrackInfo,
     orig_data: Option<&[u8]>,
     stsd_content: Option<Vec<u8>>,
+    ilst: &[u8],
 ) -> io::Result<Vec<u8>> {
     let samples = &track.samples;
     let total_duration: u64 = samples.iter().map(|sample| sample.duration as u64).sum();
@@ -949,20 +1008,28 @@ fn build_moov_internal(
     mdia.extend_from_slice(&wrap_box(b"minf", minf)?);
     trak.extend_from_slice(&wrap_box(b"mdia", mdia)?);
     moov.extend_from_slice(&wrap_box(b"trak", trak)?);
-    moov.extend_from_slice(&build_udta()?);
+    moov.extend_from_slice(&build_udta(ilst)?);
     wrap_box(b"moov", moov)
 }
 
 pub fn build_decrypted_track_moov(
     track: &TrackInfo,
     original_path: Option<&str>,
+) -> io::Result<Vec<u8>> {
+    build_tagged_track_moov(track, original_path, &[])
+}
+
+fn build_tagged_track_moov(
+    track: &TrackInfo,
+    original_path: Option<&str>,
+    ilst: &[u8],
 ) -> io::Result<Vec<u8>> {
     let orig_data = load_orig_data(track, original_path)?;
     let preferred_desc_index = preferred_sample_description_index(&track.samples);
     let stsd = orig_data.as_deref().and_then(|data| {
         extract_stsd_content(data, Some(preferred_desc_index), &track.handler_type)
     });
-    build_moov_internal(track, orig_data.as_deref(), stsd)
+    build_moov_internal(track, orig_data.as_deref(), stsd, ilst)
 }
 
 fn load_orig_data(track: &TrackInfo, original_path: Option<&str>) -> io::Result<Option<Vec<u8>>> {
@@ -1002,33 +1069,82 @@ pub fn ftyp_m4v() -> io::Result<Vec<u8>> {
     wrap_box(b"ftyp", content)
 }
 
-pub fn build_muxed_moov(mvhd: &[u8], traks: &[Vec<u8>]) -> io::Result<Vec<u8>> {
+/// Builds the `moov` for `traks` whose payloads follow `ftyp_size` bytes of
+/// `ftyp` and the `moov` itself in a single `mdat`, in the same order.
+/// Chunk offsets switch to `co64` when the file outgrows 32-bit offsets.
+pub fn build_muxed_moov_for_payloads(
+    mvhd: &[u8],
+    traks: &[Vec<u8>],
+    payload_sizes: &[u64],
+    ftyp_size: u64,
+    ilst: &[u8],
+) -> io::Result<Vec<u8>> {
+    let payload_size: u64 = payload_sizes.iter().sum();
+    let moov_probe = build_muxed_moov(mvhd, traks, ilst)?;
+    let (traks, moov_probe) = if needs_co64(ftyp_size + moov_probe.len() as u64, payload_size) {
+        let traks = traks
+            .iter()
+            .map(|trak| widen_chunk_offsets(trak))
+            .collect::<io::Result<Vec<_>>>()?;
+        let moov_probe = build_muxed_moov(mvhd, &traks, ilst)?;
+        (traks, moov_probe)
+    } else {
+        (traks.to_vec(), moov_probe)
+    };
+    let mut mdat_offset = ftyp_size + moov_probe.len() as u64 + mdat_header_size(payload_size);
+    let mut patched_traks = Vec::with_capacity(traks.len());
+    for (trak, size) in traks.iter().zip(payload_sizes) {
+        patched_traks.push(patch_first_chunk_offset(trak, mdat_offset)?);
+        mdat_offset += size;
+    }
+    build_muxed_moov(mvhd, &patched_traks, ilst)
+}
+
+pub fn build_muxed_moov(mvhd: &[u8], traks: &[Vec<u8>], ilst: &[u8]) -> io::Result<Vec<u8>> {
     let mut payload = Vec::new();
     payload.extend_from_slice(&patch_mvhd_next_track_id(mvhd, traks.len() as u32 + 1));
     for trak in traks {
         payload.extend_from_slice(trak);
     }
-    payload.extend_from_slice(&build_udta()?);
+    payload.extend_from_slice(&build_udta(ilst)?);
     wrap_box(b"moov", payload)
 }
 
-pub fn write_track_file(
-    output_path: &str,
+/// Builds the `ftyp` and `moov` of a single-track file whose `mdat` of
+/// `payload_size` bytes follows immediately.
+pub fn build_track_file_header(
     track: &TrackInfo,
     original_path: Option<&str>,
-    payload: &PayloadSource,
-) -> io::Result<()> {
-    let ftyp = if &track.handler_type == b"soun" {
+    payload_size: u64,
+    ilst: &[u8],
+) -> io::Result<Vec<u8>> {
+    let mut header = if &track.handler_type == b"soun" {
         ftyp_m4a()?
     } else {
         ftyp_mp4()?
     };
-    let mut moov = build_decrypted_track_moov(track, original_path)?;
-    let mdat_data_offset = ftyp.len() as u64 + moov.len() as u64 + 8;
-    moov = patch_moov_first_trak_chunk_offset(&moov, mdat_data_offset)?;
+    let mut moov = build_tagged_track_moov(track, original_path, ilst)?;
+    if needs_co64(header.len() as u64 + moov.len() as u64, payload_size) {
+        moov = widen_chunk_offsets(&moov)?;
+    }
+    let mdat_data_offset = header.len() as u64 + moov.len() as u64 + mdat_header_size(payload_size);
+    header.extend_from_slice(&patch_moov_first_trak_chunk_offset(
+        &moov,
+        mdat_data_offset,
+    )?);
+    Ok(header)
+}
+
+pub fn write_track_file(
+    output_path: &str,
+    track: &TrackInfo,
+    original_path: Option<&str>,
+    payload: &PayloadSource,
+    ilst: &[u8],
+) -> io::Result<()> {
+    let header = build_track_file_header(track, original_path, payload.len(), ilst)?;
     let mut file = File::create(output_path)?;
-    file.write_all(&ftyp)?;
-    file.write_all(&moov)?;
+    file.write_all(&header)?;
     write_mdat_from_sources(&mut file, &[payload.clone()])
 }
 
@@ -1037,8 +1153,9 @@ pub fn write_m4a_file(
     track: &TrackInfo,
     original_path: Option<&str>,
     payload: &PayloadSource,
+    ilst: &[u8],
 ) -> io::Result<()> {
-    write_track_file(output_path, track, original_path, payload)
+    write_track_file(output_path, track, original_path, payload, ilst)
 }
 
 fn patch_moov_first_trak_chunk_offset(moov: &[u8], offset: u64) -> io::Result<Vec<u8>> {
@@ -1074,23 +1191,94 @@ fn replace_first_child_box(
     ))
 }
 
-pub fn write_mdat_from_sources<W: Write>(out: &mut W, sources: &[PayloadSource]) -> io::Result<()> {
-    let payload_size = sources.iter().try_fold(0u64, |acc, source| {
-        acc.checked_add(source.len()).ok_or_else(|| {
-            io::Error::new(
-                io::ErrorKind::InvalidData,
-                "mux: mdat too large for 32-bit box size",
-            )
-        })
-    })?;
-    if payload_size + 8 > u32::MAX as u64 {
+fn rebuild_clear_container(container: &[u8]) -> io::Result<Vec<u8>> {
+    let mut payload = Vec::with_capacity(container.len());
+    let mut offset = 8usize;
+    while let Some((typ, box_offset, size, _)) = next_box(container, offset, container.len()) {
+        let data = &container[box_offset..box_offset + size];
+        match &typ {
+            b"trak" | b"mdia" | b"minf" | b"stbl" => {
+                payload.extend_from_slice(&rebuild_clear_container(data)?)
+            }
+            b"stsd" if data.len() >= 16 => {
+                push_box(&mut payload, b"stsd", &clean_stsd_content(&data[8..], None))?
+            }
+            b"pssh" | b"udta" | b"sbgp" | b"sgpd" => {}
+            _ => payload.extend_from_slice(data),
+        }
+        offset = box_offset + size;
+    }
+    wrap_box(&fourcc(&container[4..8]), payload)
+}
+
+/// Builds the init `moov` for clear fragmented output: sample entries lose
+/// their protection info and the movie gets `ilst` as its only metadata.
+pub fn build_clear_fragmented_moov(moov: &[u8], ilst: &[u8]) -> io::Result<Vec<u8>> {
+    let cleaned = rebuild_clear_container(moov)?;
+    let mut payload = cleaned[8..].to_vec();
+    payload.extend_from_slice(&build_udta(ilst)?);
+    wrap_box(b"moov", payload)
+}
+
+/// Turns the encryption boxes of a `moof` into `free` boxes of the same size,
+/// so sample data offsets stay valid once the fragment is decrypted.
+pub fn clear_fragment_encryption_boxes(moof: &mut [u8]) {
+    let mut offset = 8usize;
+    while let Some((typ, box_offset, size, _)) = next_box(moof, offset, moof.len()) {
+        if &typ == b"pssh" {
+            moof[box_offset + 4..box_offset + 8].copy_from_slice(b"free");
+        } else if &typ == b"traf" {
+            let mut inner = box_offset + 8;
+            let traf_end = box_offset + size;
+            while let Some((inner_type, inner_offset, inner_size, _)) =
+                next_box(moof, inner, traf_end)
+            {
+                if matches!(&inner_type, b"senc" | b"saiz" | b"saio" | b"sbgp" | b"sgpd") {
+                    moof[inner_offset + 4..inner_offset + 8].copy_from_slice(b"free");
+                }
+                inner = inner_offset + inner_size;
+            }
+        }
+        offset = box_offset + size;
+    }
+}
+
+fn mdat_header(payload_size: u64) -> Vec<u8> {
+    let header_size = mdat_header_size(payload_size);
+    let mut header = Vec::with_capacity(header_size as usize);
+    if header_size == 16 {
+        put_u32(&mut header, 1);
+        header.extend_from_slice(b"mdat");
+        header.extend_from_slice(&(payload_size + 16).to_be_bytes());
+    } else {
+        put_u32(&mut header, (payload_size + 8) as u32);
+        header.extend_from_slice(b"mdat");
+    }
+    header
+}
+
+/// Writes an `mdat` header for `payload_size` bytes at the current position
+/// and reserves space for the payload that follows.
+pub fn write_mdat_header(out: &mut File, payload_size: u64) -> io::Result<()> {
+    if payload_size > u64::MAX - 16 {
         return Err(io::Error::new(
             io::ErrorKind::InvalidData,
-            "mux: mdat too large for 32-bit box size",
+            "mux: mdat payload too large",
         ));
     }
-    out.write_all(&((payload_size + 8) as u32).to_be_bytes())?;
-    out.write_all(b"mdat")?;
+    let header = mdat_header(payload_size);
+    let mdat_offset = out.stream_position()?;
+    preallocate(out, mdat_offset + header.len() as u64 + payload_size);
+    out.write_all(&header)
+}
+
+pub fn write_mdat_from_sources(out: &mut File, sources: &[PayloadSource]) -> io::Result<()> {
+    let payload_size = sources.iter().try_fold(0u64, |acc, source| {
+        acc.checked_add(source.len()).ok_or_else(|| {
+            io::Error::new(io::ErrorKind::InvalidData, "mux: mdat payload too large")
+        })
+    })?;
+    write_mdat_header(out, payload_size)?;
     for source in sources {
         match source {
             PayloadSource::Memory(data) => out.write_all(data)?,
@@ -1102,11 +1290,81 @@ pub fn write_mdat_from_sources<W: Write>(out: &mut W, sources: &[PayloadSource])
     Ok(())
 }
 
-fn copy_file_range<W: Write>(out: &mut W, path: &str, offset: u64, size: u64) -> io::Result<()> {
+#[cfg(target_os = "linux")]
+fn preallocate(out: &File, len: u64) {
+    use std::os::fd::AsRawFd;
+
+    // Best effort: filesystems without fallocate support just grow as written.
+    unsafe {
+        libc::fallocate(
+            out.as_raw_fd(),
+            libc::FALLOC_FL_KEEP_SIZE,
+            0,
+            len as libc::off_t,
+        );
+    }
+}
+
+#[cfg(not(target_os = "linux"))]
+fn preallocate(_out: &File, _len: u64) {}
+
+#[cfg(target_os = "linux")]
+fn kernel_copy(out: &File, input: &File, offset: u64, size: u64) -> io::Result<u64> {
+    use std::os::fd::AsRawFd;
+
+    let mut copied = 0u64;
+    let mut use_sendfile = false;
+    while copied < size {
+        let chunk = (size - copied).min(KERNEL_COPY_CHUNK_SIZE) as usize;
+        let mut input_offset = (offset + copied) as libc::off_t;
+        let n = unsafe {
+            if use_sendfile {
+                libc::sendfile(out.as_raw_fd(), input.as_raw_fd(), &mut input_offset, chunk)
+            } else {
+                libc::copy_file_range(
+                    input.as_raw_fd(),
+                    &mut input_offset,
+                    out.as_raw_fd(),
+                    std::ptr::null_mut(),
+                    chunk,
+                    0,
+                )
+            }
+        };
+        if n > 0 {
+            copied += n as u64;
+            continue;
+        }
+        if n == 0 {
+            break;
+        }
+        let err = io::Error::last_os_error();
+        match err.raw_os_error() {
+            Some(libc::EINTR) => continue,
+            Some(libc::ENOSYS | libc::EXDEV | libc::EINVAL | libc::EOPNOTSUPP | libc::EPERM)
+                if !use_sendfile =>
+            {
+                use_sendfile = true;
+            }
+            Some(libc::ENOSYS | libc::EINVAL | libc::EOPNOTSUPP) => break,
+            _ => return Err(err),
+        }
+    }
+    Ok(copied)
+}
+
+#[cfg(not(target_os = "linux"))]
+fn kernel_copy(_out: &File, _input: &File, _offset: u64, _size: u64) -> io::Result<u64> {
+    Ok(0)
+}
+
+fn copy_file_range(out: &mut File, path: &str, offset: u64, size: u64) -> io::Result<()> {
     let mut input = File::open(Path::new(path))?;
-    input.seek(SeekFrom::Start(offset))?;
-    let mut remaining = size;
-    let mut buf = vec![0u8; 1024 * 1024];
+    let copied = kernel_copy(out, &input, offset, size)?;
+    // Whatever the kernel could not copy goes through the buffered loop.
+    input.seek(SeekFrom::Start(offset + copied))?;
+    let mut remaining = size - copied;
+    let mut buf = vec![0u8; remaining.min(1024 * 1024) as usize];
     while remaining > 0 {
         let to_read = remaining.min(buf.len() as u64) as usize;
         let n = input.read(&mut buf[..to_read])?;
@@ -1142,6 +1400,60 @@ mod tests {
         );
     }
 
+    fn single_track(sample_count: usize) -> TrackInfo {
+        TrackInfo {
+            samples: (0..sample_count)
+                .map(|_| SampleInfo {
+                    size: 1024,
+                    duration: 1024,
+                    desc_index: 0,
+                    composition_time_offset: 0,
+                    is_sync: true,
+                })
+                .collect(),
+            moov_data: Vec::new(),
+            ftyp_data: Vec::new(),
+            handler_type: *b"soun",
+        }
+    }
+
+    #[test]
+    fn widens_chunk_offsets_to_co64() {
+        let stco = simple_box(b"stco", b"\0\0\0\0\0\0\0\x02\0\0\0\x10\xff\xff\xff\xff");
+        let trak = simple_box(b"trak", &simple_box(b"stbl", &stco));
+        let widened = widen_chunk_offsets(&trak).unwrap();
+        assert_eq!(be_u32(&widened, 0), Some(widened.len() as u32));
+        assert!(find_box_offset_recursive(&widened, b"stco").is_none());
+        let co64 = find_box_offset_recursive(&widened, b"co64").unwrap();
+        assert_eq!(be_u32(&widened, co64 + 12), Some(2));
+        assert_eq!(be_u64(&widened, co64 + 16), Some(0x10));
+        assert_eq!(be_u64(&widened, co64 + 24), Some(0xffff_ffff));
+    }
+
+    #[test]
+    fn writes_largesize_mdat_header() {
+        assert_eq!(mdat_header(4), b"\0\0\0\x0cmdat");
+        let payload_size = 5u64 << 30;
+        let header = mdat_header(payload_size);
+        assert_eq!(&header[..8], b"\0\0\0\x01mdat");
+        assert_eq!(be_u64(&header, 8), Some(payload_size + 16));
+        assert_eq!(mdat_header_size(u32::MAX as u64 - 8), 8);
+        assert_eq!(mdat_header_size(u32::MAX as u64 - 7), 16);
+    }
+
+    #[test]
+    fn switches_to_co64_past_4_gib() {
+        let track = single_track(3);
+        let small = build_track_file_header(&track, None, 3 * 1024, &[]).unwrap();
+        let stco = find_box_offset_recursive(&small, b"stco").unwrap();
+        assert_eq!(be_u32(&small, stco + 16), Some(small.len() as u32 + 8));
+
+        let large = build_track_file_header(&track, None, 5 << 30, &[]).unwrap();
+        assert!(find_box_offset_recursive(&large, b"stco").is_none());
+        let co64 = find_box_offset_recursive(&large, b"co64").unwrap();
+        assert_eq!(be_u64(&large, co64 + 16), Some(large.len() as u64 + 16));
+    }
+
     #[test]
     fn finds_recursive_box_offset() {
         let stco = simple_box(b"stco", b"\0\0\0\0\0\0\0\x01\0\0\0\0");
@@ -1174,4 +1486,63 @@ mod tests {
         assert_eq!(&cleaned[4..8], b"alac");
         assert!(find_subslice(&cleaned, b"sinf").is_none());
     }
+
+    #[test]
+    fn embeds_ilst_payload_in_udta() {
+        let mut data = Vec::new();
+        push_full_box(&mut data, b"data", 0, 1, b"Title").unwrap();
+        let ilst = simple_box(b"\xa9nam", &data);
+        validate_ilst(&ilst).unwrap();
+        let udta = build_udta(&ilst).unwrap();
+        let ilst_offset = find_subslice(&udta, b"ilst").unwrap() - 4;
+        assert_eq!(be_u32(&udta, ilst_offset), Some(ilst.len() as u32 + 8));
+        assert_eq!(&udta[ilst_offset + 8..], &ilst[..]);
+    }
+
+    #[test]
+    fn rejects_truncated_ilst_payload() {
+        let ilst = simple_box(b"cpil", b"\0\0\0\x11data\0\0\0\x15\0\0\0\0\x01");
+        assert!(validate_ilst(&ilst[..ilst.len() - 1]).is_err());
+    }
+
+    #[test]
+    fn writes_mdat_from_file_and_memory_sources() {
+        let mut input = tempfile::NamedTempFile::new().unwrap();
+        let payload: Vec<u8> = (0..3 * 1024 * 1024).map(|i| (i % 251) as u8).collect();
+        input.write_all(&payload).unwrap();
+        let mut output = tempfile::tempfile().unwrap();
+        output.write_all(b"head").unwrap();
+        let sources = [
+            PayloadSource::File {
+                path: input.path().to_string_lossy().to_string(),
+                offset: 7,
+                size: payload.len() as u64 - 7,
+            },
+            PayloadSource::Memory(b"tail".to_vec()),
+        ];
+        write_mdat_from_sources(&mut output, &sources).unwrap();
+
+        let mut written = Vec::new();
+        output.seek(SeekFrom::Start(0)).unwrap();
+        output.read_to_end(&mut written).unwrap();
+        assert_eq!(&written[..4], b"head");
+        assert_eq!(be_u32(&written, 4), Some(payload.len() as u32 - 7 + 4 + 8));
+        assert_eq!(&written[8..12], b"mdat");
+        assert_eq!(&written[12..written.len() - 4], &payload[7..]);
+        assert_eq!(&written[written.len() - 4..], b"tail");
+    }
+
+    #[test]
+    fn rejects_truncated_file_source() {
+        let mut input = tempfile::NamedTempFile::new().unwrap();
+        input.write_all(b"short").unwrap();
+        let mut output = tempfile::tempfile().unwrap();
+        let sources = [PayloadSource::File {
+            path: input.path().to_string_lossy().to_string(),
+            offset: 0,
+            size: 64,
+        }];
+        let err = write_mdat_from_sources(&mut output, &sources).unwrap_err();
+        assert_eq!(err.kind(), io::ErrorKind::UnexpectedEof);
+    }
 }
@@ -1,9 +1,8 @@
 use crate::mp4::{
-    build_decrypted_track_moov, build_muxed_moov, extract_mdat_payload, extract_mvhd_timescale,
-    extract_top_level_box, find_child_box, find_track_by_handler, ftyp_m4v, ftyp_mp4,
-    patch_first_chunk_offset, patch_trak_duration_to_movie_timescale, patch_trak_track_id,
-    write_m4a_file, write_mdat_from_sources, write_track_file, PayloadSource, SampleInfo,
-    TrackInfo,
+    build_decrypted_track_moov, build_muxed_moov_for_payloads, extract_mdat_payload,
+    extract_mvhd_timescale, extract_top_level_box, find_child_box, find_track_by_handler, ftyp_m4v,
+    ftyp_mp4, patch_trak_duration_to_movie_timescale, patch_trak_track_id, write_m4a_file,
+    write_mdat_from_sources, write_track_file, PayloadSource, SampleInfo, TrackInfo,
 };
 use pyo3::exceptions::{PyIOError, PyValueError};
 use pyo3::prelude::*;
@@ -122,8 +121,14 @@ pub fn write_decrypted_m4a_native(
     let payload =
         payload_source_from_parts(decrypted_data.as_bytes().to_vec(), decrypted_data_path, 0)?;
     py.detach(move || {
-        write_m4a_file(&output_path, &track, original_path.as_deref(), &payload)
-            .map_err(py_io_error)
+        write_m4a_file(
+            &output_path,
+            &track,
+            original_path.as_deref(),
+            &payload,
+            &[],
+        )
+        .map_err(py_io_error)
     })
 }
 
@@ -141,8 +146,14 @@ pub fn write_decrypted_mp4_track_native(
     let payload =
         payload_source_from_parts(decrypted_data.as_bytes().to_vec(), decrypted_data_path, 0)?;
     py.detach(move || {
-        write_track_file(&output_path, &track, original_path.as_deref(), &payload)
-            .map_err(py_io_error)
+        write_track_file(
+            &output_path,
+            &track,
+            original_path.as_deref(),
+            &payload,
+            &[],
+        )
+        .map_err(py_io_error)
     })
 }
 
@@ -217,21 +228,11 @@ pub fn mux_decrypted_media_direct_native(
         traks.push(video_trak);
         traks.push(audio_trak);
         traks.extend(patched_extra_traks);
-        let moov_probe = build_muxed_moov(&mvhd, &traks)?;
-        let mut mdat_offset = ftyp.len() as u64 + moov_probe.len() as u64 + 8;
-        let mut patched_traks = Vec::new();
-        patched_traks.push(patch_first_chunk_offset(&traks[0], mdat_offset)?);
-        mdat_offset += video_source.len();
-        patched_traks.push(patch_first_chunk_offset(&traks[1], mdat_offset)?);
-        mdat_offset += audio_source.len();
-        for (trak, source) in traks.iter().skip(2).zip(extra_sources.iter()) {
-            patched_traks.push(patch_first_chunk_offset(trak, mdat_offset)?);
-            mdat_offset += source.len();
-        }
-        let moov = build_muxed_moov(&mvhd, &patched_traks)?;
-
         let mut sources = vec![video_source, audio_source];
         sources.extend(extra_sources);
+        let payload_sizes: Vec<u64> = sources.iter().map(PayloadSource::len).collect();
+        let moov =
+            build_muxed_moov_for_payloads(&mvhd, &traks, &payload_sizes, ftyp.len() as u64, &[])?;
         let mut file = File::create(&output_path)?;
         file.write_all(&ftyp)?;
         file.write_all(&moov)?;
@@ -311,14 +312,12 @@ pub fn mux_decrypted_mp4_tracks_native(
         }
 
         let ftyp = if m4v_brand { ftyp_m4v()? } else { ftyp_mp4()? };
-        let moov_probe = build_muxed_moov(&mvhd, &traks)?;
-        let mut mdat_offset = ftyp.len() as u64 + moov_probe.len() as u64 + 8;
-        let mut patched_traks = Vec::new();
-        for (trak, payload) in traks.iter().zip(payloads.iter()) {
-            patched_traks.push(patch_first_chunk_offset(trak, mdat_offset)?);
-            mdat_offset += payload.len() as u64;
-        }
-        let moov = build_muxed_moov(&mvhd, &patched_traks)?;
+        let payload_sizes: Vec<u64> = payloads
+            .iter()
+            .map(|payload| payload.len() as u64)
+            .collect();
+        let moov =
+            build_muxed_moov_for_payloads(&mvhd, &traks, &payload_sizes, ftyp.len() as u64, &[])?;
         let sources: Vec<PayloadSource> = payloads.into_iter().map(PayloadSource::Memory).collect();
 
         let mut file = File::create(&output_path)?;
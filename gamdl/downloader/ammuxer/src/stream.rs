@@ -0,0 +1,332 @@
+use crate::decrypt::WrapperDecryptSession;
+use crate::media::{FragmentDecryptor, FragmentKeys};
+use crate::mp4::{build_clear_fragmented_moov, clear_fragment_encryption_boxes, validate_ilst};
+use pyo3::exceptions::{PyIOError, PyValueError};
+use pyo3::prelude::*;
+use pyo3::types::PyBytes;
+use std::fs::File;
+use std::io::{self, BufWriter, Write};
+
+const STREAM_WRITE_BUFFER_SIZE: usize = 1024 * 1024;
+
+fn py_io_error(err: io::Error) -> PyErr {
+    PyIOError::new_err(err.to_string())
+}
+
+fn py_value_error(message: impl Into<String>) -> PyErr {
+    PyValueError::new_err(message.into())
+}
+
+fn invalid_data(message: &str) -> io::Error {
+    io::Error::new(io::ErrorKind::InvalidData, message.to_string())
+}
+
+/// Returns the size of the complete top-level box at the start of `data`, or
+/// `None` while more bytes are needed.
+fn complete_box_size(data: &[u8]) -> io::Result<Option<usize>> {
+    if data.len() < 8 {
+        return Ok(None);
+    }
+    let (size, header_size) = match u32::from_be_bytes([data[0], data[1], data[2], data[3]]) {
+        0 => return Err(invalid_data("stream: open-ended boxes are not supported")),
+        1 => {
+            if data.len() < 16 {
+                return Ok(None);
+            }
+            let mut largesize = [0u8; 8];
+            largesize.copy_from_slice(&data[8..16]);
+            let size = usize::try_from(u64::from_be_bytes(largesize))
+                .map_err(|_| invalid_data("stream: box too large"))?;
+            (size, 16)
+        }
+        size => (size as usize, 8),
+    };
+    if size < header_size {
+        return Err(invalid_data("stream: malformed box header"));
+    }
+    Ok((data.len() >= size).then_some(size))
+}
+
+/// Decrypts an encrypted fragmented MP4 as it is downloaded and appends each
+/// clear fragment to `output_path`.
+#[pyclass]
+pub struct FragmentedMuxer {
+    output: Option<BufWriter<File>>,
+    handler_type: [u8; 4],
+    keys: Option<FragmentKeys>,
+    use_cenc: bool,
+    use_single_content_key: bool,
+    ilst: Vec<u8>,
+    decryptor: Option<FragmentDecryptor>,
+    ftyp: Option<Vec<u8>>,
+    moof: Option<(u64, Vec<u8>)>,
+    pending: Vec<u8>,
+    stream_offset: u64,
+}
+
+impl FragmentedMuxer {
+    fn open(
+        output_path: &str,
+        keys: FragmentKeys,
+        use_cenc: bool,
+        use_single_content_key: bool,
+        ilst: Vec<u8>,
+    ) -> io::Result<Self> {
+        let output = File::create(output_path)?;
+        Ok(Self {
+            output: Some(BufWriter::with_capacity(STREAM_WRITE_BUFFER_SIZE, output)),
+            handler_type: *b"soun",
+            keys: Some(keys),
+            use_cenc,
+            use_single_content_key,
+            ilst,
+            decryptor: None,
+            ftyp: None,
+            moof: None,
+            pending: Vec::new(),
+            stream_offset: 0,
+        })
+    }
+
+    fn write(&mut self, data: &[u8]) -> io::Result<()> {
+        self.output
+            .as_mut()
+            .ok_or_else(|| invalid_data("stream: muxer is already finished"))?
+            .write_all(data)
+    }
+
+    fn process_box(&mut self, offset: u64, mut data: Vec<u8>) -> io::Result<()> {
+        match &data[4..8] {
+            b"ftyp" => self.ftyp = Some(data),
+            b"moov" => {
+                let keys = self
+                    .keys
+                    .take()
+                    .ok_or_else(|| invalid_data("stream: duplicate init segment"))?;
+                self.decryptor = Some(FragmentDecryptor::new(
+                    &data,
+                    self.handler_type,
+                    keys,
+                    self.use_cenc,
+                    self.use_single_content_key,
+                )?);
+                if let Some(ftyp) = self.ftyp.take() {
+                    self.write(&ftyp)?;
+                }
+                let moov = build_clear_fragmented_moov(&data, &self.ilst)?;
+                self.write(&moov)?;
+            }
+            b"moof" => {
+                if self.decryptor.is_none() {
+                    return Err(invalid_data("stream: fragment before init segment"));
+                }
+                if self.moof.replace((offset, data)).is_some() {
+                    return Err(invalid_data("stream: moof without mdat"));
+                }
+            }
+            b"mdat" => {
+                let Some((fragment_offset, mut fragment)) = self.moof.take() else {
+                    return self.write(&data);
+                };
+                let moof_size = fragment.len();
+                fragment.append(&mut data);
+                self.decryptor
+                    .as_ref()
+                    .expect("moof is only accepted after the init segment")
+                    .decrypt_fragment(&mut fragment, fragment_offset, moof_size)?;
+                clear_fragment_encryption_boxes(&mut fragment[..moof_size]);
+                self.write(&fragment)?;
+            }
+            _ => self.write(&data)?,
+        }
+        Ok(())
+    }
+
+    fn process_pending(&mut self) -> io::Result<()> {
+        let mut offset = 0usize;
+        while let Some(size) = complete_box_size(&self.pending[offset..])? {
+            let data = self.pending[offset..offset + size].to_vec();
+            self.process_box(self.stream_offset + offset as u64, data)?;
+            offset += size;
+        }
+        self.pending.drain(..offset);
+        self.stream_offset += offset as u64;
+        Ok(())
+    }
+
+    fn finish_output(&mut self) -> io::Result<()> {
+        self.process_pending()?;
+        if !self.pending.is_empty() {
+            return Err(invalid_data("stream: truncated box at end of input"));
+        }
+        if self.moof.is_some() {
+            return Err(invalid_data("stream: moof without mdat"));
+        }
+        if self.decryptor.is_none() {
+            return Err(invalid_data("stream: missing init segment"));
+        }
+        if let Some(output) = self.output.take() {
+            output
+                .into_inner()
+                .map_err(|err| err.into_error())?
+                .sync_all()?;
+        }
+        Ok(())
+    }
+}
+
+#[pymethods]
+impl FragmentedMuxer {
+    #[new]
+    #[pyo3(signature = (output_path, decryption_key=None, decrypt_session=None, track_id=None, fairplay_key=None, use_cenc=false, use_single_content_key=false, ilst=None, decrypt_threads=0))]
+    fn new(
+        output_path: String,
+        decryption_key: Option<String>,
+        decrypt_session: Option<Bound<'_, WrapperDecryptSession>>,
+        track_id: Option<String>,
+        fairplay_key: Option<String>,
+        use_cenc: bool,
+        use_single_content_key: bool,
+        ilst: Option<Bound<'_, PyBytes>>,
+        decrypt_threads: usize,
+    ) -> PyResult<Self> {
+        let ilst = ilst
+            .map(|value| value.as_bytes().to_vec())
+            .unwrap_or_default();
+        validate_ilst(&ilst).map_err(|err| py_value_error(err.to_string()))?;
+        let keys = match (decryption_key, decrypt_session, track_id, fairplay_key) {
+            (Some(key), None, _, _) => FragmentKeys::hex(&key, decrypt_threads)?,
+            (None, Some(session), Some(track_id), Some(fairplay_key)) => FragmentKeys::Wrapper {
+                pool: session.get().pool(),
+                track_id,
+                fairplay_key,
+            },
+            _ => return Err(py_value_error(
+                "stream: pass decryption_key, or decrypt_session with track_id and fairplay_key",
+            )),
+        };
+        Self::open(&output_path, keys, use_cenc, use_single_content_key, ilst).map_err(py_io_error)
+    }
+
+    fn feed(&mut self, py: Python<'_>, data: &[u8]) -> PyResult<()> {
+        self.pending.extend_from_slice(data);
+        py.detach(|| self.process_pending()).map_err(py_io_error)
+    }
+
+    fn finish(&mut self, py: Python<'_>) -> PyResult<()> {
+        py.detach(|| self.finish_output()).map_err(py_io_error)
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::fixtures::{init_segment, media_segment, KEY};
+
+    fn contains(haystack: &[u8], needle: &[u8]) -> bool {
+        haystack
+            .windows(needle.len())
+            .any(|window| window == needle)
+    }
+
+    #[test]
+    fn decrypts_fragments_as_they_arrive() {
+        let fragments: Vec<Vec<Vec<u8>>> = (0..3u8)
+            .map(|fragment| {
+                (0..5u8)
+                    .map(|sample| vec![fragment * 16 + sample; 37 + sample as usize])
+                    .collect()
+            })
+            .collect();
+        let mut input = init_segment();
+        for (sequence, samples) in fragments.iter().enumerate() {
+            input.extend_from_slice(&media_segment(sequence as u32 + 1, samples));
+        }
+
+        let output = tempfile::NamedTempFile::new().unwrap();
+        let output_path = output.path().to_string_lossy().to_string();
+        let keys = FragmentKeys::Hex {
+            key: KEY,
+            pool: None,
+        };
+        let mut muxer = FragmentedMuxer::open(&output_path, keys, false, true, Vec::new()).unwrap();
+        for chunk in input.chunks(7) {
+            muxer.pending.extend_from_slice(chunk);
+            muxer.process_pending().unwrap();
+        }
+        muxer.finish_output().unwrap();
+
+        let written = std::fs::read(&output_path).unwrap();
+        assert!(written.starts_with(&input[..20]));
+        assert!(contains(&written, b"mp4a"));
+        assert!(contains(&written, b"udta"));
+        for hidden in [&b"enca"[..], b"sinf", b"pssh", b"senc"] {
+            assert!(!contains(&written, hidden));
+        }
+        for samples in &fragments {
+            assert!(contains(&written, &samples.concat()));
+        }
+    }
+
+    #[test]
+    fn defragments_streamed_output() {
+        let samples: Vec<Vec<u8>> = (0..4u8).map(|index| vec![index; 50]).collect();
+        let input = [
+            init_segment(),
+            media_segment(1, &samples[..2]),
+            media_segment(2, &samples[2..]),
+        ]
+        .concat();
+        let fragmented = tempfile::NamedTempFile::new().unwrap();
+        let fragmented_path = fragmented.path().to_string_lossy().to_string();
+        let keys = FragmentKeys::Hex {
+            key: KEY,
+            pool: None,
+        };
+        let mut muxer =
+            FragmentedMuxer::open(&fragmented_path, keys, false, true, Vec::new()).unwrap();
+        muxer.pending = input;
+        muxer.finish_output().unwrap();
+
+        let output = tempfile::NamedTempFile::new().unwrap();
+        let output_path = output.path().to_string_lossy().to_string();
+        crate::media::defragment_file(&fragmented_path, &output_path, &[]).unwrap();
+        let written = std::fs::read(&output_path).unwrap();
+        assert!(!contains(&written, b"moof"));
+        assert!(contains(&written, b"stco"));
+        assert!(written.ends_with(&samples.concat()));
+    }
+
+    #[test]
+    fn rejects_truncated_stream() {
+        let output = tempfile::NamedTempFile::new().unwrap();
+        let output_path = output.path().to_string_lossy().to_string();
+        let keys = FragmentKeys::Hex {
+            key: KEY,
+            pool: None,
+        };
+        let mut muxer = FragmentedMuxer::open(&output_path, keys, false, true, Vec::new()).unwrap();
+        let input = init_segment();
+        muxer.pending.extend_from_slice(&input[..input.len() - 1]);
+        muxer.process_pending().unwrap();
+        assert!(muxer.finish_output().is_err());
+    }
+
+    #[test]
+    fn waits_for_complete_boxes() {
+        let mut data = 16u32.to_be_bytes().to_vec();
+        data.extend_from_slice(b"free");
+        assert_eq!(complete_box_size(&data).unwrap(), None);
+        data.extend_from_slice(&[0u8; 8]);
+        assert_eq!(complete_box_size(&data).unwrap(), Some(16));
+
+        let mut large = 1u32.to_be_bytes().to_vec();
+        large.extend_from_slice(b"mdat");
+        assert_eq!(complete_box_size(&large).unwrap(), None);
+        large.extend_from_slice(&20u64.to_be_bytes());
+        large.extend_from_slice(&[0u8; 4]);
+        assert_eq!(complete_box_size(&large).unwrap(), Some(20));
+
+        assert!(complete_box_size(&[0, 0, 0, 4, b'f', b'r', b'e', b'e']).is_err());
+    }
+}
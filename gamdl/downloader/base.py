@@ -1,23 +1,50 @@
 import asyncio
+import functools
+import hashlib
 import multiprocessing
+import os
 import queue
-import re
 import shutil
 import traceback
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager
 from pathlib import Path
 
+import httpx
+import m3u8
 import structlog
 from mutagen.mp4 import MP4, MP4Cover
 from yt_dlp import YoutubeDL
 from yt_dlp.downloader.hls import HlsFD
 from yt_dlp.downloader.http import HttpFD
 
+from .. import _ammuxer
+from ..api.wrapper import WrapperApi
 from ..interface.enums import CoverFormat
 from ..interface.interface import AppleMusicInterface
 from ..interface.types import MediaTags, PlaylistTags
-from ..utils import CustomStringFormatter, async_subprocess
-from .constants import ILLEGAL_CHAR_REPLACEMENT, ILLEGAL_CHARS_RE, TEMP_PATH_TEMPLATE
-from .enums import DownloadMode
+from ..metrics import metrics
+from ..utils import async_subprocess
+from .ammuxer import (
+    build_ilst,
+    create_wrapper_decrypt_session,
+    feed_muxer,
+    finish_muxer,
+)
+from .constants import (
+    ILLEGAL_CHAR_REPLACEMENT,
+    ILLEGAL_CHARS_PATTERN,
+    PATH_PART_CACHE_SIZE,
+    RANGED_DOWNLOAD_MIN_CHUNK_SIZE,
+    RANGED_DOWNLOAD_WRITE_SIZE,
+    STAGING_PATH_TEMPLATE,
+    STREAM_MUX_QUEUE_SIZE,
+    TEMP_PATH_TEMPLATE,
+)
+from .enums import DownloadMode, MuxMode, StagingMode
+from .exceptions import GamdlDownloaderIncompleteDownloadError
+from .filesystem import FilesystemService
+from .path_template import MEDIA_TEMPLATE_FIELDS, PLAYLIST_TEMPLATE_FIELDS, PathTemplate
 
 logger = structlog.get_logger(__name__)
 
@@ -36,6 +63,7 @@ def _download_ytdlp_process(
                 "quiet": True,
                 "no_warnings": True,
                 "overwrites": True,
+                "continuedl": False,
                 "noprogress": silent,
                 "allow_unplayable_formats": True,
                 "concurrent_fragment_downloads": 8,
@@ -73,9 +101,17 @@ class AppleMusicBaseDownloader:
         interface: AppleMusicInterface,
         output_path: str = "./Apple Music",
         temp_path: str = ".",
+        staging_mode: StagingMode = StagingMode.AUTO,
         nm3u8dlre_path: str = "N_m3u8DL-RE",
         ffmpeg_path: str = "ffmpeg",
         download_mode: DownloadMode = DownloadMode.YTDLP,
+        ranged_download_connections: int = 8,
+        memory_download_max_size: int = 0,
+        filesystem_workers: int = 4,
+        decrypt_threads: int = 0,
+        wrapper_decrypt_connections: int = 2,
+        wrapper_decrypt_pipeline_depth: int = 4,
+        mux_mode: MuxMode = MuxMode.STANDARD,
         album_folder_template: str = "{album_artist}/{album}",
         compilation_folder_template: str = "Compilations/{album}",
         no_album_folder_template: str = "{artist}/Unknown Album",
@@ -92,9 +128,17 @@ class AppleMusicBaseDownloader:
         self.interface = interface
         self.output_path = output_path
         self.temp_path = temp_path
+        self.staging_mode = staging_mode
         self.nm3u8dlre_path = nm3u8dlre_path
         self.ffmpeg_path = ffmpeg_path
         self.download_mode = download_mode
+        self.ranged_download_connections = ranged_download_connections
+        self.memory_download_max_size = memory_download_max_size
+        self.filesystem_workers = filesystem_workers
+        self.decrypt_threads = decrypt_threads
+        self.wrapper_decrypt_connections = wrapper_decrypt_connections
+        self.wrapper_decrypt_pipeline_depth = wrapper_decrypt_pipeline_depth
+        self.mux_mode = mux_mode
         self.album_folder_template = album_folder_template
         self.compilation_folder_template = compilation_folder_template
         self.no_album_folder_template = no_album_folder_template
@@ -108,8 +152,15 @@ class AppleMusicBaseDownloader:
         self.truncate = truncate
         self.silent = silent
 
+        self._staging_path = None
+        self._wrapper_decrypt_sessions = {}
+        self.filesystem = FilesystemService(filesystem_workers)
+
+        self._compile_path_templates()
+
         self._initialize_binary_paths()
 
+    @metrics.timed("initialize_binary_paths")
     def _initialize_binary_paths(self):
         log = logger.bind(action="initialize_binary_paths")
 
@@ -122,6 +173,7 @@ class AppleMusicBaseDownloader:
             full_ffmpeg_path=self.full_ffmpeg_path,
         )
 
+    @metrics.timed("get_temp_path")
     def get_temp_path(
         self,
         media_id: str,
@@ -141,13 +193,149 @@ class AppleMusicBaseDownloader:
 
         return temp_path
 
+    @staticmethod
+    def _get_device_id(path: str) -> int | None:
+        path_obj = Path(path).absolute()
+        for candidate in (path_obj, *path_obj.parents):
+            try:
+                return candidate.stat().st_dev
+            except FileNotFoundError:
+                continue
+        return None
+
+    def _resolve_staging_path(self) -> str:
+        if self.staging_mode == StagingMode.OUTPUT:
+            return self.output_path
+        if self.staging_mode == StagingMode.TEMP:
+            return self.temp_path
+
+        temp_device = self._get_device_id(self.temp_path)
+        output_device = self._get_device_id(self.output_path)
+        return (
+            self.output_path
+            if temp_device is None or temp_device != output_device
+            else self.temp_path
+        )
+
+    @metrics.timed("get_staging_path")
+    async def resolve_staging_path(self) -> str:
+        if self._staging_path is not None:
+            return self._staging_path
+
+        log = logger.bind(action="get_staging_path", staging_mode=self.staging_mode)
+
+        self._staging_path = await self.filesystem.run(self._resolve_staging_path)
+
+        log.debug("success", staging_path=self._staging_path)
+
+        return self._staging_path
+
+    @property
+    def staging_path(self) -> str:
+        if self._staging_path is None:
+            self._staging_path = self._resolve_staging_path()
+        return self._staging_path
+
+    def _get_wrapper_decrypt_session(
+        self,
+        wrapper_api: WrapperApi,
+    ) -> _ammuxer.WrapperDecryptSession:
+        session_key = (wrapper_api.decrypt_host, wrapper_api.decrypt_port)
+        if session_key not in self._wrapper_decrypt_sessions:
+            self._wrapper_decrypt_sessions[session_key] = (
+                create_wrapper_decrypt_session(
+                    wrapper_api,
+                    self.wrapper_decrypt_connections,
+                    self.wrapper_decrypt_pipeline_depth,
+                )
+            )
+
+        return self._wrapper_decrypt_sessions[session_key]
+
+    @asynccontextmanager
+    async def wrapper_decrypt_target(
+        self,
+        is_library: bool = False,
+    ) -> AsyncIterator[tuple[WrapperApi, _ammuxer.WrapperDecryptSession]]:
+        account_pool = self.interface.base.account_pool
+        if account_pool is not None and account_pool.has_wrapper_accounts:
+            async with account_pool.use(wrapper=True, primary=is_library) as account:
+                yield account.wrapper_api, self._get_wrapper_decrypt_session(
+                    account.wrapper_api
+                )
+            return
+
+        wrapper_api = self.interface.base.wrapper_api
+        if wrapper_api is None:
+            raise ValueError("wrapper_api is required for FairPlay decrypt")
+
+        yield wrapper_api, self._get_wrapper_decrypt_session(wrapper_api)
+
+    @metrics.timed("get_staged_path")
+    def get_staged_path(
+        self,
+        media_id: str,
+        folder_tag: str,
+        file_extension: str,
+    ) -> str:
+        if self.staging_path == self.temp_path:
+            return self.get_temp_path(media_id, folder_tag, "staged", file_extension)
+
+        log = logger.bind(action="get_staged_path")
+
+        staged_path = str(
+            Path(self.staging_path)
+            / STAGING_PATH_TEMPLATE.format(folder_tag)
+            / (f"{media_id}_staged" + file_extension)
+        )
+
+        log.debug("success", staged_path=staged_path)
+
+        return staged_path
+
+    def _compile_path_templates(self):
+        self._album_folder_template = PathTemplate(
+            self.album_folder_template,
+            MEDIA_TEMPLATE_FIELDS,
+        )
+        self._compilation_folder_template = PathTemplate(
+            self.compilation_folder_template,
+            MEDIA_TEMPLATE_FIELDS,
+        )
+        self._no_album_folder_template = PathTemplate(
+            self.no_album_folder_template,
+            MEDIA_TEMPLATE_FIELDS,
+        )
+        self._single_disc_file_template = PathTemplate(
+            self.single_disc_file_template,
+            MEDIA_TEMPLATE_FIELDS,
+        )
+        self._multi_disc_file_template = PathTemplate(
+            self.multi_disc_file_template,
+            MEDIA_TEMPLATE_FIELDS,
+        )
+        self._no_album_file_template = PathTemplate(
+            self.no_album_file_template,
+            MEDIA_TEMPLATE_FIELDS,
+        )
+        self._playlist_folder_template = PathTemplate(
+            self.playlist_folder_template,
+            PLAYLIST_TEMPLATE_FIELDS,
+        )
+        self._playlist_file_template = PathTemplate(
+            self.playlist_file_template,
+            PLAYLIST_TEMPLATE_FIELDS,
+        )
+        self._sanitize_path_part = functools.lru_cache(
+            maxsize=PATH_PART_CACHE_SIZE,
+        )(self._sanitize_string)
+
     def _sanitize_string(
         self,
         dirty_string: str,
         file_ext: str = None,
     ) -> str:
-        sanitized_string = re.sub(
-            ILLEGAL_CHARS_RE,
+        sanitized_string = ILLEGAL_CHARS_PATTERN.sub(
             ILLEGAL_CHAR_REPLACEMENT,
             dirty_string,
         )
@@ -163,6 +351,7 @@ class AppleMusicBaseDownloader:
 
         return sanitized_string.strip()
 
+    @metrics.timed("get_final_path")
     def get_final_path(
         self,
         tags: MediaTags,
@@ -172,67 +361,33 @@ class AppleMusicBaseDownloader:
         log = logger.bind(action="get_final_path")
 
         if tags.album:
-            template_folder_parts = (
-                self.compilation_folder_template.split("/")
+            folder_template = (
+                self._compilation_folder_template
                 if tags.compilation
-                else self.album_folder_template.split("/")
+                else self._album_folder_template
             )
         else:
-            template_folder_parts = self.no_album_folder_template.split("/")
+            folder_template = self._no_album_folder_template
 
         if tags.album:
-            template_file_parts = (
-                self.multi_disc_file_template.split("/")
+            file_template = (
+                self._multi_disc_file_template
                 if isinstance(tags.disc_total, int) and tags.disc_total > 1
-                else self.single_disc_file_template.split("/")
+                else self._single_disc_file_template
             )
         else:
-            template_file_parts = self.no_album_file_template.split("/")
-
-        template_parts = template_folder_parts + template_file_parts
-        formatted_parts = []
-
-        for i, part in enumerate(template_parts):
-            is_folder = i < len(template_parts) - 1
-            formatted_part = CustomStringFormatter().format(
-                part,
-                album=(tags.album, "Unknown Album"),
-                album_artist=(tags.album_artist, "Unknown Artist"),
-                album_id=(tags.album_id, "Unknown Album ID"),
-                artist=(tags.artist, "Unknown Artist"),
-                artist_id=(tags.artist_id, "Unknown Artist ID"),
-                composer=(tags.composer, "Unknown Composer"),
-                composer_id=(tags.composer_id, "Unknown Composer ID"),
-                date=(tags.date, "Unknown Date"),
-                disc=(tags.disc, ""),
-                disc_total=(tags.disc_total, ""),
-                media_type=(tags.media_type, "Unknown Media Type"),
-                playlist_artist=(
-                    (playlist_tags.artist if playlist_tags else None),
-                    "Unknown Playlist Artist",
-                ),
-                playlist_id=(
-                    (playlist_tags.playlist_id if playlist_tags else None),
-                    "Unknown Playlist ID",
-                ),
-                playlist_title=(
-                    (playlist_tags.title if playlist_tags else None),
-                    "Unknown Playlist Title",
-                ),
-                playlist_track=(
-                    (playlist_tags.track if playlist_tags else None),
-                    "",
-                ),
-                title=(tags.title, "Unknown Title"),
-                title_id=(tags.title_id, "Unknown Title ID"),
-                track=(tags.track, ""),
-                track_total=(tags.track_total, ""),
-            )
-            sanitized_formatted_part = self._sanitize_string(
-                formatted_part,
-                file_extension if not is_folder else None,
-            )
-            formatted_parts.append(sanitized_formatted_part)
+            file_template = self._no_album_file_template
+
+        formatted_parts = folder_template.render(
+            tags,
+            playlist_tags,
+            self._sanitize_path_part,
+        ) + file_template.render(
+            tags,
+            playlist_tags,
+            self._sanitize_path_part,
+            file_extension,
+        )
 
         final_path = str(Path(self.output_path, *formatted_parts))
 
@@ -240,6 +395,7 @@ class AppleMusicBaseDownloader:
 
         return final_path
 
+    @metrics.timed("download_stream")
     async def download_stream(
         self,
         stream_url: str,
@@ -251,10 +407,13 @@ class AppleMusicBaseDownloader:
 
         stream_url_stripped = stream_url.split("?")[0]
 
-        if (
-            self.download_mode == DownloadMode.YTDLP
-            or not stream_url_stripped.endswith(".m3u8")
-        ):
+        if not stream_url_stripped.endswith(".m3u8"):
+            await self._download_http(
+                stream_url,
+                download_path,
+            )
+
+        elif self.download_mode == DownloadMode.YTDLP:
             await self._download_ytdlp_async(
                 stream_url,
                 download_path,
@@ -265,6 +424,378 @@ class AppleMusicBaseDownloader:
 
         log.debug("success")
 
+    async def _download_http(
+        self,
+        stream_url: str,
+        download_path: str,
+    ) -> None:
+        if self.ranged_download_connections > 1 and await self._download_ranged(
+            stream_url,
+            download_path,
+        ):
+            return
+
+        await self._download_ytdlp_async(
+            stream_url,
+            download_path,
+        )
+
+    async def _get_ranged_download_size(
+        self,
+        client: httpx.AsyncClient,
+        stream_url: str,
+    ) -> int | None:
+        try:
+            response = await client.head(stream_url)
+        except httpx.HTTPError:
+            return None
+        if response.is_error:
+            return None
+
+        if response.headers.get("accept-ranges", "").lower() != "bytes":
+            return None
+
+        content_length = response.headers.get("content-length", "")
+        if not content_length.isdigit():
+            return None
+
+        return int(content_length)
+
+    @staticmethod
+    def _preallocate_file(download_path: str, size: int) -> None:
+        Path(download_path).parent.mkdir(parents=True, exist_ok=True)
+        with open(download_path, "wb") as file:
+            file.truncate(size)
+
+    async def _download_byte_range(
+        self,
+        client: httpx.AsyncClient,
+        url: str,
+        start: int,
+        length: int,
+        write: Callable[[bytes], Awaitable[None]],
+    ) -> int | None:
+        async with client.stream(
+            "GET",
+            url,
+            headers={"Range": f"bytes={start}-{start + length - 1}"},
+        ) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                return None
+
+            written = 0
+            async for data in response.aiter_bytes(RANGED_DOWNLOAD_WRITE_SIZE):
+                if written + len(data) > length:
+                    raise GamdlDownloaderIncompleteDownloadError(
+                        url,
+                        length,
+                        written + len(data),
+                    )
+                await write(data)
+                written += len(data)
+
+        if written != length:
+            raise GamdlDownloaderIncompleteDownloadError(url, length, written)
+
+        return written
+
+    async def _download_range(
+        self,
+        client: httpx.AsyncClient,
+        stream_url: str,
+        download_path: str,
+        start: int,
+        end: int,
+    ) -> int | None:
+        file = await asyncio.to_thread(open, download_path, "r+b")
+
+        async def write(data: bytes) -> None:
+            await asyncio.to_thread(file.write, data)
+
+        try:
+            file.seek(start)
+            return await self._download_byte_range(
+                client,
+                stream_url,
+                start,
+                end - start + 1,
+                write,
+            )
+        finally:
+            await asyncio.to_thread(file.close)
+
+    @metrics.timed("download_ranged")
+    async def _download_ranged(
+        self,
+        stream_url: str,
+        download_path: str,
+    ) -> bool:
+        log = logger.bind(
+            action="download_ranged",
+            stream_url=stream_url,
+            download_path=download_path,
+        )
+
+        async with httpx.AsyncClient(
+            timeout=httpx.Timeout(60.0),
+            follow_redirects=True,
+        ) as client:
+            content_length = await self._get_ranged_download_size(client, stream_url)
+            if (
+                content_length is None
+                or content_length < RANGED_DOWNLOAD_MIN_CHUNK_SIZE * 2
+            ):
+                log.debug("ranges_not_used", content_length=content_length)
+                return False
+
+            chunk_count = min(
+                self.ranged_download_connections,
+                content_length // RANGED_DOWNLOAD_MIN_CHUNK_SIZE,
+            )
+            chunk_size = -(-content_length // chunk_count)
+
+            await self.filesystem.run(
+                self._preallocate_file,
+                download_path,
+                content_length,
+            )
+
+            # A zero-filled file left behind would look complete to yt-dlp
+            try:
+                chunk_sizes = await self._download_ranges(
+                    client,
+                    stream_url,
+                    download_path,
+                    content_length,
+                    chunk_size,
+                )
+            except BaseException:
+                await self.filesystem.run(self._remove_file, download_path)
+                raise
+
+        if None in chunk_sizes:
+            log.debug("ranges_not_supported")
+            await self.filesystem.run(self._remove_file, download_path)
+            return False
+
+        downloaded_size = sum(chunk_sizes)
+        file_size = Path(download_path).stat().st_size
+        if downloaded_size != content_length or file_size != content_length:
+            await self.filesystem.run(self._remove_file, download_path)
+            raise GamdlDownloaderIncompleteDownloadError(
+                download_path,
+                content_length,
+                downloaded_size,
+            )
+
+        metrics.add_bytes("download_ranged", content_length)
+        log.debug("success", chunk_count=chunk_count, content_length=content_length)
+
+        return True
+
+    @staticmethod
+    def _remove_file(path: str) -> None:
+        Path(path).unlink(missing_ok=True)
+
+    async def _download_ranges(
+        self,
+        client: httpx.AsyncClient,
+        stream_url: str,
+        download_path: str,
+        content_length: int,
+        chunk_size: int,
+    ) -> list[int | None]:
+        tasks = [
+            asyncio.create_task(
+                self._download_range(
+                    client,
+                    stream_url,
+                    download_path,
+                    start,
+                    min(start + chunk_size, content_length) - 1,
+                )
+            )
+            for start in range(0, content_length, chunk_size)
+        ]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    @metrics.timed("download_stream_to_memory")
+    async def download_stream_to_memory(self, stream_url: str) -> bytearray | None:
+        log = logger.bind(action="download_stream_to_memory", stream_url=stream_url)
+
+        is_hls = stream_url.split("?")[0].endswith(".m3u8")
+        if self.memory_download_max_size <= 0 or not is_hls:
+            return None
+
+        async with httpx.AsyncClient(
+            timeout=httpx.Timeout(60.0),
+            follow_redirects=True,
+        ) as client:
+            response = await client.get(stream_url)
+            response.raise_for_status()
+            byte_ranges = self._get_hls_byte_ranges(
+                m3u8.loads(response.text, uri=stream_url)
+            )
+
+            total_size = (
+                sum(length for _, _, length in byte_ranges) if byte_ranges else None
+            )
+            if total_size is None or total_size > self.memory_download_max_size:
+                log.debug("memory_not_used", total_size=total_size)
+                return None
+
+            buffer = bytearray(total_size)
+            buffer_view = memoryview(buffer)
+            position = 0
+
+            async def write(data: bytes) -> None:
+                nonlocal position
+                buffer_view[position : position + len(data)] = data
+                position += len(data)
+
+            for url, offset, length in byte_ranges:
+                written = await self._download_byte_range(
+                    client,
+                    url,
+                    offset,
+                    length,
+                    write,
+                )
+                if written is None:
+                    log.debug("ranges_not_supported", url=url)
+                    return None
+
+        metrics.add_bytes("download_stream_to_memory", total_size)
+        log.debug("success", total_size=total_size)
+
+        return buffer
+
+    @metrics.timed("download_stream_to_muxer")
+    async def download_stream_to_muxer(self, stream_url: str, muxer) -> bool:
+        log = logger.bind(action="download_stream_to_muxer", stream_url=stream_url)
+
+        is_hls = stream_url.split("?")[0].endswith(".m3u8")
+        if not is_hls:
+            return False
+
+        async with httpx.AsyncClient(
+            timeout=httpx.Timeout(60.0),
+            follow_redirects=True,
+        ) as client:
+            response = await client.get(stream_url)
+            response.raise_for_status()
+            byte_ranges = self._get_hls_byte_ranges(
+                m3u8.loads(response.text, uri=stream_url)
+            )
+            if byte_ranges is None:
+                log.debug("stream_not_used")
+                return False
+
+            chunks = asyncio.Queue(STREAM_MUX_QUEUE_SIZE)
+            feeder = asyncio.create_task(self._feed_muxer(muxer, chunks))
+
+            async def write(data: bytes) -> None:
+                await self._put_muxer_chunk(chunks, feeder, data)
+
+            try:
+                for url, offset, length in byte_ranges:
+                    written = await self._download_byte_range(
+                        client,
+                        url,
+                        offset,
+                        length,
+                        write,
+                    )
+                    if written is None:
+                        log.debug("ranges_not_supported", url=url)
+                        return False
+
+                await self._put_muxer_chunk(chunks, feeder, None)
+                await feeder
+            finally:
+                if not feeder.done():
+                    feeder.cancel()
+                    await asyncio.gather(feeder, return_exceptions=True)
+
+        await finish_muxer(muxer)
+
+        metrics.add_bytes(
+            "download_stream_to_muxer",
+            sum(length for _, _, length in byte_ranges),
+        )
+        log.debug("success", segments=len(byte_ranges))
+
+        return True
+
+    @staticmethod
+    async def _put_muxer_chunk(
+        chunks: asyncio.Queue,
+        feeder: asyncio.Task,
+        data: bytes | None,
+    ) -> None:
+        put = asyncio.ensure_future(chunks.put(data))
+        await asyncio.wait({put, feeder}, return_when=asyncio.FIRST_COMPLETED)
+        if not put.done():
+            put.cancel()
+            await feeder
+
+    @staticmethod
+    async def _feed_muxer(muxer, chunks: asyncio.Queue) -> None:
+        while (data := await chunks.get()) is not None:
+            await feed_muxer(muxer, data)
+
+    @staticmethod
+    def _get_hls_byte_ranges(
+        playlist: m3u8.M3U8,
+    ) -> list[tuple[str, int, int]] | None:
+        if playlist.is_variant or not playlist.segments:
+            return None
+
+        if any(key and key.method == "AES-128" for key in playlist.keys):
+            return None
+
+        byte_ranges = []
+        next_offsets = {}
+        init_section = None
+
+        def add_range(url: str, byterange: str | None) -> bool:
+            if not byterange:
+                return False
+
+            length, _, offset = byterange.partition("@")
+            start = int(offset) if offset else next_offsets.get(url, 0)
+            next_offsets[url] = start + int(length)
+
+            if byte_ranges and byte_ranges[-1][0] == url:
+                last_url, last_start, last_length = byte_ranges[-1]
+                if last_start + last_length == start:
+                    byte_ranges[-1] = (last_url, last_start, last_length + int(length))
+                    return True
+
+            byte_ranges.append((url, start, int(length)))
+            return True
+
+        for segment in playlist.segments:
+            if segment.init_section is not None and (
+                init_section is None
+                or segment.init_section.absolute_uri != init_section.absolute_uri
+                or segment.init_section.byterange != init_section.byterange
+            ):
+                init_section = segment.init_section
+                if not add_range(init_section.absolute_uri, init_section.byterange):
+                    return None
+
+            if not add_range(segment.absolute_uri, segment.byterange):
+                return None
+
+        return byte_ranges
+
     async def _download_ytdlp_async(
         self,
         stream_url: str,
@@ -308,7 +839,7 @@ class AppleMusicBaseDownloader:
     async def _download_nm3u8dlre(self, stream_url: str, download_path: str):
         download_path_obj = Path(download_path)
 
-        download_path_obj.parent.mkdir(parents=True, exist_ok=True)
+        await self.filesystem.mkdir(download_path_obj.parent)
         await async_subprocess(
             self.full_nm3u8dlre_path,
             stream_url,
@@ -327,6 +858,7 @@ class AppleMusicBaseDownloader:
             silent=self.silent,
         )
 
+    @metrics.timed("apply_tags")
     async def apply_tags(
         self,
         media_path: str,
@@ -335,6 +867,21 @@ class AppleMusicBaseDownloader:
     ):
         log = logger.bind(action="apply_tags", media_path=media_path)
 
+        await asyncio.to_thread(
+            self._apply_mp4_tags,
+            media_path,
+            self._get_mp4_tags(tags),
+            cover_bytes,
+            self._skip_tagging,
+        )
+
+        log.debug("success")
+
+    @property
+    def _skip_tagging(self) -> bool:
+        return "all" in (self.exclude_tags or [])
+
+    def _get_mp4_tags(self, tags: MediaTags) -> dict:
         exclude_tags = self.exclude_tags or []
 
         filtered_tags = MediaTags(
@@ -344,19 +891,39 @@ class AppleMusicBaseDownloader:
                 if v is not None and k not in exclude_tags
             }
         )
-        mp4_tags = filtered_tags.as_mp4_tags(self.date_tag_template)
+        return filtered_tags.as_mp4_tags(self.date_tag_template)
 
-        skip_tagging = "all" in exclude_tags
+    def get_ilst(
+        self,
+        tags: MediaTags,
+        cover_bytes: bytes | None,
+    ) -> bytes:
+        if self._skip_tagging:
+            return b""
 
-        await asyncio.to_thread(
-            self._apply_mp4_tags,
-            media_path,
-            mp4_tags,
+        return build_ilst(
+            self._get_mp4_tags(tags),
             cover_bytes,
-            skip_tagging,
+            self.interface.base.cover_format,
         )
 
-        log.debug("success")
+    def get_tag_hash(
+        self,
+        tags: MediaTags,
+        cover_url: str | None,
+    ) -> str:
+        tag_hash = hashlib.sha256()
+
+        if self._skip_tagging:
+            return tag_hash.hexdigest()
+
+        for tag_key, tag_value in sorted(self._get_mp4_tags(tags).items()):
+            tag_hash.update(repr((tag_key, tag_value)).encode())
+
+        if cover_url and self.interface.base.cover_format != CoverFormat.RAW:
+            tag_hash.update(cover_url.encode())
+
+        return tag_hash.hexdigest()
 
     def _apply_mp4_tags(
         self,
@@ -402,32 +969,23 @@ class AppleMusicBaseDownloader:
             )
         ]
 
+    @metrics.timed("get_playlist_file_path")
     def get_playlist_file_path(
         self,
         tags: PlaylistTags,
     ) -> str:
         log = logger.bind(action="get_playlist_file_path")
 
-        template_folder_parts = self.playlist_folder_template.split("/")
-        template_file_parts = self.playlist_file_template.split("/")
-        template_parts = template_folder_parts + template_file_parts
-        formatted_parts = []
-
-        for i, part in enumerate(template_parts):
-            is_folder = i < len(template_parts) - 1
-            formatted_part = CustomStringFormatter().format(
-                part,
-                playlist_artist=(tags.artist, "Unknown Playlist Artist"),
-                playlist_id=(tags.playlist_id, "Unknown Playlist ID"),
-                playlist_title=(tags.title, "Unknown Playlist Title"),
-                playlist_track=(tags.track, ""),
-            )
-            file_ext = None if is_folder else ".m3u"
-            sanitized_formatted_part = self._sanitize_string(
-                formatted_part,
-                file_ext,
-            )
-            formatted_parts.append(sanitized_formatted_part)
+        formatted_parts = self._playlist_folder_template.render(
+            None,
+            tags,
+            self._sanitize_path_part,
+        ) + self._playlist_file_template.render(
+            None,
+            tags,
+            self._sanitize_path_part,
+            ".m3u",
+        )
 
         final_path = str(Path(self.output_path, *formatted_parts))
 
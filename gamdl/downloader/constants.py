@@ -1,3 +1,14 @@
+import re
+
 TEMP_PATH_TEMPLATE = "gamdl_temp_{}"
+STAGING_PATH_TEMPLATE = ".gamdl_staging_{}"
 ILLEGAL_CHARS_RE = r'[\\/:*?"<>|;]'
+ILLEGAL_CHARS_PATTERN = re.compile(ILLEGAL_CHARS_RE)
 ILLEGAL_CHAR_REPLACEMENT = "_"
+RANGED_DOWNLOAD_MIN_CHUNK_SIZE = 1024 * 1024
+RANGED_DOWNLOAD_WRITE_SIZE = 256 * 1024
+STREAM_MUX_QUEUE_SIZE = 16
+PLAYLIST_FILE_FLUSH_INTERVAL = 60
+PATH_PART_CACHE_SIZE = 4096
+CONTENT_STORE_CACHE_SIZE = 4096
+FICLONE = 0x40049409
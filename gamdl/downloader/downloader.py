@@ -1,20 +1,30 @@
+import asyncio
+import errno
+import os
 import shutil
 from pathlib import Path
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Callable
 
 import structlog
 
 from ..interface.types import AppleMusicMedia
-from .constants import TEMP_PATH_TEMPLATE
-from .enums import DownloadMode
+from ..metrics import metrics
+from .constants import (
+    CONTENT_STORE_CACHE_SIZE,
+    FICLONE,
+    STAGING_PATH_TEMPLATE,
+    TEMP_PATH_TEMPLATE,
+)
+from .enums import ContentStoreMode, DownloadMode
 from .exceptions import (
     GamdlDownloaderDependencyNotFoundError,
     GamdlDownloaderMediaFileExistsError,
     GamdlDownloaderSyncedLyricsOnlyError,
 )
 from .music_video import AppleMusicMusicVideoDownloader
+from .playlist_writer import PlaylistFileWriter
 from .song import AppleMusicSongDownloader
-from .types import DownloadItem
+from .types import DownloadItem, LedgerEntry
 from .uploaded_video import AppleMusicUploadedVideoDownloader
 
 logger = structlog.get_logger(__name__)
@@ -33,6 +43,9 @@ class AppleMusicDownloader:
         synced_lyrics_only: bool = False,
         skip_cleanup: bool = False,
         skip_processing: bool = False,
+        content_store_mode: ContentStoreMode = ContentStoreMode.DISABLED,
+        content_store_get_function: Callable[[str, str, str], str | None] = None,
+        content_store_add_function: Callable[[str, str, str, str], None] = None,
     ):
         self.song = song
         self.music_video = music_video
@@ -44,9 +57,15 @@ class AppleMusicDownloader:
         self.synced_lyrics_only = synced_lyrics_only
         self.skip_cleanup = skip_cleanup
         self.skip_processing = skip_processing
+        self.content_store_mode = content_store_mode
+        self.content_store_get_function = content_store_get_function
+        self.content_store_add_function = content_store_add_function
 
         self.base = song.base
 
+        self._playlist_file_writers: dict[str, PlaylistFileWriter] = {}
+        self._content_store_paths: dict[tuple[str, str, str], str] = {}
+
     async def get_download_item_from_url(
         self,
         url: str,
@@ -64,7 +83,9 @@ class AppleMusicDownloader:
         if media.partial:
             return DownloadItem(media)
 
-        elif media.media_metadata["type"] in {"songs", "library-songs"}:
+        await self.base.resolve_staging_path()
+
+        if media.media_metadata["type"] in {"songs", "library-songs"}:
             return await self.song.get_download_item(media)
 
         elif media.media_metadata["type"] in {
@@ -87,11 +108,13 @@ class AppleMusicDownloader:
             await self._initial_processing(item)
             await self._download(item)
             await self._final_processing(item)
+            await self._add_to_content_store(item)
         finally:
             if not self.skip_cleanup:
-                self._cleanup_temp(item.uuid_)
+                await self._cleanup_temp(item.uuid_)
 
-    def _update_playlist_file(
+    @metrics.timed("update_playlist_file")
+    async def _update_playlist_file(
         self,
         playlist_file_path: str,
         final_path: str,
@@ -108,7 +131,6 @@ class AppleMusicDownloader:
         final_path_obj = Path(final_path)
         output_dir_obj = Path(self.base.output_path)
 
-        playlist_file_path_obj.parent.mkdir(parents=True, exist_ok=True)
         playlist_file_path_parent_parts_len = len(playlist_file_path_obj.parent.parts)
         output_path_parts_len = len(output_dir_obj.parts)
 
@@ -116,40 +138,48 @@ class AppleMusicDownloader:
             ("../" * (playlist_file_path_parent_parts_len - output_path_parts_len)),
             *final_path_obj.parts[output_path_parts_len:],
         )
-        playlist_file_lines = (
-            playlist_file_path_obj.open("r", encoding="utf8").readlines()
-            if playlist_file_path_obj.exists()
-            else []
-        )
-        if len(playlist_file_lines) < playlist_track:
-            playlist_file_lines.extend(
-                "\n" for _ in range(playlist_track - len(playlist_file_lines))
+
+        playlist_file_writer = self._playlist_file_writers.get(playlist_file_path)
+        if playlist_file_writer is None:
+            playlist_file_writer = PlaylistFileWriter(
+                playlist_file_path,
+                self.base.filesystem,
             )
+            self._playlist_file_writers[playlist_file_path] = playlist_file_writer
 
-        playlist_file_lines[playlist_track - 1] = final_path_relative.as_posix() + "\n"
-        with playlist_file_path_obj.open("w", encoding="utf8") as playlist_file:
-            playlist_file.writelines(playlist_file_lines)
+        await playlist_file_writer.set_entry(
+            playlist_track,
+            final_path_relative.as_posix(),
+        )
 
         log.debug("success")
 
-    def _write_cover(self, cover_path: str, cover_bytes: bytes) -> None:
+    async def flush_playlist_files(self) -> None:
+        # Later requests for the same playlist start from the file on disk
+        while self._playlist_file_writers:
+            _, playlist_file_writer = self._playlist_file_writers.popitem()
+            await playlist_file_writer.flush()
+
+    @metrics.timed("write_cover_file")
+    async def _write_cover(self, cover_path: str, cover_bytes: bytes) -> None:
         log = logger.bind(action="write_cover_file", cover_path=cover_path)
 
-        Path(cover_path).parent.mkdir(parents=True, exist_ok=True)
-        with open(cover_path, "wb") as f:
-            f.write(cover_bytes)
+        await self.base.filesystem.write_bytes(cover_path, cover_bytes)
 
         log.debug("success")
 
-    def _write_synced_lyrics(self, synced_lyrics_path: str, lyrics: str) -> None:
+    @metrics.timed("write_synced_lyrics")
+    async def _write_synced_lyrics(
+        self,
+        synced_lyrics_path: str,
+        lyrics: str,
+    ) -> None:
         log = logger.bind(
             action="write_synced_lyrics",
             synced_lyrics_path=synced_lyrics_path,
         )
 
-        Path(synced_lyrics_path).parent.mkdir(parents=True, exist_ok=True)
-        with open(synced_lyrics_path, "w", encoding="utf-8") as f:
-            f.write(lyrics)
+        await self.base.filesystem.write_text(synced_lyrics_path, lyrics)
 
         log.debug("success")
 
@@ -158,30 +188,42 @@ class AppleMusicDownloader:
             return
 
         if item.playlist_file_path and item.final_path and self.save_playlist:
-            self._update_playlist_file(
+            await self._update_playlist_file(
                 item.playlist_file_path,
                 item.final_path,
                 item.media.playlist_tags.track,
             )
 
-        if item.cover_path and self.save_cover and item.media.cover.url:
+        save_cover = item.cover_path and self.save_cover and item.media.cover.url
+        save_synced_lyrics = (
+            item.synced_lyrics_path
+            and not self.no_synced_lyrics
+            and item.media.lyrics
+            and item.media.lyrics.synced
+        )
+
+        if self.overwrite:
+            cover_exists, synced_lyrics_exists = False, False
+        else:
+            cover_exists, synced_lyrics_exists = await self.base.filesystem.exists_many(
+                [
+                    item.cover_path if save_cover else None,
+                    item.synced_lyrics_path if save_synced_lyrics else None,
+                ]
+            )
+
+        if save_cover and not cover_exists:
             cover_bytes = await self.base.interface.base.get_cover_bytes(
                 item.media.cover.url,
             )
-            if cover_bytes and (self.overwrite or not Path(item.cover_path).exists()):
-                self._write_cover(
+            if cover_bytes:
+                await self._write_cover(
                     item.cover_path,
                     cover_bytes,
                 )
 
-        if (
-            item.synced_lyrics_path
-            and not self.no_synced_lyrics
-            and item.media.lyrics
-            and item.media.lyrics.synced
-            and (self.overwrite or not Path(item.synced_lyrics_path).exists())
-        ):
-            self._write_synced_lyrics(
+        if save_synced_lyrics and not synced_lyrics_exists:
+            await self._write_synced_lyrics(
                 item.synced_lyrics_path,
                 item.media.lyrics.synced,
             )
@@ -193,9 +235,13 @@ class AppleMusicDownloader:
         if self.synced_lyrics_only:
             raise GamdlDownloaderSyncedLyricsOnlyError()
 
-        if Path(item.final_path).exists() and not self.overwrite:
+        if not self.overwrite and await self.base.filesystem.exists(item.final_path):
+            await self._add_to_content_store(item)
             raise GamdlDownloaderMediaFileExistsError(item.final_path)
 
+        if await self._place_from_content_store(item):
+            return
+
         if item.media.media_metadata["type"] in {
             "music-videos",
             "library-music-videos",
@@ -220,18 +266,251 @@ class AppleMusicDownloader:
         elif item.media.media_metadata["type"] in {"uploaded-videos"}:
             await self.uploaded_video.download(item)
 
-    def _move_to_final_path(self, staged_path: str, final_path: str) -> None:
+    @staticmethod
+    def get_codec(item: DownloadItem) -> str | None:
+        if not item.media.stream_info:
+            return None
+
+        return "+".join(
+            track.codec
+            for track in (
+                item.media.stream_info.video_track,
+                item.media.stream_info.audio_track,
+            )
+            if track and track.codec
+        )
+
+    def get_content_key(self, item: DownloadItem) -> tuple[str, str, str] | None:
+        if (
+            self.content_store_mode == ContentStoreMode.DISABLED
+            or not item.media.stream_info
+            or not item.media.tags
+        ):
+            return None
+
+        return (
+            item.media.media_metadata["id"],
+            f"{self.get_codec(item)}{Path(item.final_path).suffix}",
+            self.base.get_tag_hash(
+                item.media.tags,
+                item.media.cover.url if item.media.cover else None,
+            ),
+        )
+
+    @staticmethod
+    def _get_file_stat(path: str) -> os.stat_result | None:
+        try:
+            return os.stat(path)
+        except FileNotFoundError:
+            return None
+
+    async def get_ledger_entry(self, item: DownloadItem) -> LedgerEntry | None:
+        if not item.media.media_metadata or not item.final_path:
+            return None
+
+        # content_hash is left empty here to avoid a second full read of the file
+        file_stat = await self.base.filesystem.run(
+            self._get_file_stat,
+            item.final_path,
+        )
+        if file_stat is None:
+            return None
+
+        return LedgerEntry(
+            media_id=item.media.media_metadata["id"],
+            path=item.final_path,
+            codec=self.get_codec(item),
+            size=file_stat.st_size,
+            mtime=file_stat.st_mtime,
+            tag_version=(
+                self.base.get_tag_hash(
+                    item.media.tags,
+                    item.media.cover.url if item.media.cover else None,
+                )
+                if item.media.tags
+                else None
+            ),
+            album_id=item.media.tags.album_id if item.media.tags else None,
+            artist_id=item.media.tags.artist_id if item.media.tags else None,
+        )
+
+    async def _get_content_store_path(
+        self,
+        content_key: tuple[str, str, str],
+    ) -> str | None:
+        content_path = self._content_store_paths.get(content_key)
+        if content_path is None and self.content_store_get_function:
+            content_path = await asyncio.to_thread(
+                self.content_store_get_function,
+                *content_key,
+            )
+
+        if content_path and await self.base.filesystem.run(
+            os.path.isfile,
+            content_path,
+        ):
+            return content_path
+
+        return None
+
+    @metrics.timed("place_from_content_store")
+    async def _place_from_content_store(self, item: DownloadItem) -> bool:
+        content_key = self.get_content_key(item)
+        if content_key is None:
+            return False
+
+        content_path = await self._get_content_store_path(content_key)
+        if content_path is None or Path(content_path) == Path(item.final_path):
+            return False
+
+        log = logger.bind(
+            action="place_from_content_store",
+            content_path=content_path,
+            final_path=item.final_path,
+        )
+
+        linked = await self.base.filesystem.run(
+            self._link_to_final_path,
+            content_path,
+            item.final_path,
+            self.content_store_mode,
+        )
+
+        log.debug("success", linked=linked)
+
+        return True
+
+    @staticmethod
+    def _reflink(source_path: str, target_path: Path) -> bool:
+        try:
+            import fcntl
+        except ImportError:
+            return False
+
+        with open(source_path, "rb") as source, open(target_path, "wb") as target:
+            try:
+                fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+            except OSError:
+                return False
+
+        return True
+
+    def _link_to_final_path(
+        self,
+        content_path: str,
+        final_path: str,
+        content_store_mode: ContentStoreMode,
+    ) -> bool:
+        return self.base.filesystem.run_in_dir_sync(
+            Path(final_path).parent,
+            self._link_in_final_dir,
+            content_path,
+            Path(final_path),
+            content_store_mode,
+        )
+
+    @staticmethod
+    def _link_in_final_dir(
+        content_path: str,
+        final_path_obj: Path,
+        content_store_mode: ContentStoreMode,
+    ) -> bool:
+        partial_path = final_path_obj.with_name(f".{final_path_obj.name}.part")
+        partial_path.unlink(missing_ok=True)
+
+        try:
+            linked = False
+            if content_store_mode == ContentStoreMode.HARDLINK:
+                try:
+                    os.link(content_path, partial_path)
+                    linked = True
+                except OSError:
+                    pass
+            elif content_store_mode == ContentStoreMode.REFLINK:
+                linked = AppleMusicDownloader._reflink(content_path, partial_path)
+
+            if not linked:
+                shutil.copyfile(content_path, partial_path)
+            os.replace(partial_path, final_path_obj)
+        finally:
+            partial_path.unlink(missing_ok=True)
+
+        return linked
+
+    async def _add_to_content_store(self, item: DownloadItem) -> None:
+        if self.skip_processing:
+            return
+
+        content_key = self.get_content_key(item)
+        if content_key is None or not await self.base.filesystem.run(
+            os.path.isfile,
+            item.final_path,
+        ):
+            return
+
+        if await self._get_content_store_path(content_key) is not None:
+            return
+
+        if self.content_store_add_function:
+            await asyncio.to_thread(
+                self.content_store_add_function,
+                *content_key,
+                item.final_path,
+            )
+            return
+
+        if len(self._content_store_paths) >= CONTENT_STORE_CACHE_SIZE:
+            del self._content_store_paths[next(iter(self._content_store_paths))]
+        self._content_store_paths[content_key] = item.final_path
+
+    @metrics.timed("move_to_final_path")
+    async def _move_to_final_path(self, staged_path: str, final_path: str) -> None:
         log = logger.bind(
             action="move_to_final_path",
             staged_path=staged_path,
             final_path=final_path,
         )
 
-        Path(final_path).parent.mkdir(parents=True, exist_ok=True)
-        shutil.move(staged_path, final_path)
+        copied_bytes = await self.base.filesystem.run(
+            self._replace_final_path,
+            staged_path,
+            final_path,
+        )
+
+        if copied_bytes is not None:
+            metrics.add_bytes("move_to_final_path", copied_bytes)
+            log.debug("success", copied_bytes=copied_bytes)
+            return
 
         log.debug("success")
 
+    def _replace_final_path(self, staged_path: str, final_path: str) -> int | None:
+        try:
+            self.base.filesystem.run_in_dir_sync(
+                Path(final_path).parent,
+                os.replace,
+                staged_path,
+                final_path,
+            )
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            return self._copy_to_final_path(staged_path, final_path)
+
+        return None
+
+    @staticmethod
+    def _copy_to_final_path(staged_path: str, final_path: str) -> int:
+        final_path_obj = Path(final_path)
+        partial_path = final_path_obj.with_name(f".{final_path_obj.name}.part")
+        try:
+            shutil.copyfile(staged_path, partial_path)
+            os.replace(partial_path, final_path_obj)
+        finally:
+            partial_path.unlink(missing_ok=True)
+        os.remove(staged_path)
+        return final_path_obj.stat().st_size
+
     async def _final_processing(
         self,
         item: DownloadItem,
@@ -239,16 +518,19 @@ class AppleMusicDownloader:
         if self.skip_processing:
             return
 
-        if Path(item.staged_path).exists():
-            self._move_to_final_path(
+        if await self.base.filesystem.exists(item.staged_path):
+            await self._move_to_final_path(
                 item.staged_path,
                 item.final_path,
             )
 
-    def _cleanup_temp(self, folder_tag: str) -> None:
+    @metrics.timed("cleanup_temp")
+    async def _cleanup_temp(self, folder_tag: str) -> None:
         log = logger.bind(action="cleanup_temp", folder_tag=folder_tag)
 
-        temp_path = Path(self.base.temp_path) / TEMP_PATH_TEMPLATE.format(folder_tag)
-        if temp_path.exists() and temp_path.is_dir():
-            shutil.rmtree(temp_path, ignore_errors=True)
-            log.debug("success")
+        for temp_path in (
+            Path(self.base.temp_path) / TEMP_PATH_TEMPLATE.format(folder_tag),
+            Path(self.base.staging_path) / STAGING_PATH_TEMPLATE.format(folder_tag),
+        ):
+            if await self.base.filesystem.rmtree(temp_path):
+                log.debug("success", temp_path=str(temp_path))
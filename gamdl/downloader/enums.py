@@ -6,6 +6,24 @@ class DownloadMode(Enum):
     NM3U8DLRE = "nm3u8dlre"
 
 
+class StagingMode(Enum):
+    AUTO = "auto"
+    TEMP = "temp"
+    OUTPUT = "output"
+
+
+class MuxMode(Enum):
+    STANDARD = "standard"
+    STREAMING = "streaming"
+    FRAGMENTED = "fragmented"
+
+
+class ContentStoreMode(Enum):
+    DISABLED = "disabled"
+    HARDLINK = "hardlink"
+    REFLINK = "reflink"
+
+
 class RemuxMode(Enum):
     FFMPEG = "ffmpeg"
     MP4BOX = "mp4box"
@@ -18,3 +18,11 @@ class GamdlDownloaderMediaFileExistsError(GamdlDownloaderError):
 class GamdlDownloaderDependencyNotFoundError(GamdlDownloaderError):
     def __init__(self, dependency_name: str) -> None:
         super().__init__(f"Required dependency not found: {dependency_name}")
+
+
+class GamdlDownloaderIncompleteDownloadError(GamdlDownloaderError):
+    def __init__(self, file_path: str, expected_size: int, actual_size: int) -> None:
+        super().__init__(
+            f"Downloaded file size mismatch (expected {expected_size} bytes, "
+            f"got {actual_size} bytes): {file_path}"
+        )
@@ -0,0 +1,128 @@
+import asyncio
+import contextvars
+import functools
+import os
+import shutil
+import threading
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from ..tracing import tracer
+
+
+class FilesystemService:
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max_workers
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="gamdl_filesystem",
+        )
+        self._created_dirs: set[str] = set()
+        self._created_dirs_lock = threading.Lock()
+
+    async def run(
+        self,
+        func: typing.Callable[..., typing.Any],
+        *args: typing.Any,
+        **kwargs: typing.Any,
+    ) -> typing.Any:
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor,
+            functools.partial(
+                contextvars.copy_context().run,
+                tracer.wrap(func, getattr(func, "__name__", "filesystem")),
+                *args,
+                **kwargs,
+            ),
+        )
+
+    def _is_created_dir(self, path: str | Path) -> bool:
+        with self._created_dirs_lock:
+            return os.path.abspath(path) in self._created_dirs
+
+    def mkdir_sync(self, path: str | Path) -> None:
+        path_str = os.path.abspath(path)
+        if self._is_created_dir(path_str):
+            return
+
+        path_obj = Path(path_str)
+        path_obj.mkdir(parents=True, exist_ok=True)
+        with self._created_dirs_lock:
+            self._created_dirs.add(path_str)
+            self._created_dirs.update(str(parent) for parent in path_obj.parents)
+
+    def _forget_dirs(self, path: str | Path) -> None:
+        path_str = os.path.abspath(path)
+        with self._created_dirs_lock:
+            self._created_dirs.difference_update(
+                [
+                    created_dir
+                    for created_dir in self._created_dirs
+                    if created_dir == path_str
+                    or created_dir.startswith(path_str + os.sep)
+                ]
+            )
+
+    async def mkdir(self, path: str | Path) -> None:
+        if self._is_created_dir(path):
+            return
+
+        await self.run(self.mkdir_sync, path)
+
+    def run_in_dir_sync(
+        self,
+        path: str | Path,
+        func: typing.Callable[..., typing.Any],
+        *args: typing.Any,
+    ) -> typing.Any:
+        self.mkdir_sync(path)
+        try:
+            return func(*args)
+        except FileNotFoundError:
+            if os.path.isdir(path):
+                raise
+
+        # The directory was removed outside of gamdl after it was cached
+        self._forget_dirs(path)
+        self.mkdir_sync(path)
+        return func(*args)
+
+    async def exists(self, path: str | Path) -> bool:
+        return await self.run(os.path.exists, path)
+
+    async def exists_many(self, paths: list[str | Path | None]) -> list[bool]:
+        return await self.run(
+            lambda: [path is not None and os.path.exists(path) for path in paths]
+        )
+
+    @staticmethod
+    def _write_file(path: str | Path, data: str | bytes) -> None:
+        if isinstance(data, bytes):
+            with open(path, "wb") as file:
+                file.write(data)
+        else:
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(data)
+
+    def _write(self, path: str | Path, data: str | bytes) -> None:
+        self.run_in_dir_sync(Path(path).parent, self._write_file, path, data)
+
+    async def write_bytes(self, path: str | Path, data: bytes) -> None:
+        await self.run(self._write, path, data)
+
+    async def write_text(self, path: str | Path, text: str) -> None:
+        await self.run(self._write, path, text)
+
+    def _rmtree(self, path: str | Path) -> bool:
+        self._forget_dirs(path)
+
+        if not os.path.isdir(path):
+            return False
+
+        shutil.rmtree(path, ignore_errors=True)
+        return True
+
+    async def rmtree(self, path: str | Path) -> bool:
+        return await self.run(self._rmtree, path)
@@ -24,7 +24,10 @@ class AppleMusicMusicVideoDownloader:
         staged_path: str,
         decryption_key: DecryptionKeyAv,
         is_m4v: bool = False,
+        ilst: bytes | None = None,
     ):
+        await self.base.filesystem.mkdir(Path(staged_path).parent)
+
         await decrypt_and_mux_hex(
             decryption_key.audio_track.key,
             encrypted_path_audio,
@@ -32,6 +35,8 @@ class AppleMusicMusicVideoDownloader:
             decryption_key.video_track.key,
             encrypted_path_video,
             m4v_brand=is_m4v,
+            ilst=ilst,
+            decrypt_threads=self.base.decrypt_threads,
         )
 
     def get_cover_path(
@@ -47,10 +52,9 @@ class AppleMusicMusicVideoDownloader:
     ) -> DownloadItem:
         download_item = DownloadItem(media)
 
-        download_item.staged_path = self.base.get_temp_path(
+        download_item.staged_path = self.base.get_staged_path(
             media.media_metadata["id"],
             download_item.uuid_,
-            "staged",
             "." + media.stream_info.file_format.value,
         )
 
@@ -98,14 +102,6 @@ class AppleMusicMusicVideoDownloader:
             encrypted_path_audio,
         )
 
-        await self.stage(
-            encrypted_path_video,
-            encrypted_path_audio,
-            download_item.staged_path,
-            download_item.media.decryption_key,
-            download_item.staged_path.endswith(".m4v"),
-        )
-
         cover_bytes = (
             await self.base.interface.base.get_cover_bytes(
                 download_item.media.cover.url
@@ -113,8 +109,12 @@ class AppleMusicMusicVideoDownloader:
             if self.base.interface.base.cover_format != CoverFormat.RAW
             else None
         )
-        await self.base.apply_tags(
+
+        await self.stage(
+            encrypted_path_video,
+            encrypted_path_audio,
             download_item.staged_path,
-            download_item.media.tags,
-            cover_bytes,
+            download_item.media.decryption_key,
+            download_item.staged_path.endswith(".m4v"),
+            self.base.get_ilst(download_item.media.tags, cover_bytes),
         )
@@ -0,0 +1,148 @@
+import typing
+
+from ..interface.types import MediaTags, PlaylistTags
+from ..utils import CustomStringFormatter
+
+PLAYLIST_TEMPLATE_FIELDS = {
+    "playlist_artist": (1, "artist", "Unknown Playlist Artist"),
+    "playlist_id": (1, "playlist_id", "Unknown Playlist ID"),
+    "playlist_title": (1, "title", "Unknown Playlist Title"),
+    "playlist_track": (1, "track", ""),
+}
+MEDIA_TEMPLATE_FIELDS = {
+    "album": (0, "album", "Unknown Album"),
+    "album_artist": (0, "album_artist", "Unknown Artist"),
+    "album_id": (0, "album_id", "Unknown Album ID"),
+    "artist": (0, "artist", "Unknown Artist"),
+    "artist_id": (0, "artist_id", "Unknown Artist ID"),
+    "composer": (0, "composer", "Unknown Composer"),
+    "composer_id": (0, "composer_id", "Unknown Composer ID"),
+    "date": (0, "date", "Unknown Date"),
+    "disc": (0, "disc", ""),
+    "disc_total": (0, "disc_total", ""),
+    "media_type": (0, "media_type", "Unknown Media Type"),
+    **PLAYLIST_TEMPLATE_FIELDS,
+    "title": (0, "title", "Unknown Title"),
+    "title_id": (0, "title_id", "Unknown Title ID"),
+    "track": (0, "track", ""),
+    "track_total": (0, "track_total", ""),
+}
+
+
+class PathTemplate:
+    def __init__(
+        self,
+        template: str,
+        fields: dict[str, tuple[int, str, str]],
+    ):
+        self.template = template
+
+        self._formatter = CustomStringFormatter()
+        self._parts = [self._compile_part(part) for part in template.split("/")]
+        self._field_accessors = [
+            (field_name, *fields[field_name])
+            for field_name in self._get_field_names()
+            if field_name in fields
+        ]
+
+    def _compile_part(self, part: str) -> str | list[tuple]:
+        segments = list(self._formatter.parse(part))
+
+        for _, field_name, format_spec, _ in segments:
+            if field_name is None:
+                continue
+            if not field_name.isidentifier() or "{" in format_spec:
+                # Attribute access, indexing and nested specs go through the
+                # regular formatter
+                return part
+
+        return segments
+
+    def _get_field_names(self) -> list[str]:
+        field_names = []
+
+        for part in self._parts:
+            segments = self._formatter.parse(part) if isinstance(part, str) else part
+            for _, field_name, format_spec, _ in segments:
+                for name in (field_name, *self._get_nested_field_names(format_spec)):
+                    if not name:
+                        continue
+                    name = name.split(".", 1)[0].split("[", 1)[0]
+                    if name not in field_names:
+                        field_names.append(name)
+
+        return field_names
+
+    def _get_nested_field_names(self, format_spec: str | None) -> list[str]:
+        if not format_spec or "{" not in format_spec:
+            return []
+
+        return [
+            field_name
+            for _, field_name, _, _ in self._formatter.parse(format_spec)
+            if field_name
+        ]
+
+    def _get_fields(
+        self,
+        tags: MediaTags | None,
+        playlist_tags: PlaylistTags | None,
+    ) -> dict[str, tuple[typing.Any, str]]:
+        sources = (tags, playlist_tags)
+
+        return {
+            field_name: (
+                (
+                    getattr(sources[source], attribute)
+                    if sources[source] is not None
+                    else None
+                ),
+                fallback,
+            )
+            for field_name, source, attribute, fallback in self._field_accessors
+        }
+
+    def _render_part(
+        self,
+        part: str | list[tuple],
+        fields: dict[str, tuple[typing.Any, str]],
+    ) -> str:
+        if isinstance(part, str):
+            return self._formatter.vformat(part, (), fields)
+
+        rendered = []
+        for literal, field_name, format_spec, conversion in part:
+            rendered.append(literal)
+            if field_name is None:
+                continue
+
+            value = fields[field_name]
+            if conversion:
+                value = self._formatter.convert_field(value, conversion)
+            elif value[0] is None:
+                rendered.append(value[1])
+                continue
+            elif not format_spec and isinstance(value[0], str):
+                rendered.append(value[0])
+                continue
+            rendered.append(self._formatter.format_field(value, format_spec))
+
+        return "".join(rendered)
+
+    def render(
+        self,
+        tags: MediaTags | None,
+        playlist_tags: PlaylistTags | None,
+        sanitize: typing.Callable[[str, str | None], str],
+        file_extension: str | None = None,
+    ) -> list[str]:
+        fields = self._get_fields(tags, playlist_tags)
+        last_index = len(self._parts) - 1
+
+        return [
+            sanitize(
+                self._render_part(part, fields),
+                file_extension if i == last_index else None,
+            )
+            for i, part in enumerate(self._parts)
+        ]
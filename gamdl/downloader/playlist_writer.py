@@ -0,0 +1,84 @@
+import asyncio
+import os
+import time
+from pathlib import Path
+
+import structlog
+
+from ..metrics import metrics
+from .constants import PLAYLIST_FILE_FLUSH_INTERVAL
+from .filesystem import FilesystemService
+
+logger = structlog.get_logger(__name__)
+
+
+class PlaylistFileWriter:
+    def __init__(
+        self,
+        playlist_file_path: str,
+        filesystem: FilesystemService,
+    ):
+        self.playlist_file_path = playlist_file_path
+        self.filesystem = filesystem
+
+        self._lines = None
+        self._dirty = False
+        self._last_flush = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _read_lines(self) -> list[str]:
+        playlist_file_path_obj = Path(self.playlist_file_path)
+        if not playlist_file_path_obj.exists():
+            return []
+
+        with playlist_file_path_obj.open("r", encoding="utf8") as playlist_file:
+            return playlist_file.readlines()
+
+    def _write_lines(self, lines: list[str]) -> None:
+        self.filesystem.run_in_dir_sync(
+            Path(self.playlist_file_path).parent,
+            self._replace_lines,
+            lines,
+        )
+
+    def _replace_lines(self, lines: list[str]) -> None:
+        playlist_file_path_obj = Path(self.playlist_file_path)
+        partial_path = playlist_file_path_obj.with_name(
+            f".{playlist_file_path_obj.name}.tmp"
+        )
+        with partial_path.open("w", encoding="utf8") as playlist_file:
+            playlist_file.writelines(lines)
+        os.replace(partial_path, playlist_file_path_obj)
+
+    async def set_entry(self, playlist_track: int, entry: str) -> None:
+        async with self._lock:
+            if self._lines is None:
+                self._lines = await self.filesystem.run(self._read_lines)
+
+            if len(self._lines) < playlist_track:
+                self._lines.extend(
+                    "\n" for _ in range(playlist_track - len(self._lines))
+                )
+
+            self._lines[playlist_track - 1] = entry + "\n"
+            self._dirty = True
+
+        if time.monotonic() - self._last_flush >= PLAYLIST_FILE_FLUSH_INTERVAL:
+            await self.flush()
+
+    @metrics.timed("flush_playlist_file")
+    async def flush(self) -> None:
+        log = logger.bind(
+            action="flush_playlist_file",
+            playlist_file_path=self.playlist_file_path,
+        )
+
+        async with self._lock:
+            if not self._dirty:
+                return
+
+            await self.filesystem.run(self._write_lines, list(self._lines))
+            self._dirty = False
+            self._last_flush = time.monotonic()
+
+        log.debug("success", line_count=len(self._lines))
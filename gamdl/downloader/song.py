@@ -1,11 +1,19 @@
+from contextlib import AsyncExitStack
 from pathlib import Path
 
 import structlog
 
 from ..interface.enums import CoverFormat
 from ..interface.types import AppleMusicMedia, DecryptionKeyAv
-from .ammuxer import decrypt_and_mux_hex, decrypt_and_mux_wrapper
+from ..metrics import metrics
+from .ammuxer import (
+    create_fragmented_muxer,
+    decrypt_and_mux_hex,
+    decrypt_and_mux_wrapper,
+    defragment,
+)
 from .base import AppleMusicBaseDownloader
+from .enums import MuxMode
 from .types import DownloadItem
 
 logger = structlog.get_logger(__name__)
@@ -22,10 +30,9 @@ class AppleMusicSongDownloader:
         download_item = DownloadItem(media)
 
         if media.stream_info:
-            download_item.staged_path = self.base.get_temp_path(
+            download_item.staged_path = self.base.get_staged_path(
                 media.media_metadata["id"],
                 download_item.uuid_,
-                "staged",
                 "." + media.stream_info.file_format.value,
             )
 
@@ -58,19 +65,25 @@ class AppleMusicSongDownloader:
         media_id: str,
         fairplay_key: str,
         use_single_content_key: bool = False,
+        ilst: bytes | None = None,
+        input_buffer: bytearray | None = None,
+        is_library: bool = False,
     ) -> None:
-        wrapper_api = self.base.interface.base.wrapper_api
-        if wrapper_api is None:
-            raise ValueError("wrapper_api is required for FairPlay decrypt")
-
-        await decrypt_and_mux_wrapper(
-            wrapper_api,
-            media_id,
-            input_path,
-            output_path,
-            fairplay_key_audio=fairplay_key,
-            use_single_content_key=use_single_content_key,
-        )
+        async with self.base.wrapper_decrypt_target(is_library) as (
+            wrapper_api,
+            decrypt_session,
+        ):
+            await decrypt_and_mux_wrapper(
+                wrapper_api,
+                media_id,
+                input_path,
+                output_path,
+                fairplay_key_audio=fairplay_key,
+                use_single_content_key=use_single_content_key,
+                ilst=ilst,
+                input_audio_buffer=input_buffer,
+                decrypt_session=decrypt_session,
+            )
 
     async def _decrypt_ammuxer_hex(
         self,
@@ -80,6 +93,8 @@ class AppleMusicSongDownloader:
         *,
         use_cenc: bool = False,
         use_single_content_key: bool = False,
+        ilst: bytes | None = None,
+        input_buffer: bytearray | None = None,
     ) -> None:
         await decrypt_and_mux_hex(
             decryption_key,
@@ -87,8 +102,12 @@ class AppleMusicSongDownloader:
             output_path,
             use_cenc=use_cenc,
             use_single_content_key=use_single_content_key,
+            ilst=ilst,
+            input_audio_buffer=input_buffer,
+            decrypt_threads=self.base.decrypt_threads,
         )
 
+    @metrics.timed("stage_song")
     async def stage(
         self,
         encrypted_path: str,
@@ -98,6 +117,9 @@ class AppleMusicSongDownloader:
         fairplay_key: str = None,
         use_cenc: bool = False,
         use_single_content_key: bool = False,
+        ilst: bytes | None = None,
+        encrypted_buffer: bytearray | None = None,
+        is_library: bool = False,
     ):
         log = logger.bind(
             action="stage_song",
@@ -106,6 +128,8 @@ class AppleMusicSongDownloader:
             staged_path=staged_path,
         )
 
+        await self.base.filesystem.mkdir(Path(staged_path).parent)
+
         if decryption_key:
             await self._decrypt_ammuxer_hex(
                 encrypted_path,
@@ -113,6 +137,8 @@ class AppleMusicSongDownloader:
                 decryption_key.audio_track.key,
                 use_cenc=use_cenc,
                 use_single_content_key=use_single_content_key,
+                ilst=ilst,
+                input_buffer=encrypted_buffer,
             )
         else:
             await self._decrypt_ammuxer(
@@ -121,10 +147,14 @@ class AppleMusicSongDownloader:
                 media_id,
                 fairplay_key,
                 use_single_content_key=use_single_content_key,
+                ilst=ilst,
+                input_buffer=encrypted_buffer,
+                is_library=is_library,
             )
 
         log.debug("success")
 
+    @metrics.timed("get_synced_lyrics_path")
     def get_synced_lyrics_path(self, final_path: str) -> str:
         log = logger.bind(action="get_synced_lyrics_path", final_path=final_path)
 
@@ -138,6 +168,7 @@ class AppleMusicSongDownloader:
 
         return synced_lyrics_path
 
+    @metrics.timed("get_song_cover_path")
     def get_cover_path(
         self,
         final_path: str,
@@ -155,26 +186,126 @@ class AppleMusicSongDownloader:
 
         return cover_path
 
+    @metrics.timed("stream_stage_song")
+    async def stream_stage(
+        self,
+        stream_url: str,
+        staged_path: str,
+        media_id: str,
+        folder_tag: str,
+        decryption_key: DecryptionKeyAv | None = None,
+        fairplay_key: str = None,
+        use_cenc: bool = False,
+        use_single_content_key: bool = False,
+        ilst: bytes | None = None,
+        is_library: bool = False,
+    ) -> bool:
+        log = logger.bind(
+            action="stream_stage_song",
+            media_id=media_id,
+            staged_path=staged_path,
+            mux_mode=self.base.mux_mode.value,
+        )
+
+        await self.base.filesystem.mkdir(Path(staged_path).parent)
+
+        if self.base.mux_mode == MuxMode.FRAGMENTED:
+            fragmented_path = staged_path
+        else:
+            fragmented_path = self.base.get_temp_path(
+                media_id,
+                folder_tag,
+                "fragmented",
+                ".m4a",
+            )
+            await self.base.filesystem.mkdir(Path(fragmented_path).parent)
+
+        async with AsyncExitStack() as stack:
+            if decryption_key:
+                muxer = create_fragmented_muxer(
+                    fragmented_path,
+                    decryption_key=decryption_key.audio_track.key,
+                    use_cenc=use_cenc,
+                    use_single_content_key=use_single_content_key,
+                    ilst=ilst,
+                    decrypt_threads=self.base.decrypt_threads,
+                )
+            else:
+                _, decrypt_session = await stack.enter_async_context(
+                    self.base.wrapper_decrypt_target(is_library)
+                )
+                muxer = create_fragmented_muxer(
+                    fragmented_path,
+                    decrypt_session=decrypt_session,
+                    track_id=media_id,
+                    fairplay_key=fairplay_key,
+                    use_single_content_key=use_single_content_key,
+                    ilst=ilst,
+                )
+
+            if not await self.base.download_stream_to_muxer(stream_url, muxer):
+                log.debug("stream_not_used")
+                return False
+
+        if fragmented_path != staged_path:
+            await defragment(fragmented_path, staged_path, ilst)
+
+        log.debug("success")
+
+        return True
+
     async def download(
         self,
         download_item: DownloadItem,
     ) -> None:
+        cover_bytes = (
+            await self.base.interface.base.get_cover_bytes(
+                download_item.media.cover.url
+            )
+            if self.base.interface.base.cover_format != CoverFormat.RAW
+            else None
+        )
+
         if download_item.media.stream_info.audio_track.drm_free:
             await self.base.download_stream(
                 download_item.media.stream_info.audio_track.stream_url,
                 download_item.staged_path,
             )
+            await self.base.apply_tags(
+                download_item.staged_path,
+                download_item.media.tags,
+                cover_bytes,
+            )
         else:
+            ilst = self.base.get_ilst(download_item.media.tags, cover_bytes)
+            if self.base.mux_mode != MuxMode.STANDARD and await self.stream_stage(
+                download_item.media.stream_info.audio_track.stream_url,
+                download_item.staged_path,
+                download_item.media.media_id,
+                download_item.uuid_,
+                download_item.media.decryption_key,
+                download_item.media.stream_info.audio_track.fairplay_key,
+                download_item.media.stream_info.audio_track.use_cenc,
+                download_item.media.stream_info.audio_track.use_single_content_key,
+                ilst,
+                is_library=download_item.media.is_library,
+            ):
+                return
+
             encrypted_path = self.base.get_temp_path(
                 download_item.media.media_metadata["id"],
                 download_item.uuid_,
                 "encrypted",
                 ".m4a",
             )
-            await self.base.download_stream(
+            encrypted_buffer = await self.base.download_stream_to_memory(
                 download_item.media.stream_info.audio_track.stream_url,
-                encrypted_path,
             )
+            if encrypted_buffer is None:
+                await self.base.download_stream(
+                    download_item.media.stream_info.audio_track.stream_url,
+                    encrypted_path,
+                )
 
             await self.stage(
                 encrypted_path,
@@ -184,17 +315,7 @@ class AppleMusicSongDownloader:
                 download_item.media.stream_info.audio_track.fairplay_key,
                 download_item.media.stream_info.audio_track.use_cenc,
                 download_item.media.stream_info.audio_track.use_single_content_key,
+                ilst,
+                encrypted_buffer,
+                is_library=download_item.media.is_library,
             )
-
-        cover_bytes = (
-            await self.base.interface.base.get_cover_bytes(
-                download_item.media.cover.url
-            )
-            if self.base.interface.base.cover_format != CoverFormat.RAW
-            else None
-        )
-        await self.base.apply_tags(
-            download_item.staged_path,
-            download_item.media.tags,
-            cover_bytes,
-        )
@@ -13,3 +13,32 @@ class DownloadItem:
     playlist_file_path: str = None
     synced_lyrics_path: str = None
     cover_path: str = None
+
+
+@dataclass
+class LedgerEntry:
+    media_id: str
+    path: str
+    codec: str | None = None
+    size: int | None = None
+    mtime: float | None = None
+    content_hash: str | None = None
+    tag_version: str | None = None
+    album_id: int | None = None
+    artist_id: int | None = None
+
+
+@dataclass
+class DecryptMuxJob:
+    input_audio_path: str
+    output_path: str
+    decryption_key_audio: str | None = None
+    decryption_key_video: str | None = None
+    track_id: str | None = None
+    fairplay_key_audio: str | None = None
+    fairplay_key_video: str | None = None
+    input_video_path: str | None = None
+    use_cenc: bool = False
+    use_single_content_key: bool = False
+    m4v_brand: bool = False
+    ilst: bytes | None = None
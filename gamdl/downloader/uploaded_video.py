@@ -22,10 +22,9 @@ class AppleMusicUploadedVideoDownloader:
     ) -> DownloadItem:
         download_item = DownloadItem(media)
 
-        download_item.staged_path = self.base.get_temp_path(
+        download_item.staged_path = self.base.get_staged_path(
             media.media_metadata["id"],
             download_item.uuid_,
-            "staged",
             "." + media.stream_info.file_format.value,
         )
 
@@ -13,9 +13,11 @@ from pywidevine.license_protocol_pb2 import WidevinePsshData
 
 from gamdl.interface.wvd import WVD
 
+from ..api.account_pool import AppleMusicAccountPool
 from ..api.apple_music import AppleMusicApi
 from ..api.itunes import ItunesApi
 from ..api.wrapper import WrapperApi
+from ..metrics import metrics
 from .constants import IMAGE_FILE_EXTENSION_MAP
 from .enums import CoverFormat
 from .types import Cover, DecryptionKey, MediaRating, MediaTags, MediaType, PlaylistTags
@@ -32,6 +34,7 @@ class AppleMusicBaseInterface:
         cover_format: CoverFormat,
         cover_size: int,
         cdm: Cdm,
+        account_pool: AppleMusicAccountPool | None = None,
     ) -> None:
         self.apple_music_api = apple_music_api
         self.itunes_api = itunes_api
@@ -39,6 +42,7 @@ class AppleMusicBaseInterface:
         self.cover_size = cover_size
         self.cdm = cdm
         self.wrapper_api = wrapper_api
+        self.account_pool = account_pool
 
     @staticmethod
     def create_cdm(wvd_path: str | None = None) -> Cdm:
@@ -130,6 +134,7 @@ class AppleMusicBaseInterface:
         wvd_path: str | None = None,
         itunes_api: ItunesApi | None = None,
         wrapper_api: WrapperApi | None = None,
+        account_pool: AppleMusicAccountPool | None = None,
     ):
         itunes_api = itunes_api or await ItunesApi.create(
             storefront=apple_music_api.storefront,
@@ -149,9 +154,58 @@ class AppleMusicBaseInterface:
             cover_size=cover_size,
             cdm=cdm,
             wrapper_api=wrapper_api,
+            account_pool=account_pool,
         )
         return base
 
+    async def get_webplayback(
+        self,
+        track_id: str,
+        is_library: bool = False,
+    ) -> dict:
+        if self.account_pool is None:
+            return await self.apple_music_api.get_webplayback(track_id, is_library)
+
+        return await self.account_pool.call(
+            lambda account: account.apple_music_api.get_webplayback(
+                track_id,
+                is_library,
+            ),
+            primary=is_library,
+        )
+
+    async def get_wrapper_playback(self, media_id: str) -> dict:
+        if self.account_pool is None or not self.account_pool.has_wrapper_accounts:
+            return await self.wrapper_api.get_playback(media_id)
+
+        return await self.account_pool.call(
+            lambda account: account.wrapper_api.get_playback(media_id),
+            wrapper=True,
+        )
+
+    async def get_license_exchange(
+        self,
+        track_id: str,
+        track_uri: str,
+        challenge: str,
+        is_library: bool = False,
+    ) -> dict:
+        if self.account_pool is None:
+            return await self.apple_music_api.get_license_exchange(
+                track_id,
+                track_uri,
+                challenge,
+            )
+
+        return await self.account_pool.call(
+            lambda account: account.apple_music_api.get_license_exchange(
+                track_id,
+                track_uri,
+                challenge,
+            ),
+            primary=is_library,
+        )
+
     @alru_cache()
     async def get_album_cached(
         self,
@@ -159,10 +213,12 @@ class AppleMusicBaseInterface:
     ) -> dict | None:
         return (await self.apple_music_api.get_album(album_id))["data"][0]
 
+    @metrics.timed("get_decryption_key")
     async def get_decryption_key(
         self,
         pssh: str,
         track_id: str,
+        is_library: bool = False,
     ) -> DecryptionKey:
         log = logger.bind(action="get_decryption_key", track_id=track_id)
 
@@ -177,10 +233,11 @@ class AppleMusicBaseInterface:
                     self.cdm.get_license_challenge, cdm_session, pssh_obj
                 )
             ).decode()
-            license = await self.apple_music_api.get_license_exchange(
+            license = await self.get_license_exchange(
                 track_id,
                 pssh,
                 challenge,
+                is_library,
             )
 
             await asyncio.to_thread(
@@ -202,6 +259,7 @@ class AppleMusicBaseInterface:
         return decryption_key
 
     @alru_cache()
+    @metrics.timed("get_cover_bytes")
     async def get_cover_bytes(self, cover_url: str) -> bytes | None:
         log = logger.bind(action="get_cover_bytes", cover_url=cover_url)
 
@@ -242,6 +300,7 @@ class AppleMusicBaseInterface:
         )
 
     @alru_cache()
+    @metrics.timed("get_cover_file_extension")
     async def _get_cover_file_extension(
         self,
         cover_url: str,
@@ -262,6 +321,7 @@ class AppleMusicBaseInterface:
             f".{image_format.lower()}",
         )
 
+    @metrics.timed("get_cover")
     async def get_cover(
         self,
         metadata: dict,
@@ -292,6 +352,7 @@ class AppleMusicBaseInterface:
         return cover
 
     @alru_cache()
+    @metrics.timed("get_media_date")
     async def get_media_date(
         self,
         media_id: str,
@@ -314,6 +375,7 @@ class AppleMusicBaseInterface:
 
         return parsed_date
 
+    @metrics.timed("get_playlist_tags")
     def get_playlist_tags(
         self,
         playlist_metadata: dict,
@@ -335,6 +397,7 @@ class AppleMusicBaseInterface:
 
         return playlist_tags
 
+    @metrics.timed("get_tags_from_asset_info")
     async def get_tags_from_asset_info(
         self,
         asset_data: dict,
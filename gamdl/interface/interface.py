@@ -3,6 +3,8 @@ from typing import Any, AsyncGenerator, Callable
 
 import structlog
 
+from ..metrics import metrics
+from ..tracing import current_media_id
 from ..utils import safe_gather
 from .constants import VALID_URL_PATTERN
 from .enums import ArtistMediaType
@@ -33,6 +35,7 @@ class AppleMusicInterface:
             Callable[[ArtistMediaType, list[dict]], list[dict] | None] | None
         ) = None,
         flat_filter_function: Callable[[dict], Any] | None = None,
+        flat_filter_prefetch_function: Callable[[list[str]], Any] | None = None,
         concurrency: int = 1,
         disallowed_media_types: list[str] | None = None,
     ) -> None:
@@ -42,12 +45,14 @@ class AppleMusicInterface:
         self.artist_select_media_type_function = artist_select_media_type_function
         self.artist_select_items_function = artist_select_items_function
         self.flat_filter_function = flat_filter_function
+        self.flat_filter_prefetch_function = flat_filter_prefetch_function
         self.concurrency = concurrency
         self.disallowed_media_types = disallowed_media_types
 
         self.base = song.base
 
     @staticmethod
+    @metrics.timed("get_url_info")
     def get_url_info(url: str) -> AppleMusicUrlInfo | None:
         log = logger.bind(action="get_url_info", url=url)
 
@@ -76,6 +81,14 @@ class AppleMusicInterface:
         if result:
             raise GamdlInterfaceFlatFilterExcludedError(media.media_id, result)
 
+    async def _run_flat_filter_prefetch(self, tracks: list[dict]) -> None:
+        if not self.flat_filter_function or not self.flat_filter_prefetch_function:
+            return
+
+        result = self.flat_filter_prefetch_function([track["id"] for track in tracks])
+        if asyncio.iscoroutine(result):
+            await result
+
     def _run_media_type_filter(self, media: AppleMusicMedia) -> None:
         if not self.disallowed_media_types or not media.partial:
             return
@@ -103,6 +116,7 @@ class AppleMusicInterface:
         playlist_metadata: dict | None = None,
         is_library: bool = False,
     ) -> AsyncGenerator[AppleMusicMedia, None]:
+        current_media_id.set(media_id)
         media = AppleMusicMedia(
             media_id=media_id,
             is_library=is_library,
@@ -132,6 +146,7 @@ class AppleMusicInterface:
         playlist_metadata: dict | None = None,
         is_library: bool = False,
     ) -> AsyncGenerator[AppleMusicMedia, None]:
+        current_media_id.set(media_id)
         media = AppleMusicMedia(
             media_id=media_id,
             is_library=is_library,
@@ -160,6 +175,7 @@ class AppleMusicInterface:
         self,
         media_id: str,
     ) -> AsyncGenerator[AppleMusicMedia, None]:
+        current_media_id.set(media_id)
         media = AppleMusicMedia(
             media_id=media_id,
         )
@@ -207,6 +223,7 @@ class AppleMusicInterface:
         yield base_media
 
         tracks = base_media.media_metadata["relationships"]["tracks"]["data"]
+        await self._run_flat_filter_prefetch(tracks)
         tasks = [
             (
                 self._get_song_media(
@@ -280,6 +297,7 @@ class AppleMusicInterface:
 
         yield base_media
 
+        await self._run_flat_filter_prefetch(tracks)
         tasks = [
             (
                 self._get_song_media(
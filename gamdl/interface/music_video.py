@@ -5,6 +5,7 @@ from typing import AsyncGenerator, Callable
 import m3u8
 import structlog
 
+from ..metrics import metrics
 from .base import AppleMusicBaseInterface
 from .constants import MP4_FORMAT_CODECS
 from .enums import MediaRating, MediaType, MusicVideoCodec, MusicVideoResolution
@@ -56,6 +57,7 @@ class AppleMusicMusicVideoInterface:
         )
         return itunes_page["storePlatformData"]["product-dv"]["results"][url_media_id]
 
+    @metrics.timed("get_m3u8_master_url_from_webplayback")
     def _get_m3u8_master_url_from_webplayback(self, webplayback: dict) -> str:
         log = logger.bind(action="get_m3u8_master_url_from_webplayback")
 
@@ -65,6 +67,7 @@ class AppleMusicMusicVideoInterface:
 
         return m3u8_master_url
 
+    @metrics.timed("get_m3u8_master_url_from_itunes_page_metadata")
     def _get_m3u8_master_url_from_itunes_page_metadata(
         self,
         itunes_page_metadata: dict,
@@ -95,6 +98,7 @@ class AppleMusicMusicVideoInterface:
 
         return m3u8_master_url
 
+    @metrics.timed("get_music_video_tags")
     async def get_tags(
         self,
         metadata: dict,
@@ -166,13 +170,12 @@ class AppleMusicMusicVideoInterface:
                 itunes_page_metadata,
             )
 
-        webplayback_response = await self.base.apple_music_api.get_webplayback(
-            metadata["id"]
-        )
+        webplayback_response = await self.base.get_webplayback(metadata["id"])
         return self._get_m3u8_master_url_from_webplayback(
             webplayback_response["songList"][0],
         )
 
+    @metrics.timed("get_music_video_stream_info")
     async def _get_stream_info(
         self,
         media_id: str,
@@ -472,7 +475,7 @@ class AppleMusicMusicVideoInterface:
         itunes_page_metadata = await self.get_itunes_page_metadata(media.media_metadata)
 
         if self.base.wrapper_api:
-            playback = await self.base.wrapper_api.get_playback(media.media_id)
+            playback = await self.base.get_wrapper_playback(media.media_id)
             media.tags = await self.base.get_tags_from_asset_info(
                 playback["songList"][0]["assets"][0]["metadata"],
             )
@@ -10,6 +10,7 @@ from xml.etree import ElementTree
 import m3u8
 import structlog
 
+from ..metrics import metrics
 from .base import AppleMusicBaseInterface
 from .constants import DRM_DEFAULT_KEY_MAPPING, MP4_FORMAT_CODECS, SONG_CODEC_REGEX_MAP
 from .enums import SongCodec, SyncedLyricsFormat
@@ -47,6 +48,7 @@ class AppleMusicSongInterface:
         self.skip_stream_info = skip_stream_info
         self.ask_codec_function = ask_codec_function
 
+    @metrics.timed("get_lyrics")
     async def get_lyrics(
         self,
         song_metadata: dict,
@@ -198,6 +200,7 @@ class AppleMusicSongInterface:
             m3u8_master_url,
         )
 
+    @metrics.timed("get_m3u8_master_url_from_playback")
     def _get_m3u8_from_playback(self, playback: dict) -> str | None:
         log = logger.bind(action="get_m3u8_master_url_from_playback")
 
@@ -210,6 +213,7 @@ class AppleMusicSongInterface:
 
         log.debug("no_m3u8_master_url")
 
+    @metrics.timed("get_m3u8_master_url_from_assets")
     async def _get_m3u8_master_url_from_assets(
         self,
         media_id: str,
@@ -297,6 +301,7 @@ class AppleMusicSongInterface:
 
         return stream_info
 
+    @metrics.timed("get_song_stream_info")
     async def _get_stream_info_nonweb(
         self,
         m3u8_master_url: str | None,
@@ -342,6 +347,7 @@ class AppleMusicSongInterface:
             for playlist in m3u8_master_data.get("playlists", [])
         )
 
+    @metrics.timed("get_song_stream_info_enhanced")
     async def _get_stream_info_enhanced(
         self,
         m3u8_master_url: str,
@@ -372,6 +378,7 @@ class AppleMusicSongInterface:
 
         return stream_info
 
+    @metrics.timed("get_song_stream_info_nonenhanced")
     async def _get_stream_info_nonenhanced(
         self,
         m3u8_master_url: str,
@@ -562,6 +569,7 @@ class AppleMusicSongInterface:
                 return key.uri
         return None
 
+    @metrics.timed("get_web_song_stream_info")
     async def _get_web_stream_info(
         self,
         webplayback: dict | None,
@@ -606,6 +614,7 @@ class AppleMusicSongInterface:
 
         return stream_info_av
 
+    @metrics.timed("get_library_song_stream_info")
     async def _get_library_stream_info(
         self,
         webplayback: dict | None,
@@ -675,12 +684,12 @@ class AppleMusicSongInterface:
 
         if self.base.wrapper_api:
             playback = (
-                await self.base.wrapper_api.get_playback(media.media_id)
+                await self.base.get_wrapper_playback(media.media_id)
                 if not media.is_library
                 else None
             )
             webplayback = (
-                await self.base.apple_music_api.get_webplayback(
+                await self.base.get_webplayback(
                     media.media_id,
                     media.is_library,
                 )
@@ -690,7 +699,7 @@ class AppleMusicSongInterface:
             )
         else:
             playback = None
-            webplayback = await self.base.apple_music_api.get_webplayback(
+            webplayback = await self.base.get_webplayback(
                 media.media_id,
                 media.is_library,
             )
@@ -732,6 +741,7 @@ class AppleMusicSongInterface:
                     audio_track=await self.base.get_decryption_key(
                         media.stream_info.audio_track.widevine_pssh,
                         media.media_id,
+                        media.is_library,
                     )
                 )
 
@@ -4,6 +4,7 @@ from typing import AsyncGenerator
 
 import structlog
 
+from ..metrics import metrics
 from .base import AppleMusicBaseInterface
 from .constants import UPLOADED_VIDEO_QUALITY_RANK
 from .enums import UploadedVideoQuality
@@ -61,6 +62,7 @@ class AppleMusicUploadedVideoInterface:
 
         return stream_url
 
+    @metrics.timed("get_uploaded_video_stream_info")
     async def get_stream_info(
         self,
         metadata: dict,
@@ -87,6 +89,7 @@ class AppleMusicUploadedVideoInterface:
 
         return stream_info
 
+    @metrics.timed("get_uploaded_video_tags")
     def get_tags(self, metadata: dict) -> MediaTags:
         log = logger.bind(action="get_uploaded_video_tags", media_id=metadata["id"])
 
@@ -0,0 +1,208 @@
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from typing import Any, Callable, TypeVar
+
+from .profiling import profiler
+from .tracing import tracer
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+@dataclass
+class StageMetrics:
+    bucket_counts: list[int] = field(
+        default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1)
+    )
+    count: int = 0
+    errors: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    bytes: int = 0
+
+
+class _NullSpan:
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        return None
+
+
+class _Span:
+    def __init__(self, registry: "MetricsRegistry", stage: str):
+        self.registry = registry
+        self.stage = stage
+
+    def __enter__(self) -> "_Span":
+        self.trace_span = tracer.span(self.stage) if tracer.enabled else None
+        if self.trace_span is not None:
+            self.trace_span.__enter__()
+        self.traced_memory = profiler.stage_started()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self.registry.observe(
+            self.stage,
+            time.perf_counter() - self.start,
+            failed=exc_type is not None,
+        )
+        profiler.stage_finished(self.stage, self.traced_memory)
+        if self.trace_span is not None:
+            self.trace_span.__exit__(exc_type, exc, traceback)
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.enabled = False
+        self._stages: dict[str, StageMetrics] = {}
+        self._lock = threading.Lock()
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stages.clear()
+
+    def _get_stage(self, stage: str) -> StageMetrics:
+        stage_metrics = self._stages.get(stage)
+        if stage_metrics is None:
+            stage_metrics = self._stages[stage] = StageMetrics()
+        return stage_metrics
+
+    def observe(self, stage: str, seconds: float, failed: bool = False) -> None:
+        if not self.enabled:
+            return
+
+        with self._lock:
+            stage_metrics = self._get_stage(stage)
+            stage_metrics.bucket_counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            stage_metrics.count += 1
+            stage_metrics.errors += failed
+            stage_metrics.total_seconds += seconds
+            stage_metrics.max_seconds = max(stage_metrics.max_seconds, seconds)
+
+    def add_bytes(self, stage: str, size: int | None) -> None:
+        if not self.enabled or not size:
+            return
+
+        with self._lock:
+            self._get_stage(stage).bytes += size
+
+    def span(self, stage: str) -> _Span | _NullSpan:
+        if not (self.enabled or tracer.enabled or profiler.tracks_stages):
+            return _NULL_SPAN
+        return _Span(self, stage)
+
+    def timed(self, stage: str) -> Callable[[F], F]:
+        def decorator(func: F) -> F:
+            if inspect.iscoroutinefunction(func):
+
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    if not (self.enabled or tracer.enabled or profiler.tracks_stages):
+                        return await func(*args, **kwargs)
+                    with _Span(self, stage):
+                        return await func(*args, **kwargs)
+
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not (self.enabled or tracer.enabled or profiler.tracks_stages):
+                    return func(*args, **kwargs)
+                with _Span(self, stage):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def summary(self) -> dict[str, dict]:
+        with self._lock:
+            return {
+                stage: {
+                    "count": stage_metrics.count,
+                    "errors": stage_metrics.errors,
+                    "total_seconds": round(stage_metrics.total_seconds, 6),
+                    "mean_seconds": round(
+                        stage_metrics.total_seconds / stage_metrics.count, 6
+                    ),
+                    "max_seconds": round(stage_metrics.max_seconds, 6),
+                    "bytes": stage_metrics.bytes,
+                }
+                for stage, stage_metrics in sorted(self._stages.items())
+                if stage_metrics.count
+            }
+
+    def prometheus_text(self) -> str:
+        lines = [
+            "# HELP gamdl_stage_duration_seconds Time spent in each stage.",
+            "# TYPE gamdl_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            stages = sorted(self._stages.items())
+            for stage, stage_metrics in stages:
+                cumulative = 0
+                for bound, bucket_count in zip(
+                    (*LATENCY_BUCKETS, "+Inf"),
+                    stage_metrics.bucket_counts,
+                ):
+                    cumulative += bucket_count
+                    lines.append(
+                        "gamdl_stage_duration_seconds_bucket"
+                        f'{{stage="{stage}",le="{bound}"}} {cumulative}'
+                    )
+                lines.append(
+                    f'gamdl_stage_duration_seconds_sum{{stage="{stage}"}}'
+                    f" {stage_metrics.total_seconds}"
+                )
+                lines.append(
+                    f'gamdl_stage_duration_seconds_count{{stage="{stage}"}}'
+                    f" {stage_metrics.count}"
+                )
+
+            lines += [
+                "# HELP gamdl_stage_errors_total Stage calls that raised.",
+                "# TYPE gamdl_stage_errors_total counter",
+                *(
+                    f'gamdl_stage_errors_total{{stage="{stage}"}} {stage_metrics.errors}'
+                    for stage, stage_metrics in stages
+                ),
+                "# HELP gamdl_stage_bytes_total Bytes transferred by each stage.",
+                "# TYPE gamdl_stage_bytes_total counter",
+                *(
+                    f'gamdl_stage_bytes_total{{stage="{stage}"}} {stage_metrics.bytes}'
+                    for stage, stage_metrics in stages
+                    if stage_metrics.bytes
+                ),
+            ]
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
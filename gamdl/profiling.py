@@ -0,0 +1,307 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from dataclasses import dataclass
+from enum import Enum
+from types import FrameType
+
+PROFILE_CPU_INTERVAL = 0.005
+PROFILE_ALLOC_FRAMES = 16
+PROFILE_LOOP_LAG_INTERVAL = 0.01
+PROFILE_LOOP_LAG_THRESHOLD = 0.1
+PROFILE_REPORT_LIMIT = 20
+PROFILE_SUMMARY_LIMIT = 5
+PROFILE_IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("thread.py", "_worker"),
+}
+
+
+class ProfileMode(Enum):
+    CPU = "cpu"
+    ALLOC = "alloc"
+    LOOP_LAG = "loop-lag"
+
+
+@dataclass
+class LoopStall:
+    count: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    stack: tuple[str, ...] = ()
+
+
+def _format_frame(frame: FrameType) -> str:
+    return (
+        f"{frame.f_code.co_name} "
+        f"({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"
+    )
+
+
+def _collapse_stack(frame: FrameType | None) -> tuple[str, ...]:
+    stack = []
+    while frame is not None:
+        stack.append(_format_frame(frame))
+        frame = frame.f_back
+    return tuple(reversed(stack))
+
+
+def _is_idle(frame: FrameType) -> bool:
+    return (
+        os.path.basename(frame.f_code.co_filename),
+        frame.f_code.co_name,
+    ) in PROFILE_IDLE_FRAMES
+
+
+class Profiler:
+    def __init__(self):
+        self.mode: ProfileMode | None = None
+        self.path = None
+        self.tracks_stages = False
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+        self._cpu_samples: Counter[str] = Counter()
+
+        self._snapshots: list[tuple[str, tracemalloc.Snapshot]] = []
+        self._stage_memory: dict[str, list[int]] = {}
+
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread_id = 0
+        self._heartbeat: asyncio.TimerHandle | None = None
+        self._last_beat = 0.0
+        self._stall_samples: Counter[tuple[str, ...]] = Counter()
+        self._stalls: dict[str, LoopStall] = {}
+
+    def start(self, mode: ProfileMode, path: str) -> None:
+        self.mode = mode
+        self.path = path
+        self._stop_event.clear()
+
+        if mode == ProfileMode.CPU:
+            target = self._sample_cpu
+        elif mode == ProfileMode.ALLOC:
+            tracemalloc.start(PROFILE_ALLOC_FRAMES)
+            self._snapshots = [("start", self._take_snapshot())]
+            self._stage_memory = {}
+            self.tracks_stages = True
+            return
+        else:
+            self._loop = asyncio.get_running_loop()
+            self._loop_thread_id = threading.get_ident()
+            self._last_beat = time.monotonic()
+            self._heartbeat = self._loop.call_later(
+                PROFILE_LOOP_LAG_INTERVAL,
+                self._beat,
+                self._loop.time() + PROFILE_LOOP_LAG_INTERVAL,
+            )
+            target = self._watch_loop
+
+        self._thread = threading.Thread(
+            target=target,
+            name="gamdl-profiler",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self) -> list[str]:
+        if self.mode is None:
+            return []
+
+        mode, self.mode = self.mode, None
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+
+        if mode == ProfileMode.CPU:
+            return self._write_cpu_profile()
+        if mode == ProfileMode.ALLOC:
+            self.checkpoint("stop")
+            self.tracks_stages = False
+            tracemalloc.stop()
+            return self._write_alloc_report()
+        return self._write_loop_lag_report()
+
+    def _write_lines(self, lines: list[str]) -> None:
+        with open(self.path, "w", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+
+    def _sample_cpu(self) -> None:
+        own_thread_id = threading.get_ident()
+        while not self._stop_event.wait(PROFILE_CPU_INTERVAL):
+            thread_names = {
+                thread.ident: thread.name for thread in threading.enumerate()
+            }
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread_id or _is_idle(frame):
+                    continue
+                stack = ";".join(
+                    (
+                        thread_names.get(thread_id, str(thread_id)),
+                        *_collapse_stack(frame),
+                    )
+                )
+                self._cpu_samples[stack] += 1
+
+    def _write_cpu_profile(self) -> list[str]:
+        self._write_lines(
+            [f"{stack} {count}" for stack, count in self._cpu_samples.items()]
+        )
+
+        totals: Counter[str] = Counter()
+        for stack, count in self._cpu_samples.items():
+            totals[stack.rsplit(";", 1)[-1]] += count
+        samples = sum(totals.values()) or 1
+        return [
+            f"{count / samples:6.1%} {frame}"
+            for frame, count in totals.most_common(PROFILE_SUMMARY_LIMIT)
+        ]
+
+    def checkpoint(self, label: str) -> None:
+        if not self.tracks_stages:
+            return
+
+        snapshot = self._take_snapshot()
+        with self._lock:
+            self._snapshots.append((label, snapshot))
+
+    @staticmethod
+    def _take_snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+            )
+        )
+
+    def stage_started(self) -> int | None:
+        if not self.tracks_stages:
+            return None
+        return tracemalloc.get_traced_memory()[0]
+
+    def stage_finished(self, stage: str, traced_memory: int | None) -> None:
+        if traced_memory is None or not self.tracks_stages:
+            return
+
+        # Process-wide delta: concurrent stages and tasks are included
+        growth = tracemalloc.get_traced_memory()[0] - traced_memory
+        with self._lock:
+            stage_memory = self._stage_memory.setdefault(stage, [0, 0])
+            stage_memory[0] += 1
+            stage_memory[1] += growth
+
+    def _write_alloc_report(self) -> list[str]:
+        baseline = self._snapshots[0][1]
+        lines = [
+            "# Process-wide traced memory growth while each stage was open",
+            "# Stages overlap under concurrency, so these are not per-stage figures",
+            "# calls growth_bytes stage",
+        ]
+        for stage, (calls, growth) in sorted(
+            self._stage_memory.items(),
+            key=lambda item: item[1][1],
+            reverse=True,
+        ):
+            lines.append(f"{calls:>8} {growth:>14} {stage}")
+
+        summary = []
+        previous = baseline
+        for label, snapshot in self._snapshots[1:]:
+            lines += ["", f"# Top allocators since the previous snapshot at {label}"]
+            for diff in snapshot.compare_to(previous, "traceback")[
+                :PROFILE_REPORT_LIMIT
+            ]:
+                lines.append(
+                    f"{diff.size_diff:>+14} B {diff.count_diff:>+8} blocks "
+                    f"{diff.size:>14} B total"
+                )
+                lines += [f"    {line}" for line in diff.traceback.format(limit=4)]
+            previous = snapshot
+
+        for diff in self._snapshots[-1][1].compare_to(baseline, "lineno")[
+            :PROFILE_SUMMARY_LIMIT
+        ]:
+            frame = diff.traceback[0]
+            summary.append(
+                f"{diff.size_diff / 1024:+10.1f} KiB "
+                f"{os.path.basename(frame.filename)}:{frame.lineno}"
+            )
+
+        self._snapshots = []
+        self._write_lines(lines)
+        return summary
+
+    def _beat(self, expected: float) -> None:
+        now = self._loop.time()
+        lag = now - expected
+        self._last_beat = time.monotonic()
+
+        if lag >= PROFILE_LOOP_LAG_THRESHOLD:
+            with self._lock:
+                stall_samples, self._stall_samples = self._stall_samples, Counter()
+            stack = (
+                stall_samples.most_common(1)[0][0]
+                if stall_samples
+                else ("<unsampled>",)
+            )
+            stall = self._stalls.setdefault(stack[-1], LoopStall(stack=stack))
+            stall.count += 1
+            stall.total_seconds += lag
+            stall.max_seconds = max(stall.max_seconds, lag)
+        else:
+            with self._lock:
+                self._stall_samples.clear()
+
+        self._heartbeat = self._loop.call_later(
+            PROFILE_LOOP_LAG_INTERVAL,
+            self._beat,
+            now + PROFILE_LOOP_LAG_INTERVAL,
+        )
+
+    def _watch_loop(self) -> None:
+        while not self._stop_event.wait(PROFILE_LOOP_LAG_INTERVAL):
+            if time.monotonic() - self._last_beat < PROFILE_LOOP_LAG_THRESHOLD:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            with self._lock:
+                self._stall_samples[_collapse_stack(frame)] += 1
+
+    def _write_loop_lag_report(self) -> list[str]:
+        stalls = sorted(
+            self._stalls.values(),
+            key=lambda stall: stall.total_seconds,
+            reverse=True,
+        )
+        lines = [
+            f"# Event loop stalls of at least {PROFILE_LOOP_LAG_THRESHOLD}s",
+            "# count total_seconds max_seconds call_site",
+        ]
+        for stall in stalls:
+            lines.append(
+                f"{stall.count:>7} {stall.total_seconds:>13.3f} "
+                f"{stall.max_seconds:>11.3f} {stall.stack[-1]}"
+            )
+            lines += [f"    {frame}" for frame in reversed(stall.stack)]
+
+        self._stalls = {}
+        self._write_lines(lines)
+        return [
+            f"{stall.total_seconds:8.3f}s in {stall.count} stall(s) "
+            f"at {stall.stack[-1]}"
+            for stall in stalls[:PROFILE_SUMMARY_LIMIT]
+        ]
+
+
+profiler = Profiler()
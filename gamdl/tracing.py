@@ -0,0 +1,172 @@
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, TypeVar
+
+import httpx
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+current_media_id: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "current_media_id",
+    default=None,
+)
+_current_stage: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "current_stage",
+    default=None,
+)
+_current_task: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "current_task",
+    default=None,
+)
+
+
+class _TraceSpan:
+    def __init__(self, tracer: "Tracer", name: str, args: dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self) -> "_TraceSpan":
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+
+        self.args["media_id"] = current_media_id.get()
+        self.args["parent"] = _current_stage.get()
+        if task is not None:
+            self.args["task"] = task.get_name()
+            self.event_id = hex(id(task))
+            self._task_token = _current_task.set(self.args["task"])
+        else:
+            self.args["task"] = _current_task.get()
+            self.event_id = None
+            self._task_token = None
+        self._stage_token = _current_stage.set(self.name)
+
+        self.tracer._emit(
+            self.name, "b" if self.event_id else "B", self.event_id, self.args
+        )
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        _current_stage.reset(self._stage_token)
+        if self._task_token is not None:
+            _current_task.reset(self._task_token)
+        self.tracer._emit(
+            self.name,
+            "e" if self.event_id else "E",
+            self.event_id,
+            {"error": exc_type.__name__} if exc_type else {},
+        )
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self._events: list[dict] = []
+        self._thread_names: dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._origin = 0.0
+        self._httpx_send = None
+
+    def start(self, path: str) -> None:
+        self.path = path
+        self._events = []
+        self._thread_names = {}
+        self._origin = time.perf_counter()
+
+        self._httpx_send = httpx.AsyncClient.send
+        httpx_send = self._httpx_send
+
+        @functools.wraps(httpx_send)
+        async def traced_send(client, request, *args, **kwargs):
+            with self.span(
+                f"{request.method} {request.url.host}",
+                url=str(request.url.copy_with(query=None)),
+            ):
+                return await httpx_send(client, request, *args, **kwargs)
+
+        httpx.AsyncClient.send = traced_send
+        self.enabled = True
+
+    def stop(self) -> None:
+        if not self.enabled:
+            return
+
+        self.enabled = False
+        httpx.AsyncClient.send = self._httpx_send
+
+        pid = os.getpid()
+        with self._lock:
+            events = [
+                {
+                    "name": "process_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "args": {"name": f"gamdl {pid}"},
+                },
+                *(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": pid,
+                        "tid": tid,
+                        "args": {"name": name},
+                    }
+                    for tid, name in self._thread_names.items()
+                ),
+                *self._events,
+            ]
+            self._events = []
+
+        with open(self.path, "w", encoding="utf-8") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+    def _emit(
+        self,
+        name: str,
+        phase: str,
+        event_id: str | None,
+        args: dict[str, Any],
+    ) -> None:
+        tid = threading.get_native_id()
+        event = {
+            "name": name,
+            "cat": "gamdl",
+            "ph": phase,
+            "ts": (time.perf_counter() - self._origin) * 1_000_000,
+            "pid": os.getpid(),
+            "tid": tid,
+            "args": args,
+        }
+        if event_id is not None:
+            event["id"] = event_id
+
+        with self._lock:
+            if tid not in self._thread_names:
+                self._thread_names[tid] = threading.current_thread().name
+            self._events.append(event)
+
+    def span(self, name: str, **args: Any) -> _TraceSpan:
+        return _TraceSpan(self, name, args)
+
+    def wrap(self, func: F, name: str) -> F:
+        if not self.enabled:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+
+tracer = Tracer()
@@ -0,0 +1,105 @@
+import argparse
+import logging
+import time
+from typing import Callable
+
+import structlog
+
+from gamdl.interface.types import MediaTags
+from test_path_template import (
+    create_base_downloader,
+    legacy_format_parts,
+    legacy_media_fields,
+)
+
+
+def create_library(track_count: int) -> list[MediaTags]:
+    return [
+        MediaTags(
+            album=f"Album {index // 12}",
+            album_artist=f"Artist {index // 120}",
+            artist=f"Artist {index // 120}",
+            disc=1,
+            disc_total=1,
+            title=f"Song {index}",
+            track=index % 12 + 1,
+        )
+        for index in range(track_count)
+    ]
+
+
+def time_library(
+    render: Callable[[MediaTags], object],
+    library: list[MediaTags],
+    repeat: int,
+) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for tags in library:
+            render(tags)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare compiled path templates with the legacy formatter"
+    )
+    parser.add_argument("--tracks", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    structlog.configure(
+        wrapper_class=structlog.make_filtering_bound_logger(logging.INFO)
+    )
+
+    downloader = create_base_downloader()
+    library = create_library(args.tracks)
+    template_parts = downloader.album_folder_template.split(
+        "/"
+    ) + downloader.single_disc_file_template.split("/")
+
+    def render_legacy(tags: MediaTags) -> list[str]:
+        return legacy_format_parts(
+            template_parts,
+            legacy_media_fields(tags, None),
+            downloader._sanitize_string,
+            ".m4a",
+        )
+
+    def render_compiled(tags: MediaTags) -> list[str]:
+        return downloader._album_folder_template.render(
+            tags,
+            None,
+            downloader._sanitize_path_part,
+        ) + downloader._single_disc_file_template.render(
+            tags,
+            None,
+            downloader._sanitize_path_part,
+            ".m4a",
+        )
+
+    for tags in library[:1000]:
+        assert render_legacy(tags) == render_compiled(tags)
+
+    results = {
+        "legacy": time_library(render_legacy, library, args.repeat),
+        "compiled": time_library(render_compiled, library, args.repeat),
+        "get_final_path": time_library(
+            lambda tags: downloader.get_final_path(tags, ".m4a", None),
+            library,
+            args.repeat,
+        ),
+    }
+
+    for name, seconds in results.items():
+        print(
+            f"{name:>14}: {seconds:.3f}s for {args.tracks} tracks, "
+            f"{seconds / args.tracks * 1_000_000:.2f}us per track"
+        )
+    print(f"{'speedup':>14}: {results['legacy'] / results['compiled']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import pytest
+
+from gamdl.api.account_pool import AppleMusicAccountPool, PoolAccount
+from gamdl.api.exceptions import GamdlApiResponseError
+
+
+class FakeAppleMusicApi:
+    def __init__(self, status_code: int | None = None):
+        self.status_code = status_code
+        self.calls = []
+
+    async def get_webplayback(self, track_id: str, is_library: bool = False) -> dict:
+        self.calls.append((track_id, is_library))
+        if self.status_code is not None:
+            raise GamdlApiResponseError(
+                "Error getting webplayback",
+                status_code=self.status_code,
+            )
+        return {"songList": [{"songId": track_id}]}
+
+
+def create_pool(*status_codes: int | None) -> AppleMusicAccountPool:
+    return AppleMusicAccountPool(
+        [
+            PoolAccount(f"account-{index}", FakeAppleMusicApi(status_code))
+            for index, status_code in enumerate(status_codes)
+        ]
+    )
+
+
+def get_webplayback(pool: AppleMusicAccountPool, is_library: bool = False):
+    return pool.call(
+        lambda account: account.apple_music_api.get_webplayback(
+            "1001",
+            is_library,
+        ),
+        primary=is_library,
+    )
+
+
+@pytest.mark.parametrize("status_code", [401, 429])
+async def test_call_fails_over_and_pauses_account(status_code: int):
+    pool = create_pool(status_code, None)
+
+    assert await get_webplayback(pool) == {"songList": [{"songId": "1001"}]}
+    assert [account.failovers for account in pool.accounts] == [1, 0]
+    assert not pool.accounts[0].healthy
+    assert pool.acquire().name == "account-1"
+
+
+async def test_call_does_not_fail_over_on_other_errors():
+    pool = create_pool(404, None)
+
+    with pytest.raises(GamdlApiResponseError):
+        await get_webplayback(pool)
+
+    assert pool.accounts[1].apple_music_api.calls == []
+    assert pool.accounts[0].healthy
+
+
+async def test_call_raises_when_every_account_fails_over():
+    pool = create_pool(429, 429)
+
+    with pytest.raises(GamdlApiResponseError):
+        await get_webplayback(pool)
+
+    assert [account.failovers for account in pool.accounts] == [1, 1]
+
+
+async def test_library_call_stays_on_primary_account():
+    pool = create_pool(None, None)
+    pool.accounts[0].in_flight = 1
+
+    await get_webplayback(pool, is_library=True)
+
+    assert pool.accounts[0].apple_music_api.calls == [("1001", True)]
+    assert pool.accounts[1].apple_music_api.calls == []
+
+
+async def test_library_call_does_not_fail_over():
+    pool = create_pool(429, None)
+
+    with pytest.raises(GamdlApiResponseError):
+        await get_webplayback(pool, is_library=True)
+
+    assert pool.accounts[1].apple_music_api.calls == []
@@ -0,0 +1,50 @@
+import threading
+from types import SimpleNamespace
+
+from gamdl.downloader import ammuxer as ammuxer_module
+from gamdl.downloader import decrypt_and_mux_many
+from gamdl.downloader.types import DecryptMuxJob
+
+
+async def test_decrypt_and_mux_many_keeps_job_order(tmp_path, monkeypatch):
+    jobs = [
+        DecryptMuxJob(str(tmp_path / f"{index}.mp4"), str(tmp_path / f"{index}.m4a"))
+        for index in range(3)
+    ]
+    error = ValueError("bad key")
+    native_calls = []
+
+    def decrypt_and_mux_many_native(
+        native_jobs,
+        decrypt_host,
+        decrypt_port,
+        decrypt_session,
+        max_workers,
+        decrypt_threads,
+        progress,
+    ):
+        native_calls.append((native_jobs, decrypt_host, decrypt_port))
+        for index in (2, 0, 1):
+            progress(index, error if index == 1 else None)
+        return [None, error, None]
+
+    monkeypatch.setattr(
+        ammuxer_module,
+        "_ammuxer",
+        SimpleNamespace(decrypt_and_mux_many_native=decrypt_and_mux_many_native),
+    )
+    loop_thread = threading.get_ident()
+    progress_calls = []
+
+    def progress(index: int, error: Exception | None) -> None:
+        progress_calls.append((index, error, threading.get_ident()))
+
+    results = await decrypt_and_mux_many(jobs, progress=progress)
+
+    assert results == [None, error, None]
+    assert native_calls == [(jobs, None, None)]
+    assert progress_calls == [
+        (2, None, loop_thread),
+        (0, None, loop_thread),
+        (1, error, loop_thread),
+    ]
@@ -0,0 +1,126 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from gamdl.cli.database import Database
+from gamdl.downloader import downloader as downloader_module
+from gamdl.downloader import AppleMusicDownloader, DownloadItem
+from gamdl.downloader.enums import ContentStoreMode
+from gamdl.downloader.exceptions import GamdlDownloaderMediaFileExistsError
+from gamdl.downloader.filesystem import FilesystemService
+from gamdl.interface.types import AppleMusicMedia, MediaTags, StreamInfo, StreamInfoAv
+
+CONTENT_KEY = ("1001", "alac.m4a", "tag-hash")
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(tmp_path / "gamdl.db", overwrite=False)
+    yield database
+    database.close()
+
+
+def create_downloader(
+    database: Database,
+    content_store_mode: ContentStoreMode = ContentStoreMode.HARDLINK,
+) -> AppleMusicDownloader:
+    base = SimpleNamespace(
+        filesystem=FilesystemService(),
+        get_tag_hash=lambda tags, cover_url: CONTENT_KEY[2],
+    )
+    return AppleMusicDownloader(
+        song=SimpleNamespace(base=base),
+        music_video=None,
+        uploaded_video=None,
+        content_store_mode=content_store_mode,
+        content_store_get_function=database.get_content,
+        content_store_add_function=database.add_content,
+    )
+
+
+def create_item(final_path: str) -> DownloadItem:
+    return DownloadItem(
+        AppleMusicMedia(
+            "1001",
+            partial=False,
+            media_metadata={"id": "1001", "type": "songs"},
+            tags=MediaTags(title="First"),
+            stream_info=StreamInfoAv(audio_track=StreamInfo(codec="alac")),
+        ),
+        final_path=final_path,
+    )
+
+
+async def test_existing_file_is_registered_in_content_store(tmp_path, database):
+    final_path = tmp_path / "Album" / "01 First.m4a"
+    final_path.parent.mkdir()
+    final_path.write_bytes(b"audio")
+
+    with pytest.raises(GamdlDownloaderMediaFileExistsError):
+        await create_downloader(database)._download(create_item(str(final_path)))
+
+    assert database.get_content(*CONTENT_KEY) == str(final_path)
+
+
+async def test_existing_content_is_linked_into_a_new_path(tmp_path, database):
+    content_path = tmp_path / "Album" / "01 First.m4a"
+    content_path.parent.mkdir()
+    content_path.write_bytes(b"audio")
+    database.add_content(*CONTENT_KEY, str(content_path))
+    final_path = tmp_path / "Playlist" / "01 First.m4a"
+
+    await create_downloader(database)._download(create_item(str(final_path)))
+
+    assert final_path.read_bytes() == b"audio"
+    assert final_path.stat().st_ino == content_path.stat().st_ino
+
+
+async def test_content_store_lookup_runs_off_the_event_loop(tmp_path, database):
+    loop_thread = threading.get_ident()
+    lookup_threads = []
+
+    def get_content(*content_key: str) -> str | None:
+        lookup_threads.append(threading.get_ident())
+        return database.get_content(*content_key)
+
+    downloader = create_downloader(database)
+    downloader.content_store_get_function = get_content
+
+    assert await downloader._get_content_store_path(CONTENT_KEY) is None
+    assert lookup_threads and loop_thread not in lookup_threads
+
+
+async def test_ledger_entry_uses_file_stat_without_hashing(tmp_path, database):
+    final_path = tmp_path / "Album" / "01 First.m4a"
+    final_path.parent.mkdir()
+    final_path.write_bytes(b"audio")
+
+    entry = await create_downloader(database).get_ledger_entry(
+        create_item(str(final_path))
+    )
+
+    assert (entry.media_id, entry.path, entry.codec) == (
+        "1001",
+        str(final_path),
+        "alac",
+    )
+    assert (entry.size, entry.mtime) == (5, final_path.stat().st_mtime)
+    assert entry.content_hash is None
+    assert entry.tag_version == CONTENT_KEY[2]
+
+
+async def test_in_memory_content_store_is_bounded(tmp_path, database, monkeypatch):
+    monkeypatch.setattr(downloader_module, "CONTENT_STORE_CACHE_SIZE", 2)
+    downloader = create_downloader(database)
+    downloader.content_store_get_function = None
+    downloader.content_store_add_function = None
+
+    for media_id in ("1001", "1002", "1003"):
+        item = create_item(str(tmp_path / f"{media_id}.m4a"))
+        item.media.media_metadata["id"] = media_id
+        (tmp_path / f"{media_id}.m4a").write_bytes(b"audio")
+        await downloader._add_to_content_store(item)
+
+    assert [key[0] for key in downloader._content_store_paths] == ["1002", "1003"]
+    assert database.get_content(*CONTENT_KEY) is None
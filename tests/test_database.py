@@ -0,0 +1,154 @@
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+
+import pytest
+
+from gamdl.cli import database as database_module
+from gamdl.cli.cli import add_jobs
+from gamdl.cli.database import Database
+from gamdl.downloader import LedgerEntry
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(tmp_path / "gamdl.db", overwrite=False)
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def other_database(tmp_path):
+    database = Database(tmp_path / "gamdl.db", overwrite=False)
+    database.lease_owner = "other-host:1"
+    yield database
+    database.close()
+
+
+def count_rows(tmp_path, table: str) -> int:
+    connection = sqlite3.connect(tmp_path / "gamdl.db")
+    try:
+        return connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    finally:
+        connection.close()
+
+
+def dead_lease_owner() -> str:
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return f"{socket.gethostname()}:{process.pid}"
+
+
+def test_writes_are_batched_until_the_flush_timer(tmp_path, monkeypatch):
+    monkeypatch.setattr(database_module, "DATABASE_WRITE_BATCH_SECONDS", 0.2)
+    database = Database(tmp_path / "gamdl.db", overwrite=False)
+    try:
+        job_id = database.add_job("https://music.apple.com/us/album/album/100")
+        database.add_task(job_id, "1001", 1)
+        database.add_entry(LedgerEntry("1001", str(tmp_path / "1001.m4a")))
+        assert count_rows(tmp_path, "media") == 0
+
+        time.sleep(0.5)
+
+        assert count_rows(tmp_path, "jobs") == 1
+        assert count_rows(tmp_path, "tasks") == 1
+        assert count_rows(tmp_path, "media") == 1
+    finally:
+        database.close()
+
+
+def test_finish_task_is_batched_and_lease_commits(tmp_path, database):
+    job_id = database.add_job("https://music.apple.com/us/album/album/100")
+    database.add_task(job_id, "1001", 1)
+    database.add_task(job_id, "1002", 2)
+    assert count_rows(tmp_path, "tasks") == 0
+
+    assert database.lease_task(job_id, "1001")
+    assert count_rows(tmp_path, "tasks") == 2
+    database.finish_task(job_id, "1001", "done")
+    database.finish_job(job_id)
+
+    assert not database.connection.in_transaction
+    database.flush()
+    database.cursor.execute("SELECT state FROM jobs WHERE id = ?", (job_id,))
+    assert database.cursor.fetchone() == ("pending",)
+
+
+def test_batched_writes_do_not_block_other_connections(
+    tmp_path,
+    database,
+    other_database,
+):
+    job_id = database.add_job("https://music.apple.com/us/album/album/100")
+    database.add_task(job_id, "1001", 1)
+    database.add_entry(LedgerEntry("1001", str(tmp_path / "1001.m4a")))
+    database.add_content("1001", "alac.m4a", "tag-hash", str(tmp_path / "1001.m4a"))
+    other_database.connection.execute("PRAGMA busy_timeout = 1000")
+
+    start = time.monotonic()
+    assert other_database.reserve_rate_limit_token("api.example", 1.0, 1.0) == 0.0
+    assert other_database.claim_job()[0] == job_id
+
+    assert time.monotonic() - start < 0.5
+
+
+def test_lease_task_skips_tasks_leased_by_a_live_owner(database, other_database):
+    job_id = database.add_job("https://music.apple.com/us/album/album/100")
+    database.add_task(job_id, "1001", 1)
+    database.flush()
+
+    assert other_database.lease_task(job_id, "1001")
+    assert not database.lease_task(job_id, "1001")
+    other_database.finish_task(job_id, "1001", "done")
+    other_database.flush()
+    assert not database.lease_task(job_id, "1001")
+
+
+def test_lease_task_reclaims_tasks_of_a_dead_owner(database, other_database):
+    other_database.lease_owner = dead_lease_owner()
+    job_id = database.add_job("https://music.apple.com/us/album/album/100")
+    database.add_task(job_id, "1001", 1)
+    database.flush()
+
+    assert other_database.lease_task(job_id, "1001")
+    assert database.lease_task(job_id, "1001")
+
+
+def test_get_unfinished_jobs_skips_live_leases(database, other_database):
+    job_ids = [
+        database.add_job(f"https://music.apple.com/us/album/album/{album_id}")
+        for album_id in range(3)
+    ]
+    database.flush()
+
+    assert other_database.claim_job()[0] == job_ids[0]
+    other_database.lease_owner = dead_lease_owner()
+    assert other_database.claim_job()[0] == job_ids[1]
+
+    assert [job_id for job_id, _ in database.get_unfinished_jobs()] == job_ids[1:]
+    assert database.claim_job()[0] == job_ids[1]
+
+
+def test_flush_after_close_is_ignored(tmp_path):
+    database = Database(tmp_path / "gamdl.db", overwrite=False)
+    database.add_job("https://music.apple.com/us/album/album/100")
+    database.close()
+
+    database.flush()
+
+    assert count_rows(tmp_path, "jobs") == 1
+
+
+def test_resumed_urls_reuse_their_pending_job(database):
+    urls = [f"https://music.apple.com/us/album/album/{album_id}" for album_id in (1, 2)]
+    job_id = database.add_job(urls[0])
+    database.finish_job(database.add_job(urls[1]))
+
+    jobs = add_jobs(database, urls + urls[1:], reuse_pending=True)
+
+    assert jobs == [(job_id + 2, urls[1])]
+    assert database.get_pending_job(urls[0]) == job_id
+    assert [job[0] for job in database.get_unfinished_jobs()] == [job_id, job_id + 2]
+    assert add_jobs(database, urls[:1], reuse_pending=False) == [(job_id + 3, urls[0])]
@@ -0,0 +1,40 @@
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from gamdl.downloader.filesystem import FilesystemService
+
+
+async def test_write_recreates_directory_removed_outside_the_cache(tmp_path):
+    filesystem = FilesystemService()
+    album_path = tmp_path / "Artist" / "Album"
+
+    await filesystem.write_text(album_path / "01 First.lrc", "first")
+    shutil.rmtree(tmp_path / "Artist")
+    await filesystem.write_text(album_path / "02 Second.lrc", "second")
+
+    assert (album_path / "02 Second.lrc").read_text() == "second"
+
+
+async def test_mkdir_skips_cached_directories(tmp_path):
+    filesystem = FilesystemService()
+    album_path = tmp_path / "Artist" / "Album"
+
+    await filesystem.mkdir(album_path)
+    album_path.rmdir()
+    await filesystem.mkdir(album_path)
+
+    assert not album_path.exists()
+
+
+def test_created_dirs_survive_concurrent_mkdir_and_rmtree(tmp_path):
+    filesystem = FilesystemService()
+
+    def create_and_remove(index: int) -> None:
+        for track in range(50):
+            filesystem.mkdir_sync(tmp_path / str(index) / str(track))
+        filesystem._rmtree(tmp_path / str(index))
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(create_and_remove, range(32)))
+
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,95 @@
+import datetime
+
+import pytest
+from mutagen.mp4 import MP4Cover, MP4Tags
+
+from gamdl.downloader.ammuxer import build_ilst
+from gamdl.interface.enums import CoverFormat, MediaRating, MediaType
+from gamdl.interface.types import MediaTags
+
+SONG_TAGS = MediaTags(
+    album="Album",
+    album_artist="Album Artist",
+    album_id=1440000000,
+    album_sort="Album",
+    artist="Artist",
+    artist_id=100,
+    artist_sort="Artist",
+    compilation=False,
+    composer="Composer",
+    composer_id=200,
+    composer_sort="Composer",
+    copyright="℗ 2024 Label",
+    date=datetime.date(2024, 5, 17),
+    disc=1,
+    disc_total=2,
+    gapless=True,
+    genre="Pop",
+    genre_id=14,
+    lyrics="First line\nSecond line",
+    media_type=MediaType.SONG,
+    rating=MediaRating.EXPLICIT,
+    storefront=143441,
+    title="Título ☃",
+    title_id=1440000001,
+    title_sort="Titulo",
+    track=3,
+    track_total=12,
+    xid="label:isrc:USAAA2400001",
+)
+MUSIC_VIDEO_TAGS = MediaTags(
+    artist="Artist",
+    artist_id=4294967296,
+    media_type=MediaType.MUSIC_VIDEO,
+    rating=MediaRating.CLEAN,
+    title="Video",
+    title_id=1440000002,
+)
+
+
+def render_with_mutagen(
+    mp4_tags: dict,
+    cover_bytes: bytes | None = None,
+    cover_format: CoverFormat = CoverFormat.JPG,
+) -> bytes:
+    tags = MP4Tags()
+    if cover_bytes is not None:
+        mp4_tags = {
+            **mp4_tags,
+            "covr": [
+                MP4Cover(
+                    cover_bytes,
+                    (
+                        MP4Cover.FORMAT_JPEG
+                        if cover_format == CoverFormat.JPG
+                        else MP4Cover.FORMAT_PNG
+                    ),
+                )
+            ],
+        }
+    return b"".join(tags._render(key, value) for key, value in mp4_tags.items())
+
+
+@pytest.mark.parametrize("tags", [SONG_TAGS, MUSIC_VIDEO_TAGS, MediaTags()])
+@pytest.mark.parametrize("date_format", [None, "%Y-%m-%dT00:00:00Z"])
+def test_build_ilst_matches_mutagen(tags: MediaTags, date_format: str | None):
+    mp4_tags = tags.as_mp4_tags(date_format)
+
+    assert build_ilst(mp4_tags) == render_with_mutagen(mp4_tags)
+
+
+@pytest.mark.parametrize("cover_format", [CoverFormat.JPG, CoverFormat.PNG])
+def test_build_ilst_matches_mutagen_with_cover(cover_format: CoverFormat):
+    mp4_tags = SONG_TAGS.as_mp4_tags()
+    cover_bytes = bytes(range(256)) * 4
+
+    assert build_ilst(mp4_tags, cover_bytes, cover_format) == render_with_mutagen(
+        mp4_tags,
+        cover_bytes,
+        cover_format,
+    )
+
+
+def test_build_ilst_rejects_out_of_range_integers():
+    with pytest.raises(ValueError):
+        build_ilst({"cnID": [1 << 64]})
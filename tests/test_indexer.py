@@ -0,0 +1,98 @@
+import struct
+from pathlib import Path
+
+import pytest
+
+from gamdl.cli.database import Database
+from gamdl.cli.indexer import IndexStats, LibraryIndexer, read_ilst_ids
+from gamdl.downloader import LedgerEntry
+from gamdl.downloader.ammuxer import build_ilst
+
+
+def render_atom(name: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", len(payload) + 8, name) + payload
+
+
+def write_m4a(path: Path, mp4_tags: dict) -> str:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    meta = (
+        bytes(4)
+        + render_atom(b"hdlr", bytes(8) + b"mdirappl" + bytes(9))
+        + render_atom(b"ilst", build_ilst(mp4_tags))
+    )
+    path.write_bytes(
+        render_atom(b"ftyp", b"M4A \x00\x00\x00\x00")
+        + render_atom(b"moov", render_atom(b"udta", render_atom(b"meta", meta)))
+        + render_atom(b"mdat", bytes(16))
+    )
+    return str(path)
+
+
+def write_track(root: Path, relative_path: str, media_id: int) -> str:
+    return write_m4a(
+        root / relative_path,
+        {"©nam": [relative_path], "cnID": [media_id], "plID": [100], "atID": [10]},
+    )
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(tmp_path / "gamdl.db", overwrite=False)
+    yield database
+    database.close()
+
+
+def test_read_ilst_ids(tmp_path):
+    path = write_track(tmp_path, "Artist/Album/01 First.m4a", 1001)
+
+    assert read_ilst_ids(path) == {"cnID": 1001, "plID": 100, "atID": 10}
+
+
+def test_index_registers_tagged_files(tmp_path, database):
+    library = tmp_path / "library"
+    first = write_track(library, "Artist/Album/01 First.m4a", 1001)
+    write_m4a(library / "Artist/Album/02 Untagged.m4a", {"©nam": ["Untagged"]})
+    (library / "Artist/Album/Cover.jpg").write_bytes(b"cover")
+
+    stats = LibraryIndexer(database, workers=2).index(str(library))
+
+    assert stats == IndexStats(indexed=1, without_id=1)
+    assert database.get("1001") == first
+    assert database.filter_ids(["1001", "1002"]) == {"1001"}
+
+
+def test_index_skips_unchanged_files(tmp_path, database):
+    library = tmp_path / "library"
+    write_track(library, "Artist/Album/01 First.m4a", 1001)
+    LibraryIndexer(database).index(str(library))
+    write_track(library, "Artist/Album/02 Second.m4a", 1002)
+
+    stats = LibraryIndexer(database).index(str(library))
+
+    assert stats == IndexStats(indexed=1, unchanged=1)
+
+
+def test_index_skips_staging_directories(tmp_path, database):
+    library = tmp_path / "library"
+    write_track(library, ".gamdl_staging_0123/1001_staged.m4a", 1001)
+
+    stats = LibraryIndexer(database).index(str(library))
+
+    assert stats == IndexStats()
+    assert database.get("1001") is None
+
+
+def test_index_prunes_missing_files_under_root(tmp_path, database):
+    library = tmp_path / "library"
+    first = write_track(library, "Artist/Album/01 First.m4a", 1001)
+    second = write_track(library, "Artist/Album/02 Second.m4a", 1002)
+    database.add_entry(LedgerEntry("1003", str(library / "Artist/Video.m4v")))
+    database.add_entry(LedgerEntry("1004", str(tmp_path / "other/03 Third.m4a")))
+    LibraryIndexer(database).index(str(library))
+    Path(second).unlink()
+
+    stats = LibraryIndexer(database).index(str(library))
+
+    assert stats == IndexStats(unchanged=1, pruned=1)
+    assert database.get("1001") == first
+    assert database.filter_ids(["1001", "1002", "1003", "1004"]) == {"1001", "1004"}
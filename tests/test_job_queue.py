@@ -0,0 +1,153 @@
+from types import SimpleNamespace
+
+import pytest
+import structlog
+
+from gamdl.cli.database import Database
+from gamdl.cli.runner import DownloadStats, download_url
+from gamdl.downloader import DownloadItem, LedgerEntry
+from gamdl.interface import AppleMusicInterface
+
+TRACKS = [
+    {"id": "1001", "type": "songs", "attributes": {"name": "First"}},
+    {"id": "1002", "type": "songs", "attributes": {"name": "Second"}},
+]
+ALBUM = {
+    "id": "100",
+    "type": "albums",
+    "attributes": {"name": "Album", "trackCount": len(TRACKS)},
+    "relationships": {"tracks": {"data": TRACKS}},
+}
+PLAYLIST = {
+    "id": "pl.0123456789abcdef0123456789abcdef",
+    "type": "playlists",
+    "attributes": {"name": "Playlist"},
+    "relationships": {"tracks": {"data": TRACKS}},
+}
+ARTIST = {
+    "id": "10",
+    "type": "artists",
+    "attributes": {"name": "Artist"},
+    "views": {"full-albums": {"data": [{"id": "100", "type": "albums"}]}},
+}
+URLS = {
+    "album": "https://music.apple.com/us/album/album/100",
+    "playlist": (
+        "https://music.apple.com/us/playlist/playlist/"
+        "pl.0123456789abcdef0123456789abcdef"
+    ),
+    "artist": "https://music.apple.com/us/artist/artist/10",
+}
+
+
+class FakeAppleMusicApi:
+    async def get_album(self, media_id: str) -> dict:
+        return {"data": [ALBUM]}
+
+    async def get_playlist(self, media_id: str) -> dict:
+        return {"data": [PLAYLIST]}
+
+    async def get_artist(self, media_id: str) -> dict:
+        return {"data": [ARTIST]}
+
+
+class FakeSongInterface:
+    def __init__(self):
+        self.base = SimpleNamespace(apple_music_api=FakeAppleMusicApi())
+
+    async def get_media(self, media):
+        yield media
+        media.partial = False
+        yield media
+
+
+class FakeDownloader:
+    def __init__(self, interface: AppleMusicInterface):
+        self.interface = interface
+        self.downloaded = []
+
+    async def get_download_item_from_url(self, url: str):
+        async for media in self.interface.get_media_from_url(url):
+            yield DownloadItem(media)
+
+    async def download(self, item: DownloadItem) -> None:
+        if item.media.error:
+            raise item.media.error
+        if not item.media.partial:
+            self.downloaded.append(item.media.media_id)
+
+    async def get_ledger_entry(self, item: DownloadItem) -> LedgerEntry | None:
+        if item.media.partial or item.media.error:
+            return None
+        return LedgerEntry(item.media.media_id, f"{item.media.media_id}.m4a")
+
+    async def flush_playlist_files(self) -> None:
+        pass
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(tmp_path / "gamdl.db", overwrite=False)
+    yield database
+    database.close()
+
+
+def create_downloader(database: Database) -> FakeDownloader:
+    song = FakeSongInterface()
+    return FakeDownloader(
+        AppleMusicInterface(
+            song=song,
+            music_video=song,
+            uploaded_video=song,
+            flat_filter_function=database.flat_filter,
+            flat_filter_prefetch_function=database.filter_ids,
+        )
+    )
+
+
+async def run_job(
+    downloader: FakeDownloader,
+    database: Database,
+    url: str,
+) -> DownloadStats:
+    stats = DownloadStats()
+    await download_url(
+        downloader,
+        database,
+        url,
+        structlog.get_logger(),
+        stats,
+        database.add_job(url),
+    )
+    return stats
+
+
+@pytest.mark.parametrize("url_type", URLS)
+async def test_collection_url_job_downloads_every_track(
+    database: Database,
+    url_type: str,
+):
+    downloader = create_downloader(database)
+
+    stats = await run_job(downloader, database, URLS[url_type])
+
+    assert downloader.downloaded == ["1001", "1002"]
+    assert stats == DownloadStats(downloaded=2)
+    assert database.get_unfinished_jobs() == []
+    database.cursor.execute("SELECT media_id, state FROM tasks ORDER BY media_id")
+    assert database.cursor.fetchall() == [("1001", "done"), ("1002", "done")]
+
+
+@pytest.mark.parametrize("url_type", URLS)
+async def test_collection_url_job_skips_finished_tracks(
+    database: Database,
+    url_type: str,
+):
+    await run_job(create_downloader(database), database, URLS[url_type])
+    downloader = create_downloader(database)
+
+    stats = await run_job(downloader, database, URLS[url_type])
+
+    assert downloader.downloaded == []
+    assert stats == DownloadStats(skipped=2)
+    assert database.get_unfinished_jobs() == []
@@ -0,0 +1,113 @@
+import httpx
+import pytest
+
+from gamdl.downloader import base as base_module
+from gamdl.downloader.base import AppleMusicBaseDownloader
+from gamdl.downloader.exceptions import GamdlDownloaderIncompleteDownloadError
+
+STREAM_URL = "https://aod.example/stream/P1001.m3u8"
+MEDIA_URL = "https://aod.example/stream/P1001.mp4"
+MEDIA = bytes(range(256)) * 64
+PLAYLIST = f"""#EXTM3U
+#EXT-X-VERSION:7
+#EXT-X-TARGETDURATION:10
+#EXT-X-MAP:URI="P1001.mp4",BYTERANGE="1024@0"
+#EXTINF:10.0,
+#EXT-X-BYTERANGE:4096@1024
+P1001.mp4
+#EXTINF:10.0,
+#EXT-X-BYTERANGE:{len(MEDIA) - 5120}
+P1001.mp4
+#EXT-X-ENDLIST
+"""
+
+
+def create_handler(supports_ranges: bool = True, truncate: bool = False):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.url == STREAM_URL:
+            return httpx.Response(200, text=PLAYLIST)
+
+        range_header = request.headers.get("range")
+        if not supports_ranges or range_header is None:
+            return httpx.Response(200, content=MEDIA)
+
+        start, end = map(int, range_header.removeprefix("bytes=").split("-"))
+        content = MEDIA[start : end + 1]
+        return httpx.Response(206, content=content[:-1] if truncate else content)
+
+    return handler, requests
+
+
+@pytest.fixture
+def mock_client(monkeypatch):
+    def install(handler):
+        async_client = httpx.AsyncClient
+        monkeypatch.setattr(
+            base_module.httpx,
+            "AsyncClient",
+            lambda **kwargs: async_client(
+                transport=httpx.MockTransport(handler),
+                **kwargs,
+            ),
+        )
+
+    return install
+
+
+def create_base_downloader(memory_download_max_size: int = len(MEDIA)):
+    return AppleMusicBaseDownloader(
+        interface=None,
+        memory_download_max_size=memory_download_max_size,
+    )
+
+
+async def test_download_stream_to_memory_merges_contiguous_ranges(mock_client):
+    handler, requests = create_handler()
+    mock_client(handler)
+
+    buffer = await create_base_downloader().download_stream_to_memory(STREAM_URL)
+
+    assert buffer == MEDIA
+    assert [request.headers.get("range") for request in requests] == [
+        None,
+        f"bytes=0-{len(MEDIA) - 1}",
+    ]
+
+
+@pytest.mark.parametrize(
+    "stream_url,memory_download_max_size",
+    [
+        (STREAM_URL, len(MEDIA) - 1),
+        (STREAM_URL, 0),
+        (MEDIA_URL, len(MEDIA)),
+    ],
+)
+async def test_download_stream_to_memory_falls_back(
+    mock_client,
+    stream_url: str,
+    memory_download_max_size: int,
+):
+    handler, _ = create_handler()
+    mock_client(handler)
+
+    downloader = create_base_downloader(memory_download_max_size)
+
+    assert await downloader.download_stream_to_memory(stream_url) is None
+
+
+async def test_download_stream_to_memory_needs_range_support(mock_client):
+    handler, _ = create_handler(supports_ranges=False)
+    mock_client(handler)
+
+    assert await create_base_downloader().download_stream_to_memory(STREAM_URL) is None
+
+
+async def test_download_stream_to_memory_rejects_short_ranges(mock_client):
+    handler, _ = create_handler(truncate=True)
+    mock_client(handler)
+
+    with pytest.raises(GamdlDownloaderIncompleteDownloadError):
+        await create_base_downloader().download_stream_to_memory(STREAM_URL)
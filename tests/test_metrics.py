@@ -0,0 +1,86 @@
+import pytest
+
+from gamdl.metrics import MetricsRegistry
+
+
+@pytest.fixture
+def registry():
+    registry = MetricsRegistry()
+    registry.enable()
+    return registry
+
+
+async def test_timed_records_sync_and_async_calls(registry):
+    @registry.timed("sync_stage")
+    def sync_stage(value: int) -> int:
+        return value * 2
+
+    @registry.timed("async_stage")
+    async def async_stage() -> None:
+        raise ValueError("failed")
+
+    assert sync_stage(2) == 4
+    with pytest.raises(ValueError):
+        await async_stage()
+
+    summary = registry.summary()
+    assert summary["sync_stage"]["count"] == 1
+    assert summary["sync_stage"]["errors"] == 0
+    assert summary["async_stage"]["count"] == 1
+    assert summary["async_stage"]["errors"] == 1
+
+
+def test_disabled_registry_records_nothing():
+    registry = MetricsRegistry()
+
+    @registry.timed("stage")
+    def stage() -> str:
+        return "result"
+
+    assert stage() == "result"
+    registry.observe("stage", 1.0)
+    registry.add_bytes("stage", 1024)
+
+    assert registry.summary() == {}
+
+
+def test_prometheus_histogram_is_cumulative(registry):
+    registry.observe("download_stream", 0.004)
+    registry.observe("download_stream", 0.3, failed=True)
+    registry.observe("download_stream", 120.0)
+    registry.add_bytes("download_stream", 4096)
+
+    lines = registry.prometheus_text().splitlines()
+    buckets = {
+        line.split('le="')[1].split('"')[0]: int(line.rsplit(" ", 1)[1])
+        for line in lines
+        if line.startswith('gamdl_stage_duration_seconds_bucket{stage="download')
+    }
+
+    assert buckets["0.005"] == 1
+    assert buckets["0.5"] == 2
+    assert buckets["60.0"] == 2
+    assert buckets["+Inf"] == 3
+    assert 'gamdl_stage_duration_seconds_count{stage="download_stream"} 3' in lines
+    assert 'gamdl_stage_errors_total{stage="download_stream"} 1' in lines
+    assert 'gamdl_stage_bytes_total{stage="download_stream"} 4096' in lines
+
+
+def test_summary_reports_mean_max_and_bytes(registry):
+    registry.observe("get_webplayback", 0.1)
+    registry.observe("get_webplayback", 0.3)
+    registry.add_bytes("get_webplayback", 10)
+
+    assert registry.summary() == {
+        "get_webplayback": {
+            "count": 2,
+            "errors": 0,
+            "total_seconds": 0.4,
+            "mean_seconds": 0.2,
+            "max_seconds": 0.3,
+            "bytes": 10,
+        }
+    }
+
+    registry.reset()
+    assert registry.summary() == {}
@@ -0,0 +1,170 @@
+import datetime
+import random
+from pathlib import Path
+
+import pytest
+
+from gamdl.downloader import AppleMusicBaseDownloader
+from gamdl.interface.types import MediaTags, PlaylistTags
+from gamdl.utils import CustomStringFormatter
+
+TEMPLATE_CONFIGS = [
+    {},
+    {"truncate": 20},
+    {
+        "album_folder_template": "{album_artist}/{date:%Y} - {album} [{album_id}]",
+        "single_disc_file_template": "{track:03d}. {title!r} {media_type}",
+        "playlist_file_template": "{playlist_artist}/{playlist_title}.{playlist_id}",
+    },
+    {"single_disc_file_template": "{track:0{disc}d} {title}"},
+]
+
+
+def legacy_format_parts(
+    template_parts: list[str],
+    fields: dict[str, tuple],
+    sanitize,
+    file_extension: str,
+) -> list[str]:
+    return [
+        sanitize(
+            CustomStringFormatter().format(part, **fields),
+            file_extension if i == len(template_parts) - 1 else None,
+        )
+        for i, part in enumerate(template_parts)
+    ]
+
+
+def legacy_media_fields(
+    tags: MediaTags,
+    playlist_tags: PlaylistTags | None,
+) -> dict[str, tuple]:
+    return {
+        "album": (tags.album, "Unknown Album"),
+        "album_artist": (tags.album_artist, "Unknown Artist"),
+        "album_id": (tags.album_id, "Unknown Album ID"),
+        "artist": (tags.artist, "Unknown Artist"),
+        "artist_id": (tags.artist_id, "Unknown Artist ID"),
+        "composer": (tags.composer, "Unknown Composer"),
+        "composer_id": (tags.composer_id, "Unknown Composer ID"),
+        "date": (tags.date, "Unknown Date"),
+        "disc": (tags.disc, ""),
+        "disc_total": (tags.disc_total, ""),
+        "media_type": (tags.media_type, "Unknown Media Type"),
+        "playlist_artist": (
+            playlist_tags.artist if playlist_tags else None,
+            "Unknown Playlist Artist",
+        ),
+        "playlist_id": (
+            playlist_tags.playlist_id if playlist_tags else None,
+            "Unknown Playlist ID",
+        ),
+        "playlist_title": (
+            playlist_tags.title if playlist_tags else None,
+            "Unknown Playlist Title",
+        ),
+        "playlist_track": (playlist_tags.track if playlist_tags else None, ""),
+        "title": (tags.title, "Unknown Title"),
+        "title_id": (tags.title_id, "Unknown Title ID"),
+        "track": (tags.track, ""),
+        "track_total": (tags.track_total, ""),
+    }
+
+
+def legacy_final_path(
+    downloader: AppleMusicBaseDownloader,
+    tags: MediaTags,
+    file_extension: str,
+    playlist_tags: PlaylistTags | None,
+) -> str:
+    if tags.album:
+        folder_template = (
+            downloader.compilation_folder_template
+            if tags.compilation
+            else downloader.album_folder_template
+        )
+        file_template = (
+            downloader.multi_disc_file_template
+            if isinstance(tags.disc_total, int) and tags.disc_total > 1
+            else downloader.single_disc_file_template
+        )
+    else:
+        folder_template = downloader.no_album_folder_template
+        file_template = downloader.no_album_file_template
+
+    return str(
+        Path(
+            downloader.output_path,
+            *legacy_format_parts(
+                folder_template.split("/") + file_template.split("/"),
+                legacy_media_fields(tags, playlist_tags),
+                downloader._sanitize_string,
+                file_extension,
+            ),
+        )
+    )
+
+
+def legacy_playlist_file_path(
+    downloader: AppleMusicBaseDownloader,
+    tags: PlaylistTags,
+) -> str:
+    return str(
+        Path(
+            downloader.output_path,
+            *legacy_format_parts(
+                downloader.playlist_folder_template.split("/")
+                + downloader.playlist_file_template.split("/"),
+                {
+                    "playlist_artist": (tags.artist, "Unknown Playlist Artist"),
+                    "playlist_id": (tags.playlist_id, "Unknown Playlist ID"),
+                    "playlist_title": (tags.title, "Unknown Playlist Title"),
+                    "playlist_track": (tags.track, ""),
+                },
+                downloader._sanitize_string,
+                ".m3u",
+            ),
+        )
+    )
+
+
+def random_tags(
+    rng: random.Random, index: int
+) -> tuple[MediaTags, PlaylistTags | None]:
+    tags = MediaTags(
+        album=rng.choice([None, "Alb:um?", "A/B", "x."]),
+        album_artist=rng.choice([None, "Art*"]),
+        album_id=index,
+        artist="Ar|t",
+        compilation=rng.choice([None, True]),
+        date=rng.choice([None, datetime.date(2020, 1, 2), "2021"]),
+        disc=rng.choice([None, 1, 2]),
+        disc_total=rng.choice([None, 1, 3]),
+        title=rng.choice([None, "T;itle " * 5, "ok."]),
+        title_id=index,
+        track=rng.choice([None, 3, "x"]),
+    )
+    playlist_tags = rng.choice(
+        [None, PlaylistTags(artist="P:A", playlist_id=9, title=None, track=index)]
+    )
+    return tags, playlist_tags
+
+
+def create_base_downloader(**kwargs) -> AppleMusicBaseDownloader:
+    return AppleMusicBaseDownloader(interface=None, output_path="/music", **kwargs)
+
+
+@pytest.mark.parametrize("config", TEMPLATE_CONFIGS)
+def test_compiled_templates_match_legacy_formatter(config: dict):
+    downloader = create_base_downloader(**config)
+    rng = random.Random(0)
+
+    for index in range(500):
+        tags, playlist_tags = random_tags(rng, index)
+        assert downloader.get_final_path(
+            tags, ".m4a", playlist_tags
+        ) == legacy_final_path(downloader, tags, ".m4a", playlist_tags)
+        if playlist_tags:
+            assert downloader.get_playlist_file_path(
+                playlist_tags
+            ) == legacy_playlist_file_path(downloader, playlist_tags)
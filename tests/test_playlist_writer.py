@@ -0,0 +1,87 @@
+import asyncio
+from types import SimpleNamespace
+
+from gamdl.downloader import AppleMusicDownloader
+from gamdl.downloader import playlist_writer as playlist_writer_module
+from gamdl.downloader.filesystem import FilesystemService
+from gamdl.downloader.playlist_writer import PlaylistFileWriter
+
+
+async def test_entries_are_written_on_flush(tmp_path):
+    playlist_path = tmp_path / "Playlists" / "Playlist.m3u8"
+    writer = PlaylistFileWriter(str(playlist_path), FilesystemService())
+
+    await asyncio.gather(
+        writer.set_entry(3, "../Album/03 Third.m4a"),
+        writer.set_entry(1, "../Album/01 First.m4a"),
+    )
+    assert not playlist_path.exists()
+
+    await writer.flush()
+
+    assert playlist_path.read_text() == (
+        "../Album/01 First.m4a\n\n../Album/03 Third.m4a\n"
+    )
+    assert list(playlist_path.parent.iterdir()) == [playlist_path]
+
+
+async def test_entries_are_merged_into_an_existing_file(tmp_path):
+    playlist_path = tmp_path / "Playlist.m3u8"
+    playlist_path.write_text("../Album/01 First.m4a\n../Album/02 Old.m4a\n")
+    writer = PlaylistFileWriter(str(playlist_path), FilesystemService())
+
+    await writer.set_entry(2, "../Album/02 Second.m4a")
+    await writer.flush()
+
+    assert playlist_path.read_text() == (
+        "../Album/01 First.m4a\n../Album/02 Second.m4a\n"
+    )
+
+
+async def test_entries_are_flushed_after_the_interval(tmp_path, monkeypatch):
+    monkeypatch.setattr(playlist_writer_module, "PLAYLIST_FILE_FLUSH_INTERVAL", 0)
+    playlist_path = tmp_path / "Playlist.m3u8"
+    writer = PlaylistFileWriter(str(playlist_path), FilesystemService())
+
+    await writer.set_entry(1, "../Album/01 First.m4a")
+
+    assert playlist_path.read_text() == "../Album/01 First.m4a\n"
+
+
+async def test_flush_without_changes_does_not_write(tmp_path):
+    playlist_path = tmp_path / "Playlist.m3u8"
+    writer = PlaylistFileWriter(str(playlist_path), FilesystemService())
+
+    await writer.flush()
+
+    assert not playlist_path.exists()
+
+
+async def test_downloader_drops_playlist_writers_once_flushed(tmp_path):
+    base = SimpleNamespace(output_path=str(tmp_path), filesystem=FilesystemService())
+    downloader = AppleMusicDownloader(
+        song=SimpleNamespace(base=base),
+        music_video=None,
+        uploaded_video=None,
+    )
+    playlist_path = tmp_path / "Playlists" / "Playlist.m3u8"
+
+    await downloader._update_playlist_file(
+        str(playlist_path),
+        str(tmp_path / "Album" / "01 First.m4a"),
+        1,
+    )
+    await downloader.flush_playlist_files()
+    assert downloader._playlist_file_writers == {}
+
+    playlist_path.write_text("../Album/01 Edited.m4a\n")
+    await downloader._update_playlist_file(
+        str(playlist_path),
+        str(tmp_path / "Album" / "02 Second.m4a"),
+        2,
+    )
+    await downloader.flush_playlist_files()
+
+    assert playlist_path.read_text() == (
+        "../Album/01 Edited.m4a\n../Album/02 Second.m4a\n"
+    )
@@ -0,0 +1,23 @@
+from gamdl.profiling import Profiler, ProfileMode
+
+
+def test_alloc_report_labels_stage_memory_as_process_wide(tmp_path):
+    profiler = Profiler()
+    report_path = tmp_path / "gamdl-profile-alloc.txt"
+
+    profiler.start(ProfileMode.ALLOC, str(report_path))
+    traced_memory = profiler.stage_started()
+    buffer = bytearray(64 * 1024)
+    profiler.stage_finished("download_stream", traced_memory)
+    profiler.stop()
+
+    lines = report_path.read_text().splitlines()
+    assert lines[:3] == [
+        "# Process-wide traced memory growth while each stage was open",
+        "# Stages overlap under concurrency, so these are not per-stage figures",
+        "# calls growth_bytes stage",
+    ]
+    calls, growth, stage = lines[3].split()
+    assert (calls, stage) == ("1", "download_stream")
+    assert int(growth) >= len(buffer)
+    assert not profiler.tracks_stages
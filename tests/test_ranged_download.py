@@ -0,0 +1,143 @@
+from pathlib import Path
+
+import httpx
+import pytest
+
+from gamdl.downloader import base as base_module
+from gamdl.downloader.base import AppleMusicBaseDownloader
+from gamdl.downloader.exceptions import GamdlDownloaderIncompleteDownloadError
+
+STREAM_URL = "https://mvod.example/video/P1001.mp4"
+MEDIA = bytes(range(256)) * 40
+
+
+def create_handler(
+    supports_ranges: bool = True,
+    truncate: bool = False,
+    head_error: Exception | None = None,
+):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.method == "HEAD":
+            if head_error is not None:
+                raise head_error
+            return httpx.Response(
+                200,
+                headers={
+                    "Accept-Ranges": "bytes",
+                    "Content-Length": str(len(MEDIA)),
+                },
+            )
+
+        range_header = request.headers.get("range")
+        if not supports_ranges or range_header is None:
+            return httpx.Response(200, content=MEDIA)
+
+        start, end = map(int, range_header.removeprefix("bytes=").split("-"))
+        content = MEDIA[start : end + 1]
+        return httpx.Response(206, content=content[:-1] if truncate else content)
+
+    return handler, requests
+
+
+@pytest.fixture
+def mock_client(monkeypatch):
+    monkeypatch.setattr(base_module, "RANGED_DOWNLOAD_MIN_CHUNK_SIZE", 1024)
+
+    def install(handler):
+        async_client = httpx.AsyncClient
+        monkeypatch.setattr(
+            base_module.httpx,
+            "AsyncClient",
+            lambda **kwargs: async_client(
+                transport=httpx.MockTransport(handler),
+                **kwargs,
+            ),
+        )
+
+    return install
+
+
+@pytest.fixture
+def downloader(monkeypatch):
+    downloader = AppleMusicBaseDownloader(
+        interface=None,
+        ranged_download_connections=4,
+    )
+    downloader.ytdlp_paths = []
+
+    async def download_ytdlp_async(stream_url: str, download_path: str) -> None:
+        downloader.ytdlp_paths.append(download_path)
+        assert not Path(download_path).exists()
+
+    monkeypatch.setattr(downloader, "_download_ytdlp_async", download_ytdlp_async)
+    return downloader
+
+
+async def test_ranged_download_fetches_chunks_in_parallel(
+    tmp_path,
+    mock_client,
+    downloader,
+):
+    handler, requests = create_handler()
+    mock_client(handler)
+    download_path = tmp_path / "encrypted.mp4"
+
+    await downloader._download_http(STREAM_URL, str(download_path))
+
+    assert download_path.read_bytes() == MEDIA
+    assert downloader.ytdlp_paths == []
+    assert sorted(
+        request.headers["range"] for request in requests if request.method == "GET"
+    ) == [
+        "bytes=0-2559",
+        "bytes=2560-5119",
+        "bytes=5120-7679",
+        "bytes=7680-10239",
+    ]
+
+
+async def test_ranged_download_falls_back_without_partial_content(
+    tmp_path,
+    mock_client,
+    downloader,
+):
+    handler, _ = create_handler(supports_ranges=False)
+    mock_client(handler)
+    download_path = tmp_path / "encrypted.mp4"
+
+    await downloader._download_http(STREAM_URL, str(download_path))
+
+    assert downloader.ytdlp_paths == [str(download_path)]
+
+
+async def test_ranged_download_falls_back_when_head_fails(
+    tmp_path,
+    mock_client,
+    downloader,
+):
+    handler, _ = create_handler(head_error=httpx.ConnectError("refused"))
+    mock_client(handler)
+    download_path = tmp_path / "encrypted.mp4"
+
+    await downloader._download_http(STREAM_URL, str(download_path))
+
+    assert downloader.ytdlp_paths == [str(download_path)]
+
+
+async def test_ranged_download_removes_file_after_short_chunk(
+    tmp_path,
+    mock_client,
+    downloader,
+):
+    handler, _ = create_handler(truncate=True)
+    mock_client(handler)
+    download_path = tmp_path / "encrypted.mp4"
+
+    with pytest.raises(GamdlDownloaderIncompleteDownloadError):
+        await downloader._download_http(STREAM_URL, str(download_path))
+
+    assert not download_path.exists()
+    assert downloader.ytdlp_paths == []
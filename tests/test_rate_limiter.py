@@ -0,0 +1,52 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from gamdl.cli.database import Database
+from gamdl.cli.rate_limiter import HostRateLimiter, MemoryTokenStore
+
+
+def test_memory_token_store_allows_burst_then_waits():
+    token_store = MemoryTokenStore()
+
+    waits = [
+        token_store.reserve_rate_limit_token("api.example", rate=2.0, burst=2.0)
+        for _ in range(4)
+    ]
+
+    assert waits[:2] == [0.0, 0.0]
+    assert waits[2] == pytest.approx(0.5, abs=0.05)
+    assert waits[3] == pytest.approx(1.0, abs=0.05)
+
+
+def test_database_token_bucket_is_shared_between_connections(tmp_path):
+    first = Database(tmp_path / "gamdl.db", overwrite=False)
+    second = Database(tmp_path / "gamdl.db", overwrite=False)
+    try:
+        assert first.reserve_rate_limit_token("api.example", 1.0, 1.0) == 0.0
+        assert second.reserve_rate_limit_token(
+            "api.example", 1.0, 1.0
+        ) == pytest.approx(1.0, abs=0.05)
+        assert second.reserve_rate_limit_token("other.example", 1.0, 1.0) == 0.0
+    finally:
+        first.close()
+        second.close()
+
+
+async def test_acquire_does_not_block_the_event_loop(tmp_path):
+    database = Database(tmp_path / "gamdl.db", overwrite=False)
+    locking_connection = sqlite3.connect(tmp_path / "gamdl.db")
+    locking_connection.execute("BEGIN IMMEDIATE")
+    try:
+        acquire = asyncio.create_task(
+            HostRateLimiter(100.0, database).acquire("api.example")
+        )
+        await asyncio.sleep(0.1)
+        assert not acquire.done()
+
+        locking_connection.rollback()
+        await asyncio.wait_for(acquire, 5)
+    finally:
+        locking_connection.close()
+        database.close()
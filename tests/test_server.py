@@ -0,0 +1,110 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from gamdl.cli.database import Database
+from gamdl.cli.server import DownloadServer
+from gamdl.metrics import metrics
+from test_job_queue import URLS, create_downloader
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(tmp_path / "gamdl.db", overwrite=False)
+    yield database
+    database.close()
+
+
+@pytest.fixture
+async def service(database):
+    downloader = create_downloader(database)
+    downloader.base = SimpleNamespace(
+        interface=SimpleNamespace(base=SimpleNamespace(account_pool=None))
+    )
+    server = DownloadServer(downloader, database)
+    worker = asyncio.create_task(server._run_jobs())
+    http_server = await asyncio.start_server(
+        server._handle_connection,
+        "127.0.0.1",
+        0,
+    )
+    host, port = http_server.sockets[0].getsockname()
+    async with (
+        http_server,
+        httpx.AsyncClient(base_url=f"http://{host}:{port}") as client,
+    ):
+        yield server, client
+    worker.cancel()
+
+
+async def test_submitted_job_runs_to_completion(service):
+    server, client = service
+
+    response = await client.post("/jobs", json={"urls": [f" {URLS['album']} "]})
+    assert response.status_code == 202
+    job_id = response.json()["id"]
+    assert response.json()["urls"] == [URLS["album"]]
+
+    await asyncio.wait_for(server._queue.join(), 5)
+
+    response = await client.get(f"/jobs/{job_id}")
+    assert response.status_code == 200
+    assert response.json()["status"] == "done"
+    assert response.json()["downloaded"] == 2
+    assert [job["id"] for job in (await client.get("/jobs")).json()["jobs"]] == [job_id]
+
+
+@pytest.mark.parametrize(
+    "body",
+    [b"not json", b"[]", b'{"urls": []}', b'{"urls": ["  "]}', b'{"urls": [1]}'],
+)
+async def test_invalid_job_bodies_are_rejected(service, body: bytes):
+    server, client = service
+
+    response = await client.post("/jobs", content=body)
+
+    assert response.status_code == 400
+    assert "error" in response.json()
+    assert server.jobs == {}
+
+
+@pytest.mark.parametrize(
+    "method,path,status_code",
+    [
+        ("GET", "/jobs/unknown", 404),
+        ("DELETE", "/jobs", 405),
+        ("POST", "/health", 405),
+        ("GET", "/unknown", 404),
+    ],
+)
+async def test_routing_errors(service, method: str, path: str, status_code: int):
+    _, client = service
+
+    response = await client.request(method, path)
+
+    assert response.status_code == status_code
+
+
+async def test_health_and_metrics(service, monkeypatch):
+    _, client = service
+
+    response = await client.get("/health/")
+    assert response.json() == {"status": "ok", "queued": 0, "accounts": []}
+
+    monkeypatch.setattr(metrics, "enabled", False)
+    assert (await client.get("/metrics")).status_code == 404
+    monkeypatch.setattr(metrics, "enabled", True)
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+
+
+async def test_oversized_requests_are_rejected(service):
+    server, client = service
+    server.max_request_size = 16
+
+    response = await client.post("/jobs", json={"urls": [URLS["album"]]})
+
+    assert response.status_code == 413
@@ -0,0 +1,110 @@
+import errno
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from gamdl.downloader import AppleMusicDownloader
+from gamdl.downloader.base import AppleMusicBaseDownloader
+from gamdl.downloader.enums import StagingMode
+from gamdl.downloader.filesystem import FilesystemService
+
+TEMP_PATH = "/scratch"
+OUTPUT_PATH = "/music/Apple Music"
+
+
+@pytest.mark.parametrize(
+    ("staging_mode", "temp_device", "output_device", "staging_path"),
+    [
+        (StagingMode.OUTPUT, 1, 1, OUTPUT_PATH),
+        (StagingMode.TEMP, 1, 2, TEMP_PATH),
+        (StagingMode.AUTO, 1, 1, TEMP_PATH),
+        (StagingMode.AUTO, 1, 2, OUTPUT_PATH),
+        (StagingMode.AUTO, None, 2, OUTPUT_PATH),
+    ],
+)
+def test_staging_path_follows_mode_and_devices(
+    monkeypatch,
+    staging_mode: StagingMode,
+    temp_device: int | None,
+    output_device: int | None,
+    staging_path: str,
+):
+    devices = {TEMP_PATH: temp_device, OUTPUT_PATH: output_device}
+    monkeypatch.setattr(
+        AppleMusicBaseDownloader,
+        "_get_device_id",
+        staticmethod(devices.__getitem__),
+    )
+    base = AppleMusicBaseDownloader(
+        interface=None,
+        output_path=OUTPUT_PATH,
+        temp_path=TEMP_PATH,
+        staging_mode=staging_mode,
+    )
+
+    assert base.staging_path == staging_path
+
+
+def test_device_id_of_a_missing_path_uses_its_parent(tmp_path):
+    device_id = AppleMusicBaseDownloader._get_device_id(
+        str(tmp_path / "Apple Music" / "Album")
+    )
+
+    assert device_id == tmp_path.stat().st_dev
+
+
+def create_downloader() -> AppleMusicDownloader:
+    base = SimpleNamespace(filesystem=FilesystemService())
+    return AppleMusicDownloader(
+        song=SimpleNamespace(base=base),
+        music_video=None,
+        uploaded_video=None,
+    )
+
+
+def test_cross_device_replace_falls_back_to_copy(tmp_path, monkeypatch):
+    staged_path = tmp_path / "staging" / "01 First.m4a"
+    staged_path.parent.mkdir()
+    staged_path.write_bytes(b"audio")
+    final_path = tmp_path / "Album" / "01 First.m4a"
+    replace = os.replace
+    replaced_paths = []
+
+    def cross_device_replace(src, dst):
+        replaced_paths.append((str(src), str(dst)))
+        if str(src) == str(staged_path):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", cross_device_replace)
+
+    copied_bytes = create_downloader()._replace_final_path(
+        str(staged_path), str(final_path)
+    )
+
+    assert copied_bytes == 5
+    assert final_path.read_bytes() == b"audio"
+    assert not staged_path.exists()
+    assert list(final_path.parent.iterdir()) == [final_path]
+    assert replaced_paths == [
+        (str(staged_path), str(final_path)),
+        (str(final_path.with_name(".01 First.m4a.part")), str(final_path)),
+    ]
+
+
+def test_other_replace_errors_are_raised(tmp_path, monkeypatch):
+    staged_path = tmp_path / "01 First.m4a"
+    staged_path.write_bytes(b"audio")
+
+    def denied_replace(src, dst):
+        raise OSError(errno.EACCES, "Permission denied")
+
+    monkeypatch.setattr(os, "replace", denied_replace)
+
+    with pytest.raises(PermissionError):
+        create_downloader()._replace_final_path(
+            str(staged_path), str(tmp_path / "Album" / "01 First.m4a")
+        )
+
+    assert staged_path.exists()
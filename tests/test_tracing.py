@@ -0,0 +1,68 @@
+import asyncio
+import json
+import threading
+
+import httpx
+
+from gamdl.tracing import Tracer, _current_task, current_media_id
+
+
+def decrypt() -> str:
+    return "decrypted"
+
+
+async def test_trace_pairs_async_thread_and_http_spans(tmp_path):
+    trace_path = tmp_path / "trace.json"
+    httpx_send = httpx.AsyncClient.send
+    tracer = Tracer()
+    tracer.start(str(trace_path))
+    try:
+        media_id_token = current_media_id.set("1001")
+        with tracer.span("download"):
+            assert await asyncio.to_thread(tracer.wrap(decrypt, "decrypt")) == (
+                "decrypted"
+            )
+            async with httpx.AsyncClient(
+                transport=httpx.MockTransport(lambda request: httpx.Response(200))
+            ) as client:
+                await client.get("https://api.example/v1/songs/1001?l=en-US")
+        current_media_id.reset(media_id_token)
+        assert _current_task.get() is None
+    finally:
+        tracer.stop()
+
+    assert httpx.AsyncClient.send is httpx_send
+    trace = json.loads(trace_path.read_text())["traceEvents"]
+    thread_names = {
+        event["tid"]: event["args"]["name"]
+        for event in trace
+        if event["name"] == "thread_name"
+    }
+    events = [event for event in trace if event["ph"] != "M"]
+    assert [(event["name"], event["ph"]) for event in events] == [
+        ("download", "b"),
+        ("decrypt", "B"),
+        ("decrypt", "E"),
+        ("GET api.example", "b"),
+        ("GET api.example", "e"),
+        ("download", "e"),
+    ]
+
+    download, decrypt_begin, decrypt_end, request, _, download_end = events
+    loop_tid = threading.get_native_id()
+    assert download["args"]["media_id"] == "1001"
+    assert download["args"]["parent"] is None
+    assert download["id"] == download_end["id"] == request["id"]
+    assert download["tid"] == download_end["tid"] == loop_tid
+
+    assert decrypt_begin["args"]["media_id"] == "1001"
+    assert decrypt_begin["args"]["parent"] == "download"
+    assert decrypt_begin["args"]["task"] == download["args"]["task"]
+    assert decrypt_begin["tid"] == decrypt_end["tid"] != loop_tid
+    assert "id" not in decrypt_begin
+    assert decrypt_begin["tid"] in thread_names
+
+    assert request["args"]["media_id"] == "1001"
+    assert request["args"]["parent"] == "download"
+    assert request["args"]["url"] == "https://api.example/v1/songs/1001"
+    assert request["tid"] == loop_tid